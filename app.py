@@ -1,4 +1,7 @@
 from flask import Flask
+import conexao_db
+import migracoes
+import relatorios
 from routes.auth_routes import auth_bp
 from routes.dashboard_routes import dashboard_bp
 from routes.usuarios_routes import usuarios_bp
@@ -7,11 +10,26 @@ from routes.materiais_routes import materiais_bp
 from routes.produtos_routes import produtos_bp
 from routes.saida_nf_routes import saida_nf_bp
 from routes.entrada_nf_route import entrada_nf_bp
-from routes.calculo_nfs_route import calculo_bp
+from routes.calculo_nfs_route import calculo_bp, iniciar_worker_recalculo
+from routes.relatorios_routes import relatorios_bp
+from routes.importacoes_routes import importacoes_bp
 
 app = Flask(__name__)
 app.secret_key = 'segredo'  # Necessário para flash e sessão
 
+# Conexões por requisição (devolvidas ao pool no teardown)
+conexao_db.init_app(app)
+
+# Migrações do banco (tabela de pendências do cálculo, triggers, ...)
+migracoes.aplicar_migracoes()
+
+# Worker do recálculo do calculo_nfs: esvazia a fila ao subir (ex.: carga inicial da
+# migração ou alterações feitas direto no banco) e depois sempre que uma rota o acorda
+iniciar_worker_recalculo()
+
+# Workers dos relatórios em segundo plano (PDF/Excel grandes fora da requisição)
+relatorios.iniciar_workers()
+
 # Registrando Blueprints
 app.register_blueprint(auth_bp)
 app.register_blueprint(dashboard_bp)
@@ -22,6 +40,8 @@ app.register_blueprint(produtos_bp)
 app.register_blueprint(saida_nf_bp)
 app.register_blueprint(entrada_nf_bp)
 app.register_blueprint(calculo_bp)
+app.register_blueprint(relatorios_bp)
+app.register_blueprint(importacoes_bp)
 
 
 if __name__ == '__main__':
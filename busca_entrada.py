@@ -0,0 +1,83 @@
+"""
+Planejador da busca livre de entrada_nf (migração 007).
+
+condicao_busca_entrada(texto) escolhe o predicado conforme o que foi digitado:
+  - data completa (dd/mm/aaaa, dd-mm-aaaa, aaaa-mm-dd) -> faixa do dia em `data`
+  - mês (mm/aaaa)                                     -> faixa do mês em `data`
+  - dia/mês sem ano (dd/mm)                           -> dia e mês de qualquer ano (sem índice)
+  - qualquer outro texto -> texto pesquisável (NF, fornecedor, produto, materiais)
+    sem acento e sem caixa, pelo índice de trigramas
+Faixas são sempre `data >= início AND data < fim`, que usam o índice em data.
+"""
+import re
+from datetime import date
+
+# expressão idêntica à do índice idx_entrada_nf_busca_trgm
+TEXTO_BUSCA_SQL = (
+    "texto_busca_entrada_nf(nf::text, fornecedor::text, produto::text, "
+    "material_1::text, material_2::text, material_3::text, material_4::text, material_5::text)"
+)
+
+_RE_DIA = re.compile(r'^(\d{1,2})[/\-.](\d{1,2})[/\-.](\d{4})$')
+_RE_DIA_ISO = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})$')
+_RE_MES = re.compile(r'^(\d{1,2})[/\-.](\d{4})$')
+_RE_DIA_MES = re.compile(r'^(\d{1,2})/(\d{1,2})/?$')
+
+
+def _proximo_mes(d):
+    return date(d.year + (d.month == 12), d.month % 12 + 1, 1)
+
+
+def interpretar_data(texto):
+    """
+    Retorna ('dia', date) / ('mes', date) / ('dia_mes', (dia, mes)) se o texto parece data,
+    senão None.
+    """
+    t = (texto or '').strip()
+    try:
+        m = _RE_DIA.match(t)
+        if m:
+            return 'dia', date(int(m.group(3)), int(m.group(2)), int(m.group(1)))
+        m = _RE_DIA_ISO.match(t)
+        if m:
+            return 'dia', date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        m = _RE_MES.match(t)
+        if m:
+            return 'mes', date(int(m.group(2)), int(m.group(1)), 1)
+        m = _RE_DIA_MES.match(t)
+        if m:
+            dia, mes = int(m.group(1)), int(m.group(2))
+            # valida com um ano bissexto (aceita 29/02)
+            date(2000, mes, dia)
+            return 'dia_mes', (dia, mes)
+    except ValueError:
+        return None
+    return None
+
+
+def condicao_busca_entrada(texto, alias=''):
+    """
+    Predicado SQL (string com %s) + parâmetros para a busca livre.
+    `alias` prefixa as colunas (ex.: 'en.'); vazio quando a consulta não usa alias.
+    Retorna (None, []) para texto vazio.
+    """
+    texto = (texto or '').strip()
+    if not texto:
+        return None, []
+
+    col_data = f"{alias}data"
+    data = interpretar_data(texto)
+    if data:
+        tipo, valor = data
+        if tipo == 'dia':
+            return f"({col_data} >= %s AND {col_data} < %s::date + 1)", [valor, valor]
+        if tipo == 'mes':
+            return f"({col_data} >= %s AND {col_data} < %s)", [valor, _proximo_mes(valor)]
+        dia, mes = valor
+        return (f"(EXTRACT(DAY FROM {col_data}) = %s AND EXTRACT(MONTH FROM {col_data}) = %s)",
+                [dia, mes])
+
+    expr = TEXTO_BUSCA_SQL
+    if alias:
+        expr = re.sub(r'\b(nf|fornecedor|produto|material_\d)::text', lambda m: alias + m.group(0), expr)
+    return f"{expr} LIKE '%%' || termo_busca(%s) || '%%'", [texto]
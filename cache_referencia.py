@@ -0,0 +1,212 @@
+"""
+Cache em memória (por processo) dos cadastros de referência: produtos, fornecedores e materiais.
+
+- Cada carga é um "snapshot" marcado com a geração em que foi lida.
+- Triggers nas três tabelas fazem pg_notify('referencia_atualizada') (migração 004);
+  uma thread por processo fica em LISTEN nesse canal e avança a geração.
+- Quem grava nessas tabelas pelo próprio app também chama invalidar() logo após o commit,
+  para não depender da notificação chegar antes da próxima leitura.
+- Estruturas derivadas (ex.: os mapas do cálculo de NFs) são montadas uma vez por geração
+  com derivado().
+
+Sem o LISTEN ativo (falha de conexão), o cache não é confiável: cada obter() relê do banco.
+"""
+import os
+import select
+import threading
+import time
+
+from conexao_db import conectar, conexao_dedicada
+
+CANAL = 'referencia_atualizada'
+_ESPERA_RECONEXAO = 5  # segundos entre tentativas de reabrir o LISTEN
+
+
+class Referencias:
+    """Snapshot imutável dos cadastros (listas de tuplas) + estruturas derivadas desta geração."""
+
+    def __init__(self, geracao, dados):
+        self.geracao = geracao
+        # ordem por id: base dos mapas do cálculo
+        self.produtos = dados['produtos']            # [(id, nome, percentual_cobre, percentual_zinco)]
+        self.fornecedores = dados['fornecedores']    # [(id, nome)]
+        self.materiais = dados['materiais']          # [(id, nome, fornecedor_id, grupo, valor)]
+        # ordem por nome (collation do banco): dropdowns / APIs de lista
+        self.produtos_por_nome = dados['produtos_por_nome']          # [(id, nome)]
+        self.fornecedores_por_nome = dados['fornecedores_por_nome']  # [(id, nome)]
+        self.materiais_nomes = dados['materiais_nomes']              # [nome] (DISTINCT)
+        self._derivados = {}
+        self._lock = threading.Lock()
+
+    def derivado(self, nome, construtor):
+        """Valor construido uma vez por geração: construtor(self)."""
+        valor = self._derivados.get(nome)
+        if valor is None:
+            with self._lock:
+                valor = self._derivados.get(nome)
+                if valor is None:
+                    valor = construtor(self)
+                    self._derivados[nome] = valor
+        return valor
+
+
+def _carregar(geracao, conn=None):
+    """
+    Lê os cadastros. Com `conn` (conexão que o chamador já segura) não pega outra do pool
+    nem faz commit/rollback nela: a falha do SELECT de compatibilidade fica num SAVEPOINT.
+    """
+    propria = conn is None
+    if propria:
+        conn = conectar()
+        if conn is None:
+            raise RuntimeError("Sem conexão com o banco para carregar o cache de referência")
+    cur = conn.cursor()
+    try:
+        cur.execute("SAVEPOINT carregar_referencias")
+        try:
+            cur.execute("SELECT id, nome, percentual_cobre, percentual_zinco FROM produtos ORDER BY id")
+            produtos = cur.fetchall()
+        except Exception:
+            # compatibilidade: base sem percentual_zinco
+            cur.execute("ROLLBACK TO SAVEPOINT carregar_referencias")
+            cur.execute("SELECT id, nome, percentual_cobre FROM produtos ORDER BY id")
+            produtos = [(pid, nome, pct, None) for pid, nome, pct in cur.fetchall()]
+        cur.execute("RELEASE SAVEPOINT carregar_referencias")
+
+        cur.execute("SELECT id, nome FROM fornecedores ORDER BY id")
+        fornecedores = cur.fetchall()
+        cur.execute("SELECT id, nome, fornecedor_id, grupo, valor FROM materiais ORDER BY id")
+        materiais = cur.fetchall()
+
+        cur.execute("SELECT id, nome FROM produtos ORDER BY nome")
+        produtos_por_nome = cur.fetchall()
+        cur.execute("SELECT id, nome FROM fornecedores ORDER BY nome")
+        fornecedores_por_nome = cur.fetchall()
+        cur.execute("SELECT DISTINCT nome FROM materiais ORDER BY nome")
+        materiais_nomes = [r[0] for r in cur.fetchall()]
+        if propria:
+            conn.commit()
+    finally:
+        cur.close()
+        if propria:
+            conn.close()
+
+    return Referencias(geracao, {
+        'produtos': produtos,
+        'fornecedores': fornecedores,
+        'materiais': materiais,
+        'produtos_por_nome': produtos_por_nome,
+        'fornecedores_por_nome': fornecedores_por_nome,
+        'materiais_nomes': materiais_nomes,
+    })
+
+
+class CacheReferencia:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._geracao = 0
+        self._snapshot = None
+        self._ouvindo = False
+        self._thread = None
+        self._pid = None
+        # métricas
+        self._cargas = 0
+        self._leituras = 0
+        self._invalidacoes = 0
+
+    # ---------------- leitura ----------------
+    def obter(self, conn=None):
+        """Snapshot atual (carrega do banco se a geração mudou; em `conn`, se informada)."""
+        self._garantir_listener()
+        self._leituras += 1
+        snap = self._snapshot
+        if snap is not None and self._ouvindo and snap.geracao == self._geracao:
+            return snap
+        with self._lock:
+            snap = self._snapshot
+            if snap is not None and self._ouvindo and snap.geracao == self._geracao:
+                return snap
+            # lê a geração ANTES de consultar: uma notificação durante a carga
+            # deixa o snapshot já vencido e força nova carga na próxima leitura
+            geracao = self._geracao
+            snap = _carregar(geracao, conn)
+            self._snapshot = snap
+            self._cargas += 1
+            return snap
+
+    def invalidar(self):
+        with self._lock:
+            self._geracao += 1
+            self._invalidacoes += 1
+
+    @property
+    def geracao(self):
+        return self._geracao
+
+    def estatisticas(self):
+        return {
+            "geracao": self._geracao,
+            "ouvindo": self._ouvindo,
+            "cargas": self._cargas,
+            "leituras": self._leituras,
+            "invalidacoes": self._invalidacoes,
+        }
+
+    # ---------------- LISTEN ----------------
+    def _garantir_listener(self):
+        """Uma thread de LISTEN por processo (recriada após fork, ex.: workers do gunicorn)."""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._ouvindo = False
+            self._thread = threading.Thread(target=self._ouvir, name='cache-referencia-listen', daemon=True)
+            self._thread.start()
+
+    def _ouvir(self):
+        while True:
+            conn = None
+            try:
+                conn = conexao_dedicada()
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {CANAL}")
+                cur.close()
+                # o que mudou enquanto não estávamos ouvindo é desconhecido: começa do zero
+                self.invalidar()
+                self._ouvindo = True
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.invalidar()
+            except Exception as e:
+                print("Aviso: LISTEN do cache de referência interrompido:", e)
+            finally:
+                self._ouvindo = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(_ESPERA_RECONEXAO)
+
+
+cache_referencia = CacheReferencia()
+
+
+def obter_referencias(conn=None):
+    return cache_referencia.obter(conn)
+
+
+def invalidar_referencias():
+    cache_referencia.invalidar()
+
+
+def estatisticas_cache_referencia():
+    return cache_referencia.estatisticas()
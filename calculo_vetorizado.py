@@ -0,0 +1,398 @@
+"""
+Motor vetorizado do cálculo de NFs (calculo_nfs).
+
+Calcula, para um lote inteiro de registros de uma vez, os mesmos valores que as funções
+escalares de routes/calculo_nfs_route.py (calcular_qtd_*, calcular_valor_total_nf,
+calcular_materia_prima_reg, calcular_mao_de_obra_reg, calcular_custo_total_reg e o
+encadeamento feito em calcular_registro).
+
+Os números são guardados em ponto fixo: cada coluna vira um array de inteiros com uma
+escala decimal comum (ex.: centavos -> escala 2, gramas -> escala 3). Somas e produtos
+são exatos; o arredondamento é ROUND_HALF_UP feito com aritmética inteira. Os arrays são
+int64 enquanto não há risco de estouro e passam para dtype=object (int do Python) quando há.
+
+O Decimal das funções escalares divide com 28 dígitos significativos antes do quantize.
+Quando o resultado exato de uma divisão fica muito perto de um empate (…5) esse
+arredondamento intermediário pode mudar o último dígito; essas linhas (e as que têm
+valores fora do padrão: float, texto, NaN) são marcadas em `recalcular` para o chamador
+refazer com as funções escalares, então o resultado final é sempre idêntico.
+"""
+from decimal import Decimal
+
+import numpy as np
+
+_LIMITE_INT64 = 2 ** 62
+_LIMITE_DIGITOS = 10 ** 27          # acima disso o Decimal (28 dígitos) já arredondaria somas/produtos
+_TOLERANCIA_EMPATE = 1e-9           # distância relativa ao empate que manda a linha para o cálculo escalar
+
+
+class Fixo:
+    """Array de inteiros `v` representando v / 10**escala."""
+
+    __slots__ = ('v', 'escala')
+
+    def __init__(self, v, escala):
+        self.v = v
+        self.escala = escala
+
+
+# ------------------------------
+# helpers de inteiros (int64 com checagem de estouro, senão object)
+# ------------------------------
+def _max_abs(v):
+    if v.size == 0:
+        return 0
+    return int(np.max(np.abs(v)))
+
+
+def _como_object(v):
+    return v if v.dtype == object else v.astype(object)
+
+
+def _int_array(inteiros):
+    arr = np.array(inteiros, dtype=object)
+    if arr.size == 0 or max(abs(int(x)) for x in arr) < _LIMITE_INT64:
+        return arr.astype(np.int64)
+    return arr
+
+
+def _multiplicar(a, b):
+    if a.dtype != object and b.dtype != object and _max_abs(a) * _max_abs(b) < _LIMITE_INT64:
+        return a * b
+    return _como_object(a) * _como_object(b)
+
+
+def _somar(a, b):
+    if a.dtype != object and b.dtype != object and _max_abs(a) + _max_abs(b) < _LIMITE_INT64:
+        return a + b
+    return _como_object(a) + _como_object(b)
+
+
+def _potencia10(n, k):
+    """Array com 10**k (k >= 0) do tamanho n."""
+    p = 10 ** k
+    if p < _LIMITE_INT64:
+        return np.full(n, p, dtype=np.int64)
+    return np.array([p] * n, dtype=object)
+
+
+def _alinhar(x, escala):
+    if escala == x.escala:
+        return x.v
+    return _multiplicar(x.v, _potencia10(len(x.v), escala - x.escala))
+
+
+# ------------------------------
+# operações em ponto fixo
+# ------------------------------
+def soma(x, y):
+    escala = max(x.escala, y.escala)
+    return Fixo(_somar(_alinhar(x, escala), _alinhar(y, escala)), escala)
+
+
+def subtrai(x, y):
+    escala = max(x.escala, y.escala)
+    return Fixo(_somar(_alinhar(x, escala), -_alinhar(y, escala)), escala)
+
+
+def multiplica(x, y):
+    return Fixo(_multiplicar(x.v, y.v), x.escala + y.escala)
+
+
+def _dividir_half_up(num, den):
+    """
+    round_half_up(num / den) elemento a elemento (den != 0) e a distância relativa
+    do resto até o empate (0 = empate exato), usada para marcar linhas sensíveis.
+    """
+    sinal = np.sign(num) * np.sign(den)
+    a = np.abs(num)
+    b = np.abs(den)
+    dois_a = _somar(a, a)
+    q = (_somar(dois_a, b)) // _somar(b, b)
+    resto = a % b
+    dist = np.abs(_somar(_somar(resto, resto), -b)).astype(float) / b.astype(float)
+    return sinal * q, dist
+
+
+def arredonda(x, casas):
+    """quantize(Decimal(10) ** -casas, ROUND_HALF_UP)."""
+    if x.escala <= casas:
+        return Fixo(_alinhar(x, casas), casas)
+    q, _ = _dividir_half_up(x.v, _potencia10(len(x.v), x.escala - casas))
+    return Fixo(q, casas)
+
+
+def divide_arredonda(x, y, casas, validos):
+    """
+    (x / y).quantize(10 ** -casas, ROUND_HALF_UP) onde `validos` (y != 0).
+    Retorna (Fixo, perto_do_empate) — perto_do_empate marca onde o Decimal, que arredonda
+    o quociente para 28 dígitos antes do quantize, pode divergir do resultado exato.
+    """
+    n = len(x.v)
+    # x/y = (X * 10^(ey + casas)) / (Y * 10^ex) em unidades de 10^-casas
+    num = _multiplicar(x.v, _potencia10(n, y.escala + casas))
+    den = _multiplicar(y.v, _potencia10(n, x.escala))
+    den = np.where(validos, den, 1)
+    if den.dtype != object and num.dtype == object:
+        den = den.astype(object)
+    q, dist = _dividir_half_up(num, den)
+    q = np.where(validos, q, 0)
+    perto = validos & (dist < _TOLERANCIA_EMPATE)
+    return Fixo(q, casas), perto
+
+
+def fora_do_limite(x):
+    """Linhas em que o valor já passaria dos 28 dígitos do Decimal."""
+    if x.v.dtype != object:
+        return np.zeros(len(x.v), dtype=bool)
+    return np.array([abs(int(i)) >= _LIMITE_DIGITOS for i in x.v], dtype=bool)
+
+
+def onde(cond, x, y):
+    escala = max(x.escala, y.escala)
+    a = _alinhar(x, escala)
+    b = _alinhar(y, escala)
+    if a.dtype == object or b.dtype == object:
+        a, b = _como_object(a), _como_object(b)
+    return Fixo(np.where(cond, a, b), escala)
+
+
+def zeros(n, escala=0):
+    return Fixo(np.zeros(n, dtype=np.int64), escala)
+
+
+# ------------------------------
+# conversão Decimal <-> ponto fixo
+# ------------------------------
+def coluna(valores):
+    """
+    Converte uma lista de valores (Decimal/int/None) em (Fixo, presente, irregular).
+      - presente: valor não nulo e diferente de ''
+      - irregular: tipo que o motor não trata exatamente (float, str, NaN...) -> cálculo escalar
+    None/'' viram 0 (mesmo efeito do `valor or 0` das funções escalares).
+    """
+    n = len(valores)
+    presente = np.zeros(n, dtype=bool)
+    irregular = np.zeros(n, dtype=bool)
+    decs = []
+    escala = 0
+    for i, v in enumerate(valores):
+        if v is None or v == '':
+            decs.append(None)
+            continue
+        if isinstance(v, bool) or not isinstance(v, (Decimal, int)):
+            irregular[i] = True
+            decs.append(None)
+            continue
+        d = Decimal(v)
+        if not d.is_finite():
+            irregular[i] = True
+            decs.append(None)
+            continue
+        presente[i] = True
+        decs.append(d)
+        expoente = d.as_tuple().exponent
+        if expoente < 0:
+            escala = max(escala, -expoente)
+
+    inteiros = [_inteiro_escalado(d, escala) if d is not None else 0 for d in decs]
+    return Fixo(_int_array(inteiros), escala), presente, irregular
+
+
+def _inteiro_escalado(d, escala):
+    """d * 10**escala como int, sem passar pelo contexto (28 dígitos) do Decimal."""
+    sinal, digitos, expoente = d.as_tuple()
+    inteiro = int(''.join(map(str, digitos))) * 10 ** (expoente + escala)
+    return -inteiro if sinal else inteiro
+
+
+def _decimal_escalado(inteiro, escala):
+    """inteiro / 10**escala como Decimal exato (com `escala` casas)."""
+    inteiro = int(inteiro)
+    return Decimal((1 if inteiro < 0 else 0, tuple(int(c) for c in str(abs(inteiro))), -escala))
+
+
+def para_decimais(x, validos=None):
+    """Fixo -> lista de Decimal com `escala` casas (None onde não é válido)."""
+    saida = []
+    for i, inteiro in enumerate(x.v.tolist()):
+        if validos is not None and not validos[i]:
+            saida.append(None)
+        else:
+            saida.append(_decimal_escalado(inteiro, x.escala))
+    return saida
+
+
+# ------------------------------
+# motor
+# ------------------------------
+_CAMPOS_ENTRADA = (
+    'peso_liquido', 'peso_integral', 'valor_integral', 'ipi',
+    'valor_unitario_1', 'valor_unitario_2', 'valor_unitario_3',
+    'valor_mao_obra_tm_metallica', 'valor_unitario_energia',
+    'duplicata_1', 'duplicata_2', 'duplicata_3', 'duplicata_4', 'duplicata_5', 'duplicata_6',
+    'custo_total_manual', 'qtd_cobre', 'qtd_zinco', 'qtd_sucata', 'valor_total_nf',
+)
+
+_PARAMETROS = ('pct_cobre', 'valor_cobre', 'pct_zinco', 'valor_zinco', 'valor_sucata')
+
+
+def _quantidade(diff, pct, valor, tem_pct, tem_valor, exige_diff_positiva):
+    """
+    Quantidade de metal: diff * pct / valor (ou diff / valor para sucata), arredondada a 3 casas.
+    Retorna (Fixo, valida, perto_do_empate). Resultado negativo -> None (inválida), como no escalar.
+    """
+    base = multiplica(diff, pct) if pct is not None else diff
+    validos = tem_valor & tem_pct
+    fora = fora_do_limite(base)
+    if exige_diff_positiva:
+        validos = validos & (diff.v > 0)
+    q, perto = divide_arredonda(base, valor, 3, validos)
+    # sinal do quociente exato (o arredondado para 0 ainda pode vir de um valor negativo)
+    negativo = validos & ((np.sign(base.v) * np.sign(valor.v)) < 0)
+    return q, validos & ~negativo, (perto & ~negativo) | (validos & fora)
+
+
+def calcular_lote(registros, parametros):
+    """
+    registros: lista de dicts no formato de _linha_para_registro (valores atuais do banco).
+    parametros: lista (mesma ordem) de dicts com pct_cobre, valor_cobre, pct_zinco, valor_zinco,
+                valor_sucata — percentuais/valores de material já resolvidos pelos mapas
+                (None quando o cálculo escalar devolveria None).
+
+    Retorna (resultados, recalcular):
+      - resultados: lista de dicts com qtd_cobre, qtd_zinco, qtd_sucata, valor_total_nf,
+        mao_de_obra_total, mao_de_obra, materia_prima_total, materia_prima, custo_total
+      - recalcular: índices que o chamador deve refazer com o cálculo escalar
+    """
+    n = len(registros)
+    if n == 0:
+        return [], []
+
+    col = {}
+    presente = {}
+    irregular = np.zeros(n, dtype=bool)
+    for campo in _CAMPOS_ENTRADA:
+        col[campo], presente[campo], irr = coluna([r.get(campo) for r in registros])
+        irregular |= irr
+    for campo in _PARAMETROS:
+        col[campo], presente[campo], irr = coluna([p.get(campo) for p in parametros])
+        irregular |= irr
+
+    recalcular = irregular.copy()
+    um = Fixo(np.ones(n, dtype=np.int64), 0)
+
+    pl = col['peso_liquido']
+    pi = col['peso_integral']
+    diff = subtrai(pl, pi)
+
+    # --- quantidades (só quando o valor salvo é nulo/zero) ---
+    qtds = {}
+    for campo, pct, valor, exige in (
+        ('qtd_cobre', 'pct_cobre', 'valor_cobre', False),
+        ('qtd_zinco', 'pct_zinco', 'valor_zinco', False),
+        ('qtd_sucata', None, 'valor_sucata', True),
+    ):
+        atual = col[campo]
+        recalcula = atual.v == 0
+        q, valida, perto = _quantidade(
+            diff,
+            col[pct] if pct else None,
+            col[valor],
+            presente[pct] if pct else np.ones(n, dtype=bool),
+            presente[valor],
+            exige,
+        )
+        recalcular |= recalcula & perto
+        # valor final: recalculado (ou None) onde estava nulo/zero, senão o salvo
+        valor_final = onde(recalcula, onde(valida, q, zeros(n)), atual)
+        nulo = (recalcula & ~valida) | (~recalcula & ~presente[campo])
+        qtds[campo] = (valor_final, ~nulo, recalcula)
+
+    qc, qz, qs = qtds['qtd_cobre'][0], qtds['qtd_zinco'][0], qtds['qtd_sucata'][0]
+
+    # --- valor_total_nf ---
+    dif_pos = onde(diff.v > 0, diff, zeros(n))
+    ipi_frac = Fixo(col['ipi'].v, col['ipi'].escala + 2)         # ipi / 100
+    vi_com_ipi = multiplica(col['valor_integral'], soma(um, ipi_frac))
+    total = multiplica(pi, vi_com_ipi)
+    total = soma(total, multiplica(qc, col['valor_unitario_1']))
+    total = soma(total, multiplica(qz, col['valor_unitario_2']))
+    total = soma(total, multiplica(qs, col['valor_unitario_3']))
+    total = soma(total, multiplica(dif_pos, col['valor_mao_obra_tm_metallica']))
+    total = soma(total, multiplica(dif_pos, col['valor_unitario_energia']))
+    recalcular |= fora_do_limite(total)
+    valor_calc = arredonda(total, 2)
+    vtf_salvo = col['valor_total_nf']
+    usa_calc = vtf_salvo.v == 0
+    valor_total_nf = onde(usa_calc, valor_calc, vtf_salvo)
+
+    # --- matéria-prima (total) ---
+    mat = soma(soma(multiplica(qc, col['valor_unitario_1']),
+                    multiplica(qz, col['valor_unitario_2'])),
+               multiplica(qs, col['valor_unitario_3']))
+    recalcular |= fora_do_limite(mat)
+    mat_total = arredonda(mat, 2)
+
+    # --- mão de obra (total) ---
+    soma_vals = soma(col['valor_mao_obra_tm_metallica'], col['valor_unitario_energia'])
+    soma_dup = col['duplicata_1']
+    for i in range(2, 7):
+        soma_dup = soma(soma_dup, col[f'duplicata_{i}'])
+    usa_vals = soma_vals.v != 0
+    usa_dup = ~usa_vals & (pl.v > 0) & (soma_dup.v != 0)
+    mao_vals = arredonda(multiplica(dif_pos, soma_vals), 2)
+    mao_dup, perto = divide_arredonda(multiplica(soma_dup, dif_pos), pl, 2, usa_dup)
+    recalcular |= usa_dup & perto
+    mao_total = onde(usa_vals, mao_vals, onde(usa_dup, mao_dup, zeros(n, 2)))
+
+    # --- mão de obra (unitário, por diferença de peso) ---
+    tem_diferenca = diff.v > 0
+    mao_unit_div, perto = divide_arredonda(mao_total, diff, 2, tem_diferenca)
+    recalcular |= tem_diferenca & perto
+    mao_unit = onde(tem_diferenca, mao_unit_div, mao_total)
+
+    # --- matéria-prima unitária (sem valor_integral) ---
+    tem_vi = col['valor_integral'].v != 0
+    pl_pos = pl.v > 0
+    mp_div, perto = divide_arredonda(mat_total, pl, 2, ~tem_vi & pl_pos)
+    recalcular |= ~tem_vi & pl_pos & perto
+    mp_sem_vi = onde(pl_pos, mp_div, mat_total)
+
+    # --- custo_total ---
+    manual = col['custo_total_manual']
+    usa_manual = presente['custo_total_manual'] & (manual.v > 0)
+    ct_regra2 = arredonda(soma(mp_sem_vi, mao_unit), 2)
+    pl_nz = pl.v != 0
+    ct_regra3, perto = divide_arredonda(valor_total_nf, pl, 2, tem_vi & pl_nz)
+    recalcular |= ~usa_manual & tem_vi & pl_nz & perto
+    custo_total = onde(usa_manual, arredonda(manual, 2),
+                       onde(~tem_vi, ct_regra2,
+                            onde(pl_nz, ct_regra3, zeros(n, 2))))
+
+    # --- matéria-prima unitária (com valor_integral): custo_total - mão de obra ---
+    mp_com_vi = arredonda(subtrai(custo_total, mao_unit), 2)
+    materia_prima = onde(tem_vi, mp_com_vi, mp_sem_vi)
+
+    # --- monta a saída ---
+    calc_decs = para_decimais(valor_calc)
+    saida = {
+        # valor salvo (> 0) é mantido; senão entra o calculado
+        'valor_total_nf': [calc_decs[i] if usa_calc[i] else registros[i].get('valor_total_nf')
+                           for i in range(n)],
+        'mao_de_obra_total': para_decimais(mao_total),
+        'mao_de_obra': para_decimais(mao_unit),
+        'materia_prima_total': para_decimais(mat_total),
+        'materia_prima': para_decimais(materia_prima),
+        'custo_total': para_decimais(custo_total),
+    }
+    for campo, (valor_final, valido, recalcula) in qtds.items():
+        decs = para_decimais(valor_final, valido)
+        # valores salvos (não recalculados) voltam como estavam no registro
+        saida[campo] = [
+            decs[i] if recalcula[i] else registros[i].get(campo)
+            for i in range(n)
+        ]
+
+    resultados = [{campo: valores[i] for campo, valores in saida.items()} for i in range(n)]
+    return resultados, [int(i) for i in np.nonzero(recalcular)[0]]
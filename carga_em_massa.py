@@ -0,0 +1,74 @@
+"""
+Carga em massa via COPY (importações de planilha).
+
+copiar_dataframe() grava um DataFrame numa tabela (normalmente temporária) com
+COPY ... FROM STDIN em formato CSV: uma ida ao banco por bloco em vez de um INSERT por
+linha. Valores ausentes (None/NaN/NaT) viram NULL; datas saem em ISO.
+
+importar_em_blocos() é o pipeline das importações: cada bloco lido da planilha (ver
+leitor_planilha.py) passa pela função de gravação (validação + COPY + INSERT) e é
+confirmado antes de o próximo ser lido, então a memória fica limitada a um bloco.
+"""
+import io
+
+LINHAS_POR_BLOCO = 50000
+
+
+def copiar_dataframe(cur, tabela, colunas, df, linhas_por_bloco=LINHAS_POR_BLOCO):
+    """
+    COPY de df[colunas] para `tabela` (colunas com o mesmo nome/ordem).
+    Retorna a quantidade de linhas copiadas.
+    """
+    if df is None or df.empty:
+        return 0
+    sql = (f"COPY {tabela} ({', '.join(colunas)}) FROM STDIN "
+           f"WITH (FORMAT csv, NULL '')")
+    total = 0
+    for inicio in range(0, len(df), linhas_por_bloco):
+        bloco = df.iloc[inicio:inicio + linhas_por_bloco]
+        buf = io.StringIO()
+        # texto vazio já foi convertido em None pelas importações; NULL '' cobre None/NaN/NaT
+        bloco[list(colunas)].to_csv(buf, header=False, index=False, na_rep='',
+                                    date_format='%Y-%m-%d %H:%M:%S')
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+        total += len(bloco)
+    return total
+
+
+def importar_em_blocos(conexao, blocos, gravar_bloco, progresso=None):
+    """
+    Para cada DataFrame de `blocos`: gravar_bloco(cur, bloco) -> (gravadas, rejeitadas) e
+    commit; `rejeitadas` é {índice da linha: motivo} das linhas recusadas na validação.
+    progresso(lidas, gravadas) é chamado após cada commit.
+    Retorna {'lidas', 'gravadas', 'erros', 'falha'}: se um bloco falhar ele é desfeito,
+    a importação para ali e 'falha' traz a mensagem; os blocos anteriores continuam gravados.
+    """
+    resumo = {'lidas': 0, 'gravadas': 0, 'erros': [], 'falha': None}
+    cur = conexao.cursor()
+    try:
+        blocos = iter(blocos)
+        while True:
+            try:
+                bloco = next(blocos, None)
+            except Exception as e:  # arquivo corrompido/truncado no meio da leitura
+                resumo['falha'] = f"leitura do arquivo após {resumo['lidas']} linhas: {e}"
+                break
+            if bloco is None:
+                break
+            try:
+                gravadas, rejeitadas = gravar_bloco(cur, bloco)
+                conexao.commit()
+            except Exception as e:
+                conexao.rollback()
+                inicio = int(bloco.index[0]) + 1 if len(bloco) else resumo['lidas'] + 1
+                resumo['falha'] = f'bloco a partir da linha {inicio}: {e}'
+                break
+            resumo['lidas'] += len(bloco)
+            resumo['gravadas'] += gravadas
+            resumo['erros'].extend(f'linha {i + 1}: {motivo}' for i, motivo in rejeitadas.items())
+            if progresso:
+                progresso(resumo['lidas'], resumo['gravadas'])
+    finally:
+        cur.close()
+    return resumo
@@ -1,20 +1,372 @@
 import psycopg2
+import psycopg2.extensions
 import os
+import threading
+import time
+import weakref
+import collections
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from flask import g
 
 # Carrega as variáveis do .env
 load_dotenv()
 
+# Configuração do pool (ajuste conforme o número de workers/threads do gunicorn)
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))          # espera máxima por conexão (s)
+POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))  # conexão ociosa além disso é fechada (s)
+POOL_HEALTHCHECK_AFTER = float(os.getenv("DB_POOL_HEALTHCHECK_AFTER", "30"))  # testa com SELECT 1 se ociosa há mais que isso (s)
+
+
+def _abrir_conexao_fisica():
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        port=os.getenv("DB_PORT")
+    )
+
+
+class ConexaoPool:
+    """
+    Envolve uma conexão psycopg2 emprestada do pool.
+    Repassa tudo para a conexão real, mas close() devolve a conexão ao pool
+    em vez de encerrá-la — assim o código existente (conn.close()) continua funcionando.
+    Rede de segurança: se o wrapper for coletado sem close(), um weakref.finalize devolve
+    a conexão (com rollback) e conta o vazamento em estatisticas()['conexoes_vazadas'].
+    """
+
+    def __init__(self, pool, conexao):
+        self._pool = pool
+        self._conexao = conexao
+        self._devolvida = False
+        self._finalizador = weakref.finalize(self, _devolver_vazada, pool, conexao)
+        self._finalizador.atexit = False
+
+    def __getattr__(self, nome):
+        return getattr(self._conexao, nome)
+
+    @property
+    def closed(self):
+        return 1 if self._devolvida else self._conexao.closed
+
+    def close(self):
+        if self._devolvida:
+            return
+        self._devolvida = True
+        self._finalizador.detach()
+        self._pool.devolver(self._conexao)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._conexao.commit()
+            else:
+                self._conexao.rollback()
+        finally:
+            self.close()
+        return False
+
+
+def _devolver_vazada(pool, conexao):
+    """
+    Chamado pelo coletor quando um ConexaoPool some sem close(). Pode rodar em qualquer
+    ponto (inclusive com o lock do pool tomado pela própria thread), então só enfileira:
+    a vaga é liberada pelo pool na próxima operação (_recolher_vazadas).
+    """
+    pool._vazadas.append(conexao)
+
+
+class PoolConexoes:
+    """
+    Pool thread-safe de conexões PostgreSQL.
+      - mantém entre `minimo` e `maximo` conexões físicas
+      - valida a conexão no empréstimo (SELECT 1 se ficou ociosa por muito tempo)
+      - fecha conexões ociosas além de `idle_timeout` (respeitando o mínimo)
+      - registra tempo de espera e saturação (ver estatisticas())
+    """
+
+    def __init__(self, minimo=POOL_MIN, maximo=POOL_MAX, timeout=POOL_TIMEOUT,
+                 idle_timeout=POOL_IDLE_TIMEOUT, healthcheck_after=POOL_HEALTHCHECK_AFTER):
+        self.minimo = max(0, minimo)
+        self.maximo = max(1, maximo, self.minimo)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.healthcheck_after = healthcheck_after
+
+        self._cond = threading.Condition(threading.Lock())
+        self._ociosas = []      # [(conexao, instante_devolucao)] — LIFO
+        self._em_uso = 0
+        self._abrindo = 0
+        self._pid = os.getpid()
+
+        # métricas
+        self._emprestimos = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._esperas = 0       # empréstimos que precisaram aguardar
+        self._timeouts = 0
+        self._pico_em_uso = 0
+        self._descartadas = 0
+        self._vazamentos = 0    # wrappers coletados sem close() (ver _devolver_vazada)
+        self._vazadas = collections.deque()
+
+    # ---------------- empréstimo / devolução ----------------
+    def emprestar(self):
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+        aguardou = False
+
+        with self._cond:
+            while True:
+                self._recolher_vazadas()
+                self._expirar_ociosas()
+                if self._ociosas:
+                    conexao, devolvida_em = self._ociosas.pop()
+                    self._em_uso += 1
+                    break
+                if self._em_uso + self._abrindo + len(self._ociosas) < self.maximo:
+                    self._abrindo += 1
+                    conexao, devolvida_em = None, None
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._timeouts += 1
+                    raise TimeoutError(
+                        f"Pool de conexões esgotado ({self.maximo} em uso) após {self.timeout:.1f}s"
+                    )
+                aguardou = True
+                # acorda de tempos em tempos para recolher conexões vazadas (sem notify)
+                self._cond.wait(min(restante, 0.5))
+
+        # abre/valida fora do lock para não serializar as outras threads
+        if conexao is None:
+            try:
+                conexao = _abrir_conexao_fisica()
+            except Exception:
+                with self._cond:
+                    self._abrindo -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._abrindo -= 1
+                self._em_uso += 1
+        elif not self._saudavel(conexao, devolvida_em):
+            self._fechar_silencioso(conexao)
+            try:
+                conexao = _abrir_conexao_fisica()
+            except Exception:
+                with self._cond:
+                    self._em_uso -= 1
+                    self._descartadas += 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._descartadas += 1
+
+        espera = time.monotonic() - inicio
+        with self._cond:
+            self._emprestimos += 1
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+            if aguardou:
+                self._esperas += 1
+            self._pico_em_uso = max(self._pico_em_uso, self._em_uso)
+        return conexao
+
+    def devolver(self, conexao):
+        reutilizavel = not conexao.closed
+        if reutilizavel:
+            try:
+                # nunca devolve transação aberta/abortada ao pool
+                if conexao.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conexao.rollback()
+                if conexao.autocommit:
+                    conexao.autocommit = False
+            except Exception:
+                reutilizavel = False
+
+        with self._cond:
+            self._recolher_vazadas()
+            self._em_uso -= 1
+            if reutilizavel and os.getpid() == self._pid:
+                self._ociosas.append((conexao, time.monotonic()))
+            else:
+                self._descartadas += 1
+                self._fechar_silencioso(conexao)
+            self._cond.notify()
+
+    @contextmanager
+    def conexao(self):
+        """Empresta uma conexão; commit ao sair sem erro, rollback em exceção, sempre devolve."""
+        with ConexaoPool(self, self.emprestar()) as conn:
+            yield conn
+
+    # ---------------- manutenção ----------------
+    def _saudavel(self, conexao, devolvida_em):
+        if conexao.closed:
+            return False
+        if devolvida_em is not None and time.monotonic() - devolvida_em < self.healthcheck_after:
+            return True
+        try:
+            cur = conexao.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            conexao.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _recolher_vazadas(self):
+        """Libera a vaga das conexões vazadas: estado desconhecido, então fecha (chamar com o lock)."""
+        while self._vazadas:
+            conexao = self._vazadas.popleft()
+            self._em_uso -= 1
+            self._vazamentos += 1
+            self._descartadas += 1
+            self._fechar_silencioso(conexao)
+            print("Aviso: conexão do pool coletada sem close(); vaga devolvida ao pool.")
+            self._cond.notify()
+
+    def _expirar_ociosas(self):
+        """Fecha conexões ociosas antigas mantendo pelo menos `minimo` abertas (chamar com o lock)."""
+        if not self._ociosas or self.idle_timeout <= 0:
+            return
+        agora = time.monotonic()
+        total = self._em_uso + len(self._ociosas)
+        mantidas = []
+        # as mais antigas ficam no início da lista (LIFO)
+        for conexao, devolvida_em in self._ociosas:
+            if agora - devolvida_em > self.idle_timeout and total > self.minimo:
+                self._fechar_silencioso(conexao)
+                self._descartadas += 1
+                total -= 1
+            else:
+                mantidas.append((conexao, devolvida_em))
+        self._ociosas = mantidas
+
+    @staticmethod
+    def _fechar_silencioso(conexao):
+        try:
+            conexao.close()
+        except Exception:
+            pass
+
+    def fechar_todas(self):
+        with self._cond:
+            for conexao, _ in self._ociosas:
+                self._fechar_silencioso(conexao)
+            self._ociosas = []
+
+    # ---------------- métricas ----------------
+    def estatisticas(self):
+        with self._cond:
+            self._recolher_vazadas()
+            emprestimos = self._emprestimos
+            return {
+                "minimo": self.minimo,
+                "maximo": self.maximo,
+                "em_uso": self._em_uso,
+                "ociosas": len(self._ociosas),
+                "pico_em_uso": self._pico_em_uso,
+                "saturacao": round(self._em_uso / self.maximo, 3),
+                "saturacao_pico": round(self._pico_em_uso / self.maximo, 3),
+                "emprestimos": emprestimos,
+                "emprestimos_com_espera": self._esperas,
+                "espera_media_ms": round((self._espera_total / emprestimos) * 1000, 3) if emprestimos else 0.0,
+                "espera_max_ms": round(self._espera_max * 1000, 3),
+                "timeouts": self._timeouts,
+                "conexoes_descartadas": self._descartadas,
+                "conexoes_vazadas": self._vazamentos,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def obter_pool():
+    """Pool do processo atual (recriado após fork, ex.: workers do gunicorn)."""
+    global _pool
+    pool = _pool
+    if pool is not None and pool._pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool._pid != os.getpid():
+            _pool = PoolConexoes()
+        return _pool
+
+
 def conectar():
     try:
-        conexao = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            database=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            port=os.getenv("DB_PORT")
-        )
-        return conexao
+        pool = obter_pool()
+        return ConexaoPool(pool, pool.emprestar())
     except Exception as e:
         print("Erro ao conectar ao banco:", e)
-        return None
\ No newline at end of file
+        return None
+
+
+@contextmanager
+def conexao_pool():
+    """
+    Uso:
+        with conexao_pool() as conn:
+            cur = conn.cursor()
+            ...
+    Faz commit ao sair normalmente, rollback em exceção e sempre devolve a conexão ao pool.
+    """
+    with obter_pool().conexao() as conn:
+        yield conn
+
+
+def conexao_dedicada():
+    """
+    Conexão física fora do pool, para quem precisa segurá-la o tempo todo
+    (ex.: LISTEN do cache de referência). Quem abre é responsável por fechar.
+    """
+    return _abrir_conexao_fisica()
+
+
+def estatisticas_pool():
+    return obter_pool().estatisticas()
+
+
+def conexao_requisicao():
+    """
+    Conexão do pool vinculada ao contexto da requisição atual (flask.g).
+    Chamadas repetidas na mesma requisição devolvem a mesma conexão; ela é
+    devolvida ao pool no teardown (ver init_app), com rollback se algo ficou pendente.
+    Cada thread/requisição tem a sua própria conexão, então uma falha numa
+    requisição não contamina a transação das outras.
+    """
+    conexao = g.get('db_conexao')
+    if conexao is None or conexao.closed:
+        pool = obter_pool()
+        conexao = ConexaoPool(pool, pool.emprestar())
+        g.db_conexao = conexao
+    return conexao
+
+
+def fechar_conexao_requisicao(exc=None):
+    conexao = g.pop('db_conexao', None)
+    if conexao is None:
+        return
+    try:
+        if exc is not None:
+            conexao.rollback()
+    except Exception:
+        pass
+    finally:
+        conexao.close()
+
+
+def init_app(app):
+    """Registra a devolução da conexão da requisição ao pool ao final de cada contexto."""
+    app.teardown_appcontext(fechar_conexao_requisicao)
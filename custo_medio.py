@@ -0,0 +1,83 @@
+"""
+Consultas ao custo médio ponderado por produto/mês (migração 006).
+
+custo_medio_mensal guarda as somas (peso, custo*peso, estoque, custo*estoque) de cada
+produto/mês, mantidas por trigger; o custo médio é só a divisão na leitura.
+"""
+from datetime import date, datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+
+def _mes(valor):
+    """'AAAA-MM' (ou data ISO) -> date do primeiro dia do mês."""
+    if valor is None or valor == '':
+        return None
+    if isinstance(valor, (date, datetime)):
+        return date(valor.year, valor.month, 1)
+    texto = str(valor).strip()
+    try:
+        d = datetime.strptime(texto[:7], '%Y-%m')
+    except ValueError:
+        raise ValueError(f"Mês inválido: {valor} (use AAAA-MM)")
+    return date(d.year, d.month, 1)
+
+
+def _media(soma_custo, soma_peso):
+    if not soma_peso:
+        return None
+    return (Decimal(soma_custo) / Decimal(soma_peso)).quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP)
+
+
+def _linha(row):
+    produto, nome, mes, entradas, soma_peso, soma_custo_peso, soma_estoque, soma_custo_estoque = row
+    return {
+        'produto': nome or produto,
+        'mes': mes,
+        'entradas': entradas,
+        'peso_liquido': soma_peso,
+        'estoque': soma_estoque,
+        'custo_medio_peso': _media(soma_custo_peso, soma_peso),
+        'custo_medio_estoque': _media(soma_custo_estoque, soma_estoque),
+    }
+
+
+_COLUNAS = """
+    produto, produto_nome, mes, entradas,
+    soma_peso, soma_custo_peso, soma_estoque, soma_custo_estoque
+"""
+
+
+def custo_medio_por_mes(cur, produto=None, de=None, ate=None):
+    """Custo médio de cada produto/mês; filtros opcionais por produto (nome) e faixa de meses."""
+    condicoes = ["entradas > 0"]
+    params = []
+    if produto:
+        condicoes.append("produto = normalizar_nome(%s)")
+        params.append(produto)
+    de = _mes(de)
+    if de:
+        condicoes.append("mes >= %s")
+        params.append(de)
+    ate = _mes(ate)
+    if ate:
+        condicoes.append("mes <= %s")
+        params.append(ate)
+
+    cur.execute(f"""
+        SELECT {_COLUNAS}
+        FROM custo_medio_mensal
+        WHERE {' AND '.join(condicoes)}
+        ORDER BY produto, mes
+    """, params)
+    return [_linha(r) for r in cur.fetchall()]
+
+
+def custo_medio_ultimo_mes(cur):
+    """Para cada produto, o mês mais recente com entradas."""
+    cur.execute(f"""
+        SELECT DISTINCT ON (produto) {_COLUNAS}
+        FROM custo_medio_mensal
+        WHERE entradas > 0
+        ORDER BY produto, mes DESC
+    """)
+    return sorted((_linha(r) for r in cur.fetchall()), key=lambda l: (l['produto'] or '').lower())
@@ -0,0 +1,109 @@
+"""
+Consultas ao razão de estoque (migração 005).
+
+- estoque_movimentos: lançamentos append-only (entradas, ajustes/distribuição, saídas).
+- estoque_saldo_produto / estoque_saldo_entrada: saldos mantidos por trigger a cada lançamento,
+  então o saldo atual é uma leitura por chave primária.
+- Saldo em um instante: saldo atual menos os lançamentos posteriores ao instante.
+
+As funções recebem um cursor aberto (quem chama controla conexão e transação).
+"""
+from datetime import datetime, date
+
+
+def definir_contexto_estoque(cur, origem=None, usuario=None):
+    """
+    Informa origem/usuário dos lançamentos gerados pelos triggers nesta transação
+    (set_config local: vale até o commit/rollback).
+    """
+    cur.execute(
+        "SELECT set_config('estoque.origem', %s, true), set_config('estoque.usuario', %s, true)",
+        (origem or '', usuario or '')
+    )
+
+
+def _momento(valor):
+    """Aceita datetime/date ou texto ISO (YYYY-MM-DD[THH:MM[:SS]]). Data sem hora = fim do dia."""
+    if valor is None or valor == '':
+        return None
+    if isinstance(valor, datetime):
+        return valor
+    if isinstance(valor, date):
+        return datetime(valor.year, valor.month, valor.day, 23, 59, 59, 999999)
+    texto = str(valor).strip()
+    try:
+        if len(texto) == 10:
+            d = datetime.strptime(texto, '%Y-%m-%d')
+            return d.replace(hour=23, minute=59, second=59, microsecond=999999)
+        return datetime.fromisoformat(texto)
+    except ValueError:
+        raise ValueError(f"Data inválida: {valor}")
+
+
+def saldos_por_produto(cur):
+    """Saldo atual de todos os produtos (uma linha por produto, sem varrer o histórico)."""
+    cur.execute("""
+        SELECT produto, produto_nome, saldo_entradas, total_saidas, saldo, movimentos, atualizado_em
+        FROM estoque_saldo_produto
+        ORDER BY LOWER(COALESCE(produto_nome, produto))
+    """)
+    return [
+        {
+            'produto': produto,
+            'nome': nome or produto,
+            'saldo_entradas': saldo_entradas,
+            'total_saidas': total_saidas,
+            'saldo': saldo,
+            'movimentos': movimentos,
+            'atualizado_em': atualizado_em,
+        }
+        for produto, nome, saldo_entradas, total_saidas, saldo, movimentos, atualizado_em in cur.fetchall()
+    ]
+
+
+def saldo_produto(cur, produto, momento=None):
+    """Saldo de um produto (nome livre, normalizado no banco), atual ou em `momento`."""
+    momento = _momento(momento)
+    if momento is None:
+        cur.execute("""
+            SELECT COALESCE((SELECT saldo FROM estoque_saldo_produto
+                              WHERE produto = normalizar_nome(%s)), 0)
+        """, (produto,))
+    else:
+        cur.execute("SELECT estoque_produto_em(%s, %s)", (produto, momento))
+    return cur.fetchone()[0]
+
+
+def saldo_entrada(cur, entrada_id, momento=None):
+    """Saldo de uma entrada, atual ou em `momento`."""
+    momento = _momento(momento)
+    if momento is None:
+        cur.execute("""
+            SELECT COALESCE((SELECT saldo FROM estoque_saldo_entrada WHERE entrada_id = %s), 0)
+        """, (entrada_id,))
+    else:
+        cur.execute("SELECT estoque_entrada_em(%s, %s)", (entrada_id, momento))
+    return cur.fetchone()[0]
+
+
+def movimentos_produto(cur, produto, limite=100):
+    """Últimos lançamentos de um produto (mais recentes primeiro)."""
+    cur.execute("""
+        SELECT id, momento, entrada_id, nf_saida_id, origem, quantidade, usuario
+        FROM estoque_movimentos
+        WHERE produto = normalizar_nome(%s)
+        ORDER BY momento DESC, id DESC
+        LIMIT %s
+    """, (produto, limite))
+    return [
+        {
+            'id': mid,
+            'momento': momento,
+            'entrada_id': entrada_id,
+            'nf_saida_id': nf_saida_id,
+            'origem': origem,
+            'quantidade': quantidade,
+            'usuario': usuario,
+        }
+        for mid, momento, entrada_id, nf_saida_id, origem, quantidade, usuario in cur.fetchall()
+    ]
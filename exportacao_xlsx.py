@@ -0,0 +1,102 @@
+"""
+Exportação de planilhas grandes em memória constante.
+
+- iterar_consulta(): cursor nomeado (server-side) — o PostgreSQL entrega as linhas em
+  lotes de `lote`, nunca o resultado inteiro no processo.
+- escrever_xlsx(): xlsxwriter em modo constant_memory — cada linha vai para o arquivo
+  temporário assim que é escrita (só a linha atual fica em memória).
+- resposta_xlsx(): junta as duas coisas e devolve uma Response que envia o arquivo em
+  blocos e o apaga ao final.
+
+O .xlsx é um zip que só fica completo no close() do workbook, então o envio começa quando
+a planilha termina de ser gravada em disco; o que é limitado é a memória, não a latência.
+"""
+import os
+import tempfile
+
+from flask import Response
+
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+TAMANHO_LOTE = 2000
+TAMANHO_BLOCO = 64 * 1024
+
+
+def iterar_consulta(conexao, sql, params=(), lote=TAMANHO_LOTE, nome='exportacao'):
+    """Gera as linhas de `sql` buscando `lote` por vez num cursor nomeado."""
+    cur = conexao.cursor(name=nome)
+    cur.itersize = lote
+    try:
+        cur.execute(sql, tuple(params))
+        for linha in cur:
+            yield linha
+    finally:
+        cur.close()
+
+
+def escrever_xlsx(caminho, nome_planilha, cabecalhos, linhas, larguras=None):
+    """
+    Grava `linhas` (iterável de sequências na ordem de `cabecalhos`) em `caminho`.
+    Datas saem como dd/mm/aaaa. Retorna a quantidade de linhas gravadas.
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(caminho, {
+        'constant_memory': True,
+        'default_date_format': 'dd/mm/yyyy',
+        'tmpdir': os.path.dirname(caminho) or None,
+    })
+    try:
+        planilha = workbook.add_worksheet(nome_planilha)
+        negrito = workbook.add_format({'bold': True})
+        planilha.write_row(0, 0, cabecalhos, negrito)
+        for col, largura in enumerate(larguras or []):
+            if largura:
+                planilha.set_column(col, col, largura)
+
+        total = 0
+        for total, linha in enumerate(linhas, start=1):
+            planilha.write_row(total, 0, linha)
+        return total
+    finally:
+        workbook.close()
+
+
+def _enviar_e_apagar(caminho, bloco=TAMANHO_BLOCO):
+    try:
+        with open(caminho, 'rb') as arq:
+            while True:
+                dados = arq.read(bloco)
+                if not dados:
+                    break
+                yield dados
+    finally:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+
+def resposta_xlsx(nome_arquivo, nome_planilha, cabecalhos, linhas, larguras=None):
+    """
+    Grava a planilha num arquivo temporário (memória constante) e devolve a Response
+    que o envia em blocos de TAMANHO_BLOCO. `linhas` pode ser um gerador (ex.: iterar_consulta),
+    que é totalmente consumido aqui — a conexão pode ser devolvida logo depois.
+    """
+    fd, caminho = tempfile.mkstemp(prefix='export_', suffix='.xlsx')
+    os.close(fd)
+    try:
+        escrever_xlsx(caminho, nome_planilha, cabecalhos, linhas, larguras)
+    except Exception:
+        os.remove(caminho)
+        raise
+
+    return Response(
+        _enviar_e_apagar(caminho),
+        mimetype=MIMETYPE_XLSX,
+        headers={
+            'Content-Disposition': f'attachment; filename="{nome_arquivo}"',
+            'Content-Length': str(os.path.getsize(caminho)),
+        },
+        direct_passthrough=True,
+    )
@@ -0,0 +1,446 @@
+"""
+Importações de planilha retomáveis e idempotentes.
+
+- receber() guarda o upload em PASTA_IMPORTACOES (sha256 calculado na cópia) e cria o job em
+  importacao_jobs (migração 012) — ou reaproveita a importação inacabada do mesmo usuário
+  para o mesmo nome de arquivo, que é o caso do reenvio depois de uma falha. Só reaproveita
+  se for o mesmo arquivo ou a mesma planilha corrigida: mesma assinatura (cabeçalho +
+  primeiras ASSINATURA_LINHAS linhas, migração 018). Outra planilha com o mesmo nome abre
+  um job novo.
+- executar() lê o arquivo em blocos (leitor_planilha) e grava cada um pelo importador
+  registrado (carga_em_massa.importar_em_blocos). No mesmo commit do bloco vão o checkpoint
+  (importacao_lotes + ultima_linha) e o hash de cada linha aceita (importacao_linhas).
+- Retomada: com o mesmo arquivo (hash igual) as linhas até o checkpoint nem chegam ao banco;
+  com o arquivo corrigido tudo é relido. Nos dois casos a linha é pulada se o par (hash do
+  conteúdo, posição) já consta no job: linhas repetidas no arquivo são todas gravadas e a
+  linha corrigida (hash novo) é gravada. Linhas rejeitadas na validação não entram no hash,
+  então voltam a ser avaliadas.
+- Arquivos de importações com erro/abandonadas expiram após TTL_HORAS.
+
+Importador: registrar_importador(tipo, preparar, ao_gravar=None).
+  preparar(primeiro_bloco, job_id) -> gravar_bloco(cur, bloco) -> (gravadas, {indice: motivo});
+  levanta ValueError se a planilha não serve (ex.: colunas obrigatórias faltando). O job_id
+  permite ao importador guardar estado do job nas tabelas dele (ex.: importacao_nfs).
+  ao_gravar() roda depois de uma execução que gravou alguma linha (ex.: recálculos).
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from itertools import chain
+
+import pandas as pd
+from psycopg2 import Binary
+from psycopg2.extras import execute_values
+
+from carga_em_massa import importar_em_blocos
+from conexao_db import conectar
+from leitor_planilha import abrir_planilha
+
+PASTA_IMPORTACOES = os.getenv("IMPORTACOES_DIR") or os.path.join(tempfile.gettempdir(), 'importacoes')
+TTL_HORAS = float(os.getenv("IMPORTACOES_TTL_HORAS", "72"))
+TEMPO_TRAVADO = 15 * 60       # s sem checkpoint até considerar a execução morta
+_INTERVALO_LIMPEZA = 10 * 60  # s entre limpezas de expirados
+_TAMANHO_COPIA = 64 * 1024
+ASSINATURA_LINHAS = 5         # linhas de dados que entram na assinatura do arquivo
+
+_importadores = {}
+_ultima_limpeza = 0.0
+
+
+def registrar_importador(tipo, preparar, ao_gravar=None):
+    _importadores[tipo] = (preparar, ao_gravar)
+
+
+def receber(tipo, fluxo, nome_arquivo, extensao, usuario=None):
+    """
+    Guarda o arquivo enviado e devolve (job_id, retomado). `retomado` indica que o job é a
+    importação inacabada anterior desse arquivo, que continuará de onde parou.
+    """
+    if tipo not in _importadores:
+        raise ValueError(f"Importação não suportada: {tipo}")
+    _manutencao()
+
+    os.makedirs(PASTA_IMPORTACOES, exist_ok=True)
+    fd, caminho = tempfile.mkstemp(prefix=f'{tipo}_', suffix=f'.{extensao}', dir=PASTA_IMPORTACOES)
+    sha = hashlib.sha256()
+    with os.fdopen(fd, 'wb') as destino:
+        fluxo.seek(0)
+        while True:
+            pedaco = fluxo.read(_TAMANHO_COPIA)
+            if not pedaco:
+                break
+            sha.update(pedaco)
+            destino.write(pedaco)
+    hash_arquivo = sha.hexdigest()
+    assinatura = _assinatura(caminho, extensao)
+
+    anterior = None
+    conn = conectar()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id, arquivo FROM importacao_jobs
+             WHERE tipo = %s AND usuario IS NOT DISTINCT FROM %s AND nome_arquivo = %s
+               AND (hash_arquivo = %s OR assinatura = %s)
+               AND (status IN ('pendente', 'erro')
+                    OR (status = 'processando'
+                        AND atualizado_em < now() - make_interval(secs => %s)))
+             ORDER BY id DESC
+             LIMIT 1
+             FOR UPDATE SKIP LOCKED
+        """, (tipo, usuario, nome_arquivo, hash_arquivo, Binary(assinatura) if assinatura else None,
+              TEMPO_TRAVADO))
+        linha = cur.fetchone()
+        if linha:
+            job_id, anterior = linha
+            # arquivo corrigido: relê do início; as linhas já gravadas são puladas por (hash, posição)
+            cur.execute("""
+                UPDATE importacao_jobs
+                   SET arquivo = %s, extensao = %s, hash_arquivo = %s,
+                       status = 'pendente', mensagem = NULL, atualizado_em = now(),
+                       ultima_linha   = CASE WHEN hash_arquivo = %s THEN ultima_linha ELSE -1 END,
+                       linhas_lidas   = CASE WHEN hash_arquivo = %s THEN linhas_lidas ELSE 0 END,
+                       linhas_puladas = CASE WHEN hash_arquivo = %s THEN linhas_puladas ELSE 0 END,
+                       erros          = CASE WHEN hash_arquivo = %s THEN erros ELSE '[]' END
+                 WHERE id = %s
+            """, (caminho, extensao, hash_arquivo,
+                  hash_arquivo, hash_arquivo, hash_arquivo, hash_arquivo, job_id))
+        else:
+            cur.execute("""
+                INSERT INTO importacao_jobs
+                    (tipo, usuario, nome_arquivo, extensao, arquivo, hash_arquivo, assinatura)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            """, (tipo, usuario, nome_arquivo, extensao, caminho, hash_arquivo,
+                  Binary(assinatura) if assinatura else None))
+            job_id = cur.fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        _remover(caminho)
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+    if anterior and anterior != caminho:
+        _remover(anterior)
+    return job_id, linha is not None
+
+
+def obter_job(job_id):
+    """Dicionário com o estado do job (ou None)."""
+    conn = conectar()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id, tipo, usuario, nome_arquivo, status, ultima_linha, linhas_lidas,
+                   linhas_gravadas, linhas_puladas, total_estimado, erros, mensagem,
+                   criado_em, atualizado_em, concluido_em
+            FROM importacao_jobs WHERE id = %s
+        """, (job_id,))
+        linha = cur.fetchone()
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    if linha is None:
+        return None
+    colunas = ('id', 'tipo', 'usuario', 'nome_arquivo', 'status', 'ultima_linha', 'linhas_lidas',
+               'linhas_gravadas', 'linhas_puladas', 'total_estimado', 'erros', 'mensagem',
+               'criado_em', 'atualizado_em', 'concluido_em')
+    return dict(zip(colunas, linha))
+
+
+# ---------------- execução ----------------
+def _atualizar(job_id, **campos):
+    conn = conectar()
+    if conn is None:
+        return
+    cur = conn.cursor()
+    try:
+        sets = ", ".join(f"{nome} = %s" for nome in campos)
+        cur.execute(
+            f"UPDATE importacao_jobs SET {sets}, atualizado_em = now() WHERE id = %s",
+            list(campos.values()) + [job_id]
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print("Erro ao atualizar importacao_jobs:", e)
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _reservar(job_id):
+    """Marca o job como em processamento; None se ele já está rodando ou terminou."""
+    conn = conectar()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE importacao_jobs
+               SET status = 'processando', mensagem = NULL,
+                   tentativas = tentativas + 1, atualizado_em = now()
+             WHERE id = %s AND status IN ('pendente', 'erro')
+            RETURNING tipo, arquivo, extensao, ultima_linha,
+                      (SELECT COALESCE(MAX(lote), 0) FROM importacao_lotes WHERE job_id = %s)
+        """, (job_id, job_id))
+        linha = cur.fetchone()
+        conn.commit()
+        return linha
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _hashes_linhas(bloco):
+    """blake2b (16 bytes) do conteúdo de cada linha, alinhado ao índice do bloco."""
+    hashes = []
+    for valores in bloco.itertuples(index=False, name=None):
+        texto = '\x1f'.join('' if pd.isna(v) else str(v) for v in valores)
+        hashes.append(hashlib.blake2b(texto.encode('utf-8'), digest_size=16).digest())
+    return pd.Series(hashes, index=bloco.index, dtype=object)
+
+
+def _assinatura(caminho, extensao):
+    """
+    blake2b (16 bytes) do cabeçalho + primeiras ASSINATURA_LINHAS linhas de dados do arquivo,
+    ou None se ele não puder ser lido (o job recusa a planilha em executar()).
+    """
+    try:
+        with open(caminho, 'rb') as fluxo:
+            _, blocos = abrir_planilha(fluxo, extensao, linhas_por_bloco=ASSINATURA_LINHAS)
+            try:
+                primeiro = next(blocos, None)
+            finally:
+                blocos.close()
+    except Exception:
+        return None
+    if primeiro is None:
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    h.update('\x1f'.join(str(c) for c in primeiro.columns).encode('utf-8'))
+    for hash_linha in _hashes_linhas(primeiro):
+        h.update(hash_linha)
+    return h.digest()
+
+
+def _apos_checkpoint(blocos, ultima_linha):
+    """Descarta as linhas já confirmadas numa execução anterior do mesmo arquivo."""
+    for bloco in blocos:
+        if ultima_linha >= 0:
+            bloco = bloco[bloco.index > ultima_linha]
+        if len(bloco):
+            yield bloco
+
+
+def _gravar_com_checkpoint(job_id, gravar_bloco, ultimo_lote, resumo):
+    """
+    Envolve o gravar_bloco do importador: pula linhas já importadas pelo job — o par (hash,
+    posição) já consta em importacao_linhas — e registra, na mesma transação do bloco, os
+    hashes aceitos (com a posição) e o checkpoint. Hash gravado antes da migração 016
+    (linha = -1) não tem posição e vale para qualquer linha com o mesmo conteúdo.
+    """
+    estado = {'lote': ultimo_lote}
+
+    def gravar(cur, bloco):
+        hashes = _hashes_linhas(bloco)
+        cur.execute(
+            "SELECT hash, linha FROM importacao_linhas WHERE job_id = %s AND hash = ANY(%s)",
+            (job_id, [Binary(h) for h in set(hashes)])
+        )
+        ja_importadas = {(bytes(h), linha) for h, linha in cur.fetchall()}
+        pular = pd.Series([(h, int(i)) in ja_importadas or (h, -1) in ja_importadas
+                           for i, h in hashes.items()],
+                          index=hashes.index, dtype=bool)
+
+        novas = bloco[~pular]
+        gravadas, rejeitadas = gravar_bloco(cur, novas) if len(novas) else (0, {})
+
+        aceitas = hashes[~pular & ~hashes.index.isin(list(rejeitadas))]
+        if len(aceitas):
+            execute_values(
+                cur,
+                "INSERT INTO importacao_linhas (job_id, hash, linha) VALUES %s ON CONFLICT DO NOTHING",
+                [(job_id, Binary(h), int(i)) for i, h in aceitas.items()]
+            )
+
+        estado['lote'] += 1
+        puladas = int(pular.sum())
+        erros = [f'linha {i + 1}: {motivo}' for i, motivo in rejeitadas.items()]
+        cur.execute("""
+            INSERT INTO importacao_lotes
+                (job_id, lote, linha_inicial, linha_final, lidas, gravadas, puladas)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, (job_id, estado['lote'], int(bloco.index[0]), int(bloco.index[-1]),
+              len(bloco), gravadas, puladas))
+        cur.execute("""
+            UPDATE importacao_jobs
+               SET ultima_linha = %s,
+                   linhas_lidas = linhas_lidas + %s,
+                   linhas_gravadas = linhas_gravadas + %s,
+                   linhas_puladas = linhas_puladas + %s,
+                   erros = erros || %s::jsonb,
+                   atualizado_em = now()
+             WHERE id = %s
+        """, (int(bloco.index[-1]), len(bloco), gravadas, puladas, json.dumps(erros), job_id))
+        resumo['puladas'] += puladas
+        return gravadas, rejeitadas
+
+    return gravar
+
+
+def executar(job_id):
+    """
+    Processa (ou retoma) o job na thread atual. Retorna o resumo desta execução:
+    {'job_id', 'lidas', 'gravadas', 'puladas', 'erros', 'falha', 'invalida'} — 'invalida'
+    indica que a planilha foi recusada antes de gravar qualquer coisa (preparar()).
+    """
+    resumo = {'job_id': job_id, 'lidas': 0, 'gravadas': 0, 'puladas': 0,
+              'erros': [], 'falha': None, 'invalida': False}
+    job = _reservar(job_id)
+    if job is None:
+        resumo['falha'] = 'Importação já em andamento ou concluída.'
+        return resumo
+    tipo, arquivo, extensao, ultima_linha, ultimo_lote = job
+
+    importador = _importadores.get(tipo)
+    if importador is None or not arquivo or not os.path.exists(arquivo):
+        resumo['falha'] = 'Importação não suportada.' if importador is None else 'Arquivo da importação indisponível.'
+        _atualizar(job_id, status='erro', mensagem=resumo['falha'])
+        return resumo
+    preparar, ao_gravar = importador
+
+    with open(arquivo, 'rb') as fluxo:
+        try:
+            total, blocos = abrir_planilha(fluxo, extensao)
+            primeiro = next(blocos, None)
+            gravar_bloco = preparar(primeiro, job_id) if primeiro is not None else None
+        except Exception as e:
+            resumo['falha'], resumo['invalida'] = str(e), True
+            _atualizar(job_id, status='erro', mensagem=str(e)[:500])
+            return resumo
+
+        if gravar_bloco is not None:
+            _atualizar(job_id, total_estimado=total)
+            conn = conectar()
+            try:
+                r = importar_em_blocos(
+                    conn,
+                    _apos_checkpoint(chain([primeiro], blocos), ultima_linha),
+                    _gravar_com_checkpoint(job_id, gravar_bloco, ultimo_lote, resumo)
+                )
+            finally:
+                conn.close()
+            resumo.update(lidas=r['lidas'], gravadas=r['gravadas'], erros=r['erros'], falha=r['falha'])
+
+    if resumo['gravadas'] and ao_gravar:
+        try:
+            ao_gravar()
+        except Exception as e:
+            print(f"Erro no pós-processamento da importação {job_id}:", e)
+
+    if resumo['falha']:
+        _atualizar(job_id, status='erro', mensagem=resumo['falha'][:500])
+        return resumo
+
+    conn = conectar()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE importacao_jobs
+               SET status = 'concluido', mensagem = NULL, arquivo = NULL,
+                   concluido_em = now(), atualizado_em = now()
+             WHERE id = %s
+        """, (job_id,))
+        cur.execute("DELETE FROM importacao_linhas WHERE job_id = %s", (job_id,))
+        cur.execute("DELETE FROM importacao_nfs WHERE job_id = %s", (job_id,))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    _remover(arquivo)
+    return resumo
+
+
+def executar_em_segundo_plano(job_id):
+    """executar() numa thread daemon; o andamento é acompanhado por obter_job()."""
+    def alvo():
+        try:
+            executar(job_id)
+        except Exception as e:
+            print(f"Erro na importação {job_id}:", e)
+            _atualizar(job_id, status='erro', mensagem=str(e)[:500])
+
+    threading.Thread(target=alvo, name=f"importacao-{job_id}", daemon=True).start()
+
+
+# ---------------- manutenção ----------------
+def _remover(caminho):
+    try:
+        if caminho and os.path.exists(caminho):
+            os.remove(caminho)
+    except OSError:
+        pass
+
+
+def _manutencao():
+    """Expira importações inacabadas paradas há mais de TTL_HORAS (no máximo a cada _INTERVALO_LIMPEZA)."""
+    global _ultima_limpeza
+    agora = time.monotonic()
+    if agora - _ultima_limpeza < _INTERVALO_LIMPEZA:
+        return
+    _ultima_limpeza = agora
+
+    conn = conectar()
+    if conn is None:
+        return
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            WITH vencidos AS (
+                SELECT id, arquivo FROM importacao_jobs
+                 WHERE status IN ('pendente', 'processando', 'erro')
+                   AND atualizado_em < now() - make_interval(secs => %s)
+                 FOR UPDATE SKIP LOCKED
+            )
+            UPDATE importacao_jobs j
+               SET status = 'expirado', arquivo = NULL, atualizado_em = now()
+              FROM vencidos
+             WHERE j.id = vencidos.id
+            RETURNING j.id, vencidos.arquivo
+        """, (TTL_HORAS * 3600,))
+        expirados = cur.fetchall()
+        if expirados:
+            ids = [job_id for job_id, _ in expirados]
+            cur.execute("DELETE FROM importacao_linhas WHERE job_id = ANY(%s)", (ids,))
+            cur.execute("DELETE FROM importacao_nfs WHERE job_id = ANY(%s)", (ids,))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print("Erro na manutenção de importacao_jobs:", e)
+        return
+    finally:
+        cur.close()
+        conn.close()
+
+    for _, caminho in expirados:
+        _remover(caminho)
+
+    # arquivos órfãos (falha entre gravar o upload e registrar o job) também vencem pelo TTL
+    if os.path.isdir(PASTA_IMPORTACOES):
+        limite = time.time() - TTL_HORAS * 3600
+        for nome in os.listdir(PASTA_IMPORTACOES):
+            caminho = os.path.join(PASTA_IMPORTACOES, nome)
+            try:
+                if os.path.getmtime(caminho) < limite:
+                    _remover(caminho)
+            except OSError:
+                pass
@@ -0,0 +1,137 @@
+"""
+Índice de nomes normalizados para a busca aproximada de produtos.
+
+Quando o nome do produto da entrada não está exatamente no prod_map, o cálculo procura a
+primeira chave (na ordem de inserção do mapa) que contém o nome ou está contida nele.
+Em vez de varrer todas as chaves a cada linha/metal, IndiceNomes mantém:
+  - a posição de cada chave (ordem de inserção)
+  - um índice de n-gramas (até 3 caracteres) -> chaves que os contêm
+e resolve:
+  - chaves que CONTÊM o nome: interseção das listas dos n-gramas do nome, depois confirma
+  - chaves CONTIDAS no nome: testa as substrings do nome direto no dicionário
+As respostas ficam memorizadas (LRU de até TAMANHO_MEMO nomes) até o mapa mudar.
+
+O índice é montado numa estrutura local e publicado com uma única atribuição (_estado), então
+uma consulta concorrente vê o índice antigo inteiro ou o novo inteiro, nunca metade de cada.
+"""
+import threading
+from collections import OrderedDict
+
+_TAM_NGRAMA = 3
+TAMANHO_MEMO = 20000
+
+
+class _Estado:
+    """Índice de uma geração do mapa: posições, n-gramas e memória das respostas."""
+    __slots__ = ('posicoes', 'ngramas', 'memo', 'trava')
+
+    def __init__(self, posicoes, ngramas):
+        self.posicoes = posicoes
+        self.ngramas = ngramas
+        self.memo = OrderedDict()
+        self.trava = threading.Lock()
+
+
+def _ngramas(texto, tamanho):
+    return {texto[i:i + tamanho] for i in range(len(texto) - tamanho + 1)}
+
+
+class IndiceNomes(dict):
+    """
+    dict (chave normalizada -> valor) com busca por substring indexada.
+    Pode ser usado no lugar do prod_map: leitura normal de dict continua igual.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._invalidar()
+
+    # qualquer alteração no mapa invalida índice e memória
+    def _invalidar(self):
+        self._estado = None
+
+    def __setitem__(self, chave, valor):
+        super().__setitem__(chave, valor)
+        self._invalidar()
+
+    def __delitem__(self, chave):
+        super().__delitem__(chave)
+        self._invalidar()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._invalidar()
+
+    def pop(self, *args):
+        resultado = super().pop(*args)
+        self._invalidar()
+        return resultado
+
+    def clear(self):
+        super().clear()
+        self._invalidar()
+
+    def _construir(self):
+        posicoes = {}
+        ngramas = {}
+        for pos, chave in enumerate(self.keys()):
+            if not chave:
+                continue
+            posicoes[chave] = pos
+            for tamanho in range(1, _TAM_NGRAMA + 1):
+                for g in _ngramas(chave, tamanho):
+                    ngramas.setdefault((tamanho, g), set()).add(chave)
+        return _Estado(posicoes, ngramas)
+
+    @staticmethod
+    def _que_contem(estado, nome):
+        """Chaves que contêm `nome` como substring."""
+        tamanho = min(len(nome), _TAM_NGRAMA)
+        listas = [estado.ngramas.get((tamanho, g)) for g in _ngramas(nome, tamanho)]
+        if not listas or any(lista is None for lista in listas):
+            return set()
+        listas.sort(key=len)
+        candidatos = set(listas[0])
+        for lista in listas[1:]:
+            candidatos &= lista
+            if not candidatos:
+                return candidatos
+        if len(nome) <= _TAM_NGRAMA:
+            return candidatos
+        return {c for c in candidatos if nome in c}
+
+    @staticmethod
+    def _contidas_em(estado, nome):
+        """Chaves que são substring de `nome`."""
+        encontradas = set()
+        n = len(nome)
+        for i in range(n):
+            for j in range(i + 1, n + 1):
+                sub = nome[i:j]
+                if sub in estado.posicoes:
+                    encontradas.add(sub)
+        return encontradas
+
+    def correspondencias(self, nome):
+        """
+        Chaves k (não vazias) com `nome in k` ou `k in nome`, na ordem de inserção do mapa —
+        exatamente as que a varredura linear encontraria, na mesma ordem.
+        """
+        if not nome:
+            return []
+        estado = self._estado
+        if estado is None:
+            estado = self._construir()
+            self._estado = estado
+        with estado.trava:
+            memo = estado.memo.get(nome)
+            if memo is not None:
+                estado.memo.move_to_end(nome)
+                return memo
+        chaves = self._que_contem(estado, nome) | self._contidas_em(estado, nome)
+        resultado = sorted(chaves, key=estado.posicoes.__getitem__)
+        with estado.trava:
+            estado.memo[nome] = resultado
+            if len(estado.memo) > TAMANHO_MEMO:
+                estado.memo.popitem(last=False)
+        return resultado
@@ -0,0 +1,148 @@
+"""
+Leitura de planilhas de importação em blocos, com memória limitada.
+
+abrir_planilha() devolve (total_estimado, blocos): `blocos` é um gerador de DataFrames de
+até LINHAS_POR_BLOCO linhas, com as colunas do cabeçalho (primeira linha) e o índice
+numerado pela posição da linha de dados no arquivo (0 = primeira linha depois do
+cabeçalho), para as mensagens de erro continuarem certas entre um bloco e outro.
+  - xlsx: openpyxl em modo read_only — a planilha é lida como fluxo de linhas, sem montar
+    a pasta de trabalho inteira em memória;
+  - csv: pandas em chunks (separador ';', ',' ou tab detectado na primeira linha; UTF-8
+    ou Latin-1); todas as colunas chegam como texto;
+  - xls: o formato antigo não tem leitura em fluxo; é lido inteiro (no máximo 65.536
+    linhas) e devolvido em fatias.
+Células vazias viram NaN, como no pd.read_excel. Linhas totalmente vazias são puladas.
+"""
+import codecs
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+
+LINHAS_POR_BLOCO = 5000
+EXTENSOES = {'xls', 'xlsx', 'csv'}
+
+
+def _nomes_colunas(cabecalho):
+    """Cabeçalho como o pd.read_excel: vazio -> 'Unnamed: i', repetido -> 'Nome.1'."""
+    nomes, vistos = [], {}
+    for i, valor in enumerate(cabecalho):
+        nome = str(valor).strip() if valor is not None and str(valor).strip() else f'Unnamed: {i}'
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f'{nome}.{vistos[nome]}'
+        else:
+            vistos[nome] = 0
+        nomes.append(nome)
+    return nomes
+
+
+def _quadro(linhas, indices, colunas):
+    df = pd.DataFrame.from_records(linhas, columns=colunas)
+    df.index = pd.Index(indices)
+    return df.fillna(np.nan)
+
+
+def _blocos_xlsx(arquivo, linhas_por_bloco):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        linhas = ws.iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        colunas = _nomes_colunas(cabecalho)
+        largura = len(colunas)
+
+        bloco, indices = [], []
+        for posicao, linha in enumerate(linhas):
+            if not any(v is not None and v != '' for v in linha):
+                continue
+            linha = tuple(linha[:largura])
+            if len(linha) < largura:
+                linha += (None,) * (largura - len(linha))
+            bloco.append(linha)
+            indices.append(posicao)
+            if len(bloco) >= linhas_por_bloco:
+                yield _quadro(bloco, indices, colunas)
+                bloco, indices = [], []
+        if bloco:
+            yield _quadro(bloco, indices, colunas)
+    finally:
+        wb.close()
+
+
+def _total_xlsx(arquivo):
+    """Linhas de dados segundo a dimensão gravada no arquivo (pode faltar: None)."""
+    from openpyxl import load_workbook
+
+    try:
+        wb = load_workbook(arquivo, read_only=True)
+        try:
+            max_row = wb.worksheets[0].max_row
+        finally:
+            wb.close()
+        return max(max_row - 1, 0) if max_row else None
+    except Exception:
+        return None
+    finally:
+        arquivo.seek(0)
+
+
+def _texto_csv(arquivo):
+    """Envolve o fluxo binário em texto com a codificação e o separador detectados."""
+    amostra = arquivo.read(64 * 1024)
+    arquivo.seek(0)
+    try:
+        # a amostra pode cortar um caractere multibyte no fim; o decoder incremental tolera
+        codecs.getincrementaldecoder('utf-8')().decode(amostra, final=False)
+        codificacao = 'utf-8-sig'
+    except UnicodeDecodeError:
+        codificacao = 'latin-1'
+
+    primeira = amostra.decode(codificacao, errors='ignore').splitlines()[:1]
+    try:
+        separador = csv.Sniffer().sniff(primeira[0], delimiters=';,\t').delimiter if primeira else ';'
+    except csv.Error:
+        separador = ';'
+    return io.TextIOWrapper(arquivo, encoding=codificacao, newline=''), separador
+
+
+def _blocos_csv(arquivo, linhas_por_bloco):
+    texto, separador = _texto_csv(arquivo)
+    leitor = pd.read_csv(texto, sep=separador, dtype=str, chunksize=linhas_por_bloco,
+                         skip_blank_lines=True)
+    try:
+        for bloco in leitor:
+            bloco.columns = _nomes_colunas(bloco.columns)
+            yield bloco
+    finally:
+        leitor.close()
+        texto.detach()  # não fecha o arquivo enviado junto com o wrapper
+
+
+def _blocos_xls(df, linhas_por_bloco):
+    for inicio in range(0, len(df), linhas_por_bloco):
+        yield df.iloc[inicio:inicio + linhas_por_bloco]
+
+
+def abrir_planilha(arquivo, extensao, linhas_por_bloco=LINHAS_POR_BLOCO):
+    """
+    (total_estimado, gerador de blocos) para o arquivo enviado (fluxo binário posicionável).
+    total_estimado é None quando o formato não permite saber sem ler tudo (csv).
+    Levanta ValueError para extensão não suportada.
+    """
+    extensao = (extensao or '').lower()
+    arquivo.seek(0)
+    if extensao == 'xlsx':
+        return _total_xlsx(arquivo), _blocos_xlsx(arquivo, linhas_por_bloco)
+    if extensao == 'csv':
+        return None, _blocos_csv(arquivo, linhas_por_bloco)
+    if extensao == 'xls':
+        df = pd.read_excel(arquivo, engine='xlrd')
+        df.columns = _nomes_colunas(df.columns)
+        return len(df), _blocos_xls(df, linhas_por_bloco)
+    raise ValueError(f'Extensão não suportada: .{extensao}')
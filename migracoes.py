@@ -0,0 +1,61 @@
+import os
+import glob
+from conexao_db import conectar
+
+# Arquivos .sql aplicados em ordem alfabética (001_..., 002_...), uma única vez cada.
+PASTA_MIGRACOES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migracoes')
+
+# chave do advisory lock: evita que vários workers apliquem a mesma migração ao mesmo tempo
+_LOCK_MIGRACOES = 781_245_001
+
+
+def aplicar_migracoes():
+    """
+    Aplica as migrações pendentes da pasta migracoes/ e registra cada uma em schema_migracoes.
+    Cada arquivo roda na sua própria transação; se um falhar, os seguintes não são aplicados.
+    Retorna a lista de migrações aplicadas nesta chamada.
+    """
+    conn = conectar()
+    if conn is None:
+        return []
+    cur = conn.cursor()
+    aplicadas = []
+    try:
+        cur.execute("SELECT pg_advisory_lock(%s)", (_LOCK_MIGRACOES,))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migracoes (
+                nome text PRIMARY KEY,
+                aplicada_em timestamptz NOT NULL DEFAULT now()
+            )
+        """)
+        conn.commit()
+
+        cur.execute("SELECT nome FROM schema_migracoes")
+        ja_aplicadas = {r[0] for r in cur.fetchall()}
+
+        for caminho in sorted(glob.glob(os.path.join(PASTA_MIGRACOES, '*.sql'))):
+            nome = os.path.basename(caminho)
+            if nome in ja_aplicadas:
+                continue
+            with open(caminho, encoding='utf-8') as f:
+                sql = f.read()
+            try:
+                # sem parâmetros: o psycopg2 não interpreta '%' no texto da migração
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_migracoes (nome) VALUES (%s)", (nome,))
+                conn.commit()
+                aplicadas.append(nome)
+            except Exception as e:
+                conn.rollback()
+                print(f"Erro ao aplicar migração {nome}:", e)
+                break
+    finally:
+        try:
+            conn.rollback()
+            cur.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_MIGRACOES,))
+            conn.commit()
+        except Exception:
+            pass
+        cur.close()
+        conn.close()
+    return aplicadas
@@ -0,0 +1,159 @@
+-- Fila de recálculo incremental de calculo_nfs.
+-- Qualquer alteração que afete o cálculo de uma entrada (a própria entrada_nf,
+-- preço/grupo de material, percentuais de produto, nome de fornecedor) marca as
+-- entradas dependentes aqui; recalcular_pendentes() processa só essas linhas.
+
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- Equivalente SQL de normalize_name() (routes/calculo_nfs_route.py)
+CREATE OR REPLACE FUNCTION normalizar_nome(t text) RETURNS text
+LANGUAGE sql STABLE AS $$
+    SELECT upper(btrim(
+        regexp_replace(
+            regexp_replace(
+                regexp_replace(
+                    replace(regexp_replace(unaccent(coalesce(t, '')), '\(.*?\)', ' ', 'g'), '~', ' '),
+                    '\ymm\y', ' ', 'gi'),
+                '[^0-9A-Za-z[:space:]]', ' ', 'g'),
+            '[[:space:]]+', ' ', 'g')
+    ))
+$$;
+
+CREATE TABLE IF NOT EXISTS calculo_nfs_pendentes (
+    entrada_id integer PRIMARY KEY,
+    marcado_em timestamptz NOT NULL DEFAULT now()
+);
+
+-- entrada_nf: toda entrada inserida/alterada precisa ser (re)calculada
+CREATE OR REPLACE FUNCTION marcar_pendente_entrada_nf() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO calculo_nfs_pendentes (entrada_id)
+    SELECT id FROM entradas_alteradas
+    ON CONFLICT (entrada_id) DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_entrada_nf_pendente_ins ON entrada_nf;
+CREATE TRIGGER trg_entrada_nf_pendente_ins
+    AFTER INSERT ON entrada_nf
+    REFERENCING NEW TABLE AS entradas_alteradas
+    FOR EACH STATEMENT EXECUTE FUNCTION marcar_pendente_entrada_nf();
+
+DROP TRIGGER IF EXISTS trg_entrada_nf_pendente_upd ON entrada_nf;
+CREATE TRIGGER trg_entrada_nf_pendente_upd
+    AFTER UPDATE ON entrada_nf
+    REFERENCING NEW TABLE AS entradas_alteradas
+    FOR EACH STATEMENT EXECUTE FUNCTION marcar_pendente_entrada_nf();
+
+-- materiais: marca entradas que usam o material (nome antigo ou novo) em material_1..5
+CREATE OR REPLACE FUNCTION marcar_pendente_material() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    nomes text[] := ARRAY[]::text[];
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND NEW.nome IS NOT DISTINCT FROM OLD.nome
+       AND NEW.valor IS NOT DISTINCT FROM OLD.valor
+       AND NEW.grupo IS NOT DISTINCT FROM OLD.grupo
+       AND NEW.fornecedor_id IS NOT DISTINCT FROM OLD.fornecedor_id THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        nomes := nomes || normalizar_nome(OLD.nome);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        nomes := nomes || normalizar_nome(NEW.nome);
+    END IF;
+
+    INSERT INTO calculo_nfs_pendentes (entrada_id)
+    SELECT en.id
+      FROM entrada_nf en
+     WHERE normalizar_nome(en.material_1) = ANY(nomes)
+        OR normalizar_nome(en.material_2) = ANY(nomes)
+        OR normalizar_nome(en.material_3) = ANY(nomes)
+        OR normalizar_nome(en.material_4) = ANY(nomes)
+        OR normalizar_nome(en.material_5) = ANY(nomes)
+    ON CONFLICT (entrada_id) DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_materiais_pendente ON materiais;
+CREATE TRIGGER trg_materiais_pendente
+    AFTER INSERT OR UPDATE OR DELETE ON materiais
+    FOR EACH ROW EXECUTE FUNCTION marcar_pendente_material();
+
+-- produtos: o cálculo também aceita correspondência parcial do nome (prefixo/substring),
+-- então marca toda entrada cujo produto contém ou está contido no nome alterado
+CREATE OR REPLACE FUNCTION marcar_pendente_produto() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    nomes text[] := ARRAY[]::text[];
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND NEW.nome IS NOT DISTINCT FROM OLD.nome
+       AND NEW.percentual_cobre IS NOT DISTINCT FROM OLD.percentual_cobre
+       AND NEW.percentual_zinco IS NOT DISTINCT FROM OLD.percentual_zinco THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        nomes := nomes || normalizar_nome(OLD.nome);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        nomes := nomes || normalizar_nome(NEW.nome);
+    END IF;
+
+    INSERT INTO calculo_nfs_pendentes (entrada_id)
+    SELECT en.id
+      FROM entrada_nf en
+      CROSS JOIN LATERAL (SELECT normalizar_nome(en.produto) AS p) n
+     WHERE n.p <> ''
+       AND EXISTS (
+            SELECT 1 FROM unnest(nomes) AS k
+             WHERE k <> '' AND (strpos(k, n.p) > 0 OR strpos(n.p, k) > 0)
+       )
+    ON CONFLICT (entrada_id) DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_produtos_pendente ON produtos;
+CREATE TRIGGER trg_produtos_pendente
+    AFTER INSERT OR UPDATE OR DELETE ON produtos
+    FOR EACH ROW EXECUTE FUNCTION marcar_pendente_produto();
+
+-- fornecedores: o nome resolve o fornecedor_id usado para escolher o material certo
+CREATE OR REPLACE FUNCTION marcar_pendente_fornecedor() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    nomes text[] := ARRAY[]::text[];
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.nome IS NOT DISTINCT FROM OLD.nome THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        nomes := nomes || normalizar_nome(OLD.nome);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        nomes := nomes || normalizar_nome(NEW.nome);
+    END IF;
+
+    INSERT INTO calculo_nfs_pendentes (entrada_id)
+    SELECT en.id FROM entrada_nf en
+     WHERE normalizar_nome(en.fornecedor) = ANY(nomes)
+    ON CONFLICT (entrada_id) DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_fornecedores_pendente ON fornecedores;
+CREATE TRIGGER trg_fornecedores_pendente
+    AFTER INSERT OR UPDATE OR DELETE ON fornecedores
+    FOR EACH ROW EXECUTE FUNCTION marcar_pendente_fornecedor();
+
+-- carga inicial: tudo que existe hoje é calculado uma vez pela fila
+INSERT INTO calculo_nfs_pendentes (entrada_id)
+SELECT id FROM entrada_nf
+ON CONFLICT (entrada_id) DO NOTHING;
@@ -0,0 +1,5 @@
+-- Grid do cálculo de NFs: paginação keyset em (data, id).
+-- Mesma expressão usada em _GRID_ORDENACAO['data'] (routes/calculo_nfs_route.py),
+-- senão o planner não usa o índice.
+CREATE INDEX IF NOT EXISTS idx_entrada_nf_data_id
+    ON entrada_nf ((COALESCE(data, '-infinity')), id);
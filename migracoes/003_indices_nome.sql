@@ -0,0 +1,41 @@
+-- Índices para as buscas por nome do cálculo de NFs (fallback sem mapas em
+-- calcular_qtd_cobre/zinco/sucata: WHERE UPPER(TRIM(nome)) = %s [AND fornecedor_id = %s]).
+-- A expressão precisa ser idêntica à da consulta para o planner usar o índice.
+CREATE INDEX IF NOT EXISTS idx_produtos_nome_upper
+    ON produtos ((UPPER(TRIM(nome))));
+
+CREATE INDEX IF NOT EXISTS idx_fornecedores_nome_upper
+    ON fornecedores ((UPPER(TRIM(nome))));
+
+CREATE INDEX IF NOT EXISTS idx_materiais_nome_upper_fornecedor
+    ON materiais ((UPPER(TRIM(nome))), fornecedor_id);
+
+-- Versão IMMUTABLE de normalizar_nome (migração 001) para poder ser usada em índices:
+-- unaccent() é STABLE porque depende do search_path; fixando o dicionário fica imutável.
+CREATE OR REPLACE FUNCTION unaccent_imutavel(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+
+CREATE OR REPLACE FUNCTION normalizar_nome(t text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT upper(btrim(
+        regexp_replace(
+            regexp_replace(
+                regexp_replace(
+                    replace(regexp_replace(unaccent_imutavel(coalesce(t, '')), '\(.*?\)', ' ', 'g'), '~', ' '),
+                    '\ymm\y', ' ', 'gi'),
+                '[^0-9A-Za-z[:space:]]', ' ', 'g'),
+            '[[:space:]]+', ' ', 'g')
+    ))
+$$;
+
+-- Nome normalizado (mesma chave de normalize_name nos mapas do cálculo) mantido pelo
+-- próprio índice: usado pelas triggers de pendência e por buscas normalizadas.
+CREATE INDEX IF NOT EXISTS idx_produtos_nome_normalizado
+    ON produtos ((normalizar_nome(nome)));
+
+CREATE INDEX IF NOT EXISTS idx_fornecedores_nome_normalizado
+    ON fornecedores ((normalizar_nome(nome)));
+
+CREATE INDEX IF NOT EXISTS idx_materiais_nome_normalizado
+    ON materiais ((normalizar_nome(nome)), fornecedor_id);
@@ -0,0 +1,24 @@
+-- Cache de referência (cache_referencia.py): avisa os processos do app quando
+-- produtos, fornecedores ou materiais mudam. Um aviso por comando basta.
+CREATE OR REPLACE FUNCTION notificar_referencia() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('referencia_atualizada', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_produtos_notificar_referencia ON produtos;
+CREATE TRIGGER trg_produtos_notificar_referencia
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON produtos
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_referencia();
+
+DROP TRIGGER IF EXISTS trg_fornecedores_notificar_referencia ON fornecedores;
+CREATE TRIGGER trg_fornecedores_notificar_referencia
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON fornecedores
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_referencia();
+
+DROP TRIGGER IF EXISTS trg_materiais_notificar_referencia ON materiais;
+CREATE TRIGGER trg_materiais_notificar_referencia
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON materiais
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_referencia();
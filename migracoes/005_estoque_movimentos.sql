@@ -0,0 +1,297 @@
+-- Razão de estoque (append-only) + saldos materializados.
+--
+-- estoque_movimentos recebe um lançamento para cada variação de estoque:
+--   - calculo_nfs.quantidade_estoque (carga da entrada, distribuir_quantidade, edição manual):
+--     lançamento com entrada_id, quantidade = novo - antigo
+--   - entrada_nf.produto alterado: transfere o saldo da entrada entre os produtos
+--   - produtos_nf (produtos das NFs de saída): lançamento negativo por produto, sem entrada_id
+-- A origem/usuário do lançamento podem ser informados pela transação com
+-- set_config('estoque.origem', ..., true) / set_config('estoque.usuario', ..., true).
+--
+-- estoque_saldo_produto / estoque_saldo_entrada são mantidos pelo trigger de inserção do
+-- razão (um upsert agregado por comando): consultar saldo não depende do tamanho do histórico.
+
+CREATE TABLE IF NOT EXISTS estoque_movimentos (
+    id bigserial PRIMARY KEY,
+    momento timestamptz NOT NULL DEFAULT now(),
+    produto text NOT NULL,              -- normalizar_nome(nome do produto)
+    produto_nome text,                  -- nome como veio na origem (exibição)
+    entrada_id integer,                 -- NULL para saídas
+    nf_saida_id integer,
+    origem text NOT NULL,               -- entrada | ajuste | distribuicao | exclusao | reclassificacao | saida | saldo_inicial
+    quantidade numeric NOT NULL,        -- positiva entra, negativa sai
+    usuario text
+);
+
+CREATE INDEX IF NOT EXISTS idx_estoque_movimentos_produto_momento
+    ON estoque_movimentos (produto, momento);
+CREATE INDEX IF NOT EXISTS idx_estoque_movimentos_entrada_momento
+    ON estoque_movimentos (entrada_id, momento) WHERE entrada_id IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS estoque_saldo_produto (
+    produto text PRIMARY KEY,
+    produto_nome text,
+    saldo_entradas numeric NOT NULL DEFAULT 0,  -- lançamentos de estoque (entradas/ajustes) do produto
+    total_saidas numeric NOT NULL DEFAULT 0,    -- quantidade já faturada em NFs de saída
+    saldo numeric NOT NULL DEFAULT 0,           -- saldo_entradas - total_saidas
+    movimentos bigint NOT NULL DEFAULT 0,
+    atualizado_em timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS estoque_saldo_entrada (
+    entrada_id integer PRIMARY KEY,
+    produto text NOT NULL,
+    saldo numeric NOT NULL DEFAULT 0,
+    atualizado_em timestamptz NOT NULL DEFAULT now()
+);
+
+-- razão é append-only: correções entram como novos lançamentos
+CREATE OR REPLACE FUNCTION estoque_movimentos_imutavel() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    RAISE EXCEPTION 'estoque_movimentos é somente inserção (%)', TG_OP;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_estoque_movimentos_imutavel ON estoque_movimentos;
+CREATE TRIGGER trg_estoque_movimentos_imutavel
+    BEFORE UPDATE OR DELETE ON estoque_movimentos
+    FOR EACH ROW EXECUTE FUNCTION estoque_movimentos_imutavel();
+
+DROP TRIGGER IF EXISTS trg_estoque_movimentos_truncate ON estoque_movimentos;
+CREATE TRIGGER trg_estoque_movimentos_truncate
+    BEFORE TRUNCATE ON estoque_movimentos
+    FOR EACH STATEMENT EXECUTE FUNCTION estoque_movimentos_imutavel();
+
+-- saldos: aplica os lançamentos do comando de uma vez
+CREATE OR REPLACE FUNCTION estoque_aplicar_saldos() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO estoque_saldo_produto AS s
+           (produto, produto_nome, saldo_entradas, total_saidas, saldo, movimentos, atualizado_em)
+    SELECT m.produto,
+           (array_agg(m.produto_nome ORDER BY m.id DESC) FILTER (WHERE m.produto_nome IS NOT NULL))[1],
+           COALESCE(SUM(m.quantidade) FILTER (WHERE m.nf_saida_id IS NULL), 0),
+           COALESCE(-SUM(m.quantidade) FILTER (WHERE m.nf_saida_id IS NOT NULL), 0),
+           SUM(m.quantidade),
+           COUNT(*),
+           now()
+      FROM novos_movimentos m
+     GROUP BY m.produto
+    ON CONFLICT (produto) DO UPDATE SET
+        produto_nome = COALESCE(EXCLUDED.produto_nome, s.produto_nome),
+        saldo_entradas = s.saldo_entradas + EXCLUDED.saldo_entradas,
+        total_saidas = s.total_saidas + EXCLUDED.total_saidas,
+        saldo = s.saldo + EXCLUDED.saldo,
+        movimentos = s.movimentos + EXCLUDED.movimentos,
+        atualizado_em = EXCLUDED.atualizado_em;
+
+    -- o produto "atual" da entrada é o do lançamento mais recente
+    INSERT INTO estoque_saldo_entrada AS s (entrada_id, produto, saldo, atualizado_em)
+    SELECT m.entrada_id,
+           (array_agg(m.produto ORDER BY m.id DESC))[1],
+           SUM(m.quantidade),
+           now()
+      FROM novos_movimentos m
+     WHERE m.entrada_id IS NOT NULL
+     GROUP BY m.entrada_id
+    ON CONFLICT (entrada_id) DO UPDATE SET
+        produto = EXCLUDED.produto,
+        saldo = s.saldo + EXCLUDED.saldo,
+        atualizado_em = EXCLUDED.atualizado_em;
+
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_estoque_movimentos_saldos ON estoque_movimentos;
+CREATE TRIGGER trg_estoque_movimentos_saldos
+    AFTER INSERT ON estoque_movimentos
+    REFERENCING NEW TABLE AS novos_movimentos
+    FOR EACH STATEMENT EXECUTE FUNCTION estoque_aplicar_saldos();
+
+-- ---------------------------------------------------------------------------
+-- Alimentação: calculo_nfs.quantidade_estoque
+-- ---------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION estoque_produto_calculo(p_entrada_id integer, p_id_produto integer)
+RETURNS TABLE (produto text, produto_nome text)
+LANGUAGE sql STABLE AS $$
+    SELECT normalizar_nome(en.produto), en.produto
+      FROM entrada_nf en WHERE en.id = p_entrada_id
+    UNION ALL
+    SELECT normalizar_nome(p.nome), p.nome
+      FROM produtos p
+     WHERE p_entrada_id IS NULL AND p.id = p_id_produto
+    UNION ALL
+    -- entrada já excluída: produto do último lançamento dela
+    SELECT se.produto, NULL
+      FROM estoque_saldo_entrada se WHERE se.entrada_id = p_entrada_id
+    LIMIT 1
+$$;
+
+CREATE OR REPLACE FUNCTION estoque_registrar_calculo() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_origem text := NULLIF(current_setting('estoque.origem', true), '');
+    v_usuario text := NULLIF(current_setting('estoque.usuario', true), '');
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO estoque_movimentos (produto, produto_nome, entrada_id, origem, quantidade, usuario)
+        SELECT ep.produto, ep.produto_nome, n.entrada_id, COALESCE(v_origem, 'entrada'),
+               n.quantidade_estoque, v_usuario
+          FROM calculo_novos n
+          CROSS JOIN LATERAL estoque_produto_calculo(n.entrada_id, n.id_produto) ep
+         WHERE COALESCE(n.quantidade_estoque, 0) <> 0;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO estoque_movimentos (produto, produto_nome, entrada_id, origem, quantidade, usuario)
+        SELECT ep.produto, ep.produto_nome, n.entrada_id,
+               COALESCE(v_origem, CASE WHEN o.quantidade_estoque IS NULL THEN 'entrada' ELSE 'ajuste' END),
+               COALESCE(n.quantidade_estoque, 0) - COALESCE(o.quantidade_estoque, 0), v_usuario
+          FROM calculo_novos n
+          JOIN calculo_antigos o ON o.id = n.id
+          CROSS JOIN LATERAL estoque_produto_calculo(n.entrada_id, n.id_produto) ep
+         WHERE COALESCE(n.quantidade_estoque, 0) <> COALESCE(o.quantidade_estoque, 0);
+    ELSE
+        INSERT INTO estoque_movimentos (produto, produto_nome, entrada_id, origem, quantidade, usuario)
+        SELECT ep.produto, ep.produto_nome, o.entrada_id, COALESCE(v_origem, 'exclusao'),
+               -o.quantidade_estoque, v_usuario
+          FROM calculo_antigos o
+          CROSS JOIN LATERAL estoque_produto_calculo(o.entrada_id, o.id_produto) ep
+         WHERE COALESCE(o.quantidade_estoque, 0) <> 0;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_calculo_nfs_estoque_ins ON calculo_nfs;
+CREATE TRIGGER trg_calculo_nfs_estoque_ins
+    AFTER INSERT ON calculo_nfs
+    REFERENCING NEW TABLE AS calculo_novos
+    FOR EACH STATEMENT EXECUTE FUNCTION estoque_registrar_calculo();
+
+DROP TRIGGER IF EXISTS trg_calculo_nfs_estoque_upd ON calculo_nfs;
+CREATE TRIGGER trg_calculo_nfs_estoque_upd
+    AFTER UPDATE ON calculo_nfs
+    REFERENCING OLD TABLE AS calculo_antigos NEW TABLE AS calculo_novos
+    FOR EACH STATEMENT EXECUTE FUNCTION estoque_registrar_calculo();
+
+DROP TRIGGER IF EXISTS trg_calculo_nfs_estoque_del ON calculo_nfs;
+CREATE TRIGGER trg_calculo_nfs_estoque_del
+    AFTER DELETE ON calculo_nfs
+    REFERENCING OLD TABLE AS calculo_antigos
+    FOR EACH STATEMENT EXECUTE FUNCTION estoque_registrar_calculo();
+
+-- ---------------------------------------------------------------------------
+-- Alimentação: troca de produto numa entrada já em estoque
+-- ---------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION estoque_reclassificar_entrada() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_usuario text := NULLIF(current_setting('estoque.usuario', true), '');
+BEGIN
+    INSERT INTO estoque_movimentos (produto, produto_nome, entrada_id, origem, quantidade, usuario)
+    SELECT t.produto, t.produto_nome, se.entrada_id, 'reclassificacao', t.sinal * se.saldo, v_usuario
+      FROM entradas_antigas o
+      JOIN entradas_novas n ON n.id = o.id
+      JOIN estoque_saldo_entrada se ON se.entrada_id = n.id
+      CROSS JOIN LATERAL (VALUES
+          (se.produto, o.produto, -1),
+          (normalizar_nome(n.produto), n.produto, 1)
+      ) AS t(produto, produto_nome, sinal)
+     WHERE normalizar_nome(n.produto) IS DISTINCT FROM se.produto
+       AND se.saldo <> 0;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_entrada_nf_estoque_produto ON entrada_nf;
+CREATE TRIGGER trg_entrada_nf_estoque_produto
+    AFTER UPDATE ON entrada_nf
+    REFERENCING OLD TABLE AS entradas_antigas NEW TABLE AS entradas_novas
+    FOR EACH STATEMENT EXECUTE FUNCTION estoque_reclassificar_entrada();
+
+-- ---------------------------------------------------------------------------
+-- Alimentação: produtos das NFs de saída
+-- ---------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION estoque_registrar_saida() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_usuario text := NULLIF(current_setting('estoque.usuario', true), '');
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        -- estorno do que saiu antes
+        INSERT INTO estoque_movimentos (produto, produto_nome, nf_saida_id, origem, quantidade, usuario)
+        SELECT normalizar_nome(o.produto_nome), o.produto_nome, o.nf_id, 'saida', o.peso, v_usuario
+          FROM saidas_antigas o
+         WHERE COALESCE(o.peso, 0) <> 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO estoque_movimentos (produto, produto_nome, nf_saida_id, origem, quantidade, usuario)
+        SELECT normalizar_nome(n.produto_nome), n.produto_nome, n.nf_id, 'saida', -n.peso, v_usuario
+          FROM saidas_novas n
+         WHERE COALESCE(n.peso, 0) <> 0;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_produtos_nf_estoque_ins ON produtos_nf;
+CREATE TRIGGER trg_produtos_nf_estoque_ins
+    AFTER INSERT ON produtos_nf
+    REFERENCING NEW TABLE AS saidas_novas
+    FOR EACH STATEMENT EXECUTE FUNCTION estoque_registrar_saida();
+
+DROP TRIGGER IF EXISTS trg_produtos_nf_estoque_upd ON produtos_nf;
+CREATE TRIGGER trg_produtos_nf_estoque_upd
+    AFTER UPDATE ON produtos_nf
+    REFERENCING OLD TABLE AS saidas_antigas NEW TABLE AS saidas_novas
+    FOR EACH STATEMENT EXECUTE FUNCTION estoque_registrar_saida();
+
+DROP TRIGGER IF EXISTS trg_produtos_nf_estoque_del ON produtos_nf;
+CREATE TRIGGER trg_produtos_nf_estoque_del
+    AFTER DELETE ON produtos_nf
+    REFERENCING OLD TABLE AS saidas_antigas
+    FOR EACH STATEMENT EXECUTE FUNCTION estoque_registrar_saida();
+
+-- ---------------------------------------------------------------------------
+-- Consulta em um instante: saldo atual menos o que foi lançado depois
+-- (custo proporcional aos lançamentos posteriores, não ao histórico inteiro)
+-- ---------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION estoque_produto_em(p_produto text, p_momento timestamptz)
+RETURNS numeric
+LANGUAGE sql STABLE AS $$
+    SELECT COALESCE((SELECT s.saldo FROM estoque_saldo_produto s
+                      WHERE s.produto = normalizar_nome(p_produto)), 0)
+         - COALESCE((SELECT SUM(m.quantidade) FROM estoque_movimentos m
+                      WHERE m.produto = normalizar_nome(p_produto)
+                        AND m.momento > p_momento), 0)
+$$;
+
+CREATE OR REPLACE FUNCTION estoque_entrada_em(p_entrada_id integer, p_momento timestamptz)
+RETURNS numeric
+LANGUAGE sql STABLE AS $$
+    SELECT COALESCE((SELECT s.saldo FROM estoque_saldo_entrada s
+                      WHERE s.entrada_id = p_entrada_id), 0)
+         - COALESCE((SELECT SUM(m.quantidade) FROM estoque_movimentos m
+                      WHERE m.entrada_id = p_entrada_id
+                        AND m.momento > p_momento), 0)
+$$;
+
+-- ---------------------------------------------------------------------------
+-- Carga inicial: saldo atual de cada entrada e as saídas já emitidas
+-- (o histórico anterior à migração não existe; cada saldo entra na data da própria NF)
+-- ---------------------------------------------------------------------------
+INSERT INTO estoque_movimentos (momento, produto, produto_nome, entrada_id, origem, quantidade)
+SELECT COALESCE(en.data::timestamptz, now()), ep.produto, ep.produto_nome, cn.entrada_id,
+       'saldo_inicial', cn.quantidade_estoque
+  FROM calculo_nfs cn
+  LEFT JOIN entrada_nf en ON en.id = cn.entrada_id
+  CROSS JOIN LATERAL estoque_produto_calculo(cn.entrada_id, cn.id_produto) ep
+ WHERE COALESCE(cn.quantidade_estoque, 0) <> 0;
+
+INSERT INTO estoque_movimentos (momento, produto, produto_nome, nf_saida_id, origem, quantidade)
+SELECT COALESCE(nf.data::timestamptz, now()), normalizar_nome(p.produto_nome), p.produto_nome,
+       p.nf_id, 'saldo_inicial', -p.peso
+  FROM produtos_nf p
+  LEFT JOIN nf ON nf.id = p.nf_id
+ WHERE COALESCE(p.peso, 0) <> 0;
@@ -0,0 +1,190 @@
+-- Custo médio ponderado por produto e mês (data da entrada).
+--
+-- custo_total de calculo_nfs é o custo por Kg da entrada; o custo médio do mês é
+--   SUM(custo_total * peso) / SUM(peso)
+-- com dois pesos: peso_liquido da entrada e quantidade_estoque atual.
+--
+-- custo_medio_contribuicao guarda o que cada entrada somou no último cálculo; quando a
+-- entrada ou o cálculo muda, custo_medio_atualizar() desconta a contribuição antiga e soma a
+-- nova (só para as entradas que de fato mudaram). Nada é recalculado do zero.
+-- Meses que ficaram sem entradas permanecem com entradas = 0 (filtrados na leitura).
+
+CREATE TABLE IF NOT EXISTS custo_medio_mensal (
+    produto text NOT NULL,                      -- normalizar_nome(produto)
+    mes date NOT NULL,                          -- primeiro dia do mês
+    produto_nome text,
+    entradas integer NOT NULL DEFAULT 0,
+    soma_peso numeric NOT NULL DEFAULT 0,
+    soma_custo_peso numeric NOT NULL DEFAULT 0,
+    soma_estoque numeric NOT NULL DEFAULT 0,
+    soma_custo_estoque numeric NOT NULL DEFAULT 0,
+    atualizado_em timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (produto, mes)
+);
+
+CREATE INDEX IF NOT EXISTS idx_custo_medio_mensal_mes ON custo_medio_mensal (mes);
+
+CREATE TABLE IF NOT EXISTS custo_medio_contribuicao (
+    entrada_id integer PRIMARY KEY,
+    produto text NOT NULL,
+    mes date NOT NULL,
+    peso numeric NOT NULL,
+    estoque numeric NOT NULL,
+    custo numeric NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION custo_medio_atualizar(p_ids integer[]) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF p_ids IS NULL OR cardinality(p_ids) = 0 THEN
+        RETURN;
+    END IF;
+
+    -- serializa atualizações da mesma entrada (entrada_nf e calculo_nfs podem mudar
+    -- em transações diferentes). Trava por faixa (id % 256) para não estourar a tabela de
+    -- locks em cargas grandes; ordem fixa evita deadlock
+    PERFORM pg_advisory_xact_lock(781245006, faixa)
+       FROM (SELECT DISTINCT i % 256 AS faixa FROM unnest(p_ids) AS i ORDER BY 1) faixas;
+
+    CREATE TEMP TABLE IF NOT EXISTS tmp_custo_medio_novos (
+        entrada_id integer, produto text, produto_nome text, mes date,
+        peso numeric, estoque numeric, custo numeric
+    ) ON COMMIT DROP;
+    TRUNCATE tmp_custo_medio_novos;
+
+    INSERT INTO tmp_custo_medio_novos
+    SELECT en.id, normalizar_nome(en.produto), en.produto, date_trunc('month', en.data)::date,
+           COALESCE(en.peso_liquido, 0), COALESCE(cn.quantidade_estoque, 0), cn.custo_total
+      FROM entrada_nf en
+      JOIN calculo_nfs cn ON cn.entrada_id = en.id
+     WHERE en.id = ANY(p_ids)
+       AND en.data IS NOT NULL
+       AND cn.custo_total IS NOT NULL
+       AND normalizar_nome(en.produto) <> '';
+
+    WITH antigos AS (
+        SELECT c.* FROM custo_medio_contribuicao c WHERE c.entrada_id = ANY(p_ids)
+    ),
+    mudou AS (
+        SELECT COALESCE(n.entrada_id, a.entrada_id) AS entrada_id
+          FROM tmp_custo_medio_novos n
+          FULL JOIN antigos a ON a.entrada_id = n.entrada_id
+         WHERE (n.produto, n.mes, n.peso, n.estoque, n.custo)
+               IS DISTINCT FROM (a.produto, a.mes, a.peso, a.estoque, a.custo)
+    ),
+    deltas AS (
+        SELECT n.produto, n.mes, n.produto_nome, 1 AS entradas,
+               n.peso, n.peso * n.custo AS custo_peso, n.estoque, n.estoque * n.custo AS custo_estoque
+          FROM tmp_custo_medio_novos n JOIN mudou USING (entrada_id)
+        UNION ALL
+        SELECT a.produto, a.mes, NULL, -1,
+               -a.peso, -(a.peso * a.custo), -a.estoque, -(a.estoque * a.custo)
+          FROM antigos a JOIN mudou USING (entrada_id)
+    )
+    INSERT INTO custo_medio_mensal AS m
+           (produto, mes, produto_nome, entradas, soma_peso, soma_custo_peso,
+            soma_estoque, soma_custo_estoque, atualizado_em)
+    SELECT produto, mes, max(produto_nome), SUM(entradas), SUM(peso), SUM(custo_peso),
+           SUM(estoque), SUM(custo_estoque), now()
+      FROM deltas
+     GROUP BY produto, mes
+    ON CONFLICT (produto, mes) DO UPDATE SET
+        produto_nome = COALESCE(EXCLUDED.produto_nome, m.produto_nome),
+        entradas = m.entradas + EXCLUDED.entradas,
+        soma_peso = m.soma_peso + EXCLUDED.soma_peso,
+        soma_custo_peso = m.soma_custo_peso + EXCLUDED.soma_custo_peso,
+        soma_estoque = m.soma_estoque + EXCLUDED.soma_estoque,
+        soma_custo_estoque = m.soma_custo_estoque + EXCLUDED.soma_custo_estoque,
+        atualizado_em = EXCLUDED.atualizado_em;
+
+    -- contribuições: regrava as que mudaram, remove as que deixaram de contar
+    INSERT INTO custo_medio_contribuicao AS c (entrada_id, produto, mes, peso, estoque, custo)
+    SELECT entrada_id, produto, mes, peso, estoque, custo FROM tmp_custo_medio_novos
+    ON CONFLICT (entrada_id) DO UPDATE SET
+        produto = EXCLUDED.produto, mes = EXCLUDED.mes, peso = EXCLUDED.peso,
+        estoque = EXCLUDED.estoque, custo = EXCLUDED.custo
+    WHERE (c.produto, c.mes, c.peso, c.estoque, c.custo)
+          IS DISTINCT FROM (EXCLUDED.produto, EXCLUDED.mes, EXCLUDED.peso, EXCLUDED.estoque, EXCLUDED.custo);
+
+    DELETE FROM custo_medio_contribuicao c
+     WHERE c.entrada_id = ANY(p_ids)
+       AND NOT EXISTS (SELECT 1 FROM tmp_custo_medio_novos n WHERE n.entrada_id = c.entrada_id);
+END
+$$;
+
+-- triggers: passam as entradas afetadas pelo comando
+CREATE OR REPLACE FUNCTION custo_medio_trg_calculo() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM custo_medio_atualizar(ARRAY(SELECT entrada_id FROM calculo_novos WHERE entrada_id IS NOT NULL));
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM custo_medio_atualizar(ARRAY(
+            SELECT n.entrada_id
+              FROM calculo_novos n JOIN calculo_antigos o ON o.id = n.id
+             WHERE n.entrada_id IS NOT NULL
+               AND (n.custo_total IS DISTINCT FROM o.custo_total
+                    OR n.quantidade_estoque IS DISTINCT FROM o.quantidade_estoque
+                    OR n.entrada_id IS DISTINCT FROM o.entrada_id)
+            UNION
+            SELECT o.entrada_id
+              FROM calculo_novos n JOIN calculo_antigos o ON o.id = n.id
+             WHERE o.entrada_id IS NOT NULL AND n.entrada_id IS DISTINCT FROM o.entrada_id
+        ));
+    ELSE
+        PERFORM custo_medio_atualizar(ARRAY(SELECT entrada_id FROM calculo_antigos WHERE entrada_id IS NOT NULL));
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_calculo_nfs_custo_medio_ins ON calculo_nfs;
+CREATE TRIGGER trg_calculo_nfs_custo_medio_ins
+    AFTER INSERT ON calculo_nfs
+    REFERENCING NEW TABLE AS calculo_novos
+    FOR EACH STATEMENT EXECUTE FUNCTION custo_medio_trg_calculo();
+
+DROP TRIGGER IF EXISTS trg_calculo_nfs_custo_medio_upd ON calculo_nfs;
+CREATE TRIGGER trg_calculo_nfs_custo_medio_upd
+    AFTER UPDATE ON calculo_nfs
+    REFERENCING OLD TABLE AS calculo_antigos NEW TABLE AS calculo_novos
+    FOR EACH STATEMENT EXECUTE FUNCTION custo_medio_trg_calculo();
+
+DROP TRIGGER IF EXISTS trg_calculo_nfs_custo_medio_del ON calculo_nfs;
+CREATE TRIGGER trg_calculo_nfs_custo_medio_del
+    AFTER DELETE ON calculo_nfs
+    REFERENCING OLD TABLE AS calculo_antigos
+    FOR EACH STATEMENT EXECUTE FUNCTION custo_medio_trg_calculo();
+
+CREATE OR REPLACE FUNCTION custo_medio_trg_entrada() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        PERFORM custo_medio_atualizar(ARRAY(
+            SELECT n.id
+              FROM entradas_novas n JOIN entradas_antigas o ON o.id = n.id
+             WHERE n.data IS DISTINCT FROM o.data
+                OR n.produto IS DISTINCT FROM o.produto
+                OR n.peso_liquido IS DISTINCT FROM o.peso_liquido
+        ));
+    ELSE
+        PERFORM custo_medio_atualizar(ARRAY(SELECT id FROM entradas_antigas));
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_entrada_nf_custo_medio_upd ON entrada_nf;
+CREATE TRIGGER trg_entrada_nf_custo_medio_upd
+    AFTER UPDATE ON entrada_nf
+    REFERENCING OLD TABLE AS entradas_antigas NEW TABLE AS entradas_novas
+    FOR EACH STATEMENT EXECUTE FUNCTION custo_medio_trg_entrada();
+
+DROP TRIGGER IF EXISTS trg_entrada_nf_custo_medio_del ON entrada_nf;
+CREATE TRIGGER trg_entrada_nf_custo_medio_del
+    AFTER DELETE ON entrada_nf
+    REFERENCING OLD TABLE AS entradas_antigas
+    FOR EACH STATEMENT EXECUTE FUNCTION custo_medio_trg_entrada();
+
+-- carga inicial
+SELECT custo_medio_atualizar(ARRAY(SELECT entrada_id FROM calculo_nfs WHERE entrada_id IS NOT NULL));
@@ -0,0 +1,34 @@
+-- Busca textual de entrada_nf (listar_entradas / exportar_filtrado, ver busca_entrada.py).
+-- Em vez de oito `unaccent(col) ILIKE unaccent(...)` em OR (varredura sequencial a cada
+-- tecla), a busca compara um único texto pesquisável indexado por trigramas:
+--     texto_busca_entrada_nf(...) LIKE '%' || termo_busca(%s) || '%'
+-- A expressão da consulta precisa ser idêntica à do índice.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- termo/texto sem acento e em minúsculas (unaccent_imutavel vem da migração 003)
+CREATE OR REPLACE FUNCTION termo_busca(t text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT lower(unaccent_imutavel(coalesce(t, '')))
+$$;
+
+-- campos separados por \x1f: um termo não casa "atravessando" dois campos
+CREATE OR REPLACE FUNCTION texto_busca_entrada_nf(
+    nf text, fornecedor text, produto text,
+    material_1 text, material_2 text, material_3 text, material_4 text, material_5 text
+) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT termo_busca(concat_ws(E'\x1f', nf, fornecedor, produto,
+                                 material_1, material_2, material_3, material_4, material_5))
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_entrada_nf_busca_trgm
+    ON entrada_nf USING gin (
+        texto_busca_entrada_nf(nf::text, fornecedor::text, produto::text,
+                               material_1::text, material_2::text, material_3::text,
+                               material_4::text, material_5::text)
+        gin_trgm_ops
+    );
+
+-- buscas por data viram faixa em `data` (dia ou mês inteiro)
+CREATE INDEX IF NOT EXISTS idx_entrada_nf_data ON entrada_nf (data);
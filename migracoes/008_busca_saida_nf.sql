@@ -0,0 +1,35 @@
+-- Busca de NFs de saída (saida_nf): índices de trigramas sobre número, cliente e
+-- CNPJ/CPF sem pontuação (nf) e sobre nome/base dos produtos (produtos_nf).
+-- termo_busca()/pg_trgm vêm da migração 007. As expressões das consultas em
+-- saida_nf_routes.py precisam ser idênticas às destes índices.
+
+-- CNPJ/CPF só com dígitos/letras: '12.345.678/0001-90' -> '12345678000190'
+CREATE OR REPLACE FUNCTION documento_busca(t text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT lower(regexp_replace(coalesce(t, ''), '[.\-/]', '', 'g'))
+$$;
+
+CREATE OR REPLACE FUNCTION texto_busca_nf(numero_nf text, cliente text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT termo_busca(concat_ws(E'\x1f', numero_nf, cliente))
+$$;
+
+CREATE OR REPLACE FUNCTION texto_busca_produto_nf(produto_nome text, base_produto text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT termo_busca(concat_ws(E'\x1f', produto_nome, base_produto))
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_nf_busca_trgm
+    ON nf USING gin (texto_busca_nf(numero_nf::text, cliente::text) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_nf_documento_trgm
+    ON nf USING gin (documento_busca(cnpj_cpf::text) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_produtos_nf_busca_trgm
+    ON produtos_nf USING gin (texto_busca_produto_nf(produto_nome::text, base_produto::text) gin_trgm_ops);
+
+-- semi-join / produtos da página por NF
+CREATE INDEX IF NOT EXISTS idx_produtos_nf_nf_id ON produtos_nf (nf_id);
+
+-- ordenação da listagem e faixas de data
+CREATE INDEX IF NOT EXISTS idx_nf_data_numero ON nf (data DESC, numero_nf DESC);
@@ -0,0 +1,5 @@
+-- Paginação por keyset (paginacao.py) das NFs de saída: ordem (data, id) DESC.
+-- A expressão precisa ser idêntica à usada em saida_nf_routes.py.
+-- (entrada_nf já tem idx_entrada_nf_data_id, migração 002.)
+CREATE INDEX IF NOT EXISTS idx_nf_data_id
+    ON nf ((COALESCE(data, '-infinity')), id);
@@ -0,0 +1,30 @@
+-- Fila de geração de relatórios em segundo plano (relatorios.py).
+-- A rota só grava o pedido aqui; os workers do próprio processo pegam os pendentes com
+-- FOR UPDATE SKIP LOCKED (vários processos do gunicorn podem consumir a mesma fila),
+-- gravam o arquivo em disco e o tornam disponível até expira_em.
+
+CREATE TABLE IF NOT EXISTS relatorio_jobs (
+    id            bigserial PRIMARY KEY,
+    tipo          text NOT NULL,                -- gerador registrado (ex.: 'entrada_nf')
+    formato       text NOT NULL,                -- 'pdf' / 'excel'
+    parametros    jsonb NOT NULL DEFAULT '{}',  -- filtros da exportação
+    usuario       text,
+    status        text NOT NULL DEFAULT 'pendente'
+                  CHECK (status IN ('pendente', 'processando', 'concluido', 'erro', 'expirado')),
+    progresso     smallint NOT NULL DEFAULT 0 CHECK (progresso BETWEEN 0 AND 100),
+    mensagem      text,
+    arquivo       text,                         -- caminho no disco do servidor
+    nome_arquivo  text,                         -- nome para download
+    mimetype      text,
+    tentativas    smallint NOT NULL DEFAULT 0,
+    criado_em     timestamptz NOT NULL DEFAULT now(),
+    atualizado_em timestamptz NOT NULL DEFAULT now(),
+    concluido_em  timestamptz,
+    expira_em     timestamptz
+);
+
+-- próximo pendente (fila) e jobs parados/expirados (manutenção)
+CREATE INDEX IF NOT EXISTS idx_relatorio_jobs_pendentes
+    ON relatorio_jobs (id) WHERE status = 'pendente';
+CREATE INDEX IF NOT EXISTS idx_relatorio_jobs_ativos
+    ON relatorio_jobs (status, atualizado_em) WHERE status IN ('processando', 'concluido');
@@ -0,0 +1,3 @@
+-- Anti-join da importação de entradas (importar_excel_entrada): cada linha da planilha,
+-- carregada por COPY numa tabela temporária, é descartada se a NF já existe em entrada_nf.
+CREATE INDEX IF NOT EXISTS idx_entrada_nf_nf ON entrada_nf (nf);
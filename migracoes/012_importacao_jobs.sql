@@ -0,0 +1,54 @@
+-- Importações de planilha retomáveis (importacoes.py).
+-- O arquivo enviado fica guardado em disco; cada bloco gravado registra um checkpoint
+-- (importacao_lotes) e o hash das linhas que processou (importacao_linhas) NA MESMA
+-- transação dos dados. Se a importação cair no meio, reenviar o arquivo (ou pedir
+-- /importacoes/<id>/retomar) continua do último bloco confirmado; se o arquivo foi
+-- corrigido, as linhas já importadas são reconhecidas pelo hash e puladas.
+
+CREATE TABLE IF NOT EXISTS importacao_jobs (
+    id              bigserial PRIMARY KEY,
+    tipo            text NOT NULL,                -- importador registrado (ex.: 'entrada_nf')
+    usuario         text,
+    nome_arquivo    text NOT NULL,
+    extensao        text NOT NULL,
+    arquivo         text,                         -- cópia do upload no disco do servidor
+    hash_arquivo    text NOT NULL,                -- sha256 do conteúdo enviado
+    status          text NOT NULL DEFAULT 'pendente'
+                    CHECK (status IN ('pendente', 'processando', 'concluido', 'erro', 'expirado')),
+    ultima_linha    integer NOT NULL DEFAULT -1,  -- checkpoint: posição da última linha confirmada
+    linhas_lidas    integer NOT NULL DEFAULT 0,
+    linhas_gravadas integer NOT NULL DEFAULT 0,
+    linhas_puladas  integer NOT NULL DEFAULT 0,   -- já importadas antes (hash)
+    total_estimado  integer,
+    erros           jsonb NOT NULL DEFAULT '[]',  -- linhas rejeitadas na validação
+    mensagem        text,
+    tentativas      smallint NOT NULL DEFAULT 0,
+    criado_em       timestamptz NOT NULL DEFAULT now(),
+    atualizado_em   timestamptz NOT NULL DEFAULT now(),
+    concluido_em    timestamptz
+);
+
+-- reenvio do mesmo arquivo: procura a importação inacabada do usuário
+CREATE INDEX IF NOT EXISTS idx_importacao_jobs_inacabados
+    ON importacao_jobs (tipo, usuario, nome_arquivo)
+    WHERE status IN ('pendente', 'processando', 'erro');
+
+-- um registro por bloco confirmado
+CREATE TABLE IF NOT EXISTS importacao_lotes (
+    job_id        bigint NOT NULL REFERENCES importacao_jobs (id) ON DELETE CASCADE,
+    lote          integer NOT NULL,
+    linha_inicial integer NOT NULL,
+    linha_final   integer NOT NULL,
+    lidas         integer NOT NULL,
+    gravadas      integer NOT NULL,
+    puladas       integer NOT NULL,
+    confirmado_em timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (job_id, lote)
+);
+
+-- hash do conteúdo de cada linha já processada pelo job (apagado quando o job conclui)
+CREATE TABLE IF NOT EXISTS importacao_linhas (
+    job_id bigint NOT NULL REFERENCES importacao_jobs (id) ON DELETE CASCADE,
+    hash   bytea NOT NULL,
+    PRIMARY KEY (job_id, hash)
+);
@@ -0,0 +1,97 @@
+-- Id da NF de saída reaproveitando lacunas sem varrer a tabela a cada gravação.
+--
+-- Antes: salvar_nf procurava "o menor id vago" com generate_series(1, MAX(id)+1) + NOT EXISTS
+-- (custo proporcional ao total de NFs) e depois fazia setval na sequência; dois saves ao mesmo
+-- tempo podiam escolher o mesmo id.
+--
+-- Agora nf_ids_livres guarda os ids vagos abaixo do maior em uso:
+--   - os triggers devolvem o id de toda NF excluída e retiram o de toda NF inserida;
+--   - alocar_id_nf() retira o menor id da tabela (índice da PK, O(log n)). FOR UPDATE SKIP
+--     LOCKED faz saves concorrentes pegarem lacunas diferentes, e um rollback devolve a lacuna;
+--   - sem lacuna, o id vem da sequência (nextval é seguro entre transações e mantém a
+--     sequência sempre à frente do maior id, então o setval não é mais necessário).
+-- Ids consumidos por INSERTs desfeitos (nextval não volta atrás) não viram lacuna sozinhos:
+-- SELECT reconstruir_ids_livres_nf() refaz a tabela a partir de nf.
+
+CREATE TABLE IF NOT EXISTS nf_ids_livres (
+    id bigint PRIMARY KEY
+);
+
+CREATE OR REPLACE FUNCTION reconstruir_ids_livres_nf() RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_inseridos integer;
+BEGIN
+    INSERT INTO nf_ids_livres (id)
+    SELECT g.id
+      FROM generate_series(1, (SELECT COALESCE(MAX(id), 0) FROM nf)) AS g(id)
+     WHERE NOT EXISTS (SELECT 1 FROM nf WHERE nf.id = g.id)
+    ON CONFLICT (id) DO NOTHING;
+    GET DIAGNOSTICS v_inseridos = ROW_COUNT;
+    RETURN v_inseridos;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION alocar_id_nf() RETURNS bigint
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_id bigint;
+BEGIN
+    LOOP
+        DELETE FROM nf_ids_livres
+         WHERE id = (SELECT id FROM nf_ids_livres
+                      ORDER BY id
+                      LIMIT 1
+                      FOR UPDATE SKIP LOCKED)
+        RETURNING id INTO v_id;
+        EXIT WHEN v_id IS NULL;
+        -- lacuna já ocupada (ex.: INSERT com id explícito feito fora daqui) é descartada
+        IF NOT EXISTS (SELECT 1 FROM nf WHERE id = v_id) THEN
+            RETURN v_id;
+        END IF;
+    END LOOP;
+    RETURN nextval(pg_get_serial_sequence('nf', 'id'));
+END
+$$;
+
+CREATE OR REPLACE FUNCTION nf_atualizar_ids_livres() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO nf_ids_livres (id)
+        SELECT o.id FROM nf_antigas o
+         WHERE NOT EXISTS (SELECT 1 FROM nf WHERE nf.id = o.id)
+        ON CONFLICT (id) DO NOTHING;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        DELETE FROM nf_ids_livres l
+         USING nf_novas n
+         WHERE l.id = n.id;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_nf_ids_livres_ins ON nf;
+CREATE TRIGGER trg_nf_ids_livres_ins
+    AFTER INSERT ON nf
+    REFERENCING NEW TABLE AS nf_novas
+    FOR EACH STATEMENT EXECUTE FUNCTION nf_atualizar_ids_livres();
+
+DROP TRIGGER IF EXISTS trg_nf_ids_livres_upd ON nf;
+CREATE TRIGGER trg_nf_ids_livres_upd
+    AFTER UPDATE ON nf
+    REFERENCING OLD TABLE AS nf_antigas NEW TABLE AS nf_novas
+    FOR EACH STATEMENT EXECUTE FUNCTION nf_atualizar_ids_livres();
+
+DROP TRIGGER IF EXISTS trg_nf_ids_livres_del ON nf;
+CREATE TRIGGER trg_nf_ids_livres_del
+    AFTER DELETE ON nf
+    REFERENCING OLD TABLE AS nf_antigas
+    FOR EACH STATEMENT EXECUTE FUNCTION nf_atualizar_ids_livres();
+
+-- carga inicial das lacunas e sequência alinhada ao maior id (como o setval antigo fazia)
+SELECT reconstruir_ids_livres_nf();
+SELECT setval(pg_get_serial_sequence('nf', 'id'),
+              GREATEST((SELECT COALESCE(MAX(id), 0) FROM nf), 1),
+              (SELECT EXISTS (SELECT 1 FROM nf)));
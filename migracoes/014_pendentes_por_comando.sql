@@ -0,0 +1,154 @@
+-- Triggers de pendência de materiais e produtos (migração 001) por comando, não por linha.
+--
+-- Antes: FOR EACH ROW, e cada linha alterada varria entrada_nf inteira calculando
+-- normalizar_nome() de material_1..5 (ou do produto). Um UPDATE em massa de preços repetia a
+-- varredura para cada material.
+--
+-- Agora: FOR EACH STATEMENT com tabelas de transição. Os nomes normalizados de todas as
+-- linhas alteradas (antigo e novo) são juntados num único array, e as entradas afetadas são
+-- achadas por índice. normalizar_nome é IMMUTABLE desde a migração 003, então entrada_nf ganha
+-- índices de expressão com a mesma chave usada nos índices de produtos/materiais:
+--   - materiais: normalizar_nome(material_k) = ANY(nomes), um índice por coluna (BitmapOr);
+--   - produtos: o cálculo aceita correspondência parcial (um nome contém o outro):
+--       * "produto da entrada contém o nome alterado": LIKE '%nome%' no índice de trigramas
+--         (pg_trgm, migração 007). normalizar_nome só devolve letras, dígitos e espaços,
+--         então o nome não tem curingas do LIKE;
+--       * "nome alterado contém o produto da entrada": o produto é uma das substrings do
+--         nome, geradas aqui e procuradas por igualdade no índice btree.
+-- Transição não pode ser usada com mais de um evento no mesmo trigger: um trigger por evento.
+
+CREATE INDEX IF NOT EXISTS idx_entrada_nf_material_1_normalizado ON entrada_nf ((normalizar_nome(material_1)));
+CREATE INDEX IF NOT EXISTS idx_entrada_nf_material_2_normalizado ON entrada_nf ((normalizar_nome(material_2)));
+CREATE INDEX IF NOT EXISTS idx_entrada_nf_material_3_normalizado ON entrada_nf ((normalizar_nome(material_3)));
+CREATE INDEX IF NOT EXISTS idx_entrada_nf_material_4_normalizado ON entrada_nf ((normalizar_nome(material_4)));
+CREATE INDEX IF NOT EXISTS idx_entrada_nf_material_5_normalizado ON entrada_nf ((normalizar_nome(material_5)));
+
+CREATE INDEX IF NOT EXISTS idx_entrada_nf_produto_normalizado
+    ON entrada_nf ((normalizar_nome(produto)));
+CREATE INDEX IF NOT EXISTS idx_entrada_nf_produto_normalizado_trgm
+    ON entrada_nf USING gin ((normalizar_nome(produto)) gin_trgm_ops);
+
+-- materiais ---------------------------------------------------------------
+CREATE OR REPLACE FUNCTION marcar_pendente_materiais() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    nomes text[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT normalizar_nome(n.nome)) INTO nomes FROM materiais_novos n;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(DISTINCT normalizar_nome(o.nome)) INTO nomes FROM materiais_antigos o;
+    ELSE
+        -- só as linhas em que algo usado pelo cálculo mudou
+        SELECT array_agg(DISTINCT k) INTO nomes
+          FROM materiais_antigos o
+          JOIN materiais_novos n ON n.id = o.id
+         CROSS JOIN LATERAL (VALUES (normalizar_nome(o.nome)), (normalizar_nome(n.nome))) AS v(k)
+         WHERE n.nome IS DISTINCT FROM o.nome
+            OR n.valor IS DISTINCT FROM o.valor
+            OR n.grupo IS DISTINCT FROM o.grupo
+            OR n.fornecedor_id IS DISTINCT FROM o.fornecedor_id;
+    END IF;
+    IF nomes IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO calculo_nfs_pendentes (entrada_id)
+    SELECT en.id
+      FROM entrada_nf en
+     WHERE normalizar_nome(en.material_1) = ANY(nomes)
+        OR normalizar_nome(en.material_2) = ANY(nomes)
+        OR normalizar_nome(en.material_3) = ANY(nomes)
+        OR normalizar_nome(en.material_4) = ANY(nomes)
+        OR normalizar_nome(en.material_5) = ANY(nomes)
+    ON CONFLICT (entrada_id) DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_materiais_pendente ON materiais;
+DROP FUNCTION IF EXISTS marcar_pendente_material();
+
+DROP TRIGGER IF EXISTS trg_materiais_pendente_ins ON materiais;
+CREATE TRIGGER trg_materiais_pendente_ins
+    AFTER INSERT ON materiais
+    REFERENCING NEW TABLE AS materiais_novos
+    FOR EACH STATEMENT EXECUTE FUNCTION marcar_pendente_materiais();
+
+DROP TRIGGER IF EXISTS trg_materiais_pendente_upd ON materiais;
+CREATE TRIGGER trg_materiais_pendente_upd
+    AFTER UPDATE ON materiais
+    REFERENCING OLD TABLE AS materiais_antigos NEW TABLE AS materiais_novos
+    FOR EACH STATEMENT EXECUTE FUNCTION marcar_pendente_materiais();
+
+DROP TRIGGER IF EXISTS trg_materiais_pendente_del ON materiais;
+CREATE TRIGGER trg_materiais_pendente_del
+    AFTER DELETE ON materiais
+    REFERENCING OLD TABLE AS materiais_antigos
+    FOR EACH STATEMENT EXECUTE FUNCTION marcar_pendente_materiais();
+
+-- produtos ----------------------------------------------------------------
+CREATE OR REPLACE FUNCTION marcar_pendente_produtos() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    nomes text[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT normalizar_nome(n.nome)) INTO nomes FROM produtos_novos n;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(DISTINCT normalizar_nome(o.nome)) INTO nomes FROM produtos_antigos o;
+    ELSE
+        SELECT array_agg(DISTINCT k) INTO nomes
+          FROM produtos_antigos o
+          JOIN produtos_novos n ON n.id = o.id
+         CROSS JOIN LATERAL (VALUES (normalizar_nome(o.nome)), (normalizar_nome(n.nome))) AS v(k)
+         WHERE n.nome IS DISTINCT FROM o.nome
+            OR n.percentual_cobre IS DISTINCT FROM o.percentual_cobre
+            OR n.percentual_zinco IS DISTINCT FROM o.percentual_zinco;
+    END IF;
+    nomes := array_remove(nomes, '');
+    IF nomes IS NULL OR cardinality(nomes) = 0 THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO calculo_nfs_pendentes (entrada_id)
+    -- produto da entrada contém o nome (índice de trigramas)
+    SELECT en.id
+      FROM unnest(nomes) AS k
+      JOIN entrada_nf en ON normalizar_nome(en.produto) LIKE '%' || k || '%'
+    UNION
+    -- nome contém o produto da entrada: o produto é uma substring do nome (índice btree)
+    SELECT en.id
+      FROM entrada_nf en
+     WHERE normalizar_nome(en.produto) = ANY(ARRAY(
+            SELECT DISTINCT substr(k, i, j)
+              FROM unnest(nomes) AS k,
+                   generate_series(1, length(k)) AS i,
+                   generate_series(1, length(k) - i + 1) AS j
+           ))
+       AND normalizar_nome(en.produto) <> ''
+    ON CONFLICT (entrada_id) DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_produtos_pendente ON produtos;
+DROP FUNCTION IF EXISTS marcar_pendente_produto();
+
+DROP TRIGGER IF EXISTS trg_produtos_pendente_ins ON produtos;
+CREATE TRIGGER trg_produtos_pendente_ins
+    AFTER INSERT ON produtos
+    REFERENCING NEW TABLE AS produtos_novos
+    FOR EACH STATEMENT EXECUTE FUNCTION marcar_pendente_produtos();
+
+DROP TRIGGER IF EXISTS trg_produtos_pendente_upd ON produtos;
+CREATE TRIGGER trg_produtos_pendente_upd
+    AFTER UPDATE ON produtos
+    REFERENCING OLD TABLE AS produtos_antigos NEW TABLE AS produtos_novos
+    FOR EACH STATEMENT EXECUTE FUNCTION marcar_pendente_produtos();
+
+DROP TRIGGER IF EXISTS trg_produtos_pendente_del ON produtos;
+CREATE TRIGGER trg_produtos_pendente_del
+    AFTER DELETE ON produtos
+    REFERENCING OLD TABLE AS produtos_antigos
+    FOR EACH STATEMENT EXECUTE FUNCTION marcar_pendente_produtos();
@@ -0,0 +1,12 @@
+-- NFs criadas por cada importação de entrada (importacoes.py / _gravar_bloco_entrada).
+-- A importação não duplica NF que já existia antes dela, mas as linhas de uma mesma NF podem
+-- cair em blocos diferentes: o anti-join contra entrada_nf via as linhas do primeiro bloco
+-- (já confirmado) e descartava o resto da NF. As NFs que o próprio job inseriu ficam aqui
+-- e não contam como "já existentes" para ele — inclusive ao retomar depois de uma falha.
+-- Apagadas junto com importacao_linhas quando o job conclui ou expira.
+
+CREATE TABLE IF NOT EXISTS importacao_nfs (
+    job_id bigint NOT NULL REFERENCES importacao_jobs (id) ON DELETE CASCADE,
+    nf     text NOT NULL,
+    PRIMARY KEY (job_id, nf)
+);
@@ -0,0 +1,21 @@
+-- Hash das linhas importadas com a posição no arquivo (importacoes.py).
+-- Só o conteúdo não basta: duas linhas iguais no mesmo arquivo (ex.: o mesmo produto duas
+-- vezes na NF) tinham o mesmo hash e a segunda era pulada como "já importada".
+--   - mesmo arquivo: a linha só é pulada se o par (hash, linha) já consta no job;
+--   - arquivo corrigido (arquivo_alterado): as posições antigas não valem mais, compara só
+--     o hash do conteúdo, como antes.
+-- arquivo_alterado não volta a false: os hashes guardados continuam sendo do arquivo anterior.
+
+ALTER TABLE importacao_jobs
+    ADD COLUMN IF NOT EXISTS arquivo_alterado boolean NOT NULL DEFAULT false;
+
+ALTER TABLE importacao_linhas
+    ADD COLUMN IF NOT EXISTS linha integer NOT NULL DEFAULT -1;
+
+ALTER TABLE importacao_linhas DROP CONSTRAINT IF EXISTS importacao_linhas_pkey;
+ALTER TABLE importacao_linhas ADD PRIMARY KEY (job_id, hash, linha);
+
+-- jobs inacabados de antes desta migração só têm o hash do conteúdo
+UPDATE importacao_jobs
+   SET arquivo_alterado = true
+ WHERE id IN (SELECT DISTINCT job_id FROM importacao_linhas);
@@ -0,0 +1,21 @@
+-- Fila de recálculo (migração 001) com tentativas: uma entrada cujo cálculo falha não trava
+-- mais a fila. recalcular_pendentes() refaz o lote que falhou entrada por entrada; as que
+-- falham de novo ganham uma tentativa e a mensagem do erro e continuam na fila, mas depois
+-- de MAX_TENTATIVAS_RECALCULO ficam paradas (em erro) até serem marcadas de novo.
+-- Marcar de novo (entrada editada ou marcar_pendentes()) zera as tentativas.
+
+ALTER TABLE calculo_nfs_pendentes
+    ADD COLUMN IF NOT EXISTS tentativas smallint NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS erro text;
+
+CREATE OR REPLACE FUNCTION marcar_pendente_entrada_nf() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO calculo_nfs_pendentes (entrada_id)
+    SELECT id FROM entradas_alteradas
+    ON CONFLICT (entrada_id) DO UPDATE
+        SET tentativas = 0, erro = NULL, marcado_em = now()
+        WHERE calculo_nfs_pendentes.tentativas > 0;
+    RETURN NULL;
+END
+$$;
@@ -0,0 +1,19 @@
+-- Retomada de importação com arquivo corrigido (importacoes.py).
+--
+-- Antes: o reenvio com o mesmo nome reaproveitava o job inacabado mesmo que fosse outra
+-- planilha, e com o arquivo alterado as linhas eram puladas só pelo hash do conteúdo.
+-- Então uma linha repetida de propósito que já constava no job era descartada.
+--
+-- Agora:
+--   - assinatura = hash do cabeçalho + primeiras linhas de dados. O job só é reaproveitado
+--     com o mesmo arquivo ou com a mesma assinatura (a mesma planilha, corrigida mais
+--     adiante); senão o reenvio abre um job novo;
+--   - a linha é pulada pelo par (hash, posição) também no arquivo corrigido. Linhas de jobs
+--     anteriores à migração 016 (linha = -1) continuam valendo pelo hash só.
+-- arquivo_alterado (migração 016) deixa de ser usado.
+
+ALTER TABLE importacao_jobs
+    ADD COLUMN IF NOT EXISTS assinatura bytea;
+
+ALTER TABLE importacao_jobs
+    DROP COLUMN IF EXISTS arquivo_alterado;
@@ -0,0 +1,86 @@
+"""
+Paginação por keyset (cursor) para as listagens de entrada_nf e NFs de saída.
+
+- A ordem é sempre (chave DESC, id DESC); a próxima página é
+  `WHERE (chave, id) < (chave_da_ultima_linha, id_da_ultima_linha)`, que usa o índice
+  da chave e custa o mesmo em qualquer profundidade (sem OFFSET).
+- O cursor é opaco para o cliente: base64 de [chave_como_texto, id].
+- Sem filtro o total é estimado (pg_class.reltuples), sem COUNT(*) da tabela inteira.
+  Com busca/filtro é contado de verdade (contagem_consulta), até LIMITE_CONTAGEM linhas.
+"""
+import base64
+import json
+
+LIMITE_CONTAGEM = 10000  # linhas contadas no máximo numa busca (1000 páginas de 10)
+
+
+def codificar_cursor(chave, ultimo_id):
+    bruto = json.dumps([chave, ultimo_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(bruto).decode('ascii')
+
+
+def decodificar_cursor(cursor_txt):
+    """(chave_texto, id) ou None se o cursor for inválido/vazio."""
+    if not cursor_txt:
+        return None
+    try:
+        chave, ultimo_id = json.loads(base64.urlsafe_b64decode(cursor_txt.encode('ascii')))
+        return str(chave), int(ultimo_id)
+    except Exception:
+        return None
+
+
+def pagina_keyset(cur, colunas, origem, params, chave_sql, id_sql, cursor_txt, limite, offset=0):
+    """
+    Executa uma página de `SELECT {colunas} {origem}`; `origem` é "FROM ... WHERE ..." (sempre
+    com WHERE; use WHERE TRUE sem filtros). `chave_sql`/`id_sql` são as expressões da ordenação
+    (a chave já com COALESCE se a coluna aceitar nulos, igual ao índice).
+    Sem cursor válido, `offset` abre uma página por número (compatibilidade com links ?page=).
+    Retorna (linhas, proximo_cursor); proximo_cursor é None na última página.
+    """
+    params = list(params)
+    pos = decodificar_cursor(cursor_txt)
+    filtro = ""
+    if pos is not None:
+        filtro = f" AND ({chave_sql}, {id_sql}) < (%s, %s)"
+        params.extend(pos)
+        offset = 0
+
+    cur.execute(f"""
+        SELECT {colunas}, ({chave_sql})::text AS _cursor_chave, {id_sql} AS _cursor_id
+        {origem}{filtro}
+        ORDER BY {chave_sql} DESC, {id_sql} DESC
+        LIMIT %s OFFSET %s
+    """, params + [limite + 1, max(int(offset or 0), 0)])
+    linhas = cur.fetchall()
+
+    proximo = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        ultima = linhas[-1]
+        proximo = codificar_cursor(ultima[-2], ultima[-1])
+    return [linha[:-2] for linha in linhas], proximo
+
+
+def estimativa_tabela(cur, tabela):
+    """Total estimado de linhas da tabela (pg_class.reltuples, atualizado por ANALYZE/autovacuum)."""
+    cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", (tabela,))
+    linha = cur.fetchone()
+    if not linha or linha[0] is None or linha[0] < 0:
+        # tabela nunca analisada: conta de verdade uma vez
+        cur.execute(f"SELECT COUNT(*) FROM {tabela}")
+        return cur.fetchone()[0]
+    return linha[0]
+
+
+def contagem_consulta(cur, sql, params, limite=LIMITE_CONTAGEM):
+    """
+    Total exato de linhas de `sql` (busca/filtro ativo). A contagem para na linha limite+1,
+    então um termo amplo não percorre a tabela inteira só para numerar páginas.
+    Retorna (total, exato); exato=False quando passou do limite (total = limite).
+    """
+    cur.execute(f"SELECT count(*) FROM ({sql} LIMIT %s) AS contagem", list(params) + [limite + 1])
+    total = cur.fetchone()[0]
+    if total > limite:
+        return limite, False
+    return total, True
@@ -0,0 +1,169 @@
+"""
+Renderizador de relatórios tabulares em PDF direto no canvas do ReportLab.
+
+Substitui Table + um Paragraph por célula (platypus), que mede e monta um objeto por
+célula e resolve o layout da tabela inteira antes de desenhar a primeira página:
+  - larguras de coluna definidas uma vez (escaladas para caber na página);
+  - um objeto de texto por página; quebra de linha (simpleSplit) só quando a célula
+    não cabe na largura da coluna, e a largura de cada string é medida uma vez;
+  - a paginação é feita aqui, linha a linha: nada além da linha atual fica em memória,
+    então `linhas` pode ser um gerador (ex.: cursor nomeado);
+  - linhas são tuplas de valores já formatados (sem DataFrame).
+"""
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas as pdf_canvas
+
+FONTE = 'Helvetica'
+FONTE_NEGRITO = 'Helvetica-Bold'
+
+
+class ColunaPdf:
+    """Coluna do relatório: título, largura (pt) e alinhamento ('esquerda' / 'direita' / 'centro')."""
+
+    __slots__ = ('titulo', 'largura', 'alinhamento')
+
+    def __init__(self, titulo, largura, alinhamento='esquerda'):
+        self.titulo = titulo
+        self.largura = largura
+        self.alinhamento = alinhamento
+
+
+def _ajustar_larguras(colunas, largura_util):
+    total = sum(c.largura for c in colunas)
+    fator = largura_util / float(total) if total > largura_util else 1.0
+    return [c.largura * fator for c in colunas]
+
+
+def renderizar_tabela_pdf(destino, colunas, linhas, titulo=None, subtitulo=None,
+                          pagesize=A4, margem=1.5 * cm, margem_vertical=2 * cm,
+                          tamanho_fonte=8, progresso=None, total=None):
+    """
+    Desenha `linhas` (iterável de tuplas, uma posição por coluna) em `destino`
+    (caminho ou arquivo). O cabeçalho se repete em toda página; rodapé "Página N".
+    `progresso(pct, msg)`/`total` são opcionais (jobs de relatório).
+    Retorna a quantidade de linhas desenhadas.
+    """
+    largura_pagina, altura_pagina = pagesize
+    x0 = margem
+    larguras = _ajustar_larguras(colunas, largura_pagina - 2 * margem)
+    posicoes = [x0]
+    for w in larguras:
+        posicoes.append(posicoes[-1] + w)
+
+    pad = 3
+    entrelinha = tamanho_fonte * 1.2
+    topo = altura_pagina - margem_vertical
+    fundo = margem_vertical
+    c = pdf_canvas.Canvas(destino, pagesize=pagesize, pageCompression=1)
+
+    # larguras de texto se repetem muito (datas, clientes, bases): mede cada string uma vez
+    medidas = {FONTE: {}, FONTE_NEGRITO: {}}
+
+    def medir(texto, fonte):
+        cache = medidas[fonte]
+        w = cache.get(texto)
+        if w is None:
+            w = stringWidth(texto, fonte, tamanho_fonte)
+            if len(cache) < 20000:
+                cache[texto] = w
+        return w
+
+    def quebrar(texto, largura, fonte):
+        """[(linha, largura_da_linha)]; simpleSplit só quando não cabe."""
+        w = medir(texto, fonte)
+        if w <= largura:
+            return ((texto, w),)
+        partes = simpleSplit(texto, fonte, tamanho_fonte, largura) or ['']
+        return tuple((p, medir(p, fonte)) for p in partes)
+
+    # cabeçalho já quebrado uma vez só
+    cab_linhas = [quebrar(str(col.titulo), w - 2 * pad, FONTE_NEGRITO)
+                  for col, w in zip(colunas, larguras)]
+    altura_cab = max(len(l) for l in cab_linhas) * entrelinha + 2 * pad
+
+    # um único objeto de texto por página (setFont/beginText por célula custam caro)
+    estado = {'pagina': 0, 'y': topo, 'y_tabela': topo, 'texto': None}
+
+    def desenhar_celula(linhas_celula, i, y):
+        txt = estado['texto']
+        w = larguras[i]
+        alinhamento = colunas[i].alinhamento
+        yl = y - pad - tamanho_fonte
+        for t, wt in linhas_celula:
+            if alinhamento == 'direita':
+                x = posicoes[i] + w - pad - wt
+            elif alinhamento == 'centro':
+                x = posicoes[i] + (w - wt) / 2
+            else:
+                x = posicoes[i] + pad
+            txt.setTextOrigin(x, yl)
+            txt.textOut(t)
+            yl -= entrelinha
+
+    def fechar_pagina():
+        c.drawText(estado['texto'])
+        # linhas verticais da página atual (do topo da tabela até a última linha)
+        c.setStrokeColor(colors.grey)
+        c.setLineWidth(0.25)
+        for x in posicoes:
+            c.line(x, estado['y_tabela'], x, estado['y'])
+        c.showPage()
+
+    def nova_pagina():
+        if estado['pagina']:
+            fechar_pagina()
+        estado['pagina'] += 1
+        y = topo
+        if estado['pagina'] == 1 and titulo:
+            c.setFont(FONTE_NEGRITO, 14)
+            c.drawCentredString(largura_pagina / 2, y - 14, titulo)
+            y -= 22
+            if subtitulo:
+                c.setFont(FONTE, 9)
+                c.drawString(x0, y - 9, subtitulo)
+                y -= 16
+        c.setFont(FONTE, 8)
+        c.drawString(x0, fundo - 0.8 * cm, f"Página {estado['pagina']}")
+
+        c.setFillColor(colors.lightgrey)
+        c.rect(x0, y - altura_cab, posicoes[-1] - x0, altura_cab, stroke=0, fill=1)
+        c.setFillColor(colors.black)
+        c.setStrokeColor(colors.grey)
+        c.setLineWidth(0.25)
+        c.line(x0, y, posicoes[-1], y)
+        c.line(x0, y - altura_cab, posicoes[-1], y - altura_cab)
+
+        estado['texto'] = c.beginText()
+        estado['texto'].setFont(FONTE_NEGRITO, tamanho_fonte)
+        for i, linhas_celula in enumerate(cab_linhas):
+            desenhar_celula(linhas_celula, i, y)
+        estado['texto'].setFont(FONTE, tamanho_fonte)
+        estado['y_tabela'] = y
+        estado['y'] = y - altura_cab
+
+    nova_pagina()
+    largura_texto = [w - 2 * pad for w in larguras]
+    n = 0
+    for n, linha in enumerate(linhas, start=1):
+        celulas = [quebrar('' if v is None else str(v), largura_texto[i], FONTE)
+                   for i, v in enumerate(linha)]
+        altura = max(len(t) for t in celulas) * entrelinha + 2 * pad
+        if estado['y'] - altura < fundo:
+            nova_pagina()
+        y = estado['y']
+        for i, t in enumerate(celulas):
+            desenhar_celula(t, i, y)
+        estado['y'] = y - altura
+        c.line(x0, estado['y'], posicoes[-1], estado['y'])
+
+        if progresso and n % 1000 == 0:
+            pct = 10 + 89 * n / total if total else 50
+            progresso(pct, f"Gerando página {estado['pagina']} ({n} linhas)")
+
+    fechar_pagina()
+    c.save()
+    return n
@@ -0,0 +1,325 @@
+"""
+Geração de relatórios (PDF/Excel) em segundo plano, sem broker externo.
+
+- enfileirar() grava o pedido em relatorio_jobs (migração 010) e acorda os workers.
+- Cada processo do app mantém um pequeno pool de threads (iniciar_workers()) que pega
+  pendentes com FOR UPDATE SKIP LOCKED, chama o gerador registrado para (tipo, formato)
+  e grava o arquivo em PASTA_RELATORIOS.
+- O gerador informa o andamento por progresso(pct, mensagem); a UI consulta o status
+  e baixa o arquivo quando concluído. Arquivos expiram após TTL_HORAS.
+- Enquanto o gerador roda, uma thread de pulso renova atualizado_em a cada
+  _INTERVALO_PULSO, mesmo numa etapa longa sem progresso (consulta grande, montagem do PDF).
+  Job "processando" sem atualização há mais de TEMPO_TRAVADO (processo morreu) volta
+  para a fila, até MAX_TENTATIVAS.
+
+Gerador: função(conexao, parametros, caminho_destino, progresso) -> nome do arquivo para
+download. Registrado com registrar_gerador(tipo, formato, mimetype, funcao).
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+from conexao_db import conectar
+
+PASTA_RELATORIOS = os.getenv("RELATORIOS_DIR") or os.path.join(tempfile.gettempdir(), 'relatorios')
+NUM_WORKERS = int(os.getenv("RELATORIOS_WORKERS", "2"))
+TTL_HORAS = float(os.getenv("RELATORIOS_TTL_HORAS", "24"))
+TEMPO_TRAVADO = 15 * 60      # s sem progresso até considerar o worker morto
+MAX_TENTATIVAS = 2
+_INTERVALO_PULSO = TEMPO_TRAVADO / 3  # s entre renovações de atualizado_em durante a geração
+_INTERVALO_FILA = 5          # s entre consultas à fila quando ninguém acorda os workers
+_INTERVALO_LIMPEZA = 10 * 60  # s entre limpezas de expirados
+
+_geradores = {}
+_acordar = threading.Event()
+_workers_pid = None
+_workers_lock = threading.Lock()
+_ultima_limpeza = 0.0
+
+
+def registrar_gerador(tipo, formato, mimetype, funcao):
+    _geradores[(tipo, formato)] = (funcao, mimetype)
+
+
+def tem_gerador(tipo, formato):
+    return (tipo, formato) in _geradores
+
+
+def enfileirar(tipo, formato, parametros, usuario=None):
+    """
+    Cria o job e retorna o id. Levanta ValueError se não houver gerador para (tipo, formato)
+    e RuntimeError se não houver conexão com o banco.
+    """
+    if not tem_gerador(tipo, formato):
+        raise ValueError(f"Relatório não suportado: {tipo}/{formato}")
+    conn = conectar()
+    if conn is None:
+        raise RuntimeError("Sem conexão com o banco para enfileirar o relatório")
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO relatorio_jobs (tipo, formato, parametros, usuario)
+            VALUES (%s, %s, %s::jsonb, %s)
+            RETURNING id
+        """, (tipo, formato, json.dumps(parametros or {}), usuario))
+        job_id = cur.fetchone()[0]
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    iniciar_workers()
+    _acordar.set()
+    return job_id
+
+
+def obter_job(job_id):
+    """Dicionário com o estado do job (ou None)."""
+    conn = conectar()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id, tipo, formato, usuario, status, progresso, mensagem,
+                   arquivo, nome_arquivo, mimetype, criado_em, concluido_em, expira_em
+            FROM relatorio_jobs WHERE id = %s
+        """, (job_id,))
+        linha = cur.fetchone()
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    if linha is None:
+        return None
+    colunas = ('id', 'tipo', 'formato', 'usuario', 'status', 'progresso', 'mensagem',
+               'arquivo', 'nome_arquivo', 'mimetype', 'criado_em', 'concluido_em', 'expira_em')
+    return dict(zip(colunas, linha))
+
+
+# ---------------- progresso ----------------
+def _atualizar(job_id, **campos):
+    conn = conectar()
+    if conn is None:
+        return
+    cur = conn.cursor()
+    try:
+        sets = "".join(f"{nome} = %s, " for nome in campos)
+        cur.execute(
+            f"UPDATE relatorio_jobs SET {sets}atualizado_em = now() WHERE id = %s",
+            list(campos.values()) + [job_id]
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print("Erro ao atualizar relatorio_jobs:", e)
+    finally:
+        cur.close()
+        conn.close()
+
+
+class _Progresso:
+    """Callback passado ao gerador; grava no máximo ~1x/s (ou a cada 5 pontos percentuais)."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._pct = -1
+        self._instante = 0.0
+
+    def __call__(self, pct, mensagem=None):
+        pct = max(0, min(int(pct), 99))  # 100 só quando o arquivo estiver pronto
+        agora = time.monotonic()
+        if pct - self._pct < 5 and agora - self._instante < 1.0:
+            return
+        self._pct, self._instante = pct, agora
+        campos = {'progresso': pct}
+        if mensagem is not None:
+            campos['mensagem'] = mensagem
+        _atualizar(self.job_id, **campos)
+
+
+def _pulso(job_id, parar):
+    """Renova atualizado_em do job até parar ser sinalizado (o gerador terminou)."""
+    while not parar.wait(_INTERVALO_PULSO):
+        _atualizar(job_id)
+
+
+# ---------------- workers ----------------
+def iniciar_workers(quantidade=None):
+    """Sobe o pool de threads deste processo (idempotente; refeito após fork)."""
+    global _workers_pid
+    if _workers_pid == os.getpid():
+        return
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        _workers_pid = os.getpid()
+        os.makedirs(PASTA_RELATORIOS, exist_ok=True)
+        for i in range(quantidade or NUM_WORKERS):
+            threading.Thread(target=_laco_worker, name=f"relatorios-{i}", daemon=True).start()
+
+
+def _laco_worker():
+    while True:
+        try:
+            _manutencao()
+            if not _processar_proximo():
+                _acordar.wait(_INTERVALO_FILA)
+                _acordar.clear()
+        except Exception as e:
+            print("Erro no worker de relatórios:", e)
+            time.sleep(_INTERVALO_FILA)
+
+
+def _pegar_proximo():
+    conn = conectar()
+    if conn is None:
+        return None
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE relatorio_jobs
+               SET status = 'processando', progresso = 0, mensagem = NULL,
+                   tentativas = tentativas + 1, atualizado_em = now()
+             WHERE id = (
+                SELECT id FROM relatorio_jobs
+                 WHERE status = 'pendente'
+                 ORDER BY id
+                 LIMIT 1
+                 FOR UPDATE SKIP LOCKED
+             )
+            RETURNING id, tipo, formato, parametros
+        """)
+        linha = cur.fetchone()
+        conn.commit()
+        return linha
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _processar_proximo():
+    """Processa um job pendente. Retorna False se a fila estava vazia."""
+    job = _pegar_proximo()
+    if job is None:
+        return False
+    job_id, tipo, formato, parametros = job
+    if isinstance(parametros, str):
+        parametros = json.loads(parametros)
+
+    gerador = _geradores.get((tipo, formato))
+    if gerador is None:
+        _atualizar(job_id, status='erro', mensagem=f"Relatório não suportado: {tipo}/{formato}")
+        return True
+    funcao, mimetype = gerador
+
+    extensao = 'pdf' if formato == 'pdf' else 'xlsx'
+    caminho = os.path.join(PASTA_RELATORIOS, f"relatorio_{job_id}.{extensao}")
+    parar_pulso = threading.Event()
+    threading.Thread(target=_pulso, args=(job_id, parar_pulso),
+                     name=f"relatorios-pulso-{job_id}", daemon=True).start()
+    conn = conectar()
+    try:
+        nome_arquivo = funcao(conn, parametros, caminho, _Progresso(job_id))
+        conn.commit()
+    except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        print(f"Erro ao gerar relatório {job_id}:", e)
+        _remover(caminho)
+        _atualizar(job_id, status='erro', mensagem=str(e)[:500])
+        return True
+    finally:
+        parar_pulso.set()
+        if conn is not None:
+            conn.close()
+
+    conn = conectar()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE relatorio_jobs
+               SET status = 'concluido', progresso = 100, mensagem = NULL,
+                   arquivo = %s, nome_arquivo = %s, mimetype = %s,
+                   concluido_em = now(), atualizado_em = now(),
+                   expira_em = now() + make_interval(secs => %s)
+             WHERE id = %s
+        """, (caminho, nome_arquivo or os.path.basename(caminho), mimetype, TTL_HORAS * 3600, job_id))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return True
+
+
+# ---------------- manutenção ----------------
+def _remover(caminho):
+    try:
+        if caminho and os.path.exists(caminho):
+            os.remove(caminho)
+    except OSError:
+        pass
+
+
+def _manutencao():
+    """Requeue de jobs travados e remoção de arquivos expirados (no máximo a cada _INTERVALO_LIMPEZA)."""
+    global _ultima_limpeza
+    agora = time.monotonic()
+    if agora - _ultima_limpeza < _INTERVALO_LIMPEZA:
+        return
+    _ultima_limpeza = agora
+
+    conn = conectar()
+    if conn is None:
+        return
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE relatorio_jobs
+               SET status = CASE WHEN tentativas < %s THEN 'pendente' ELSE 'erro' END,
+                   mensagem = CASE WHEN tentativas < %s THEN mensagem
+                                   ELSE 'Geração interrompida.' END,
+                   atualizado_em = now()
+             WHERE status = 'processando'
+               AND atualizado_em < now() - make_interval(secs => %s)
+        """, (MAX_TENTATIVAS, MAX_TENTATIVAS, TEMPO_TRAVADO))
+
+        cur.execute("""
+            WITH vencidos AS (
+                SELECT id, arquivo FROM relatorio_jobs
+                 WHERE status = 'concluido' AND expira_em < now()
+                 FOR UPDATE SKIP LOCKED
+            )
+            UPDATE relatorio_jobs j
+               SET status = 'expirado', arquivo = NULL, atualizado_em = now()
+              FROM vencidos
+             WHERE j.id = vencidos.id
+            RETURNING vencidos.arquivo
+        """)
+        expirados = [r[0] for r in cur.fetchall()]
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print("Erro na manutenção de relatorio_jobs:", e)
+        return
+    finally:
+        cur.close()
+        conn.close()
+
+    for caminho in expirados:
+        _remover(caminho)
+
+    # arquivos órfãos (job apagado, falha entre gravar e registrar) também vencem pelo TTL
+    if os.path.isdir(PASTA_RELATORIOS):
+        limite = time.time() - TTL_HORAS * 3600
+        for nome in os.listdir(PASTA_RELATORIOS):
+            caminho = os.path.join(PASTA_RELATORIOS, nome)
+            try:
+                if os.path.getmtime(caminho) < limite:
+                    _remover(caminho)
+            except OSError:
+                pass
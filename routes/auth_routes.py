@@ -2,11 +2,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 import bcrypt, re
 from functools import wraps
-from conexao_db import conectar
+from conexao_db import conexao_requisicao
 
 auth_bp = Blueprint('auth', __name__)
-conexao = conectar()
-cursor = conexao.cursor()
 
 @auth_bp.route('/')
 def home():
@@ -50,6 +48,8 @@ def register():
             flash('As senhas não coincidem.', 'erro')
             return render_template('register.html')
 
+        conexao = conexao_requisicao()
+        cursor = conexao.cursor()
         # 4) Email único
         cursor.execute("SELECT id FROM usuarios WHERE email = %s", (email,))
         if cursor.fetchone():
@@ -82,6 +82,8 @@ def login():
         email = request.form['email'].strip().lower()
         senha = request.form['senha']
 
+        conexao = conexao_requisicao()
+        cursor = conexao.cursor()
         cursor.execute(
             "SELECT id, first_name, senha, ativo, force_reset "
             "FROM usuarios WHERE email = %s",
@@ -139,6 +141,8 @@ def primeiro_login():
 
         # 4) Hash e update
         senha_hash = bcrypt.hashpw(nova_senha.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        conexao = conexao_requisicao()
+        cursor = conexao.cursor()
         try:
             cursor.execute(
                 "UPDATE usuarios SET senha = %s, force_reset = FALSE WHERE id = %s",
@@ -180,6 +184,8 @@ def forgot_password():
             flash('Formato de email inválido.', 'erro')
             return render_template('forgot_password.html')
 
+        conexao = conexao_requisicao()
+        cursor = conexao.cursor()
         # 2) verificar existência no banco
         cursor.execute("SELECT id FROM usuarios WHERE email = %s", (email,))
         row = cursor.fetchone()
@@ -223,6 +229,8 @@ def reset_password():
 
         # 4) Hash e update
         senha_hash = bcrypt.hashpw(nova.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        conexao = conexao_requisicao()
+        cursor = conexao.cursor()
         cursor.execute("UPDATE usuarios SET senha = %s WHERE email = %s", (senha_hash, email))
         conexao.commit()
 
@@ -7,6 +7,17 @@ import io
 import pandas as pd
 import unicodedata
 import re
+import os
+import threading
+from functools import lru_cache
+import json
+from psycopg2.extras import execute_values
+from calculo_vetorizado import calcular_lote
+from indice_nomes import IndiceNomes
+from estoque import definir_contexto_estoque
+from cache_referencia import obter_referencias, estatisticas_cache_referencia
+import base64
+from datetime import datetime
 
 calculo_bp = Blueprint('calculo_nfs', __name__, url_prefix='/calculo_nfs')
 
@@ -27,78 +38,58 @@ def converter_numero_br_para_decimal(valor):
     except Exception:
         return None
 
-def registrar_historico(usuario, nf, produto, quantidade, tipo):
+def registrar_historico(cur, usuario, nf, produto, quantidade, tipo):
     """
-    Tenta gravar histórico, mas silencia erro quando a tabela calculo_historico não existe
-    (útil durante testes). Outros erros serão logados.
+    Grava o histórico na transação de quem chamou (cur), sem pegar outra conexão do pool:
+    entra junto com a alteração no commit dela. Um SAVEPOINT isola a falha, e o erro é
+    silenciado quando a tabela calculo_historico não existe (útil durante testes).
+    Outros erros serão logados.
     """
-    conn = conectar()
-    cur = conn.cursor()
+    cur.execute("SAVEPOINT registrar_historico")
     try:
         cur.execute(
             "INSERT INTO calculo_historico (usuario, nf, produto, quantidade, tipo, timestamp) "
             "VALUES (%s, %s, %s, %s, %s, now())",
             (usuario or '', str(nf), str(produto), Decimal(str(quantidade)), tipo)
         )
-        conn.commit()
-        try:
-            cur.execute("SELECT pg_notify('historico_atualizado', 'novo');")
-            conn.commit()
-        except Exception:
-            pass
+        # NOTIFY é entregue no commit da transação
+        cur.execute("SELECT pg_notify('historico_atualizado', 'novo');")
+        cur.execute("RELEASE SAVEPOINT registrar_historico")
     except Exception as e:
-        conn.rollback()
+        cur.execute("ROLLBACK TO SAVEPOINT registrar_historico")
         msg = str(e).lower()
         if 'calculo_historico' in msg or 'relation "calculo_historico" does not exist' in msg:
             # silenciar (tabela pode não existir em testes)
             pass
         else:
             print("Erro ao gravar histórico:", e)
-    finally:
-        cur.close()
-        conn.close()
 
-def sincronizar_estoque_por_entrada():
+def sincronizar_estoque_por_entrada(cur, entrada_ids):
     """
     Cada linha da entrada_nf vira uma linha em calculo_nfs com a mesma quantidade do peso_liquido.
     NÃO sobrescreve quantidade_estoque já existente — apenas insere novas linhas ou preenche NULL.
+    Trabalha só nas entradas informadas, dentro da transação de quem chamou (um único comando).
     """
-    conn = conectar()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT en.id AS entrada_id, en.peso_liquido
-            FROM entrada_nf en
-            WHERE en.peso_liquido IS NOT NULL
-        """)
-        rows = cur.fetchall()
-
-        for entrada_id, peso in rows:
-            if peso is None:
-                continue
-            peso_dec = Decimal(str(peso))
-
-            cur.execute("""
-                INSERT INTO calculo_nfs (entrada_id, quantidade_estoque)
-                VALUES (%s, %s)
-                ON CONFLICT (entrada_id) DO UPDATE
-                SET quantidade_estoque = CASE
-                    WHEN calculo_nfs.quantidade_estoque IS NULL THEN EXCLUDED.quantidade_estoque
-                    ELSE calculo_nfs.quantidade_estoque
-                END
-            """, (entrada_id, peso_dec))
-
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        print("Erro sincronizar_estoque_por_entrada:", e)
-    finally:
-        cur.close()
-        conn.close()
-
+    cur.execute("""
+        INSERT INTO calculo_nfs (entrada_id, quantidade_estoque)
+        SELECT en.id, en.peso_liquido
+        FROM entrada_nf en
+        WHERE en.peso_liquido IS NOT NULL
+          AND en.id = ANY(%s)
+        ON CONFLICT (entrada_id) DO UPDATE
+        SET quantidade_estoque = CASE
+            WHEN calculo_nfs.quantidade_estoque IS NULL THEN EXCLUDED.quantidade_estoque
+            ELSE calculo_nfs.quantidade_estoque
+        END
+    """, (list(entrada_ids),))
+
+# tamanho do cache de normalize_name (nomes distintos de produtos/fornecedores/materiais)
+NORMALIZE_CACHE_SIZE = int(os.getenv("NORMALIZE_CACHE_SIZE", "20000"))
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
 def normalize_name(s):
     """
-    Normaliza um nome para comparação:
+    Normaliza um nome para comparação (resultado em cache LRU, ver estatisticas_normalize_name):
       - remove acentos
       - remove conteúdo entre parênteses
       - substitui '~' por espaço
@@ -119,6 +110,18 @@ def normalize_name(s):
     t = re.sub(r'\s+', ' ', t).strip().upper()
     return t
 
+def estatisticas_normalize_name():
+    """Acertos/erros e ocupação do cache de normalize_name."""
+    info = normalize_name.cache_info()
+    consultas = info.hits + info.misses
+    return {
+        "acertos": info.hits,
+        "erros": info.misses,
+        "taxa_acerto": round(info.hits / consultas, 4) if consultas else 0.0,
+        "tamanho": info.currsize,
+        "maximo": info.maxsize,
+    }
+
 def safe_decimal_zero(value):
     """
     Converte value para Decimal, retornando Decimal('0') em qualquer caso inválido,
@@ -147,6 +150,68 @@ def safe_decimal_zero(value):
     except (InvalidOperation, ValueError, TypeError):
         return Decimal('0')
 
+def percentual_produto(prod_map, produto_nome, indice):
+    """
+    Percentual (fração) do produto no prod_map: indice 0 = cobre, 1 = zinco.
+    Procura pelo nome normalizado e, se não achar, pela primeira chave que contenha
+    (ou esteja contida em) o nome, na ordem de inserção do mapa.
+    """
+    def extrair(raw):
+        if isinstance(raw, (list, tuple)):
+            if indice == 0:
+                return raw[0]
+            # raw_pct pode ser apenas o percentual de zinco (compatibilidade)
+            return raw[1] if len(raw) > 1 else raw
+        return raw
+
+    prod_key = normalize_name(produto_nome)
+    raw_pct = prod_map.get(prod_key)
+    percentual = extrair(raw_pct) if raw_pct is not None else None
+
+    if percentual is None:
+        if isinstance(prod_map, IndiceNomes):
+            # busca indexada (mesmas chaves e mesma ordem da varredura abaixo)
+            candidatas = prod_map.correspondencias(prod_key)
+        else:
+            candidatas = prod_map.keys()
+        for k in candidatas:
+            if not k:
+                continue
+            if prod_key and (k.startswith(prod_key) or prod_key.startswith(k) or k in prod_key or prod_key in k):
+                percentual = extrair(prod_map.get(k))
+                if percentual is not None:
+                    break
+    return percentual
+
+def valor_material_do_grupo(materiais_list, fornecedor_id, materials_by_fornecedor, materials_fallback, grupos):
+    """
+    Valor do primeiro material da entrada cujo grupo contém um dos termos em `grupos`
+    (material do fornecedor primeiro, depois o cadastro geral). Materiais com valor
+    nulo ou zero são ignorados. Retorna None se nenhum servir.
+    """
+    for mat in (materiais_list or []):
+        if not mat:
+            continue
+        mat_key = normalize_name(mat)
+        mat_info = None
+        if fornecedor_id is not None:
+            mat_info = materials_by_fornecedor.get((mat_key, fornecedor_id))
+        if not mat_info:
+            mat_info = materials_fallback.get(mat_key)
+        if not mat_info:
+            continue
+        grupo, valor_mat = mat_info
+        if valor_mat is None:
+            continue
+        if grupo and any(g in grupo.lower() for g in grupos):
+            try:
+                if Decimal(str(valor_mat)) == 0:
+                    continue
+            except Exception:
+                return None
+            return valor_mat
+    return None
+
 def calcular_qtd_cobre(cursor, produto_nome, fornecedor_nome, materiais_list, peso_liquido, peso_integral,
                        prod_map=None, forn_map=None, materials_by_fornecedor=None, materials_fallback=None):
     """
@@ -165,61 +230,25 @@ def calcular_qtd_cobre(cursor, produto_nome, fornecedor_nome, materiais_list, pe
 
     # usa mapas pré-carregados
     if prod_map is not None and materials_by_fornecedor is not None and materials_fallback is not None:
-        prod_key = normalize_name(produto_nome)
-        raw_pct = prod_map.get(prod_key)
-        percent_cobre = None
-        if raw_pct is not None:
-            if isinstance(raw_pct, (list, tuple)):
-                percent_cobre = raw_pct[0]
-            else:
-                percent_cobre = raw_pct
-
-        if percent_cobre is None:
-            for k in prod_map.keys():
-                if not k:
-                    continue
-                if prod_key and (k.startswith(prod_key) or prod_key.startswith(k) or k in prod_key or prod_key in k):
-                    candidate = prod_map.get(k)
-                    if isinstance(candidate, (list, tuple)):
-                        percent_cobre = candidate[0]
-                    else:
-                        percent_cobre = candidate
-                    if percent_cobre is not None:
-                        break
-
+        percent_cobre = percentual_produto(prod_map, produto_nome, 0)
         if not percent_cobre or Decimal(str(percent_cobre)) == 0:
             return None
 
-        forn_key = normalize_name(fornecedor_nome)
         fornecedor_id = None
         if forn_map is not None:
-            fornecedor_id = forn_map.get(forn_key)
+            fornecedor_id = forn_map.get(normalize_name(fornecedor_nome))
 
-        for mat in (materiais_list or []):
-            if not mat:
-                continue
-            mat_key = normalize_name(mat)
-            mat_info = None
-            if fornecedor_id is not None:
-                mat_info = materials_by_fornecedor.get((mat_key, fornecedor_id))
-            if not mat_info:
-                mat_info = materials_fallback.get(mat_key)
-            if not mat_info:
-                continue
-            grupo, valor_mat = mat_info
-            if valor_mat is None:
-                continue
-            if grupo and 'cobr' in grupo.lower():
-                try:
-                    if Decimal(str(valor_mat)) == 0:
-                        continue
-                    quantidade_cobre = ((pl - pi) * Decimal(str(percent_cobre))) / Decimal(str(valor_mat))
-                    if quantidade_cobre < 0:
-                        return None
-                    return quantidade_cobre
-                except Exception:
-                    return None
-        return None
+        valor_mat = valor_material_do_grupo(materiais_list, fornecedor_id, materials_by_fornecedor,
+                                            materials_fallback, ('cobr',))
+        if valor_mat is None:
+            return None
+        try:
+            quantidade_cobre = ((pl - pi) * Decimal(str(percent_cobre))) / Decimal(str(valor_mat))
+            if quantidade_cobre < 0:
+                return None
+            return quantidade_cobre
+        except Exception:
+            return None
 
     # fallback DB
     produto_norm = normalize_name(produto_nome)
@@ -315,62 +344,25 @@ def calcular_qtd_zinco(cursor, produto_nome, fornecedor_nome, materiais_list, pe
 
     # usa mapas pré-carregados
     if prod_map is not None and materials_by_fornecedor is not None and materials_fallback is not None:
-        prod_key = normalize_name(produto_nome)
-        raw_pct = prod_map.get(prod_key)
-        percent_zinco = None
-        if raw_pct is not None:
-            if isinstance(raw_pct, (list, tuple)) and len(raw_pct) > 1:
-                percent_zinco = raw_pct[1]
-            else:
-                # raw_pct pode ser apenas o percentual de zinco (compatibilidade)
-                percent_zinco = raw_pct
-
-        if percent_zinco is None:
-            for k in prod_map.keys():
-                if not k:
-                    continue
-                if prod_key and (k.startswith(prod_key) or prod_key.startswith(k) or k in prod_key or prod_key in k):
-                    candidate = prod_map.get(k)
-                    if isinstance(candidate, (list, tuple)) and len(candidate) > 1:
-                        percent_zinco = candidate[1]
-                    else:
-                        percent_zinco = candidate
-                    if percent_zinco is not None:
-                        break
-
+        percent_zinco = percentual_produto(prod_map, produto_nome, 1)
         if not percent_zinco or Decimal(str(percent_zinco)) == 0:
             return None
 
-        forn_key = normalize_name(fornecedor_nome)
         fornecedor_id = None
         if forn_map is not None:
-            fornecedor_id = forn_map.get(forn_key)
+            fornecedor_id = forn_map.get(normalize_name(fornecedor_nome))
 
-        for mat in (materiais_list or []):
-            if not mat:
-                continue
-            mat_key = normalize_name(mat)
-            mat_info = None
-            if fornecedor_id is not None:
-                mat_info = materials_by_fornecedor.get((mat_key, fornecedor_id))
-            if not mat_info:
-                mat_info = materials_fallback.get(mat_key)
-            if not mat_info:
-                continue
-            grupo, valor_mat = mat_info
-            if valor_mat is None:
-                continue
-            if grupo and ('zinco' in grupo.lower() or 'zinc' in grupo.lower()):
-                try:
-                    if Decimal(str(valor_mat)) == 0:
-                        continue
-                    quantidade_zinco = ((pl - pi) * Decimal(str(percent_zinco))) / Decimal(str(valor_mat))
-                    if quantidade_zinco < 0:
-                        return None
-                    return quantidade_zinco
-                except Exception:
-                    return None
-        return None
+        valor_mat = valor_material_do_grupo(materiais_list, fornecedor_id, materials_by_fornecedor,
+                                            materials_fallback, ('zinco', 'zinc'))
+        if valor_mat is None:
+            return None
+        try:
+            quantidade_zinco = ((pl - pi) * Decimal(str(percent_zinco))) / Decimal(str(valor_mat))
+            if quantidade_zinco < 0:
+                return None
+            return quantidade_zinco
+        except Exception:
+            return None
 
     # fallback DB
     produto_norm = normalize_name(produto_nome)
@@ -480,33 +472,17 @@ def calcular_qtd_sucata(cursor, fornecedor_nome, materiais_list, peso_liquido, p
 
     # tenta via maps (agora respeitando fornecedor)
     if materials_by_fornecedor is not None and materials_fallback is not None:
-        for mat in (materiais_list or []):
-            if not mat:
-                continue
-            mat_key = normalize_name(mat)
-            mat_info = None
-            # primeiro tenta material específico do fornecedor (se tivermos fornecedor_id)
-            if fornecedor_id is not None:
-                mat_info = materials_by_fornecedor.get((mat_key, fornecedor_id))
-            # depois tenta fallback global
-            if not mat_info:
-                mat_info = materials_fallback.get(mat_key)
-            if not mat_info:
-                continue
-            grupo, valor_mat = mat_info
-            if valor_mat is None:
-                continue
-            if grupo and 'sucata' in (grupo or '').lower():
-                try:
-                    if Decimal(str(valor_mat)) == 0:
-                        continue
-                    qtd = diff / Decimal(str(valor_mat))
-                    if qtd < 0:
-                        return None
-                    return qtd
-                except Exception:
-                    return None
-        return None
+        valor_mat = valor_material_do_grupo(materiais_list, fornecedor_id, materials_by_fornecedor,
+                                            materials_fallback, ('sucata',))
+        if valor_mat is None:
+            return None
+        try:
+            qtd = diff / Decimal(str(valor_mat))
+            if qtd < 0:
+                return None
+            return qtd
+        except Exception:
+            return None
 
     # fallback DB: (mantém comportamento atual)
     for mat in (materiais_list or []):
@@ -741,393 +717,591 @@ def format_br_filter(value, decimals=2):
         except Exception:
             return ''
 
-@calculo_bp.route('/', methods=['GET'])
-@login_required
-def listar_calculo_nfs():
+# Campos de entrada_nf + calculo_nfs usados no grid e no cálculo de valor_total_nf / mao_de_obra / materia_prima
+_SQL_REGISTROS = """
+    SELECT
+        en.id AS entrada_id,
+        en.data AS entrada_data,
+        en.nf AS entrada_nf,
+        en.produto AS entrada_produto,
+        en.fornecedor AS entrada_fornecedor,
+        en.material_1, en.material_2, en.material_3, en.material_4, en.material_5,
+        en.peso_liquido AS peso_liquido,
+        en.peso_integral AS peso_integral,
+        en.valor_integral, en.ipi,
+        en.valor_unitario_1, en.valor_unitario_2, en.valor_unitario_3,
+        en.valor_mao_obra_tm_metallica, en.valor_unitario_energia,
+        en.duplicata_1, en.duplicata_2, en.duplicata_3, en.duplicata_4, en.duplicata_5, en.duplicata_6,
+        cn.id AS calculo_id,
+        COALESCE(cn.quantidade_estoque, 0) AS quantidade_estoque,
+        cn.qtd_cobre, cn.qtd_zinco, cn.qtd_sucata,
+        cn.valor_total_nf, cn.mao_de_obra, cn.materia_prima,
+        cn.custo_total_manual, cn.custo_total
+    FROM entrada_nf en
+    LEFT JOIN calculo_nfs cn ON cn.entrada_id = en.id
+"""
+
+def _linha_para_registro(columns, row):
+    """Monta o dict 'reg' (usado pelos cálculos e pelo template) a partir de uma linha de _SQL_REGISTROS."""
+    rowdict = dict(zip(columns, row))
+
+    return {
+        'entrada_id': rowdict.get('entrada_id') or rowdict.get('id'),
+        'data': rowdict.get('entrada_data') or rowdict.get('data'),
+        'nf': rowdict.get('entrada_nf') or rowdict.get('nf'),
+        'produto': rowdict.get('entrada_produto') or rowdict.get('produto'),
+        'fornecedor': rowdict.get('entrada_fornecedor') or rowdict.get('fornecedor'),
+        'material_1': rowdict.get('material_1'),
+        'material_2': rowdict.get('material_2'),
+        'material_3': rowdict.get('material_3'),
+        'material_4': rowdict.get('material_4'),
+        'material_5': rowdict.get('material_5'),
+        'peso_liquido': rowdict.get('peso_liquido'),
+        'peso_integral': rowdict.get('peso_integral'),
+        'valor_integral': rowdict.get('valor_integral'),
+        'ipi': rowdict.get('ipi'),
+        'valor_unitario_1': rowdict.get('valor_unitario_1'),
+        'valor_unitario_2': rowdict.get('valor_unitario_2'),
+        'valor_unitario_3': rowdict.get('valor_unitario_3'),
+        'valor_mao_obra_tm_metallica': rowdict.get('valor_mao_obra_tm_metallica'),
+        'valor_unitario_energia': rowdict.get('valor_unitario_energia'),
+        'duplicata_1': rowdict.get('duplicata_1'),
+        'duplicata_2': rowdict.get('duplicata_2'),
+        'duplicata_3': rowdict.get('duplicata_3'),
+        'duplicata_4': rowdict.get('duplicata_4'),
+        'duplicata_5': rowdict.get('duplicata_5'),
+        'duplicata_6': rowdict.get('duplicata_6'),
+        'id': rowdict.get('calculo_id') or rowdict.get('id'),
+        'quantidade_estoque': rowdict.get('quantidade_estoque'),
+        'qtd_cobre': rowdict.get('qtd_cobre'),
+        'qtd_zinco': rowdict.get('qtd_zinco'),
+        'qtd_sucata': rowdict.get('qtd_sucata'),
+        'valor_total_nf': rowdict.get('valor_total_nf'),
+        'mao_de_obra': rowdict.get('mao_de_obra'),
+        'materia_prima': rowdict.get('materia_prima'),
+        'custo_total_manual': rowdict.get('custo_total_manual'),
+        'custo_total': rowdict.get('custo_total'),
+    }
+
+def _formatar_data_registro(reg):
+    """Formata reg['data'] como dd/mm/YYYY (in-place)."""
+    d = reg.get('data')
+    if d:
+        try:
+            if hasattr(d, 'strftime'):
+                reg['data'] = d.strftime('%d/%m/%Y')
+            else:
+                s = str(d).split('T')[0].split()[0]
+                parts = s.split('-')
+                if len(parts) == 3:
+                    reg['data'] = f"{parts[2]}/{parts[1]}/{parts[0]}"
+                else:
+                    reg['data'] = s
+        except Exception:
+            reg['data'] = str(d).split()[0]
+    else:
+        reg['data'] = None
+
+def _montar_mapas(refs):
+    """Monta os mapas do cálculo a partir de um snapshot do cache de referência."""
+    prod_map = {}
+    forn_map = {}
+    materials_by_fornecedor = {}
+    materials_fallback = {}
+
+    for _pid, nome, pct_c, pct_z in refs.produtos:
+        key = normalize_name(nome)
+        try:
+            pct_c_frac = (Decimal(str(pct_c)) / Decimal('100')) if pct_c is not None else None
+        except Exception:
+            pct_c_frac = None
+        try:
+            pct_z_frac = (Decimal(str(pct_z)) / Decimal('100')) if pct_z is not None else None
+        except Exception:
+            pct_z_frac = None
+        prod_map[key] = (pct_c_frac, pct_z_frac)
+
+    for fid, nome in refs.fornecedores:
+        if nome:
+            forn_map[normalize_name(nome)] = fid
+
+    for _mid, nome, fornecedor_id, grupo, valor in refs.materiais:
+        key = normalize_name(nome)
+        try:
+            valor_dec = Decimal(str(valor)) if valor is not None else None
+        except Exception:
+            valor_dec = None
+        grp = (grupo or '').strip()
+        if fornecedor_id is not None:
+            materials_by_fornecedor[(key, int(fornecedor_id))] = (grp.lower(), valor_dec)
+        if key not in materials_fallback:
+            materials_fallback[key] = (grp.lower(), valor_dec)
+
+    return {
+        'prod_map': IndiceNomes(prod_map),
+        'forn_map': forn_map,
+        'materials_by_fornecedor': materials_by_fornecedor,
+        'materials_fallback': materials_fallback,
+    }
+
+def carregar_mapas_referencia(conn=None):
+    """
+    Mapas de produtos, fornecedores e materiais usados por calcular_registro.
+    Vêm do cache de referência: montados uma vez por geração (só mudam quando um cadastro muda).
+    Quem já segura uma conexão passa `conn`, usada se o cache precisar recarregar.
+    """
+    return obter_referencias(conn).derivado('mapas_calculo', _montar_mapas)
+
+def calcular_registro(cur, reg, mapas):
+    """
+    Calcula (in-place) qtd_cobre, qtd_zinco, qtd_sucata e as colunas de custo de um registro,
+    usando os mapas de carregar_mapas_referencia(). Não grava nada no banco.
+    """
+    prod_map = mapas['prod_map']
+    forn_map = mapas['forn_map']
+    materials_by_fornecedor = mapas['materials_by_fornecedor']
+    materials_fallback = mapas['materials_fallback']
+
+    produto_nome = reg.get('produto') or ''
+    fornecedor_nome = reg.get('fornecedor') or ''
+    materiais_list = [reg.get('material_1'), reg.get('material_2'), reg.get('material_3'),
+                      reg.get('material_4'), reg.get('material_5')]
+    peso_liq = reg.get('peso_liquido') or 0
+    peso_int = reg.get('peso_integral') or 0
+
+    # cobre
+    existing_cobre = reg.get('qtd_cobre')
+    if existing_cobre is None or Decimal(str(existing_cobre or 0)) == 0:
+        try:
+            cobre_calc = calcular_qtd_cobre(cur, produto_nome, fornecedor_nome, materiais_list, peso_liq, peso_int,
+                                            prod_map=prod_map, forn_map=forn_map,
+                                            materials_by_fornecedor=materials_by_fornecedor,
+                                            materials_fallback=materials_fallback)
+            if cobre_calc is not None:
+                q_cobre = Decimal(str(cobre_calc)).quantize(Decimal('0.001'), rounding=ROUND_HALF_UP)
+                reg['qtd_cobre'] = q_cobre
+            else:
+                reg['qtd_cobre'] = None
+        except Exception as e:
+            print("Aviso: erro ao calcular qtd_cobre (função) para entrada_id", reg.get('entrada_id'), e)
+
+    # zinco
+    existing_zinco = reg.get('qtd_zinco')
+    if existing_zinco is None or Decimal(str(existing_zinco or 0)) == 0:
+        try:
+            zinco_calc = calcular_qtd_zinco(cur, produto_nome, fornecedor_nome, materiais_list, peso_liq, peso_int,
+                                            prod_map=prod_map, forn_map=forn_map,
+                                            materials_by_fornecedor=materials_by_fornecedor,
+                                            materials_fallback=materials_fallback)
+            if zinco_calc is not None:
+                q_zinco = Decimal(str(zinco_calc)).quantize(Decimal('0.001'), rounding=ROUND_HALF_UP)
+                reg['qtd_zinco'] = q_zinco
+            else:
+                reg['qtd_zinco'] = None
+        except Exception as e:
+            print("Aviso: erro ao calcular qtd_zinco (função) para entrada_id", reg.get('entrada_id'), e)
+
+    # sucata (agora passando forn_map para respeitar materiais por fornecedor)
+    existing_sucata = reg.get('qtd_sucata')
+    if existing_sucata is None or Decimal(str(existing_sucata or 0)) == 0:
+        try:
+            sucata_calc = calcular_qtd_sucata(cur, fornecedor_nome, materiais_list, peso_liq, peso_int,
+                                              materials_by_fornecedor=materials_by_fornecedor,
+                                              materials_fallback=materials_fallback,
+                                              forn_map=forn_map)
+            if sucata_calc is not None:
+                q_sucata = Decimal(str(sucata_calc)).quantize(Decimal('0.001'), rounding=ROUND_HALF_UP)
+                reg['qtd_sucata'] = q_sucata
+            else:
+                reg['qtd_sucata'] = None
+        except Exception as e:
+            print("Aviso: erro ao calcular qtd_sucata para entrada_id", reg.get('entrada_id'), e)
+
+    # valor_total_nf (apenas parte NF: peso_integral * valor_integral_com_ipi)
+    try:
+        calc_val = calcular_valor_total_nf(reg)
+        existing_valor = reg.get('valor_total_nf')
+        if calc_val is not None:
+            # mantem valor salvo > 0; caso contrário preenche com o calculado
+            if existing_valor is None or Decimal(str(existing_valor or 0)) == 0:
+                reg['valor_total_nf'] = calc_val
+    except Exception as e:
+        print("Aviso: erro ao atribuir valor_total_nf para entrada_id", reg.get('entrada_id'), e)
+
+    # ----------------------------
+    # matéria-prima e mão-de-obra:
+    # calculamos o TOTAL (como já vinha sendo feito)
+    # e também o VALOR UNITÁRIO:
+    # - MATÉRIA-PRIMA: unitário por PESO_LÍQUIDO (ou desktop-flow quando valor_integral existe)
+    # - MÃO-DE-OBRA: unitário por DIFERENÇA_DE_PESO (mantido)
+    # ----------------------------
     try:
-        sincronizar_estoque_por_entrada()
+        calc_mat_total = calcular_materia_prima_reg(reg)  # total (R$) -> soma(qtd * valor_unit)
     except Exception as e:
-        print("Aviso: falha na sincronização automática de estoque:", e)
+        calc_mat_total = None
+        print("Aviso: erro ao calcular materia_prima (total) para entrada_id", reg.get('entrada_id'), e)
 
-    conn = conectar()
-    cur = conn.cursor()
     try:
-        # Seleciona também campos usados no cálculo de valor_total_nf / mao_de_obra / materia_prima
-        cur.execute("""
-            SELECT
-                en.id AS entrada_id,
-                en.data AS entrada_data,
-                en.nf AS entrada_nf,
-                en.produto AS entrada_produto,
-                en.fornecedor AS entrada_fornecedor,
-                en.material_1, en.material_2, en.material_3, en.material_4, en.material_5,
-                en.peso_liquido AS peso_liquido,
-                en.peso_integral AS peso_integral,
-                en.valor_integral, en.ipi,
-                en.valor_unitario_1, en.valor_unitario_2, en.valor_unitario_3,
-                en.valor_mao_obra_tm_metallica, en.valor_unitario_energia,
-                en.duplicata_1, en.duplicata_2, en.duplicata_3, en.duplicata_4, en.duplicata_5, en.duplicata_6,
-                cn.id AS calculo_id,
-                COALESCE(cn.quantidade_estoque, 0) AS quantidade_estoque,
-                cn.qtd_cobre, cn.qtd_zinco, cn.qtd_sucata,
-                cn.valor_total_nf, cn.mao_de_obra, cn.materia_prima,
-                cn.custo_total_manual, cn.custo_total
-            FROM entrada_nf en
-            LEFT JOIN calculo_nfs cn ON cn.entrada_id = en.id
-            ORDER BY en.data DESC NULLS LAST, en.id DESC
-        """)
-        rows = cur.fetchall()
+        calc_mao_total = calcular_mao_de_obra_reg(reg)  # total (R$)
+    except Exception as e:
+        calc_mao_total = None
+        print("Aviso: erro ao calcular mao_de_obra (total) para entrada_id", reg.get('entrada_id'), e)
 
-        # monta registros de forma robusta usando nomes de colunas
-        columns = [desc[0] for desc in cur.description]
-        registros = []
-        for row in rows:
-            rowdict = dict(zip(columns, row))
-
-            reg = {
-                'entrada_id': rowdict.get('entrada_id') or rowdict.get('id'),
-                'data': rowdict.get('entrada_data') or rowdict.get('data'),
-                'nf': rowdict.get('entrada_nf') or rowdict.get('nf'),
-                'produto': rowdict.get('entrada_produto') or rowdict.get('produto'),
-                'fornecedor': rowdict.get('entrada_fornecedor') or rowdict.get('fornecedor'),
-                'material_1': rowdict.get('material_1'),
-                'material_2': rowdict.get('material_2'),
-                'material_3': rowdict.get('material_3'),
-                'material_4': rowdict.get('material_4'),
-                'material_5': rowdict.get('material_5'),
-                'peso_liquido': rowdict.get('peso_liquido'),
-                'peso_integral': rowdict.get('peso_integral'),
-                'valor_integral': rowdict.get('valor_integral'),
-                'ipi': rowdict.get('ipi'),
-                'valor_unitario_1': rowdict.get('valor_unitario_1'),
-                'valor_unitario_2': rowdict.get('valor_unitario_2'),
-                'valor_unitario_3': rowdict.get('valor_unitario_3'),
-                'valor_mao_obra_tm_metallica': rowdict.get('valor_mao_obra_tm_metallica'),
-                'valor_unitario_energia': rowdict.get('valor_unitario_energia'),
-                'duplicata_1': rowdict.get('duplicata_1'),
-                'duplicata_2': rowdict.get('duplicata_2'),
-                'duplicata_3': rowdict.get('duplicata_3'),
-                'duplicata_4': rowdict.get('duplicata_4'),
-                'duplicata_5': rowdict.get('duplicata_5'),
-                'duplicata_6': rowdict.get('duplicata_6'),
-                'id': rowdict.get('calculo_id') or rowdict.get('id'),
-                'quantidade_estoque': rowdict.get('quantidade_estoque'),
-                'qtd_cobre': rowdict.get('qtd_cobre'),
-                'qtd_zinco': rowdict.get('qtd_zinco'),
-                'qtd_sucata': rowdict.get('qtd_sucata'),
-                'valor_total_nf': rowdict.get('valor_total_nf'),
-                'mao_de_obra': rowdict.get('mao_de_obra'),
-                'materia_prima': rowdict.get('materia_prima'),
-                'custo_total_manual': rowdict.get('custo_total_manual'),
-                'custo_total': rowdict.get('custo_total'),
-            }
-
-            registros.append(reg)
-
-        # formata datas simples
-        for reg in registros:
-            d = reg.get('data')
-            if d:
-                try:
-                    if hasattr(d, 'strftime'):
-                        reg['data'] = d.strftime('%d/%m/%Y')
-                    else:
-                        s = str(d).split('T')[0].split()[0]
-                        parts = s.split('-')
-                        if len(parts) == 3:
-                            reg['data'] = f"{parts[2]}/{parts[1]}/{parts[0]}"
-                        else:
-                            reg['data'] = s
-                except Exception:
-                    reg['data'] = str(d).split()[0]
+    # pega pesos com segurança
+    try:
+        peso_liq_dec = Decimal(reg.get('peso_liquido') or 0)
+    except Exception:
+        peso_liq_dec = Decimal('0')
+    try:
+        peso_int_dec = Decimal(reg.get('peso_integral') or 0)
+    except Exception:
+        peso_int_dec = Decimal('0')
+
+    # diferença de peso (usar como denominador para obtenção do unitário da mão-de-obra)
+    try:
+        diferenca_peso = peso_liq_dec - peso_int_dec
+        if diferenca_peso <= 0:
+            diferenca_peso = None
+    except Exception:
+        diferenca_peso = None
+
+    # Primeiro atribui mão-de-obra (total e unitário) — necessário antes de calcular custo_total quando valor_integral existe
+    try:
+        if calc_mao_total is not None:
+            reg['mao_de_obra_total'] = Decimal(calc_mao_total).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            if diferenca_peso:
+                unit_mao = (Decimal(calc_mao_total) / diferenca_peso).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+                reg['mao_de_obra'] = unit_mao
             else:
-                reg['data'] = None
+                reg['mao_de_obra'] = Decimal(calc_mao_total).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        else:
+            reg['mao_de_obra_total'] = None
+            reg['mao_de_obra'] = None
+    except Exception as e:
+        print("Aviso: erro ao atribuir mao_de_obra para entrada_id", reg.get('entrada_id'), e)
+        reg['mao_de_obra_total'] = None
+        reg['mao_de_obra'] = None
 
-        # ------------------------------
-        # Pré-carrega produtos, fornecedores e materiais em memória (mapas)
-        # ------------------------------
-        prod_map = {}
-        forn_map = {}
-        materials_by_fornecedor = {}
-        materials_fallback = {}
+    try:
+        tem_valor_integral = (reg.get('valor_integral') not in (None, '')
+                              and Decimal(str(reg.get('valor_integral') or 0)) != 0)
+    except Exception:
+        tem_valor_integral = False
+
+    # Sem valor_integral a matéria-prima unitária não depende do custo_total: calcula ANTES,
+    # para que calcular_custo_total_reg (materia_prima + mao_de_obra) já use o valor atual
+    # e o resultado de uma única passada seja o mesmo de recarregar a página duas vezes.
+    if not tem_valor_integral:
+        try:
+            # usar total calculado dividido por peso_liquido (compatível com desktop)
+            if calc_mat_total is not None:
+                total_mat = Decimal(calc_mat_total)
+                reg['materia_prima_total'] = total_mat.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+                if peso_liq_dec > 0:
+                    unit_mat = (total_mat / peso_liq_dec).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+                    reg['materia_prima'] = unit_mat
+                else:
+                    # sem peso_liquido definido, manter total
+                    reg['materia_prima'] = total_mat.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            else:
+                reg['materia_prima_total'] = None
+                reg['materia_prima'] = None
+        except Exception as e:
+            print("Aviso: erro ao atribuir materia_prima para entrada_id", reg.get('entrada_id'), e)
+            reg['materia_prima_total'] = None
+            reg['materia_prima'] = None
+
+    # Agora: calcular custo_total (unitário) usando a função centralizada.
+    # Isso é importante porque, no desktop, quando valor_integral existe, a matéria-prima unitária
+    # é obtida como (custo_total_unitario - mao_de_obra_unitario).
+    try:
+        calc_ct = calcular_custo_total_reg(reg)
+        if calc_ct is not None:
+            reg['custo_total'] = calc_ct
+        else:
+            reg['custo_total'] = Decimal('0.00').quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    except Exception as e:
+        print("Aviso: erro ao atribuir custo_total para entrada_id", reg.get('entrada_id'), e)
+        reg['custo_total'] = Decimal('0.00').quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
+    # Com valor_integral (fluxo desktop): materia_prima_unit = custo_total_unit - mao_de_obra_unit
+    if tem_valor_integral:
         try:
-            cur.execute("SELECT nome, percentual_cobre, percentual_zinco FROM produtos")
-            for nome, pct_c, pct_z in cur.fetchall():
-                key = normalize_name(nome)
-                try:
-                    pct_c_frac = (Decimal(str(pct_c)) / Decimal('100')) if pct_c is not None else None
-                except Exception:
-                    pct_c_frac = None
-                try:
-                    pct_z_frac = (Decimal(str(pct_z)) / Decimal('100')) if pct_z is not None else None
-                except Exception:
-                    pct_z_frac = None
-                prod_map[key] = (pct_c_frac, pct_z_frac)
+            custo_unit = Decimal(reg.get('custo_total') or 0)
+            mao_unit = Decimal(reg.get('mao_de_obra') or 0)
+            materia_unit = custo_unit - mao_unit
+            # guarda total (se calculado) e unitário
+            reg['materia_prima_total'] = (Decimal(calc_mat_total).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+                                         if calc_mat_total is not None else None)
+            reg['materia_prima'] = materia_unit.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
         except Exception:
-            # fallback para apenas percentual_cobre (compatibilidade)
-            try:
-                cur.execute("SELECT nome, percentual_cobre FROM produtos")
-                for nome, pct in cur.fetchall():
-                    key = normalize_name(nome)
-                    try:
-                        pct_c_frac = (Decimal(str(pct)) / Decimal('100')) if pct is not None else None
-                    except Exception:
-                        pct_c_frac = None
-                    prod_map[key] = (pct_c_frac, None)
-            except Exception as e:
-                print("Aviso: falha ao carregar produtos:", e)
-                prod_map = {}
+            reg['materia_prima_total'] = None
+            reg['materia_prima'] = None
+
+def parametros_quantidades(reg, mapas):
+    """
+    Resolve pelos mapas os percentuais do produto e os valores de material usados nas
+    quantidades de cobre/zinco/sucata (entrada do motor vetorizado). None = sem cálculo.
+    """
+    prod_map = mapas['prod_map']
+    forn_map = mapas['forn_map']
+    materials_by_fornecedor = mapas['materials_by_fornecedor']
+    materials_fallback = mapas['materials_fallback']
+
+    fornecedor_nome = reg.get('fornecedor') or ''
+    materiais_list = [reg.get('material_1'), reg.get('material_2'), reg.get('material_3'),
+                      reg.get('material_4'), reg.get('material_5')]
+    fornecedor_id = forn_map.get(normalize_name(fornecedor_nome))
 
+    def decimal_ou_none(v):
         try:
-            cur.execute("SELECT id, nome FROM fornecedores")
-            for fid, nome in cur.fetchall():
-                if nome:
-                    forn_map[normalize_name(nome)] = fid
-        except Exception as e:
-            print("Aviso: falha ao carregar fornecedores:", e)
-            forn_map = {}
+            return Decimal(str(v)) if v is not None else None
+        except Exception:
+            return None
+
+    parametros = {}
+    for metal, indice, grupos in (('cobre', 0, ('cobr',)), ('zinco', 1, ('zinco', 'zinc'))):
+        pct = percentual_produto(prod_map, reg.get('produto') or '', indice)
+        pct = decimal_ou_none(pct) if pct else None
+        if not pct:
+            parametros[f'pct_{metal}'] = None
+            parametros[f'valor_{metal}'] = None
+            continue
+        parametros[f'pct_{metal}'] = pct
+        parametros[f'valor_{metal}'] = decimal_ou_none(valor_material_do_grupo(
+            materiais_list, fornecedor_id, materials_by_fornecedor, materials_fallback, grupos))
+
+    # sucata só usa o fornecedor quando o nome foi informado
+    parametros['valor_sucata'] = decimal_ou_none(valor_material_do_grupo(
+        materiais_list, fornecedor_id if fornecedor_nome else None,
+        materials_by_fornecedor, materials_fallback, ('sucata',)))
+    return parametros
+
+def calcular_registros_lote(cur, registros, mapas):
+    """
+    Versão em lote de calcular_registro (in-place) usando o motor vetorizado.
+    Linhas que o motor não garante idênticas ao Decimal (perto de empate, valores
+    irregulares) são refeitas com calcular_registro.
+    """
+    parametros = [parametros_quantidades(reg, mapas) for reg in registros]
+    resultados, recalcular = calcular_lote(registros, parametros)
+    refazer = set(recalcular)
+    for i, reg in enumerate(registros):
+        if i in refazer:
+            calcular_registro(cur, reg, mapas)
+        else:
+            reg.update(resultados[i])
+
+def persistir_registros(cur, registros, tamanho_pagina=1000):
+    """
+    Upsert em lote dos valores calculados em calculo_nfs (por entrada_id), com execute_values:
+    um comando por página de `tamanho_pagina` registros em vez de um por registro.
+    Valores NULL não apagam o que já está salvo (COALESCE com o valor atual).
+    """
+    valores = [
+        (reg.get('entrada_id'),
+         reg.get('qtd_cobre'), reg.get('qtd_zinco'), reg.get('qtd_sucata'),
+         reg.get('valor_total_nf'), reg.get('mao_de_obra'), reg.get('materia_prima'), reg.get('custo_total'))
+        for reg in registros
+        if reg.get('entrada_id') is not None
+    ]
+    if not valores:
+        return 0
+
+    execute_values(cur, """
+        INSERT INTO calculo_nfs (
+            entrada_id, qtd_cobre, qtd_zinco, qtd_sucata,
+            valor_total_nf, mao_de_obra, materia_prima, custo_total
+        ) VALUES %s
+        ON CONFLICT (entrada_id) DO UPDATE SET
+            qtd_cobre = COALESCE(EXCLUDED.qtd_cobre, calculo_nfs.qtd_cobre),
+            qtd_zinco = COALESCE(EXCLUDED.qtd_zinco, calculo_nfs.qtd_zinco),
+            qtd_sucata = COALESCE(EXCLUDED.qtd_sucata, calculo_nfs.qtd_sucata),
+            valor_total_nf = COALESCE(EXCLUDED.valor_total_nf, calculo_nfs.valor_total_nf),
+            mao_de_obra = COALESCE(EXCLUDED.mao_de_obra, calculo_nfs.mao_de_obra),
+            materia_prima = COALESCE(EXCLUDED.materia_prima, calculo_nfs.materia_prima),
+            custo_total = COALESCE(EXCLUDED.custo_total, calculo_nfs.custo_total)
+    """, valores,
+        template="(%s::int, %s::numeric, %s::numeric, %s::numeric, %s::numeric, %s::numeric, %s::numeric, %s::numeric)",
+        page_size=tamanho_pagina)
+    return len(valores)
+
+def marcar_pendentes(cur, entrada_ids):
+    """
+    Coloca entradas na fila de recálculo (calculo_nfs_pendentes), na transação de quem chamou.
+    Entrada que estava parada por falhas volta a ser tentada (tentativas zeradas).
+    """
+    ids = [int(i) for i in entrada_ids if i is not None]
+    if not ids:
+        return
+    cur.execute("""
+        INSERT INTO calculo_nfs_pendentes (entrada_id)
+        SELECT DISTINCT unnest(%s::int[])
+        ON CONFLICT (entrada_id) DO UPDATE
+            SET tentativas = 0, erro = NULL, marcado_em = now()
+            WHERE calculo_nfs_pendentes.tentativas > 0
+    """, (ids,))
+
+# Depois de tantas falhas seguidas a entrada fica parada na fila (com o erro) até ser marcada de novo
+MAX_TENTATIVAS_RECALCULO = 3
+
+def _recalcular_ids(conn, cur, ids):
+    """Recalcula e grava as entradas `ids` (já retiradas da fila) na transação de conn."""
+    sincronizar_estoque_por_entrada(cur, ids)
+
+    mapas = carregar_mapas_referencia(conn)
 
+    cur.execute(_SQL_REGISTROS + " WHERE en.id = ANY(%s)", (ids,))
+    columns = [desc[0] for desc in cur.description]
+    registros = [_linha_para_registro(columns, row) for row in cur.fetchall()]
+
+    calcular_registros_lote(cur, registros, mapas)
+    persistir_registros(cur, registros)
+    return len(registros)
+
+def _recalcular_uma_a_uma(ids):
+    """
+    Refaz um lote que falhou entrada por entrada, cada uma na sua transação: a entrada que
+    falha de novo ganha uma tentativa e a mensagem do erro e continua na fila; as outras são
+    gravadas. Retorna (recalculadas, falhas_registradas).
+    """
+    recalculadas = falhas = 0
+    for entrada_id in ids:
+        conn = conectar()
+        if conn is None:
+            break
+        cur = conn.cursor()
         try:
-            cur.execute("SELECT id, nome, fornecedor_id, grupo, valor FROM materiais")
-            for mid, nome, fornecedor_id, grupo, valor in cur.fetchall():
-                key = normalize_name(nome)
-                try:
-                    valor_dec = Decimal(str(valor)) if valor is not None else None
-                except Exception:
-                    valor_dec = None
-                grp = (grupo or '').strip()
-                if fornecedor_id is not None:
-                    materials_by_fornecedor[(key, int(fornecedor_id))] = (grp.lower(), valor_dec)
-                if key not in materials_fallback:
-                    materials_fallback[key] = (grp.lower(), valor_dec)
+            cur.execute("""
+                DELETE FROM calculo_nfs_pendentes
+                 WHERE entrada_id = (
+                    SELECT entrada_id FROM calculo_nfs_pendentes
+                     WHERE entrada_id = %s
+                     FOR UPDATE SKIP LOCKED
+                 )
+                RETURNING entrada_id
+            """, (entrada_id,))
+            if cur.fetchone() is None:  # outro processo já pegou (ou já saiu da fila)
+                conn.commit()
+                continue
+            recalculadas += _recalcular_ids(conn, cur, [entrada_id])
+            conn.commit()
         except Exception as e:
-            print("Aviso: falha ao carregar materiais:", e)
-            materials_by_fornecedor = {}
-            materials_fallback = {}
-
-        # ------------------------------
-        # calcula qtd_cobre, qtd_zinco, qtd_sucata e as colunas de custo usando funções auxiliares
-        # ------------------------------
-        for reg in registros:
+            conn.rollback()
+            print(f"Erro ao recalcular a entrada {entrada_id}:", e)
             try:
-                produto_nome = reg.get('produto') or ''
-                fornecedor_nome = reg.get('fornecedor') or ''
-                materiais_list = [reg.get('material_1'), reg.get('material_2'), reg.get('material_3'),
-                                  reg.get('material_4'), reg.get('material_5')]
-                peso_liq = reg.get('peso_liquido') or 0
-                peso_int = reg.get('peso_integral') or 0
-
-                # cobre
-                existing_cobre = reg.get('qtd_cobre')
-                if existing_cobre is None or Decimal(str(existing_cobre or 0)) == 0:
-                    try:
-                        cobre_calc = calcular_qtd_cobre(cur, produto_nome, fornecedor_nome, materiais_list, peso_liq, peso_int,
-                                                        prod_map=prod_map, forn_map=forn_map,
-                                                        materials_by_fornecedor=materials_by_fornecedor,
-                                                        materials_fallback=materials_fallback)
-                        if cobre_calc is not None:
-                            q_cobre = Decimal(str(cobre_calc)).quantize(Decimal('0.001'), rounding=ROUND_HALF_UP)
-                            reg['qtd_cobre'] = q_cobre
-                        else:
-                            reg['qtd_cobre'] = None
-                    except Exception as e:
-                        print("Aviso: erro ao calcular qtd_cobre (função) para entrada_id", reg.get('entrada_id'), e)
-
-                # zinco
-                existing_zinco = reg.get('qtd_zinco')
-                if existing_zinco is None or Decimal(str(existing_zinco or 0)) == 0:
-                    try:
-                        zinco_calc = calcular_qtd_zinco(cur, produto_nome, fornecedor_nome, materiais_list, peso_liq, peso_int,
-                                                        prod_map=prod_map, forn_map=forn_map,
-                                                        materials_by_fornecedor=materials_by_fornecedor,
-                                                        materials_fallback=materials_fallback)
-                        if zinco_calc is not None:
-                            q_zinco = Decimal(str(zinco_calc)).quantize(Decimal('0.001'), rounding=ROUND_HALF_UP)
-                            reg['qtd_zinco'] = q_zinco
-                        else:
-                            reg['qtd_zinco'] = None
-                    except Exception as e:
-                        print("Aviso: erro ao calcular qtd_zinco (função) para entrada_id", reg.get('entrada_id'), e)
-
-                # sucata (agora passando forn_map para respeitar materiais por fornecedor)
-                existing_sucata = reg.get('qtd_sucata')
-                if existing_sucata is None or Decimal(str(existing_sucata or 0)) == 0:
-                    try:
-                        sucata_calc = calcular_qtd_sucata(cur, fornecedor_nome, materiais_list, peso_liq, peso_int,
-                                                          materials_by_fornecedor=materials_by_fornecedor,
-                                                          materials_fallback=materials_fallback,
-                                                          forn_map=forn_map)
-                        if sucata_calc is not None:
-                            q_sucata = Decimal(str(sucata_calc)).quantize(Decimal('0.001'), rounding=ROUND_HALF_UP)
-                            reg['qtd_sucata'] = q_sucata
-                        else:
-                            reg['qtd_sucata'] = None
-                    except Exception as e:
-                        print("Aviso: erro ao calcular qtd_sucata para entrada_id", reg.get('entrada_id'), e)
-
-                # valor_total_nf (apenas parte NF: peso_integral * valor_integral_com_ipi)
-                try:
-                    calc_val = calcular_valor_total_nf(reg)
-                    existing_valor = reg.get('valor_total_nf')
-                    if calc_val is not None:
-                        # mantem valor salvo > 0; caso contrário preenche com o calculado
-                        if existing_valor is None or Decimal(str(existing_valor or 0)) == 0:
-                            reg['valor_total_nf'] = calc_val
-                except Exception as e:
-                    print("Aviso: erro ao atribuir valor_total_nf para entrada_id", reg.get('entrada_id'), e)
-
-                # ----------------------------
-                # matéria-prima e mão-de-obra:
-                # calculamos o TOTAL (como já vinha sendo feito)
-                # e também o VALOR UNITÁRIO:
-                # - MATÉRIA-PRIMA: unitário por PESO_LÍQUIDO (ou desktop-flow quando valor_integral existe)
-                # - MÃO-DE-OBRA: unitário por DIFERENÇA_DE_PESO (mantido)
-                # ----------------------------
-                try:
-                    calc_mat_total = calcular_materia_prima_reg(reg)  # total (R$) -> soma(qtd * valor_unit)
-                except Exception as e:
-                    calc_mat_total = None
-                    print("Aviso: erro ao calcular materia_prima (total) para entrada_id", reg.get('entrada_id'), e)
-
-                try:
-                    calc_mao_total = calcular_mao_de_obra_reg(reg)  # total (R$)
-                except Exception as e:
-                    calc_mao_total = None
-                    print("Aviso: erro ao calcular mao_de_obra (total) para entrada_id", reg.get('entrada_id'), e)
-
-                # pega pesos com segurança
-                try:
-                    peso_liq_dec = Decimal(reg.get('peso_liquido') or 0)
-                except Exception:
-                    peso_liq_dec = Decimal('0')
-                try:
-                    peso_int_dec = Decimal(reg.get('peso_integral') or 0)
-                except Exception:
-                    peso_int_dec = Decimal('0')
-
-                # diferença de peso (usar como denominador para obtenção do unitário da mão-de-obra)
-                try:
-                    diferenca_peso = peso_liq_dec - peso_int_dec
-                    if diferenca_peso <= 0:
-                        diferenca_peso = None
-                except Exception:
-                    diferenca_peso = None
-
-                # Primeiro atribui mão-de-obra (total e unitário) — necessário antes de calcular custo_total quando valor_integral existe
-                try:
-                    if calc_mao_total is not None:
-                        reg['mao_de_obra_total'] = Decimal(calc_mao_total).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                        if diferenca_peso:
-                            unit_mao = (Decimal(calc_mao_total) / diferenca_peso).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                            reg['mao_de_obra'] = unit_mao
-                        else:
-                            reg['mao_de_obra'] = Decimal(calc_mao_total).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                    else:
-                        reg['mao_de_obra_total'] = None
-                        reg['mao_de_obra'] = None
-                except Exception as e:
-                    print("Aviso: erro ao atribuir mao_de_obra para entrada_id", reg.get('entrada_id'), e)
-                    reg['mao_de_obra_total'] = None
-                    reg['mao_de_obra'] = None
-
-                # Agora: calcular custo_total (unitário) usando a função centralizada.
-                # Isso é importante porque, no desktop, quando valor_integral existe, a matéria-prima unitária
-                # é obtida como (custo_total_unitario - mao_de_obra_unitario).
-                try:
-                    calc_ct = calcular_custo_total_reg(reg)
-                    if calc_ct is not None:
-                        reg['custo_total'] = calc_ct
-                    else:
-                        reg['custo_total'] = Decimal('0.00').quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                except Exception as e:
-                    print("Aviso: erro ao atribuir custo_total para entrada_id", reg.get('entrada_id'), e)
-                    reg['custo_total'] = Decimal('0.00').quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-
-                # Agora decide materia_prima seguindo 1:1 com o desktop:
-                # - Se valor_integral existe (não nulo e != 0) => materia_prima_unit = custo_total_unit - mao_de_obra_unit
-                # - Senão => materia_prima_unit = calc_mat_total / peso_liq_dec  (se possível)
-                try:
-                    if reg.get('valor_integral') not in (None, '') and Decimal(str(reg.get('valor_integral') or 0)) != 0:
-                        # segue fluxo desktop: unitário = custo_total (unit) - mao_de_obra (unit)
-                        try:
-                            custo_unit = Decimal(reg.get('custo_total') or 0)
-                            mao_unit = Decimal(reg.get('mao_de_obra') or 0)
-                            materia_unit = custo_unit - mao_unit
-                            # guarda total (se calculado) e unitário
-                            reg['materia_prima_total'] = (Decimal(calc_mat_total).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                                                         if calc_mat_total is not None else None)
-                            reg['materia_prima'] = materia_unit.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                        except Exception:
-                            reg['materia_prima_total'] = None
-                            reg['materia_prima'] = None
-                    else:
-                        # sem valor_integral: usar total calculado dividido por peso_liquido (compatível com desktop)
-                        if calc_mat_total is not None:
-                            total_mat = Decimal(calc_mat_total)
-                            reg['materia_prima_total'] = total_mat.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                            if peso_liq_dec > 0:
-                                unit_mat = (total_mat / peso_liq_dec).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                                reg['materia_prima'] = unit_mat
-                            else:
-                                # sem peso_liquido definido, manter total
-                                reg['materia_prima'] = total_mat.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                        else:
-                            reg['materia_prima_total'] = None
-                            reg['materia_prima'] = None
-                except Exception as e:
-                    print("Aviso: erro ao atribuir materia_prima para entrada_id", reg.get('entrada_id'), e)
-                    reg['materia_prima_total'] = None
-                    reg['materia_prima'] = None
-
-                # --- persistir cálculos no DB (upsert por entrada_id)
-                try:
-                    entrada_id_val = reg.get('entrada_id')
-                    if entrada_id_val is not None:
-                        v_qtd_cobre = reg.get('qtd_cobre')
-                        v_qtd_zinco = reg.get('qtd_zinco')
-                        v_qtd_sucata = reg.get('qtd_sucata')
-                        v_valor_total_nf = reg.get('valor_total_nf')
-                        v_mao_de_obra = reg.get('mao_de_obra')
-                        v_materia_prima = reg.get('materia_prima')
-                        v_custo_total = reg.get('custo_total')
-
-                        upsert_sql = """
-                            INSERT INTO calculo_nfs (
-                                entrada_id, qtd_cobre, qtd_zinco, qtd_sucata,
-                                valor_total_nf, mao_de_obra, materia_prima, custo_total
-                            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (entrada_id) DO UPDATE SET
-                                qtd_cobre = COALESCE(EXCLUDED.qtd_cobre, calculo_nfs.qtd_cobre),
-                                qtd_zinco = COALESCE(EXCLUDED.qtd_zinco, calculo_nfs.qtd_zinco),
-                                qtd_sucata = COALESCE(EXCLUDED.qtd_sucata, calculo_nfs.qtd_sucata),
-                                valor_total_nf = COALESCE(EXCLUDED.valor_total_nf, calculo_nfs.valor_total_nf),
-                                mao_de_obra = COALESCE(EXCLUDED.mao_de_obra, calculo_nfs.mao_de_obra),
-                                materia_prima = COALESCE(EXCLUDED.materia_prima, calculo_nfs.materia_prima),
-                                custo_total = COALESCE(EXCLUDED.custo_total, calculo_nfs.custo_total)
-                        """
-                        cur.execute(upsert_sql, (
-                            entrada_id_val,
-                            v_qtd_cobre, v_qtd_zinco, v_qtd_sucata,
-                            v_valor_total_nf, v_mao_de_obra, v_materia_prima, v_custo_total
-                        ))
-                except Exception as e:
-                    # loga, mas não quebra a listagem
-                    print("Aviso: falha ao salvar calculos para entrada_id", reg.get('entrada_id'), e)
-
-            except Exception as e:
-                print("Aviso: erro no loop de pré-cálculo para entrada_id", reg.get('entrada_id'), e)
-
-        # commit dos upserts feitos acima
+                cur.execute("""
+                    UPDATE calculo_nfs_pendentes
+                       SET tentativas = tentativas + 1, erro = %s
+                     WHERE entrada_id = %s
+                """, (str(e)[:500], entrada_id))
+                conn.commit()
+                falhas += 1
+            except Exception as e2:
+                conn.rollback()
+                print(f"Erro ao registrar a falha da entrada {entrada_id}:", e2)
+        finally:
+            cur.close()
+            conn.close()
+    return recalculadas, falhas
+
+def recalcular_pendentes(tamanho_lote=500):
+    """
+    Motor de recálculo incremental: processa apenas as entradas marcadas em calculo_nfs_pendentes
+    (marcadas por triggers em entrada_nf/materiais/produtos/fornecedores ou por marcar_pendentes()).
+    Cada lote é retirado da fila e gravado na mesma transação. Se o lote falhar ele é refeito
+    entrada por entrada: uma entrada com problema fica na fila com a tentativa contada (e sai
+    da vez depois de MAX_TENTATIVAS_RECALCULO) sem impedir o resto da fila de andar.
+    Retorna quantas entradas foram recalculadas.
+    """
+    total = 0
+    while True:
+        conn = conectar()
+        if conn is None:
+            break
+        cur = conn.cursor()
+        ids = []
         try:
+            cur.execute("""
+                DELETE FROM calculo_nfs_pendentes
+                 WHERE entrada_id IN (
+                    SELECT entrada_id FROM calculo_nfs_pendentes
+                     WHERE tentativas < %s
+                     ORDER BY tentativas, entrada_id
+                     LIMIT %s
+                     FOR UPDATE SKIP LOCKED
+                 )
+                RETURNING entrada_id
+            """, (MAX_TENTATIVAS_RECALCULO, tamanho_lote))
+            ids = [r[0] for r in cur.fetchall()]
+            if not ids:
+                conn.commit()
+                break
+
+            total += _recalcular_ids(conn, cur, ids)
             conn.commit()
+            continue
         except Exception as e:
-            print("Aviso: falha no commit dos cálculos:", e)
-            try:
-                conn.rollback()
-            except Exception:
-                pass
+            conn.rollback()  # o lote volta para a fila
+            print("Erro em recalcular_pendentes:", e)
+        finally:
+            cur.close()
+            conn.close()
+
+        if not ids:
+            break
+        recalculadas, falhas = _recalcular_uma_a_uma(ids)
+        total += recalculadas
+        if not recalculadas and not falhas:
+            # nem gravou nem conseguiu registrar a falha (banco fora?): tenta na próxima rodada
+            break
+    return total
+
+# Worker do recálculo: as rotas que mudam cadastros/entradas só acordam a thread
+# (agendar_recalculo) em vez de esvaziar a fila dentro da requisição. As pendências já
+# estão gravadas pelos triggers/marcar_pendentes na transação da alteração; a varredura
+# periódica cobre alterações feitas direto no banco ou avisos perdidos.
+INTERVALO_RECALCULO = float(os.getenv("RECALCULO_INTERVALO", "60"))  # s
+
+_recalculo_acordar = threading.Event()
+_recalculo_pid = None
+_recalculo_lock = threading.Lock()
+
+def iniciar_worker_recalculo():
+    """Sobe a thread de recálculo deste processo (idempotente; refeita após fork)."""
+    global _recalculo_pid
+    if _recalculo_pid == os.getpid():
+        return
+    with _recalculo_lock:
+        if _recalculo_pid == os.getpid():
+            return
+        _recalculo_pid = os.getpid()
+        threading.Thread(target=_laco_recalculo, name="recalculo-calculo-nfs", daemon=True).start()
+
+def _laco_recalculo():
+    while True:
+        try:
+            recalcular_pendentes()
+        except Exception as e:
+            print("Erro no worker de recálculo:", e)
+        _recalculo_acordar.wait(INTERVALO_RECALCULO)
+        _recalculo_acordar.clear()
 
+def agendar_recalculo():
+    """Pede ao worker que processe a fila de recálculo (a requisição não espera)."""
+    iniciar_worker_recalculo()
+    _recalculo_acordar.set()
+
+@calculo_bp.route('/', methods=['GET'])
+@login_required
+def listar_calculo_nfs():
+    """
+    Página do cálculo de NFs. As linhas do grid vêm paginadas de /calculo_nfs/dados (JS);
+    o recálculo é feito por recalcular_pendentes() quando algo que afeta o cálculo muda.
+    """
+    conn = conectar()
+    cur = conn.cursor()
+    try:
         # lista de produtos para dropdown
         cur.execute("""
             SELECT DISTINCT ON (produto) id, produto
@@ -1140,7 +1314,210 @@ def listar_calculo_nfs():
         cur.close()
         conn.close()
 
-    return render_template('calculo_nfs.html', estoques=registros, produtos=produtos_dropdown)
+    return render_template('calculo_nfs.html', produtos=produtos_dropdown)
+
+@calculo_bp.route('/status_cache', methods=['GET'])
+@login_required
+def status_cache():
+    return jsonify({
+        'normalize_name': estatisticas_normalize_name(),
+        'referencia': estatisticas_cache_referencia(),
+    })
+
+@calculo_bp.route('/recalcular_pendentes', methods=['POST'])
+@login_required
+def recalcular_pendentes_route():
+    """Esvazia a fila agora; entradas paradas por falhas repetidas são tentadas de novo."""
+    conn = conectar()
+    cur = conn.cursor()
+    try:
+        cur.execute("UPDATE calculo_nfs_pendentes SET tentativas = 0 WHERE tentativas > 0")
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    processados = recalcular_pendentes()
+    return jsonify({'processados': processados}), 200
+
+# ------------------------------
+# Grid paginado (JSON): keyset em (coluna de ordenação, id), filtros no SQL
+# ------------------------------
+_GRID_LIMITE_PADRAO = 100
+_GRID_LIMITE_MAX = 500
+
+# coluna pedida pelo front -> expressão SQL (sem NULL, para o keyset funcionar)
+_GRID_ORDENACAO = {
+    'data': "COALESCE(en.data, '-infinity')",
+    'nf': "COALESCE(en.nf::text, '')",
+    'produto': "COALESCE(en.produto, '')",
+    'fornecedor': "COALESCE(en.fornecedor, '')",
+    'peso_liquido': "COALESCE(en.peso_liquido, 0)",
+    'quantidade_estoque': "COALESCE(cn.quantidade_estoque, 0)",
+    'qtd_cobre': "COALESCE(cn.qtd_cobre, 0)",
+    'qtd_zinco': "COALESCE(cn.qtd_zinco, 0)",
+    'qtd_sucata': "COALESCE(cn.qtd_sucata, 0)",
+    'valor_total_nf': "COALESCE(cn.valor_total_nf, 0)",
+    'mao_de_obra': "COALESCE(cn.mao_de_obra, 0)",
+    'materia_prima': "COALESCE(cn.materia_prima, 0)",
+    'custo_total_manual': "COALESCE(cn.custo_total_manual, 0)",
+    'custo_total': "COALESCE(cn.custo_total, 0)",
+}
+
+_GRID_CAMPOS_NUMERICOS = (
+    'peso_liquido', 'quantidade_estoque', 'qtd_cobre', 'qtd_zinco', 'qtd_sucata',
+    'valor_total_nf', 'mao_de_obra', 'materia_prima', 'custo_total_manual', 'custo_total',
+)
+
+def _data_filtro(valor):
+    """Aceita 'YYYY-MM-DD' (input date) ou 'DD/MM/YYYY'; retorna date ou None."""
+    valor = (valor or '').strip()
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(valor, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def filtros_grid(args):
+    """
+    Monta o WHERE do grid a partir dos parâmetros da requisição.
+    Filtros: q (NF/produto/fornecedor), produto, fornecedor, data_inicio, data_fim.
+    Retorna (lista de condições SQL, lista de parâmetros).
+    """
+    condicoes = []
+    params = []
+
+    q = (args.get('q') or '').strip()
+    if q:
+        like = f"%{q}%"
+        condicoes.append("(en.nf::text ILIKE %s OR en.produto ILIKE %s OR en.fornecedor ILIKE %s)")
+        params.extend([like, like, like])
+
+    produto = (args.get('produto') or '').strip()
+    if produto:
+        condicoes.append("en.produto ILIKE %s")
+        params.append(f"%{produto}%")
+
+    fornecedor = (args.get('fornecedor') or '').strip()
+    if fornecedor:
+        condicoes.append("en.fornecedor ILIKE %s")
+        params.append(f"%{fornecedor}%")
+
+    # intervalo de datas como range (usa o índice em data)
+    data_inicio = _data_filtro(args.get('data_inicio'))
+    if data_inicio:
+        condicoes.append("en.data >= %s")
+        params.append(data_inicio)
+
+    data_fim = _data_filtro(args.get('data_fim'))
+    if data_fim:
+        condicoes.append("en.data < %s::date + 1")
+        params.append(data_fim)
+
+    return condicoes, params
+
+def _codificar_cursor(chave, ultimo_id):
+    bruto = json.dumps([chave, ultimo_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(bruto).decode('ascii')
+
+def _decodificar_cursor(cursor_txt):
+    try:
+        chave, ultimo_id = json.loads(base64.urlsafe_b64decode(cursor_txt.encode('ascii')))
+        return str(chave), int(ultimo_id)
+    except Exception:
+        return None
+
+def _registro_grid_json(reg):
+    _formatar_data_registro(reg)
+    for campo in _GRID_CAMPOS_NUMERICOS:
+        v = reg.get(campo)
+        reg[campo] = str(v) if v is not None else None
+    return reg
+
+@calculo_bp.route('/dados', methods=['GET'])
+@login_required
+def dados_calculo_nfs():
+    """
+    Página do grid de custo médio em JSON.
+    Parâmetros: limite, ordenar (coluna), direcao (asc|desc), cursor (devolvido pela página anterior)
+    e os filtros de filtros_grid(). Paginação por keyset: o custo de cada página não depende
+    de quantas entradas já existem no histórico.
+    """
+    ordenar = request.args.get('ordenar') or 'data'
+    if ordenar not in _GRID_ORDENACAO:
+        return jsonify({'error': 'Coluna de ordenação inválida'}), 400
+    direcao = 'ASC' if (request.args.get('direcao') or '').lower() == 'asc' else 'DESC'
+
+    try:
+        limite = int(request.args.get('limite') or _GRID_LIMITE_PADRAO)
+    except ValueError:
+        limite = _GRID_LIMITE_PADRAO
+    limite = max(1, min(limite, _GRID_LIMITE_MAX))
+
+    expr = _GRID_ORDENACAO[ordenar]
+    condicoes, params = filtros_grid(request.args)
+
+    cursor_txt = request.args.get('cursor')
+    if cursor_txt:
+        cursor_val = _decodificar_cursor(cursor_txt)
+        if cursor_val is None:
+            return jsonify({'error': 'Cursor inválido'}), 400
+        comparacao = '>' if direcao == 'ASC' else '<'
+        condicoes.append(f"({expr}, en.id) {comparacao} (%s, %s)")
+        params.extend(cursor_val)
+
+    where = ("WHERE " + " AND ".join(condicoes)) if condicoes else ""
+    sql = f"""
+        SELECT
+            en.id AS entrada_id,
+            en.data AS entrada_data,
+            en.nf AS entrada_nf,
+            en.produto AS entrada_produto,
+            en.fornecedor AS entrada_fornecedor,
+            en.peso_liquido,
+            cn.id AS calculo_id,
+            COALESCE(cn.quantidade_estoque, 0) AS quantidade_estoque,
+            cn.qtd_cobre, cn.qtd_zinco, cn.qtd_sucata,
+            cn.valor_total_nf, cn.mao_de_obra, cn.materia_prima,
+            cn.custo_total_manual, cn.custo_total,
+            ({expr})::text AS chave_ordem
+        FROM entrada_nf en
+        LEFT JOIN calculo_nfs cn ON cn.entrada_id = en.id
+        {where}
+        ORDER BY {expr} {direcao}, en.id {direcao}
+        LIMIT %s
+    """
+    params.append(limite + 1)
+
+    conn = conectar()
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, tuple(params))
+        columns = [desc[0] for desc in cur.description]
+        linhas = cur.fetchall()
+    except Exception as e:
+        conn.rollback()
+        print("Erro em dados_calculo_nfs:", e)
+        return jsonify({'error': str(e)}), 500
+    finally:
+        cur.close()
+        conn.close()
+
+    tem_mais = len(linhas) > limite
+    linhas = linhas[:limite]
+
+    registros = []
+    for row in linhas:
+        reg = _linha_para_registro(columns, row)
+        registros.append(_registro_grid_json({k: reg[k] for k in (
+            'entrada_id', 'id', 'data', 'nf', 'produto', 'fornecedor') + _GRID_CAMPOS_NUMERICOS}))
+
+    proximo_cursor = None
+    if tem_mais and linhas:
+        ultima = dict(zip(columns, linhas[-1]))
+        proximo_cursor = _codificar_cursor(ultima['chave_ordem'], ultima['entrada_id'])
+
+    return jsonify({'registros': registros, 'proximo_cursor': proximo_cursor})
 
 @calculo_bp.route('/create', methods=['POST'])
 @login_required
@@ -1218,13 +1595,16 @@ def editar_registro_calculo(registro_id):
         set_parts.append(f"{k} = %s")
         values.append(v)
     values.append(registro_id)
-    sql = f"UPDATE calculo_nfs SET {', '.join(set_parts)} WHERE id = %s"
+    sql = f"UPDATE calculo_nfs SET {', '.join(set_parts)} WHERE id = %s RETURNING entrada_id"
 
     conn = conectar()
     cur = conn.cursor()
     try:
         cur.execute(sql, tuple(values))
+        # custo/matéria-prima dependem das quantidades editadas: recalcula só esta entrada
+        marcar_pendentes(cur, [r[0] for r in cur.fetchall()])
         conn.commit()
+        agendar_recalculo()
         flash('Registro atualizado.', 'sucesso')
         return ('OK', 200)
     except Exception as e:
@@ -1248,9 +1628,11 @@ def atualizar_custo_manual():
     cur = conn.cursor()
     try:
         ids_int = tuple(map(int, ids))
-        sql = f"UPDATE calculo_nfs SET custo_total_manual = %s WHERE id IN ({','.join(['%s']*len(ids_int))})"
+        sql = f"UPDATE calculo_nfs SET custo_total_manual = %s WHERE id IN ({','.join(['%s']*len(ids_int))}) RETURNING entrada_id"
         cur.execute(sql, (valor, *ids_int))
+        marcar_pendentes(cur, [r[0] for r in cur.fetchall()])
         conn.commit()
+        agendar_recalculo()
         flash('Custo manual atualizado.', 'sucesso')
         return ('OK', 200)
     except Exception as e:
@@ -1275,66 +1657,63 @@ def distribuir_quantidade():
     if valor is None or valor <= 0:
         return ('Valor inválido', 400)
 
-    conn = conectar()
-    cur = conn.cursor()
     try:
-        filtro_por_entrada_id = False
+        entrada_id_val = int(produto)
+        filtro_por_entrada_id = True
+    except Exception:
         entrada_id_val = None
-        try:
-            entrada_id_val = int(produto)
-            filtro_por_entrada_id = True
-        except Exception:
-            filtro_por_entrada_id = False
+        filtro_por_entrada_id = False
 
-        if operacao == 'Subtrair':
-            if filtro_por_entrada_id:
-                cur.execute("""
-                    SELECT cn.id, cn.quantidade_estoque, en.peso_liquido, en.id AS entrada_id, en.produto
-                    FROM calculo_nfs cn
-                    JOIN entrada_nf en ON cn.entrada_id = en.id
-                    WHERE en.id = %s
-                    ORDER BY en.data ASC NULLS LAST, en.id ASC
-                """, (entrada_id_val,))
-            else:
-                cur.execute("""
-                    SELECT cn.id, cn.quantidade_estoque, en.peso_liquido, en.id AS entrada_id, en.produto
-                    FROM calculo_nfs cn
-                    JOIN entrada_nf en ON cn.entrada_id = en.id
-                    WHERE LOWER(en.produto) = LOWER(%s)
-                    ORDER BY en.data ASC NULLS LAST, en.id ASC
-                """, (produto,))
-        else:
-            if filtro_por_entrada_id:
-                cur.execute("""
-                    SELECT cn.id, cn.quantidade_estoque, en.peso_liquido, en.id AS entrada_id, en.produto
-                    FROM calculo_nfs cn
-                    JOIN entrada_nf en ON cn.entrada_id = en.id
-                    WHERE en.id = %s
-                    ORDER BY en.data DESC NULLS LAST, en.id DESC
-                """, (entrada_id_val,))
-            else:
-                cur.execute("""
-                    SELECT cn.id, cn.quantidade_estoque, en.peso_liquido, en.id AS entrada_id, en.produto
-                    FROM calculo_nfs cn
-                    JOIN entrada_nf en ON cn.entrada_id = en.id
-                    WHERE LOWER(en.produto) = LOWER(%s)
-                    ORDER BY en.data DESC NULLS LAST, en.id DESC
-                """, (produto,))
+    if filtro_por_entrada_id:
+        where = "en.id = %s"
+        params = (entrada_id_val,)
+    else:
+        where = "LOWER(en.produto) = LOWER(%s)"
+        params = (produto,)
 
-        registros = cur.fetchall()
-        if not registros:
+    # Subtrair consome das entradas mais antigas (FIFO); Adicionar devolve às mais recentes (LIFO)
+    if operacao == 'Subtrair':
+        ordem = "en.data ASC NULLS LAST, en.id ASC"
+    else:
+        ordem = "en.data DESC NULLS LAST, en.id DESC"
+
+    conn = conectar()
+    cur = conn.cursor()
+    try:
+        # 1) trava as linhas do produto, sempre na ordem de cn.id (as duas operações
+        #    travam na mesma ordem, então não há deadlock entre Adicionar e Subtrair)
+        cur.execute(f"""
+            SELECT cn.id
+            FROM calculo_nfs cn
+            JOIN entrada_nf en ON cn.entrada_id = en.id
+            WHERE {where}
+            ORDER BY cn.id
+            FOR UPDATE OF cn
+        """, params)
+        if not cur.fetchall():
+            conn.rollback()
             return ('Nenhum registro encontrado para esse produto/entrada', 404)
 
+        # 2) relê já com as linhas travadas: os saldos vistos aqui são os definitivos
+        cur.execute(f"""
+            SELECT cn.id, cn.quantidade_estoque, en.peso_liquido, en.id AS entrada_id, en.produto
+            FROM calculo_nfs cn
+            JOIN entrada_nf en ON cn.entrada_id = en.id
+            WHERE {where}
+            ORDER BY {ordem}
+        """, params)
+        registros = cur.fetchall()
+
         valor_restante = Decimal(str(valor))
         total_alterado = Decimal('0')
         detalhes = []
+        novos_saldos = []
 
         for r in registros:
             cn_id = r[0]
             qtd_atual = Decimal(r[1] or 0)
             peso_liq = Decimal(r[2] or 0)
             entrada_id = r[3]
-            nome_from_entry = r[4]
 
             if operacao == 'Subtrair':
                 if valor_restante <= 0:
@@ -1343,7 +1722,7 @@ def distribuir_quantidade():
                 if dec <= 0:
                     continue
                 nova_qtd = qtd_atual - dec
-                cur.execute("UPDATE calculo_nfs SET quantidade_estoque = %s WHERE id = %s", (nova_qtd, cn_id))
+                novos_saldos.append((cn_id, nova_qtd))
                 total_alterado += dec
                 valor_restante -= dec
                 detalhes.append({'cn_id': cn_id, 'entrada_id': entrada_id, 'alterado': str(dec), 'qtd_anterior': str(qtd_atual), 'qtd_nova': str(nova_qtd)})
@@ -1356,15 +1735,25 @@ def distribuir_quantidade():
                 if dec <= 0:
                     continue
                 nova_qtd = qtd_atual + dec
-                cur.execute("UPDATE calculo_nfs SET quantidade_estoque = %s WHERE id = %s", (nova_qtd, cn_id))
+                novos_saldos.append((cn_id, nova_qtd))
                 total_alterado += dec
                 valor_restante -= dec
                 detalhes.append({'cn_id': cn_id, 'entrada_id': entrada_id, 'alterado': str(dec), 'qtd_anterior': str(qtd_atual), 'qtd_nova': str(nova_qtd), 'peso_liq': str(peso_liq)})
 
+        # 3) um UPDATE para todas as linhas alteradas (o trigger lança cada variação no razão de estoque)
+        if novos_saldos:
+            definir_contexto_estoque(cur, 'distribuicao', usuario)
+            execute_values(cur, """
+                UPDATE calculo_nfs AS cn
+                SET quantidade_estoque = v.quantidade_estoque
+                FROM (VALUES %s) AS v(id, quantidade_estoque)
+                WHERE cn.id = v.id
+            """, novos_saldos, template="(%s, %s::numeric)", page_size=1000)
+
         if total_alterado > 0:
             produto_para_historico = registros[0][4] if registros and registros[0] and registros[0][4] else (produto if not filtro_por_entrada_id else f'entrada_id:{entrada_id_val}')
             tipo = 'adicionar' if operacao == 'Adicionar' else 'subtrair'
-            registrar_historico(usuario, None, produto_para_historico, total_alterado, tipo)
+            registrar_historico(cur, usuario, None, produto_para_historico, total_alterado, tipo)
 
         conn.commit()
     except Exception as e:
@@ -1383,42 +1772,65 @@ def distribuir_quantidade():
 @calculo_bp.route('/calcular', methods=['POST'])
 @login_required
 def calcular_custos():
-    ids = request.form.getlist('nf_ids')
-    if not ids:
-        return jsonify({'error': 'Nenhum id enviado'}), 400
-    try:
-        ids_int = tuple(map(int, ids))
-    except ValueError:
-        return jsonify({'error': 'IDs inválidos'}), 400
+    """
+    Recalcula custo_total num único comando:
+      - custo_total_manual > 0 prevalece;
+      - senão valor_total_nf + mao_de_obra + materia_prima (nulos contam como 0).
+    Modos:
+      - nf_ids (padrão): ids de calculo_nfs enviados pelo formulário;
+      - modo=filtro: todas as linhas que casam com os filtros do grid
+        (q, produto, fornecedor, data_inicio, data_fim — ver filtros_grid), ex.: fechamento do mês.
+    Só regrava as linhas cujo custo mudou; a resposta traz todas as processadas.
+    """
+    modo = (request.form.get('modo') or 'ids').strip().lower()
+
+    if modo == 'filtro':
+        condicoes, params = filtros_grid(request.form)
+        origem = "FROM calculo_nfs cn JOIN entrada_nf en ON en.id = cn.entrada_id"
+        where = ("WHERE " + " AND ".join(condicoes)) if condicoes else ""
+    else:
+        ids = request.form.getlist('nf_ids')
+        if not ids:
+            return jsonify({'error': 'Nenhum id enviado'}), 400
+        try:
+            ids_int = list(map(int, ids))
+        except ValueError:
+            return jsonify({'error': 'IDs inválidos'}), 400
+        origem = "FROM calculo_nfs cn"
+        where = "WHERE cn.id = ANY(%s)"
+        params = [ids_int]
+
+    sql = f"""
+        WITH alvo AS (
+            SELECT cn.id,
+                   CASE
+                       WHEN cn.custo_total_manual > 0 THEN cn.custo_total_manual
+                       ELSE COALESCE(cn.valor_total_nf, 0)
+                          + COALESCE(cn.mao_de_obra, 0)
+                          + COALESCE(cn.materia_prima, 0)
+                   END AS custo_total
+            {origem}
+            {where}
+        ),
+        atualizados AS (
+            UPDATE calculo_nfs c
+            SET custo_total = alvo.custo_total
+            FROM alvo
+            WHERE c.id = alvo.id
+              AND c.custo_total IS DISTINCT FROM alvo.custo_total
+            RETURNING c.id
+        )
+        SELECT alvo.id, alvo.custo_total, (atualizados.id IS NOT NULL) AS alterado
+        FROM alvo
+        LEFT JOIN atualizados ON atualizados.id = alvo.id
+        ORDER BY alvo.id
+    """
 
     conn = conectar()
     cur = conn.cursor()
-    results = []
     try:
-        sql = f"""
-            SELECT id, valor_total_nf, mao_de_obra, materia_prima
-            FROM calculo_nfs
-            WHERE id IN ({','.join(['%s']*len(ids_int))})
-        """
-        cur.execute(sql, ids_int)
+        cur.execute(sql, params)
         rows = cur.fetchall()
-        for row in rows:
-            eid, valor_total_nf, mao_de_obra, materia_prima = row
-            valor_total_nf = Decimal(valor_total_nf or 0)
-            mao_de_obra = Decimal(mao_de_obra or 0)
-            materia_prima = Decimal(materia_prima or 0)
-
-            cur.execute("SELECT custo_total_manual FROM calculo_nfs WHERE id = %s", (eid,))
-            cm = cur.fetchone()
-            custo_manual = Decimal(cm[0]) if cm and cm[0] is not None else None
-
-            if custo_manual and custo_manual > 0:
-                custo_total = custo_manual
-            else:
-                custo_total = valor_total_nf + mao_de_obra + materia_prima
-
-            cur.execute("UPDATE calculo_nfs SET custo_total = %s WHERE id = %s", (custo_total, eid))
-            results.append({'id': eid, 'custo_total': str(custo_total)})
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -1427,7 +1839,9 @@ def calcular_custos():
         cur.close()
         conn.close()
 
-    return jsonify({'processed': len(results), 'results': results}), 200
+    results = [{'id': eid, 'custo_total': str(custo_total)} for eid, custo_total, _ in rows]
+    alterados = sum(1 for _, _, alterado in rows if alterado)
+    return jsonify({'processed': len(results), 'updated': alterados, 'results': results}), 200
 
 @calculo_bp.route('/export', methods=['GET'])
 @login_required
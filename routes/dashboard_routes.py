@@ -1,6 +1,8 @@
-from flask import Blueprint, render_template, session
+from flask import Blueprint, render_template, session, jsonify, request
 from routes.auth_routes import login_required
-from conexao_db import conectar
+from conexao_db import conectar, estatisticas_pool
+from estoque import saldos_por_produto, saldo_produto, movimentos_produto
+from custo_medio import custo_medio_por_mes, custo_medio_ultimo_mes
 from collections import OrderedDict
 
 dashboard_bp = Blueprint('dashboard', __name__)
@@ -44,6 +46,20 @@ def dashboard():
         except Exception:
             materiais = []
 
+        # estoque por produto (saldos materializados do razão de estoque)
+        try:
+            estoque = saldos_por_produto(cursor)
+        except Exception:
+            conexao.rollback()
+            estoque = []
+
+        # custo médio ponderado (último mês de cada produto)
+        try:
+            custo_medio = custo_medio_ultimo_mes(cursor)
+        except Exception:
+            conexao.rollback()
+            custo_medio = []
+
         # ultimas saídas (mantém seu select)
         try:
             cursor.execute("""
@@ -187,5 +203,118 @@ def dashboard():
         produtos=produtos,
         materiais=materiais,
         ultimas_saidas=ultimas_saidas_grouped,
-        ultimas_entradas=ultimas_entradas
+        ultimas_entradas=ultimas_entradas,
+        estoque=estoque,
+        custo_medio=custo_medio
     )
+
+@dashboard_bp.route('/dashboard/status_pool')
+@login_required
+def status_pool():
+    """Tempo de espera e saturação do pool de conexões deste processo (para dimensionar DB_POOL_MAX)."""
+    return jsonify(estatisticas_pool())
+
+def _estoque_json(item):
+    return {
+        'produto': item['nome'],
+        'saldo_entradas': str(item['saldo_entradas']),
+        'total_saidas': str(item['total_saidas']),
+        'saldo': str(item['saldo']),
+        'movimentos': item['movimentos'],
+        'atualizado_em': item['atualizado_em'].isoformat() if item['atualizado_em'] else None,
+    }
+
+@dashboard_bp.route('/dashboard/estoque')
+@login_required
+def estoque_produtos():
+    """Saldo atual de todos os produtos (lido de estoque_saldo_produto)."""
+    conexao = conectar()
+    cursor = conexao.cursor()
+    try:
+        dados = [_estoque_json(item) for item in saldos_por_produto(cursor)]
+    except Exception as e:
+        conexao.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        cursor.close()
+        conexao.close()
+    return jsonify(dados)
+
+@dashboard_bp.route('/dashboard/estoque/produto')
+@login_required
+def estoque_produto():
+    """
+    Saldo de um produto: ?produto=<nome>[&em=AAAA-MM-DD ou ISO datetime][&movimentos=N].
+    Com `em`, devolve o saldo naquele instante.
+    """
+    produto = (request.args.get('produto') or '').strip()
+    if not produto:
+        return jsonify({'error': 'Informe o produto'}), 400
+    em = request.args.get('em')
+    try:
+        limite = min(int(request.args.get('movimentos', 20)), 500)
+    except ValueError:
+        limite = 20
+
+    conexao = conectar()
+    cursor = conexao.cursor()
+    try:
+        saldo = saldo_produto(cursor, produto, em)
+        movimentos = movimentos_produto(cursor, produto, limite) if limite > 0 else []
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        conexao.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        cursor.close()
+        conexao.close()
+
+    return jsonify({
+        'produto': produto,
+        'em': em or None,
+        'saldo': str(saldo),
+        'movimentos': [
+            {**m, 'momento': m['momento'].isoformat(), 'quantidade': str(m['quantidade'])}
+            for m in movimentos
+        ],
+    })
+
+def _custo_medio_json(item):
+    def txt(v):
+        return str(v) if v is not None else None
+    return {
+        'produto': item['produto'],
+        'mes': item['mes'].strftime('%Y-%m'),
+        'entradas': item['entradas'],
+        'peso_liquido': txt(item['peso_liquido']),
+        'estoque': txt(item['estoque']),
+        'custo_medio_peso': txt(item['custo_medio_peso']),
+        'custo_medio_estoque': txt(item['custo_medio_estoque']),
+    }
+
+@dashboard_bp.route('/dashboard/custo_medio')
+@login_required
+def custo_medio():
+    """
+    Custo médio ponderado por produto/mês: ?produto=<nome>&de=AAAA-MM&ate=AAAA-MM.
+    custo_medio_peso pondera por peso_liquido; custo_medio_estoque pela quantidade em estoque.
+    """
+    conexao = conectar()
+    cursor = conexao.cursor()
+    try:
+        dados = custo_medio_por_mes(
+            cursor,
+            produto=(request.args.get('produto') or '').strip() or None,
+            de=request.args.get('de'),
+            ate=request.args.get('ate'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        conexao.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        cursor.close()
+        conexao.close()
+    return jsonify([_custo_medio_json(item) for item in dados])
@@ -1,6 +1,15 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, send_file, current_app as app
 from routes.auth_routes import login_required
 from conexao_db import conectar
+from routes.calculo_nfs_route import agendar_recalculo
+from cache_referencia import obter_referencias
+from busca_entrada import condicao_busca_entrada
+from paginacao import pagina_keyset, estimativa_tabela, contagem_consulta
+from exportacao_xlsx import iterar_consulta, escrever_xlsx, resposta_xlsx, MIMETYPE_XLSX
+from relatorios import registrar_gerador
+from carga_em_massa import copiar_dataframe
+from leitor_planilha import EXTENSOES
+import importacoes
 from datetime import datetime
 from math import ceil
 from werkzeug.utils import secure_filename
@@ -179,97 +188,18 @@ MAX_DUPLICATAS_DB = 6  # limite físico da sua tabela (duplicata_1..duplicata_6)
 @entrada_nf_bp.route('/')
 @login_required
 def nova_entrada():
-    # pega página (query string) ou 1 por padrão
-    page = int(request.args.get('page', 1))
-    per_page = 10
-    offset = (page - 1) * per_page
-
-    conexao = conectar()
-    cursor = conexao.cursor()
-    try:
-        # dados para dropdown
-        cursor.execute('SELECT nome FROM fornecedores ORDER BY nome')
-        fornecedores = [row[0] for row in cursor.fetchall()]
-        cursor.execute('SELECT DISTINCT nome FROM materiais ORDER BY nome')
-        materiais = [row[0] for row in cursor.fetchall()]
-        cursor.execute('SELECT nome FROM produtos ORDER BY nome')
-        produtos = [row[0] for row in cursor.fetchall()]
-
-        # busca entradas para o modal (paginado) - agora incluindo id como primeira coluna
-        cursor.execute("""
-            SELECT
-                id,
-                data, nf, fornecedor,
-                material_1, material_2, material_3, material_4, material_5,
-                produto, custo_empresa, ipi, valor_integral,
-                valor_unitario_1, valor_unitario_2, valor_unitario_3,
-                valor_unitario_4, valor_unitario_5,
-                duplicata_1, duplicata_2, duplicata_3,
-                duplicata_4, duplicata_5, duplicata_6,
-                valor_unitario_energia, valor_mao_obra_tm_metallica,
-                peso_liquido, peso_integral
-            FROM entrada_nf
-            ORDER BY data DESC
-            LIMIT %s OFFSET %s
-        """, (per_page, offset))
-        linhas = cursor.fetchall()
-
-        entradas = [_linha_para_entrada(l) for l in linhas]
-
-        # calcula máximos observados nas entradas desta página
-        max_materiais = 0
-        max_valores = 0
-        max_duplicatas = 0
-
-        for e in entradas:
-            # materiais (lista construída por _linha_para_entrada)
-            if isinstance(e.get('materiais'), list):
-                max_materiais = max(max_materiais, len(e['materiais']))
-
-            # valores unitários (1..MAX_MATERIAIS_DB) - checa colunas e fallback em materiais[]
-            for i in range(1, MAX_MATERIAIS_DB + 1):
-                vu_col = e.get(f'valor_unitario_{i}')
-                vu_fallback = None
-                try:
-                    if isinstance(e.get('materiais'), list) and len(e['materiais']) >= i:
-                        vu_fallback = e['materiais'][i-1].get('valor_unitario')
-                except Exception:
-                    vu_fallback = None
-                if vu_col not in (None, '') or (vu_fallback not in (None, '') and vu_fallback is not None):
-                    max_valores = max(max_valores, i)
-
-            # duplicatas: tanto colunas duplicata_X quanto lista duplicatas[]
-            if isinstance(e.get('duplicatas'), list):
-                max_duplicatas = max(max_duplicatas, len(e['duplicatas']))
-            for j in range(1, MAX_DUPLICATAS_DB + 1):
-                d_col = e.get(f'duplicata_{j}')
-                if d_col not in (None, '', 0):
-                    max_duplicatas = max(max_duplicatas, j)
-
-        # limita ao máximo físico do DB
-        max_materiais = min(max_materiais or 0, MAX_MATERIAIS_DB)
-        max_valores = min(max_valores or 0, MAX_MATERIAIS_DB)
-        max_duplicatas = min(max_duplicatas or 0, MAX_DUPLICATAS_DB)
-
-        cursor.execute("SELECT COUNT(*) FROM entrada_nf")
-        total = cursor.fetchone()[0]
-    finally:
-        cursor.close()
-        conexao.close()
-
-    total_pages = (total + per_page - 1) // per_page
+    # dados para dropdown (cache de referência, invalidado por NOTIFY).
+    # O modal de entradas carrega a lista por /entrada_nf/listar (keyset), não aqui.
+    refs = obter_referencias()
+    fornecedores = [nome for _, nome in refs.fornecedores_por_nome]
+    materiais = list(refs.materiais_nomes)
+    produtos = [nome for _, nome in refs.produtos_por_nome]
 
     return render_template(
         'entrada_nf.html',
         fornecedores=fornecedores,
         materiais=materiais or [],
-        produtos=produtos or [],
-        entradas=entradas,
-        page=page,
-        total_pages=total_pages,
-        max_materiais=max_materiais,
-        max_valores=max_valores,
-        max_duplicatas=max_duplicatas
+        produtos=produtos or []
     )
 
 @entrada_nf_bp.route('/salvar', methods=['POST'])
@@ -368,6 +298,7 @@ def salvar_entrada():
     try:
         cursor.execute(sql, valores)
         conexao.commit()
+        agendar_recalculo()
         flash('Entrada de NF salva com sucesso!', 'sucesso')
     except Exception as e:
         conexao.rollback()
@@ -563,6 +494,7 @@ def editar_entrada(id):
         print("[editar_entrada] executando UPDATE:", sql, "params:", params)
         cur.execute(sql, tuple(params))
         conn.commit()
+        agendar_recalculo()
         print("[editar_entrada] UPDATE executado com sucesso para id=", id)
     except Exception as e:
         if conn:
@@ -646,36 +578,23 @@ def editar_entrada(id):
 @entrada_nf_bp.route('/api/fornecedores/list')
 @login_required
 def api_fornecedores_list():
-    conn = conectar()
-    cur = conn.cursor()
-    cur.execute("SELECT id, nome FROM fornecedores ORDER BY nome")
-    rows = cur.fetchall()
-    data = [{"id": r[0], "nome": r[1]} for r in rows]
-    cur.close()
-    conn.close()
+    refs = obter_referencias()
+    data = [{"id": fid, "nome": nome} for fid, nome in refs.fornecedores_por_nome]
     return jsonify(data)
 
 @entrada_nf_bp.route('/api/materiais/list')
 @login_required
 def api_materiais_list():
-    conn = conectar()
-    cur = conn.cursor()
-    # DISTINCT para evitar duplicatas entre fornecedores
-    cur.execute("SELECT DISTINCT nome FROM materiais ORDER BY nome")
-    data = [{"id": i, "nome": r[0]} for i, r in enumerate(cur.fetchall())]
-    cur.close()
-    conn.close()
+    refs = obter_referencias()
+    # nomes DISTINCT para evitar duplicatas entre fornecedores
+    data = [{"id": i, "nome": nome} for i, nome in enumerate(refs.materiais_nomes)]
     return jsonify(data)
 
 @entrada_nf_bp.route('/api/produtos/list')
 @login_required
 def api_produtos_list():
-    conn = conectar()
-    cur = conn.cursor()
-    cur.execute("SELECT id, nome FROM produtos ORDER BY nome")
-    data = [{"id": r[0], "nome": r[1]} for r in cur.fetchall()]
-    cur.close()
-    conn.close()
+    refs = obter_referencias()
+    data = [{"id": pid, "nome": nome} for pid, nome in refs.produtos_por_nome]
     return jsonify(data)
 
 @entrada_nf_bp.route('/ids_all', methods=['POST'])
@@ -851,92 +770,54 @@ def excluir_entradas():
         print("Exceção em excluir_entradas:", exc)
         return jsonify({"status": "error", "msg": "Erro interno."}), 500
 
+# colunas da listagem (ordem esperada por _linha_para_entrada)
+_COLUNAS_ENTRADA = """
+    id,
+    data, nf, fornecedor,
+    material_1, material_2, material_3, material_4, material_5,
+    produto, custo_empresa, ipi, valor_integral,
+    valor_unitario_1, valor_unitario_2, valor_unitario_3,
+    valor_unitario_4, valor_unitario_5,
+    duplicata_1, duplicata_2, duplicata_3,
+    duplicata_4, duplicata_5, duplicata_6,
+    valor_unitario_energia, valor_mao_obra_tm_metallica,
+    peso_liquido, peso_integral
+"""
+
+# chave do keyset: mesma expressão do índice idx_entrada_nf_data_id (migração 002)
+_CHAVE_ENTRADA = "COALESCE(data, '-infinity')"
+
 @entrada_nf_bp.route('/listar')
 @login_required
 def listar_entradas():
-    page = int(request.args.get('page', 1))
+    """
+    Lista do modal de entradas, paginada por keyset: ?cursor=<opaco> traz a página seguinte
+    (ver paginacao.py). ?page=N sem cursor ainda abre a página por número.
+    Total: sem busca, estimado (reltuples); com busca, contado (até paginacao.LIMITE_CONTAGEM).
+    """
+    page = max(int(request.args.get('page', 1) or 1), 1)
     per_page = 10
     search = (request.args.get('search') or request.args.get('q_raw') or request.args.get('q') or '').strip()
+    cursor_pagina = request.args.get('cursor') or ''
 
     conexao = conectar()
     cursor = conexao.cursor()
     try:
         if search:
-            # mantém o que o usuário digitou e também cria um pattern com % para ILIKE
-            raw = (search or '').strip()
-            like = f"%{raw}%"
-
-            # tenta interpretar como dd/mm/YYYY para comparação exata por date
-            data_iso = None
-            try:
-                data_obj = datetime.strptime(raw, '%d/%m/%Y')
-                data_iso = data_obj.strftime('%Y-%m-%d')   # '2025-08-06'
-            except Exception:
-                data_iso = None
-
-            sql = """
-                SELECT id,
-                    data, nf, fornecedor,
-                    material_1, material_2, material_3, material_4, material_5,
-                    produto, custo_empresa, ipi, valor_integral,
-                    valor_unitario_1, valor_unitario_2, valor_unitario_3,
-                    valor_unitario_4, valor_unitario_5,
-                    duplicata_1, duplicata_2, duplicata_3,
-                    duplicata_4, duplicata_5, duplicata_6,
-                    valor_unitario_energia, valor_mao_obra_tm_metallica,
-                    peso_liquido, peso_integral
-                FROM entrada_nf
-                WHERE unaccent(nf::text)         ILIKE unaccent(%s)
-                OR unaccent(fornecedor::text) ILIKE unaccent(%s)
-                OR unaccent(produto::text)    ILIKE unaccent(%s)
-                OR unaccent(material_1::text) ILIKE unaccent(%s)
-                OR unaccent(material_2::text) ILIKE unaccent(%s)
-                OR unaccent(material_3::text) ILIKE unaccent(%s)
-                OR unaccent(material_4::text) ILIKE unaccent(%s)
-                OR unaccent(material_5::text) ILIKE unaccent(%s)
-                -- compara como date (só funciona se o usuário digitou a data completa)
-                OR (data::date = %s::date)
-                -- compara a data formatada DD/MM/YYYY com pattern (aceita buscas parciais '06/' '06/08' etc.)
-                OR (to_char(data, 'DD/MM/YYYY') ILIKE %s)
-                ORDER BY data DESC, nf DESC
-            """
-
-            # montagem dos parâmetros: 8 vezes para os unaccent ILIKE, depois data_iso (pode ser None),
-            # depois o 'like' para a comparação to_char(... ) ILIKE %s
-            params = [like] * 8
-            params.append(data_iso)   # para data::date = %s::date (None se não for data completa)
-            params.append(like)       # para to_char(...) ILIKE %s (usa wildcard)
-
-            cursor.execute(sql, tuple(params))
-            linhas = cursor.fetchall()
-            total_pages = 1
-            page = 1
-
+            # data -> faixa em `data`; texto -> índice de trigramas (ver busca_entrada.py)
+            condicao, params = condicao_busca_entrada(search)
+            origem = f"FROM entrada_nf WHERE ({condicao})"
+            total, total_exato = contagem_consulta(cursor, f"SELECT id {origem}", params)
         else:
-            cursor.execute("SELECT COUNT(*) FROM entrada_nf")
-            total = cursor.fetchone()[0] or 0
-            total_pages = (total + per_page - 1) // per_page
-            offset = (page - 1) * per_page
-
-            cursor.execute(
-                """
-                SELECT id,
-                       data, nf, fornecedor,
-                       material_1, material_2, material_3, material_4, material_5,
-                       produto, custo_empresa, ipi, valor_integral,
-                       valor_unitario_1, valor_unitario_2, valor_unitario_3,
-                       valor_unitario_4, valor_unitario_5,
-                       duplicata_1, duplicata_2, duplicata_3,
-                       duplicata_4, duplicata_5, duplicata_6,
-                       valor_unitario_energia, valor_mao_obra_tm_metallica,
-                       peso_liquido, peso_integral
-                FROM entrada_nf
-                ORDER BY data DESC, nf DESC
-                LIMIT %s OFFSET %s
-                """,
-                (per_page, offset)
-            )
-            linhas = cursor.fetchall()
+            params = []
+            origem = "FROM entrada_nf WHERE TRUE"
+            total, total_exato = estimativa_tabela(cursor, 'entrada_nf'), False
+
+        linhas, proximo_cursor = pagina_keyset(
+            cursor, _COLUNAS_ENTRADA, origem, params,
+            _CHAVE_ENTRADA, 'id', cursor_pagina, per_page,
+            offset=(page - 1) * per_page
+        )
 
         entradas = [_linha_para_entrada(l) for l in linhas]
 
@@ -979,13 +860,15 @@ def listar_entradas():
         'partials/entrada_nf_list.html',
         entradas=entradas,
         page=page,
-        total_pages=total_pages,
+        proximo_cursor=proximo_cursor,
+        total=total,
+        total_exato=total_exato,
         max_materiais=max_materiais,
         max_valores=max_valores,
         max_duplicatas=max_duplicatas
     )
 
-ALLOWED_EXT = {'xls', 'xlsx'}
+ALLOWED_EXT = EXTENSOES
 
 def _normalize_colname(s):
     s = str(s or '').strip().lower()
@@ -1021,6 +904,173 @@ def _to_float_safe(v):
     except Exception:
         return None
 
+# Importação: chave do expected_map -> coluna de entrada_nf
+_IMPORT_TEXTOS = {
+    'nf': 'nf', 'fornecedor': 'fornecedor', 'produto': 'produto',
+    'material1': 'material_1', 'material2': 'material_2', 'material3': 'material_3',
+    'material4': 'material_4', 'material5': 'material_5',
+}
+_IMPORT_NUMEROS = {
+    'custoempresa': 'custo_empresa', 'ipi': 'ipi', 'valorintegral': 'valor_integral',
+    'valorunitario1': 'valor_unitario_1', 'valorunitario2': 'valor_unitario_2',
+    'valorunitario3': 'valor_unitario_3', 'valorunitario4': 'valor_unitario_4',
+    'valorunitario5': 'valor_unitario_5',
+    'duplicata1': 'duplicata_1', 'duplicata2': 'duplicata_2', 'duplicata3': 'duplicata_3',
+    'duplicata4': 'duplicata_4', 'duplicata5': 'duplicata_5', 'duplicata6': 'duplicata_6',
+    'valorunitarioenergia': 'valor_unitario_energia', 'valormaoobra': 'valor_mao_obra_tm_metallica',
+    'pesoliquido': 'peso_liquido', 'pesointegral': 'peso_integral',
+}
+_IMPORT_COLUNAS_DB = [
+    'data','nf','fornecedor','produto',
+    'material_1','material_2','material_3','material_4','material_5',
+    'custo_empresa','ipi','valor_integral',
+    'valor_unitario_1','valor_unitario_2','valor_unitario_3','valor_unitario_4','valor_unitario_5',
+    'duplicata_1','duplicata_2','duplicata_3','duplicata_4','duplicata_5','duplicata_6',
+    'valor_unitario_energia','valor_mao_obra_tm_metallica','peso_liquido','peso_integral'
+]
+
+def _coagir_textos(serie):
+    """Versão por coluna de _to_str_safe: texto aparado ou None se vazio/NaN."""
+    texto = serie.astype(str).str.strip()
+    vazio = serie.isna() | texto.str.lower().isin(('', 'nan', 'none', 'null'))
+    return texto.mask(vazio)
+
+def _coagir_numeros(serie):
+    """
+    Versão por coluna de _to_float_safe: números ficam como estão; em textos só restam
+    dígitos, vírgula e sinal (milhar '.' e espaços somem) e a vírgula vira ponto.
+    Cada texto distinto é convertido uma vez (factorize). Inválidos viram NaN.
+    """
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.astype(float)
+    eh_texto = serie.map(type) == str
+    resultado = pd.to_numeric(serie.where(~eh_texto), errors='coerce').astype(float)
+    if eh_texto.any():
+        codigos, distintos = pd.factorize(serie[eh_texto])
+        limpos = (pd.Series(distintos, dtype=object)
+                  .str.replace(r'[^0-9,\-]', '', regex=True)
+                  .str.replace(',', '.', regex=False))
+        convertidos = pd.to_numeric(limpos, errors='coerce').to_numpy(dtype=float)
+        resultado[eh_texto] = convertidos[codigos]
+    return resultado
+
+# Cabeçalhos aceitos na importação: chave -> apelidos (comparados com _normalize_colname)
+_IMPORT_ALIASES = {
+    'data'                 : ['data'],
+    'nf'                   : ['nf', 'nota', 'nota fiscal'],
+    'fornecedor'           : ['fornecedor', 'empresa'],
+    'produto'              : ['produto'],
+    'material1'            : ['material1','material_1','mat1'],
+    'material2'            : ['material2','material_2','mat2'],
+    'material3'            : ['material3','material_3','mat3'],
+    'material4'            : ['material4','material_4','mat4'],
+    'material5'            : ['material5','material_5','mat5'],
+    'custoempresa'         : ['custoempresa','custo_empresa','custo'],
+    'ipi'                  : ['ipi'],
+    'valorintegral'        : ['valorintegral','valor_integral','valor total'],
+    'valorunitario1'       : ['valorunitario1','valor_unitario_1'],
+    'valorunitario2'       : ['valorunitario2','valor_unitario_2'],
+    'valorunitario3'       : ['valorunitario3','valor_unitario_3'],
+    'valorunitario4'       : ['valorunitario4','valor_unitario_4'],
+    'valorunitario5'       : ['valorunitario5','valor_unitario_5'],
+    'duplicata1'           : ['duplicata1','duplicata_1'],
+    'duplicata2'           : ['duplicata2','duplicata_2'],
+    'duplicata3'           : ['duplicata3','duplicata_3'],
+    'duplicata4'           : ['duplicata4','duplicata_4'],
+    'duplicata5'           : ['duplicata5','duplicata_5'],
+    'duplicata6'           : ['duplicata6','duplicata_6'],
+    'valorunitarioenergia' : ['valorunitarioenergia','valor_unitario_energia','valor unitário energia','energia'],
+    'valormaoobra'         : ['valormaoobra','valor_mao_obra_tm_metallica','valor mão de obra tm/metallica','mao de obra','mão obra'],
+    'pesoliquido'          : ['pesoliquido','peso_liquido','peso líquido'],
+    'pesointegral'         : ['pesointegral','peso_integral','peso integral']
+}
+
+def _resolver_colunas_importacao(colunas):
+    """chave de _IMPORT_ALIASES -> nome da coluna na planilha (ou None)."""
+    normalized = {_normalize_colname(c): c for c in colunas}
+    resolved = {}
+    for key, aliases in _IMPORT_ALIASES.items():
+        found = None
+        for a in aliases:
+            na = _normalize_colname(a)
+            if na in normalized:
+                found = normalized[na]
+                break
+        resolved[key] = found
+    return resolved
+
+def _gravar_bloco_entrada(cur, df, resolved, job_id):
+    """
+    Converte um bloco da planilha e insere em entrada_nf: COPY para tabela temporária +
+    anti-join contra as NFs que já existiam antes da importação. As NFs criadas pelo próprio
+    job (importacao_nfs, migração 015) não contam: uma NF cujas linhas atravessam dois blocos
+    continua recebendo as linhas do bloco seguinte.
+    Retorna (inseridas, {índice: motivo} das linhas recusadas).
+    """
+    # Conversão por coluna inteira (sem iterrows); inválidos viram NaN/None
+    dados = pd.DataFrame(index=df.index)
+    try:
+        dados['data'] = pd.to_datetime(df[resolved['data']], dayfirst=True, errors='coerce')
+    except Exception:
+        dados['data'] = pd.to_datetime(df[resolved['data']].astype(str), dayfirst=True, errors='coerce')
+
+    for txt_key, coluna in _IMPORT_TEXTOS.items():
+        colname = resolved.get(txt_key)
+        dados[coluna] = _coagir_textos(df[colname]) if colname else None
+
+    for num_key, coluna in _IMPORT_NUMEROS.items():
+        colname = resolved.get(num_key)
+        dados[coluna] = _coagir_numeros(df[colname]) if colname else float('nan')
+    dados['peso_liquido'] = dados['peso_liquido'].fillna(0.0)
+
+    # Erros por máscara: linha sem data válida não entra
+    sem_data = dados['data'].isna()
+    rejeitadas = {idx: 'data vazia ou inválida' for idx in dados.index[sem_data]}
+    dados = dados[~sem_data]
+    if dados.empty:
+        return 0, rejeitadas
+
+    cols_sql = ', '.join(_IMPORT_COLUNAS_DB)
+    cur.execute(f"""
+        CREATE TEMP TABLE tmp_importacao_entrada ON COMMIT DROP AS
+        SELECT {cols_sql} FROM entrada_nf WITH NO DATA
+    """)
+    copiar_dataframe(cur, 'tmp_importacao_entrada', _IMPORT_COLUNAS_DB, dados)
+    cur.execute(f"""
+        WITH inseridas AS (
+            INSERT INTO entrada_nf ({cols_sql})
+            SELECT {cols_sql}
+              FROM tmp_importacao_entrada t
+             WHERE NOT EXISTS (
+                    SELECT 1 FROM entrada_nf e
+                     WHERE e.nf = t.nf
+                       AND NOT EXISTS (SELECT 1 FROM importacao_nfs i
+                                        WHERE i.job_id = %s AND i.nf = e.nf::text)
+                   )
+            RETURNING nf
+        ),
+        registradas AS (
+            INSERT INTO importacao_nfs (job_id, nf)
+            SELECT DISTINCT %s, nf::text FROM inseridas WHERE nf IS NOT NULL
+            ON CONFLICT DO NOTHING
+        )
+        SELECT count(*) FROM inseridas
+    """, (job_id, job_id))
+    return cur.fetchone()[0], rejeitadas
+
+def _preparar_importacao_entrada(primeiro, job_id):
+    """Importador 'entrada_nf' (importacoes.py): resolve os cabeçalhos pelo primeiro bloco."""
+    resolved = _resolver_colunas_importacao(primeiro.columns)
+    obrigatorias = ['data','nf','fornecedor','produto']
+    faltando = [k for k in obrigatorias if not resolved.get(k)]
+    if faltando:
+        raise ValueError(f'Colunas obrigatórias faltando no Excel: {faltando}. '
+                         f'Cabeçalhos detectados: {list(primeiro.columns)}')
+    return lambda cur, bloco: _gravar_bloco_entrada(cur, bloco, resolved, job_id)
+
+importacoes.registrar_importador('entrada_nf', _preparar_importacao_entrada,
+                                 ao_gravar=agendar_recalculo)
+
 @entrada_nf_bp.route('/importar_excel', methods=['POST'])
 @login_required
 def importar_excel_entrada():
@@ -1042,207 +1092,116 @@ def importar_excel_entrada():
 
     ext = filename.rsplit('.', 1)[1].lower()
     if ext not in ALLOWED_EXT:
-        msg = 'Extensão não permitida. Use .xls ou .xlsx'
+        msg = 'Extensão não permitida. Use .xls, .xlsx ou .csv'
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return jsonify(error=msg), 400
         flash(msg, 'danger')
         return redirect(url_for('entrada_nf.entradas_nf'))
 
+    xhr = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    # Job retomável: reenviar o mesmo arquivo depois de uma falha continua do último bloco gravado
     try:
-        arquivo.stream.seek(0)
-        engine = 'xlrd' if ext == 'xls' else 'openpyxl'
-        df = pd.read_excel(arquivo.stream, engine=engine)
+        job_id, retomado = importacoes.receber('entrada_nf', arquivo.stream, filename, ext,
+                                               session.get('usuario'))
     except Exception as e:
-        msg = f'Falha ao ler Excel: {e}'
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return jsonify(error=msg), 400
+        msg = f'Falha ao receber o arquivo: {e}'
+        if xhr:
+            return jsonify(error=msg), 500
         flash(msg, 'danger')
         return redirect(url_for('entrada_nf.entradas_nf'))
 
-    # Normaliza cabeçalhos
-    orig_cols = list(df.columns)
-    normalized = {_normalize_colname(c): c for c in orig_cols}
-
-    # Mapeamento esperado
-    expected_map = {
-        'data'                 : ['data'],
-        'nf'                   : ['nf', 'nota', 'nota fiscal'],
-        'fornecedor'           : ['fornecedor', 'empresa'],
-        'produto'              : ['produto'],
-        'material1'            : ['material1','material_1','mat1'],
-        'material2'            : ['material2','material_2','mat2'],
-        'material3'            : ['material3','material_3','mat3'],
-        'material4'            : ['material4','material_4','mat4'],
-        'material5'            : ['material5','material_5','mat5'],
-        'custoempresa'         : ['custoempresa','custo_empresa','custo'],
-        'ipi'                  : ['ipi'],
-        'valorintegral'        : ['valorintegral','valor_integral','valor total'],
-        'valorunitario1'       : ['valorunitario1','valor_unitario_1'],
-        'valorunitario2'       : ['valorunitario2','valor_unitario_2'],
-        'valorunitario3'       : ['valorunitario3','valor_unitario_3'],
-        'valorunitario4'       : ['valorunitario4','valor_unitario_4'],
-        'valorunitario5'       : ['valorunitario5','valor_unitario_5'],
-        'duplicata1'           : ['duplicata1','duplicata_1'],
-        'duplicata2'           : ['duplicata2','duplicata_2'],
-        'duplicata3'           : ['duplicata3','duplicata_3'],
-        'duplicata4'           : ['duplicata4','duplicata_4'],
-        'duplicata5'           : ['duplicata5','duplicata_5'],
-        'duplicata6'           : ['duplicata6','duplicata_6'],
-        'valorunitarioenergia' : ['valorunitarioenergia','valor_unitario_energia','valor unitário energia','energia'],
-        'valormaoobra'         : ['valormaoobra','valor_mao_obra_tm_metallica','valor mão de obra tm/metallica','mao de obra','mão obra'],
-        'pesoliquido'          : ['pesoliquido','peso_liquido','peso líquido'],
-        'pesointegral'         : ['pesointegral','peso_integral','peso integral']
-    }
+    resumo = importacoes.executar(job_id)
+    inserted, errors, skipped = resumo['gravadas'], resumo['erros'], resumo['puladas']
 
-    # Resolve colunas
-    resolved = {}
-    for key, aliases in expected_map.items():
-        found = None
-        for a in aliases:
-            na = _normalize_colname(a)
-            if na in normalized:
-                found = normalized[na]
-                break
-        resolved[key] = found
+    if resumo['invalida']:
+        msg = f"Falha ao ler Excel: {resumo['falha']}"
+        if xhr:
+            return jsonify(error=msg, job_id=job_id), 400
+        flash(msg, 'danger')
+        return redirect(url_for('entrada_nf.entradas_nf'))
 
-    obrigatorias = ['data','nf','fornecedor','produto']
-    faltando = [k for k in obrigatorias if not resolved.get(k)]
-    if faltando:
-        msg = f'Colunas obrigatórias faltando no Excel: {faltando}. Cabeçalhos detectados: {orig_cols}'
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return jsonify(error=msg), 400
+    if resumo['falha']:
+        msg = (f"Erro ao inserir no banco ({resumo['falha']}). Já gravados: {inserted}. "
+               f"Reenvie o arquivo (corrigido, se for o caso) para continuar de onde parou.")
+        if xhr:
+            return jsonify(error=msg, job_id=job_id, inserted=inserted, skipped=skipped,
+                           failed=len(errors), errors=errors), 500
         flash(msg, 'danger')
         return redirect(url_for('entrada_nf.entradas_nf'))
 
-    # Datas
-    try:
-        df['_data_parsed'] = pd.to_datetime(df[resolved['data']], dayfirst=True, errors='coerce')
-    except Exception:
-        df['_data_parsed'] = pd.to_datetime(df[resolved['data']].astype(str), dayfirst=True, errors='coerce')
+    if xhr:
+        return jsonify(inserted=inserted, failed=len(errors), errors=errors,
+                       skipped=skipped, resumed=retomado, job_id=job_id), 200
 
-    # Números
-    for num_key in ['custoempresa','ipi','valorintegral',
-                    'valorunitario1','valorunitario2','valorunitario3','valorunitario4','valorunitario5',
-                    'duplicata1','duplicata2','duplicata3','duplicata4','duplicata5','duplicata6',
-                    'valorunitarioenergia','valormaoobra','pesoliquido','pesointegral']:
-        colname = resolved.get(num_key)
-        if colname:
-            df['_'+num_key] = df[colname].apply(_to_float_safe)
-        else:
-            df['_'+num_key] = None
+    msg = f'Importação concluída. Inseridos: {inserted}. Falhas: {len(errors)}'
+    if retomado:
+        msg = f'Importação retomada e concluída. Inseridos: {inserted}. Já importados antes: {skipped}. Falhas: {len(errors)}'
+    flash(msg, 'success')
+    return redirect(url_for('entrada_nf.entradas_nf'))
 
-    # Textos
-    for txt_key in ['nf','fornecedor','produto','material1','material2','material3','material4','material5']:
-        colname = resolved.get(txt_key)
-        if colname:
-            df['_'+txt_key] = df[colname].apply(_to_str_safe)
+_COLUNAS_EXPORTACAO = [
+    ('data', 'Data'),
+    ('nf', 'NF'),
+    ('fornecedor', 'Fornecedor'),
+    ('material_1', 'Material 1'),
+    ('material_2', 'Material 2'),
+    ('material_3', 'Material 3'),
+    ('material_4', 'Material 4'),
+    ('material_5', 'Material 5'),
+    ('produto', 'Produto'),
+    ('custo_empresa', 'Custo R$'),
+    ('ipi', 'IPI %'),
+    ('valor_integral', 'Valor Integral'),
+    ('valor_unitario_1', 'Valor Unit. 1'),
+    ('valor_unitario_2', 'Valor Unit. 2'),
+    ('valor_unitario_3', 'Valor Unit. 3'),
+    ('valor_unitario_4', 'Valor Unit. 4'),
+    ('valor_unitario_5', 'Valor Unit. 5'),
+    ('duplicata_1', 'Duplicata 1'),
+    ('duplicata_2', 'Duplicata 2'),
+    ('duplicata_3', 'Duplicata 3'),
+    ('duplicata_4', 'Duplicata 4'),
+    ('duplicata_5', 'Duplicata 5'),
+    ('duplicata_6', 'Duplicata 6'),
+    ('valor_unitario_energia', 'Valor Unit. Energia'),
+    ('valor_mao_obra_tm_metallica', 'Valor M.O.'),
+    ('peso_liquido', 'Peso Liq.'),
+    ('peso_integral', 'Peso Int.')
+]
+
+
+def _valores_exportacao(linha):
+    """Linha de entrada_nf (colunas de _COLUNAS_ENTRADA) -> valores na ordem de _COLUNAS_EXPORTACAO."""
+    mapped = _linha_para_entrada(linha)
+    mapped['data'] = linha[1]
+    for i in range(5):
+        if len(mapped['materiais']) > i:
+            mapped[f"material_{i+1}"] = mapped['materiais'][i].get('nome')
+            mapped[f"valor_unitario_{i+1}"] = mapped['materiais'][i].get('valor_unitario')
         else:
-            df['_'+txt_key] = None
-
-    # Colunas do banco
-    db_columns = [
-        'data','nf','fornecedor','produto',
-        'material_1','material_2','material_3','material_4','material_5',
-        'custo_empresa','ipi','valor_integral',
-        'valor_unitario_1','valor_unitario_2','valor_unitario_3','valor_unitario_4','valor_unitario_5',
-        'duplicata_1','duplicata_2','duplicata_3','duplicata_4','duplicata_5','duplicata_6',
-        'valor_unitario_energia','valor_mao_obra_tm_metallica','peso_liquido','peso_integral'
-    ]
-
-    rows, errors = [], []
-    for idx, r in df.iterrows():
-        try:
-            pesol = r['_pesoliquido']
-            if pesol is None or pd.isna(pesol):
-                pesol = 0.0
-
-            tup = (
-                (r['_data_parsed'].to_pydatetime() if (hasattr(r['_data_parsed'],'to_pydatetime')) else (r['_data_parsed'] if not pd.isna(r['_data_parsed']) else None)),
-                r['_nf'],
-                r['_fornecedor'],
-                r['_produto'],
-                r['_material1'],
-                r['_material2'],
-                r['_material3'],
-                r['_material4'],
-                r['_material5'],
-                r['_custoempresa'],
-                r['_ipi'],
-                r['_valorintegral'],
-                r['_valorunitario1'],
-                r['_valorunitario2'],
-                r['_valorunitario3'],
-                r['_valorunitario4'],
-                r['_valorunitario5'],
-                r['_duplicata1'],
-                r['_duplicata2'],
-                r['_duplicata3'],
-                r['_duplicata4'],
-                r['_duplicata5'],
-                r['_duplicata6'],
-                r['_valorunitarioenergia'],
-                r['_valormaoobra'],
-                pesol,
-                r['_pesointegral']
-            )
-            rows.append(tup)
-        except Exception as e:
-            errors.append(f'linha {idx+1}: {e}')
-
-    # Inserção no banco (anti-duplicação de NF)
-    inserted = 0
-    if rows:
-        conn = conectar()
-        cur = conn.cursor()
-        try:
-            # busca NFs já existentes
-            cur.execute("SELECT nf FROM entrada_nf")
-            nfs_existentes = {row[0] for row in cur.fetchall() if row[0]}
-
-            # filtra apenas os que não estão no banco
-            rows_filtradas = [r for r in rows if r[1] not in nfs_existentes]
-
-            if rows_filtradas:
-                cols_sql = ','.join(db_columns)
-                sql = f"INSERT INTO entrada_nf ({cols_sql}) VALUES %s"
-                execute_values(cur, sql, rows_filtradas)
-                inserted = cur.rowcount if cur.rowcount is not None else len(rows_filtradas)
-
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            msg = f'Erro ao inserir no banco: {e}'
-            try:
-                cur.close(); conn.close()
-            except: pass
-            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                return jsonify(error=msg), 500
-            flash(msg, 'danger')
-            return redirect(url_for('entrada_nf.entradas_nf'))
-        finally:
-            try:
-                cur.close(); conn.close()
-            except: pass
-
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return jsonify(inserted=inserted, failed=len(errors), errors=errors), 200
+            mapped[f"material_{i+1}"] = None
+            mapped[f"valor_unitario_{i+1}"] = None
+    for j in range(6):
+        mapped[f"duplicata_{j+1}"] = mapped['duplicatas'][j] if len(mapped['duplicatas']) > j else None
 
-    flash(f'Importação concluída. Inseridos: {inserted}. Falhas: {len(errors)}', 'success')
-    return redirect(url_for('entrada_nf.entradas_nf'))
+    ipi_val = mapped.get('ipi')
+    if isinstance(ipi_val, float) and ipi_val <= 1:
+        mapped['ipi'] = ipi_val * 100
+    return [mapped.get(k) for k, _ in _COLUNAS_EXPORTACAO]
 
-@entrada_nf_bp.route('/exportar_filtrado')
-@login_required
-def exportar_filtrado():
-    import datetime as dt  # evita conflito se houver "from datetime import datetime" em outro lugar
-    from io import BytesIO
+def _consulta_exportacao(args):
+    """
+    SQL + parâmetros da exportação filtrada de entradas. `args` é o request.args da rota
+    ou os parâmetros guardados num job de relatório (relatorios.py).
+    """
+    import datetime as dt
 
-    tipo = (request.args.get('tipo') or 'excel').lower()
-    q = (request.args.get('q') or '').strip()
-    data_de = (request.args.get('data_de') or '').strip()
-    data_ate = (request.args.get('data_ate') or '').strip()
-    numero_nf = (request.args.get('numero_nf') or '').strip()
-    fornecedor = (request.args.get('fornecedor') or '').strip()
-    produto_nome = (request.args.get('produto_nome') or '').strip()
+    q = (args.get('q') or '').strip()
+    data_de = (args.get('data_de') or '').strip()
+    data_ate = (args.get('data_ate') or '').strip()
+    numero_nf = (args.get('numero_nf') or '').strip()
+    fornecedor = (args.get('fornecedor') or '').strip()
+    produto_nome = (args.get('produto_nome') or '').strip()
 
     def parse_date_try(s):
         if not s:
@@ -1262,33 +1221,10 @@ def exportar_filtrado():
     where = []
     params = []
 
-    iso_q = ''
     if q:
-        try:
-            if '/' in q and len(q.split('/')) == 3:
-                d = parse_date_try(q)
-                if d:
-                    iso_q = d.isoformat()
-        except Exception:
-            iso_q = ''
-
-    if iso_q:
-        where.append("data::text = %s")
-        params.append(iso_q)
-    else:
-        if q:
-            like = f"%{q}%"
-            where.append("(" + " OR ".join([
-                "unaccent(nf::text) ILIKE unaccent(%s)",
-                "unaccent(fornecedor::text) ILIKE unaccent(%s)",
-                "unaccent(produto::text) ILIKE unaccent(%s)",
-                "unaccent(material_1::text) ILIKE unaccent(%s)",
-                "unaccent(material_2::text) ILIKE unaccent(%s)",
-                "unaccent(material_3::text) ILIKE unaccent(%s)",
-                "unaccent(material_4::text) ILIKE unaccent(%s)",
-                "unaccent(material_5::text) ILIKE unaccent(%s)"
-            ]) + ")")
-            params.extend([like]*8)
+        condicao, params_q = condicao_busca_entrada(q)
+        where.append(condicao)
+        params.extend(params_q)
 
     if numero_nf:
         where.append("nf::text = %s")
@@ -1329,236 +1265,145 @@ def exportar_filtrado():
         {where_sql}
         ORDER BY data DESC, nf DESC
     """
+    return sql, tuple(params)
+
+# rótulos alinhados à direita no PDF
+_ROTULOS_NUMERICOS_PDF = {
+    'Custo R$', 'IPI %', 'Valor Integral', 'Valor Unit. 1', 'Valor Unit. 2',
+    'Valor Unit. 3', 'Valor Unit. 4', 'Valor Unit. 5',
+    'Duplicata 1', 'Duplicata 2', 'Duplicata 3', 'Duplicata 4', 'Duplicata 5', 'Duplicata 6',
+    'Valor Unit. Energia', 'Valor M.O.', 'Peso Liq.', 'Peso Int.'
+}
+
+def _texto_pdf(v):
+    if v is None:
+        return ''
+    if hasattr(v, 'strftime'):
+        return v.strftime('%d/%m/%Y')
+    if isinstance(v, float):
+        if v != v:  # NaN
+            return ''
+        return f"{v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return str(v)
+
+def _pdf_entradas(valores, destino, progresso=None):
+    """
+    PDF das entradas exportadas gravado em `destino` (caminho ou arquivo), pelo
+    renderizador de pdf_tabela. `valores` são listas na ordem de _COLUNAS_EXPORTACAO
+    (ver _valores_exportacao); `progresso(pct, msg)` é opcional (jobs).
+    """
+    import datetime as dt
+    # import local: sem reportlab a rota cai no fallback Excel
+    from pdf_tabela import ColunaPdf, renderizar_tabela_pdf
+    from reportlab.lib.pagesizes import A4, A3, landscape
+    from reportlab.lib.units import mm
+
+    rotulos = [label for _, label in _COLUNAS_EXPORTACAO]
+
+    # Retira colunas totalmente vazias (manutenção da ordem original)
+    com_valor = [False] * len(rotulos)
+    for linha in valores:
+        for i, v in enumerate(linha):
+            if not com_valor[i] and _texto_pdf(v).strip().lower() not in ('', 'nan', 'none'):
+                com_valor[i] = True
+    indices = [i for i, tem in enumerate(com_valor) if tem] or list(range(len(rotulos)))
+
+    # larguras por heurística (prioriza algumas colunas); escaladas para a página pelo renderizador
+    colunas = []
+    for i in indices:
+        h = rotulos[i]
+        if h in ('Fornecedor', 'Produto'):
+            largura = 55 * mm
+        elif h.startswith('Material'):
+            largura = 45 * mm
+        elif h.startswith('Duplicata'):
+            largura = 28 * mm
+        else:
+            largura = 30 * mm
+        numerico = h in _ROTULOS_NUMERICOS_PDF or 'Valor' in h or 'Custo' in h or 'Peso' in h
+        colunas.append(ColunaPdf(h, largura, 'direita' if numerico else 'esquerda'))
+
+    # muitas colunas: A3 paisagem
+    page_size = landscape(A3) if len(rotulos) > 12 else landscape(A4)
+
+    renderizar_tabela_pdf(
+        destino, colunas,
+        (tuple(_texto_pdf(linha[i]) for i in indices) for linha in valores),
+        titulo="Entradas Exportadas",
+        subtitulo=f"Gerado em: {dt.datetime.now().strftime('%d/%m/%Y %H:%M')}",
+        pagesize=page_size, margem=10 * mm, margem_vertical=10 * mm,
+        progresso=progresso, total=len(valores)
+    )
 
-    conn = None
-    cur = None
+def _relatorio_entradas_pdf(conn, parametros, caminho, progresso):
+    """Gerador do job de relatório PDF de entradas (ver relatorios.py)."""
+    import datetime as dt
+    sql, params = _consulta_exportacao(parametros)
+    cur = conn.cursor()
     try:
-        conn = conectar()
-        cur = conn.cursor()
-        cur.execute(sql, tuple(params))
+        cur.execute(sql, params)
         rows = cur.fetchall() or []
+    finally:
+        cur.close()
+    progresso(10, f"{len(rows)} entradas encontradas")
+    valores = [_valores_exportacao(r) for r in rows]
+    del rows
+    _pdf_entradas(valores, caminho, progresso)
+    return f"entradas_export_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+
+
+def _relatorio_entradas_excel(conn, parametros, caminho, progresso):
+    """Gerador do job de relatório Excel de entradas (cursor nomeado, memória constante)."""
+    import datetime as dt
+    sql, params = _consulta_exportacao(parametros)
+    escrever_xlsx(
+        caminho, 'Entradas',
+        [label for _, label in _COLUNAS_EXPORTACAO],
+        (_valores_exportacao(r) for r in iterar_consulta(conn, sql, params))
+    )
+    return f"entradas_export_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
 
-        records = []
-        for r in rows:
-            mapped = _linha_para_entrada(r)
-            data_str = mapped.get('data')
-            try:
-                if data_str:
-                    mapped['data'] = dt.datetime.strptime(data_str, '%d/%m/%Y').date()
-                else:
-                    mapped['data'] = None
-            except Exception:
-                mapped['data'] = mapped.get('data')
-            for i in range(5):
-                if isinstance(mapped.get('materiais'), list) and len(mapped['materiais']) > i:
-                    mapped[f"material_{i+1}"] = mapped['materiais'][i].get('nome')
-                    mapped[f"valor_unitario_{i+1}"] = mapped['materiais'][i].get('valor_unitario')
-                else:
-                    mapped[f"material_{i+1}"] = None
-                    mapped[f"valor_unitario_{i+1}"] = None
-            for j in range(6):
-                mapped[f"duplicata_{j+1}"] = mapped['duplicatas'][j] if (isinstance(mapped.get('duplicatas'), list) and len(mapped['duplicatas']) > j) else None
-
-            records.append(mapped)
-
-        cols = [
-            ('data', 'Data'),
-            ('nf', 'NF'),
-            ('fornecedor', 'Fornecedor'),
-            ('material_1', 'Material 1'),
-            ('material_2', 'Material 2'),
-            ('material_3', 'Material 3'),
-            ('material_4', 'Material 4'),
-            ('material_5', 'Material 5'),
-            ('produto', 'Produto'),
-            ('custo_empresa', 'Custo R$'),
-            ('ipi', 'IPI %'),
-            ('valor_integral', 'Valor Integral'),
-            ('valor_unitario_1', 'Valor Unit. 1'),
-            ('valor_unitario_2', 'Valor Unit. 2'),
-            ('valor_unitario_3', 'Valor Unit. 3'),
-            ('valor_unitario_4', 'Valor Unit. 4'),
-            ('valor_unitario_5', 'Valor Unit. 5'),
-            ('duplicata_1', 'Duplicata 1'),
-            ('duplicata_2', 'Duplicata 2'),
-            ('duplicata_3', 'Duplicata 3'),
-            ('duplicata_4', 'Duplicata 4'),
-            ('duplicata_5', 'Duplicata 5'),
-            ('duplicata_6', 'Duplicata 6'),
-            ('valor_unitario_energia', 'Valor Unit. Energia'),
-            ('valor_mao_obra_tm_metallica', 'Valor M.O.'),
-            ('peso_liquido', 'Peso Liq.'),
-            ('peso_integral', 'Peso Int.')
-        ]
-
-        df_rows = []
-        for rec in records:
-            row = {}
-            for k, label in cols:
-                if k == 'ipi' and rec.get('ipi') is not None:
-                    ipi_val = rec.get('ipi')
-                    row[label] = (ipi_val * 100) if (isinstance(ipi_val, float) and ipi_val <= 1) else ipi_val
-                else:
-                    row[label] = rec.get(k)
-            df_rows.append(row)
 
-        df = pd.DataFrame(df_rows, columns=[label for _, label in cols])
+registrar_gerador('entrada_nf', 'pdf', 'application/pdf', _relatorio_entradas_pdf)
+registrar_gerador('entrada_nf', 'excel', MIMETYPE_XLSX, _relatorio_entradas_excel)
+
+@entrada_nf_bp.route('/exportar_filtrado')
+@login_required
+def exportar_filtrado():
+    import datetime as dt  # evita conflito se houver "from datetime import datetime" em outro lugar
+    from io import BytesIO
+
+    tipo = (request.args.get('tipo') or 'excel').lower()
+    sql, params = _consulta_exportacao(request.args)
 
+    conn = None
+    cur = None
+    try:
+        conn = conectar()
+
+        cols = _COLUNAS_EXPORTACAO
         timestamp = dt.datetime.now().strftime('%Y%m%d_%H%M%S')
         base_name = f"entradas_export_{timestamp}"
 
-        # Excel (padrão)
+        # Excel (padrão): cursor nomeado -> xlsx em memória constante -> envio em blocos
         if tipo != 'pdf':
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Entradas', index=False)
-            output.seek(0)
-            return send_file(
-                output,
-                as_attachment=True,
-                download_name=f"{base_name}.xlsx",
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            return resposta_xlsx(
+                f"{base_name}.xlsx", 'Entradas',
+                [label for _, label in cols],
+                (_valores_exportacao(r) for r in iterar_consulta(conn, sql, params))
             )
 
+        cur = conn.cursor()
+        cur.execute(sql, tuple(params))
+        valores = [_valores_exportacao(r) for r in cur.fetchall()]
+
         # -----------------------------
-        # GERAÇÃO DE PDF COM REPORTLAB (melhor legibilidade)
+        # PDF síncrono (link direto). A tela gera o PDF como job em segundo plano
+        # (/relatorios, gerador _relatorio_entradas_pdf).
         # -----------------------------
         try:
-            # imports locais
-            from reportlab.lib.pagesizes import A4, A3, landscape
-            from reportlab.lib import colors
-            from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-            from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-            from reportlab.lib.units import mm
-            from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT
-            from xml.sax.saxutils import escape as xml_escape
-
-            # Decide página: se muitas colunas, usa A3 paisagem
-            original_headers = [label for _, label in cols]
-            n_cols = len(original_headers)
-            use_a3 = n_cols > 12  # limiar ajustável
-            page_size = landscape(A3) if use_a3 else landscape(A4)
-            page_width = page_size[0]
-            # margem
-            margin_mm = 10
-            usable_width = page_width - (2 * margin_mm * mm)
-
             buf = BytesIO()
-            doc = SimpleDocTemplate(buf, pagesize=page_size,
-                                    leftMargin=margin_mm*mm, rightMargin=margin_mm*mm,
-                                    topMargin=10*mm, bottomMargin=10*mm)
-            story = []
-            styles = getSampleStyleSheet()
-            # estilos
-            header_style = ParagraphStyle('h', parent=styles['Heading4'], alignment=TA_CENTER, fontSize=9, leading=10)
-            text_style = ParagraphStyle('t', parent=styles['Normal'], alignment=TA_LEFT, fontSize=8, leading=9)
-            small_text_style = ParagraphStyle('ts', parent=styles['Normal'], alignment=TA_LEFT, fontSize=7, leading=8)
-            number_style = ParagraphStyle('n', parent=styles['Normal'], alignment=TA_RIGHT, fontSize=8, leading=9)
-
-            story.append(Paragraph("Entradas Exportadas", styles['Heading2']))
-            story.append(Spacer(1, 6))
-
-            # Retira colunas totalmente vazias (manutenção da ordem original)
-            def col_has_value(series):
-                if series is None:
-                    return False
-                for v in series:
-                    if v is None:
-                        continue
-                    try:
-                        if isinstance(v, float) and pd.isna(v):
-                            continue
-                    except Exception:
-                        pass
-                    s = str(v).strip().lower()
-                    if s not in ('', 'nan', 'none'):
-                        return True
-                return False
-
-            headers = []
-            for h in original_headers:
-                if h not in df.columns:
-                    continue
-                if col_has_value(df[h]):
-                    headers.append(h)
-            if not headers:
-                headers = original_headers.copy()
-
-            # calcula larguras baseadas em heurística (prioriza algumas colunas)
-            widths = []
-            for h in headers:
-                if h in ('Data', 'NF'):
-                    widths.append(30 * mm)
-                elif h in ('Fornecedor', 'Produto'):
-                    widths.append(55 * mm)
-                elif h.startswith('Material'):
-                    widths.append(45 * mm)
-                elif h.startswith('Duplicata'):
-                    widths.append(28 * mm)
-                elif h in ('Custo R$', 'Valor Integral', 'Valor Unit. Energia', 'Valor M.O.', 'Peso Liq.', 'Peso Int.'):
-                    widths.append(30 * mm)
-                else:
-                    widths.append(30 * mm)
-
-            # ajusta proporcionalmente se soma > usable_width
-            sum_w = sum(widths)
-            if sum_w > usable_width:
-                factor = usable_width / float(sum_w)
-                widths = [w * factor for w in widths]
-
-            # prepara table_data usando Paragraph (para quebra de linha)
-            table_data = []
-            # cabeçalho com Paragraphs
-            header_row = [Paragraph(xml_escape(h), header_style) for h in headers]
-            table_data.append(header_row)
-
-            # linhas
-            for _, r in df.iterrows():
-                row = []
-                for h in headers:
-                    v = r.get(h)
-                    if isinstance(v, (dt.date, dt.datetime)):
-                        text = v.strftime('%d/%m/%Y')
-                        p = Paragraph(xml_escape(text), text_style)
-                    elif isinstance(v, float):
-                        formatted = f"{v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-                        p = Paragraph(xml_escape(formatted), number_style)
-                    elif v is None or (isinstance(v, float) and pd.isna(v)):
-                        p = Paragraph('', text_style)
-                    else:
-                        s = str(v)
-                        # se muito longo, deixa o Paragraph quebrar naturalmente (vai ajustar altura)
-                        # usa estilo menor se texto muito comprido
-                        p = Paragraph(xml_escape(s), small_text_style if len(s) > 80 else text_style)
-                    row.append(p)
-                table_data.append(row)
-
-            # cria tabela
-            tbl = Table(table_data, colWidths=widths, repeatRows=1)
-            tbl_style = TableStyle([
-                ('GRID', (0,0), (-1,-1), 0.25, colors.HexColor('#BBBBBB')),
-                ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#F0F0F0')),
-                ('VALIGN', (0,0), (-1,-1), 'TOP'),
-                ('FONTSIZE', (0,0), (-1,-1), 8),
-                ('LEFTPADDING', (0,0), (-1,-1), 4),
-                ('RIGHTPADDING', (0,0), (-1,-1), 4),
-            ])
-            # alinha numericas à direita (procura por alguns rótulos que indicam número)
-            numeric_labels = set(['Custo R$', 'IPI %', 'Valor Integral', 'Valor Unit. 1', 'Valor Unit. 2',
-                                  'Valor Unit. 3', 'Valor Unit. 4', 'Valor Unit. 5',
-                                  'Duplicata 1', 'Duplicata 2', 'Duplicata 3', 'Duplicata 4', 'Duplicata 5', 'Duplicata 6',
-                                  'Valor Unit. Energia', 'Valor M.O.', 'Peso Liq.', 'Peso Int.'])
-            for col_idx, h in enumerate(headers):
-                if h in numeric_labels or 'Valor' in h or 'Custo' in h or 'Peso' in h or h.startswith('Duplicata'):
-                    tbl_style.add('ALIGN', (col_idx, 1), (col_idx, -1), 'RIGHT')
-                else:
-                    tbl_style.add('ALIGN', (col_idx, 1), (col_idx, -1), 'LEFT')
-
-            tbl.setStyle(tbl_style)
-            story.append(tbl)
-
-            # renderiza PDF
-            doc.build(story)
+            _pdf_entradas(valores, buf)
             buf.seek(0)
             return send_file(
                 buf,
@@ -1567,31 +1412,12 @@ def exportar_filtrado():
                 mimetype='application/pdf'
             )
 
-        except ImportError as e:
-            # reportlab não instalado -> fallback Excel
-            print("reportlab não instalado:", e)
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Entradas', index=False)
-            output.seek(0)
-            return send_file(
-                output,
-                as_attachment=True,
-                download_name=f"{base_name}_fallback.xlsx",
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
         except Exception as e:
-            # erro qualquer durante geração do PDF -> fallback Excel
+            # reportlab não instalado / erro na geração do PDF -> fallback Excel
             print("Erro ao gerar PDF com reportlab:", e)
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Entradas', index=False)
-            output.seek(0)
-            return send_file(
-                output,
-                as_attachment=True,
-                download_name=f"{base_name}_fallback.xlsx",
-                mimetype='application/vnd.openxmlformats-officedocument-spreadsheetml.sheet'
+            return resposta_xlsx(
+                f"{base_name}_fallback.xlsx", 'Entradas',
+                [label for _, label in cols], valores
             )
 
     except Exception as exc:
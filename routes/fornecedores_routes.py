@@ -1,16 +1,18 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_file
 from routes.auth_routes import login_required
-from conexao_db import conectar
+from conexao_db import conexao_requisicao
+from routes.calculo_nfs_route import agendar_recalculo
+from cache_referencia import invalidar_referencias
 
 fornecedores_bp = Blueprint('fornecedores', __name__)
-conexao = conectar()
-cursor = conexao.cursor()
 
 
 @fornecedores_bp.route('/fornecedores')
 @login_required
 def fornecedores():
     """Lista todos os fornecedores."""
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     cursor.execute("SELECT id, nome FROM fornecedores ORDER BY nome")
     rows = cursor.fetchall()
     fornecedores_list = [dict(id=row[0], nome=row[1]) for row in rows]
@@ -24,6 +26,8 @@ def create_fornecedor():
         flash('Informe o nome do fornecedor.', 'erro')
         return redirect(url_for('fornecedores.fornecedores'))
 
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     # Verifica duplicado
     cursor.execute("SELECT 1 FROM fornecedores WHERE nome ILIKE %s", (nome,))
     if cursor.fetchone():
@@ -55,6 +59,8 @@ def create_fornecedor():
                           GREATEST((SELECT MAX(id) FROM fornecedores), nextval(pg_get_serial_sequence('fornecedores','id'))))
         """)
         conexao.commit()
+        invalidar_referencias()
+        agendar_recalculo()
         flash(f'Fornecedor criado com sucesso!', 'sucesso')
 
     except Exception as e:
@@ -71,6 +77,8 @@ def edit_fornecedor(forn_id):
         flash('O nome do fornecedor não pode ficar vazio.', 'erro')
         return redirect(url_for('fornecedores.fornecedores'))
 
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     # Verifica duplicado em outro ID
     cursor.execute("SELECT id FROM fornecedores WHERE nome ILIKE %s AND id <> %s", (novo_nome, forn_id))
     if cursor.fetchone():
@@ -80,6 +88,8 @@ def edit_fornecedor(forn_id):
     try:
         cursor.execute("UPDATE fornecedores SET nome = %s WHERE id = %s", (novo_nome, forn_id))
         conexao.commit()
+        invalidar_referencias()
+        agendar_recalculo()
         flash('Fornecedor atualizado com sucesso.', 'sucesso')
     except Exception as e:
         conexao.rollback()
@@ -89,6 +99,8 @@ def edit_fornecedor(forn_id):
 @fornecedores_bp.route('/fornecedores/delete/<int:forn_id>', methods=['POST'])
 @login_required
 def delete_fornecedor(forn_id):
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     # Verifica se existe algum material atrelado a esse fornecedor
     cursor.execute("SELECT 1 FROM materiais WHERE fornecedor_id = %s LIMIT 1", (forn_id,))
     if cursor.fetchone():
@@ -98,6 +110,8 @@ def delete_fornecedor(forn_id):
     try:
         cursor.execute("DELETE FROM fornecedores WHERE id = %s", (forn_id,))
         conexao.commit()
+        invalidar_referencias()
+        agendar_recalculo()
         flash('Fornecedor excluído com sucesso.', 'sucesso')
     except Exception as e:
         conexao.rollback()
@@ -113,6 +127,8 @@ def delete_selecionados_fornecedores():
         flash('Nenhum fornecedor selecionado.', 'erro')
         return redirect(url_for('fornecedores.fornecedores'))
 
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     try:
         # Converte para tupla de inteiros e apaga todos de uma vez
         ids_int = tuple(map(int, ids))
@@ -120,6 +136,8 @@ def delete_selecionados_fornecedores():
         query = f"DELETE FROM fornecedores WHERE id IN ({placeholders})"
         cursor.execute(query, ids_int)
         conexao.commit()
+        invalidar_referencias()
+        agendar_recalculo()
         flash(f"{cursor.rowcount} fornecedor(es) excluído(s) com sucesso.", 'sucesso')
     except Exception as e:
         conexao.rollback()
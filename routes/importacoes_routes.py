@@ -0,0 +1,61 @@
+from flask import Blueprint, jsonify, session, url_for
+from routes.auth_routes import login_required
+import importacoes
+
+# Importações de planilha retomáveis (ver importacoes.py):
+#   GET  /importacoes/<id>          -> status/progresso e checkpoint do job
+#   POST /importacoes/<id>/retomar  -> continua do último bloco gravado, com o arquivo guardado,
+#                                      em segundo plano (202; acompanhar pelo GET acima)
+importacoes_bp = Blueprint('importacoes', __name__, url_prefix='/importacoes')
+
+
+def _job_do_usuario(job_id):
+    job = importacoes.obter_job(job_id)
+    if job is None or job['usuario'] != session.get('usuario'):
+        return None
+    return job
+
+
+@importacoes_bp.route('/<int:job_id>', methods=['GET'])
+@login_required
+def status_importacao(job_id):
+    job = _job_do_usuario(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'msg': 'Importação não encontrada.'}), 404
+
+    total = job['total_estimado']
+    if job['status'] == 'concluido':
+        progresso = 100
+    elif total:
+        progresso = min(int(100 * job['linhas_lidas'] / total), 99)
+    else:
+        progresso = None
+    return jsonify({
+        'job_id': job['id'],
+        'estado': job['status'],
+        'progresso': progresso,
+        'linhas_lidas': job['linhas_lidas'],
+        'linhas_gravadas': job['linhas_gravadas'],
+        'linhas_puladas': job['linhas_puladas'],
+        'ultima_linha': job['ultima_linha'] + 1,
+        'total_estimado': total,
+        'erros': job['erros'],
+        'mensagem': job['mensagem'],
+    })
+
+
+@importacoes_bp.route('/<int:job_id>/retomar', methods=['POST'])
+@login_required
+def retomar_importacao(job_id):
+    job = _job_do_usuario(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'msg': 'Importação não encontrada.'}), 404
+    if job['status'] not in ('pendente', 'erro'):
+        return jsonify({'status': 'error', 'msg': 'Só importações interrompidas podem ser retomadas.'}), 409
+
+    importacoes.executar_em_segundo_plano(job_id)
+    return jsonify({
+        'status': 'ok',
+        'job_id': job_id,
+        'status_url': url_for('importacoes.status_importacao', job_id=job_id)
+    }), 202
@@ -1,19 +1,21 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_file
 from routes.auth_routes import login_required
-from conexao_db import conectar
+from conexao_db import conexao_requisicao
+from routes.calculo_nfs_route import agendar_recalculo
+from cache_referencia import invalidar_referencias
 import pandas as pd
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
 from reportlab.lib import colors
 import io
 
 materiais_bp = Blueprint('materiais', __name__)
-conexao = conectar()
-cursor = conexao.cursor()
 
 @materiais_bp.route('/materiais')
 @login_required
 def materiais():
     """Lista todos os materiais e exibe link para criar, editar e excluir."""
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     cursor.execute("""
         SELECT m.id, m.nome, f.nome AS fornecedor, m.valor, m.grupo
         FROM materiais m
@@ -57,6 +59,8 @@ def create_material():
         flash('Grupo inválido.', 'erro')
         return redirect(url_for('materiais.materiais'))
 
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     try:
         # 4) Encontrar o menor ID livre
         cursor.execute("""
@@ -87,6 +91,9 @@ def create_material():
         """)
 
         conexao.commit()
+
+        invalidar_referencias()
+        agendar_recalculo()
         flash(f'Material criado com sucesso!', 'sucesso')
 
     except Exception as e:
@@ -118,6 +125,8 @@ def edit_material(mat_id):
         flash('Grupo inválido.', 'erro')
         return redirect(url_for('materiais.materiais'))
 
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     try:
         cursor.execute("""
             UPDATE materiais
@@ -125,6 +134,8 @@ def edit_material(mat_id):
              WHERE id=%s
         """, (nome, fornecedor_id, valor, grupo, mat_id))
         conexao.commit()
+        invalidar_referencias()
+        agendar_recalculo()
         flash('Material atualizado com sucesso.', 'sucesso')
     except Exception as e:
         conexao.rollback()
@@ -135,9 +146,13 @@ def edit_material(mat_id):
 @materiais_bp.route('/materiais/delete/<int:mat_id>', methods=['POST'])
 @login_required
 def delete_material(mat_id):
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     try:
         cursor.execute("DELETE FROM materiais WHERE id = %s", (mat_id,))
         conexao.commit()
+        invalidar_referencias()
+        agendar_recalculo()
         flash('Material excluído com sucesso.', 'sucesso')
     except Exception as e:
         conexao.rollback()
@@ -151,11 +166,15 @@ def delete_selecionados_materiais():
     if not ids:
         flash('Nenhum material selecionado.', 'erro')
         return redirect(url_for('materiais.materiais'))
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     try:
         ids_int = tuple(map(int, ids))
         sql = f"DELETE FROM materiais WHERE id IN ({','.join(['%s']*len(ids_int))})"
         cursor.execute(sql, ids_int)
         conexao.commit()
+        invalidar_referencias()
+        agendar_recalculo()
         flash(f"{cursor.rowcount} material(is) excluído(s).", 'sucesso')
     except Exception:
         conexao.rollback()
@@ -165,6 +184,8 @@ def delete_selecionados_materiais():
 @materiais_bp.route('/materiais/export/excel')
 @login_required
 def exportar_materiais_excel():
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     # Busca dados
     cursor.execute("""
         SELECT m.nome, f.nome AS fornecedor, m.valor, m.grupo
@@ -194,6 +215,8 @@ def exportar_materiais_excel():
 @materiais_bp.route('/materiais/export/pdf')
 @login_required
 def exportar_materiais_pdf():
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     # Busca dados
     cursor.execute("""
         SELECT m.nome, f.nome AS fornecedor, 
@@ -1,18 +1,20 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_file
 from routes.auth_routes import login_required
-from conexao_db import conectar
+from conexao_db import conexao_requisicao
+from routes.calculo_nfs_route import agendar_recalculo
+from cache_referencia import invalidar_referencias
 import pandas as pd
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
 from reportlab.lib import colors
 import io
 
 produtos_bp = Blueprint('produtos', __name__)
-conexao = conectar()
-cursor = conexao.cursor()
 
 @produtos_bp.route('/produtos')
 @login_required
 def produtos():
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     cursor.execute('SELECT id, nome, percentual_cobre, percentual_zinco FROM produtos ORDER BY id')
     produtos = cursor.fetchall()
     return render_template('produtos.html', produtos=[
@@ -39,6 +41,8 @@ def create_produto():
         flash('Percentual inválido.', 'erro')
         return redirect(url_for('produtos.produtos'))
 
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     try:
         # 1) Descobre o menor id livre em produtos
         cursor.execute("""
@@ -69,6 +73,9 @@ def create_produto():
         """)
 
         conexao.commit()
+
+        invalidar_referencias()
+        agendar_recalculo()
         flash(f'Produto criado com sucesso!', 'sucesso')
     except Exception as e:
         conexao.rollback()
@@ -93,12 +100,16 @@ def edit_produto(prod_id):
 
     pc = parse_percent(pc_raw)
     pz = parse_percent(pz_raw)
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     try:
         cursor.execute(
             'UPDATE produtos SET nome=%s, percentual_cobre=%s, percentual_zinco=%s WHERE id=%s',
             (nome, float(pc), float(pz), prod_id)
         )
         conexao.commit()
+        invalidar_referencias()
+        agendar_recalculo()
         flash('Produto atualizado com sucesso.', 'sucesso')
     except Exception as e:
         conexao.rollback()
@@ -108,9 +119,13 @@ def edit_produto(prod_id):
 @produtos_bp.route('/produtos/delete/<int:prod_id>', methods=['POST'])
 @login_required
 def delete_produto(prod_id):
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     try:
         cursor.execute("DELETE FROM produtos WHERE id = %s", (prod_id,))
         conexao.commit()
+        invalidar_referencias()
+        agendar_recalculo()
         flash('Produto excluído com sucesso.', 'sucesso')
     except Exception:
         conexao.rollback()
@@ -125,12 +140,16 @@ def delete_selecionados_produtos():
         flash('Nenhum produto selecionado.', 'erro')
         return redirect(url_for('produtos.produtos'))
 
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     try:
         ids_int = tuple(map(int, ids))  # converte para tupla de inteiros
         placeholders = ','.join(['%s'] * len(ids_int))
         query = f"DELETE FROM produtos WHERE id IN ({placeholders})"
         cursor.execute(query, ids_int)
         conexao.commit()
+        invalidar_referencias()
+        agendar_recalculo()
         flash(f"{cursor.rowcount} produto(s) excluído(s).", 'sucesso')
     except Exception as e:
         conexao.rollback()
@@ -141,6 +160,8 @@ def delete_selecionados_produtos():
 @produtos_bp.route('/produtos/export/excel')
 @login_required
 def export_produtos_excel():
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     cursor.execute("""
         SELECT nome, percentual_cobre, percentual_zinco 
         FROM produtos 
@@ -164,6 +185,8 @@ def export_produtos_excel():
 @produtos_bp.route('/produtos/export/pdf')
 @login_required
 def export_produtos_pdf():
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     cursor.execute("""
         SELECT nome, 
                to_char(percentual_cobre, 'FM999990.00') AS cobre,
@@ -0,0 +1,77 @@
+from flask import Blueprint, request, jsonify, send_file, session, url_for
+from routes.auth_routes import login_required
+import relatorios
+import os
+
+# Relatórios gerados em segundo plano (ver relatorios.py):
+#   POST /relatorios/             -> enfileira (tipo, formato + filtros) e devolve o id
+#   GET  /relatorios/<id>         -> status/progresso (a tela consulta até concluir)
+#   GET  /relatorios/<id>/arquivo -> download do arquivo pronto
+relatorios_bp = Blueprint('relatorios', __name__, url_prefix='/relatorios')
+
+
+def _job_do_usuario(job_id):
+    job = relatorios.obter_job(job_id)
+    if job is None or job['usuario'] != session.get('usuario'):
+        return None
+    return job
+
+
+@relatorios_bp.route('/', methods=['POST'])
+@login_required
+def enfileirar_relatorio():
+    dados = request.form.to_dict() or (request.get_json(silent=True) or {})
+    tipo = (dados.pop('tipo', '') or '').strip()
+    formato = (dados.pop('formato', '') or 'pdf').strip().lower()
+    # só os filtros preenchidos vão para o job
+    parametros = {k: v for k, v in dados.items() if isinstance(v, str) and v.strip()}
+
+    if not relatorios.tem_gerador(tipo, formato):
+        return jsonify({'status': 'error', 'msg': 'Relatório não suportado.'}), 400
+    try:
+        job_id = relatorios.enfileirar(tipo, formato, parametros, session.get('usuario'))
+    except Exception as e:
+        print("Erro ao enfileirar relatório:", e)
+        return jsonify({'status': 'error', 'msg': 'Erro ao agendar o relatório.'}), 500
+
+    return jsonify({
+        'status': 'ok',
+        'job_id': job_id,
+        'status_url': url_for('relatorios.status_relatorio', job_id=job_id)
+    }), 202
+
+
+@relatorios_bp.route('/<int:job_id>', methods=['GET'])
+@login_required
+def status_relatorio(job_id):
+    job = _job_do_usuario(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'msg': 'Relatório não encontrado.'}), 404
+
+    resposta = {
+        'job_id': job['id'],
+        'estado': job['status'],
+        'progresso': job['progresso'],
+        'mensagem': job['mensagem'],
+    }
+    if job['status'] == 'concluido':
+        resposta['download_url'] = url_for('relatorios.baixar_relatorio', job_id=job_id)
+        resposta['expira_em'] = job['expira_em'].isoformat() if job['expira_em'] else None
+    return jsonify(resposta)
+
+
+@relatorios_bp.route('/<int:job_id>/arquivo', methods=['GET'])
+@login_required
+def baixar_relatorio(job_id):
+    job = _job_do_usuario(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'msg': 'Relatório não encontrado.'}), 404
+    if job['status'] != 'concluido' or not job['arquivo'] or not os.path.exists(job['arquivo']):
+        return jsonify({'status': 'error', 'msg': 'Arquivo indisponível (expirado ou não concluído).'}), 410
+
+    return send_file(
+        job['arquivo'],
+        mimetype=job['mimetype'],
+        as_attachment=True,
+        download_name=job['nome_arquivo']
+    )
@@ -1,76 +1,151 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify, session, current_app
 from routes.auth_routes import login_required
+from werkzeug.utils import secure_filename
 from conexao_db import conectar
-from psycopg2.extras import execute_values
+from busca_entrada import interpretar_data
+from relatorios import registrar_gerador
+from paginacao import codificar_cursor, decodificar_cursor, estimativa_tabela, contagem_consulta
 import pandas as pd
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle,Paragraph, Spacer
-from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.units import cm
+from pdf_tabela import ColunaPdf, renderizar_tabela_pdf
+from carga_em_massa import copiar_dataframe
+from leitor_planilha import EXTENSOES
+import importacoes
 import io
 import requests
 import re
-from datetime import datetime
+from decimal import Decimal
 
 saida_nf_bp = Blueprint('saida_nf', __name__, url_prefix='/saida_nf')
 
+def _condicao_busca_saida(search):
+    """
+    WHERE da busca de NFs de saída (migração 008): número/cliente, CNPJ/CPF sem pontuação e
+    nome/base dos produtos. Data digitada (dd/mm/aaaa) vira faixa do dia em nf.data.
+    Cada critério é um ramo de `nf.id IN (... UNION ALL ...)` com o seu índice de trigramas:
+    num OR com um EXISTS o planejador não monta BitmapOr e varre nf inteira. O IN vira
+    semi-join, então cada NF aparece uma vez sem DISTINCT.
+    Retorna (sql, params).
+    """
+    ramos = [
+        """SELECT b.id FROM nf b
+            WHERE texto_busca_nf(b.numero_nf::text, b.cliente::text) LIKE '%%' || termo_busca(%s) || '%%'""",
+        """SELECT b.id FROM nf b
+            WHERE documento_busca(b.cnpj_cpf::text) LIKE '%%' || documento_busca(%s) || '%%'""",
+        """SELECT p.nf_id FROM produtos_nf p
+            WHERE texto_busca_produto_nf(p.produto_nome::text, p.base_produto::text)
+                  LIKE '%%' || termo_busca(%s) || '%%'""",
+    ]
+    params = [search, search, search]
+
+    data = interpretar_data(search)
+    if data and data[0] == 'dia':
+        ramos.append("SELECT b.id FROM nf b WHERE b.data >= %s AND b.data < %s::date + 1")
+        params.extend([data[1], data[1]])
+
+    return "nf.id IN (\n" + "\n UNION ALL\n".join(ramos) + "\n)", params
+
+# chave do keyset: mesma expressão do índice idx_nf_data_id (migração 009)
+_CHAVE_NF = "COALESCE(nf.data, '-infinity')"
+
+def _total_nfs(cursor, where, params):
+    """
+    (total, exato) de NFs para a paginação: sem busca, estimado por reltuples (exato=False);
+    com busca, contado de verdade até paginacao.LIMITE_CONTAGEM.
+    """
+    if where == "TRUE":
+        return estimativa_tabela(cursor, 'nf'), False
+    return contagem_consulta(cursor, f"SELECT nf.id FROM nf WHERE {where}", params)
+
+def _numero_paginas(total, exato, per_page, page):
+    paginas = (total + per_page - 1) // per_page
+    # estimativa pode ficar abaixo do real: a página aberta sempre existe
+    return paginas if exato else max(paginas, page)
+
+def _pagina_nfs(cursor, where, params, limite, cursor_txt='', offset=0):
+    """
+    Uma consulta por página: as NFs da página já com seus produtos agregados (json_agg),
+    então o custo depende do tamanho da página e não do total de produtos_nf.
+    Paginação por keyset em (data, id) DESC (ver paginacao.py); sem cursor, `offset`
+    abre a página por número.
+    Retorna ([(id, data, numero_nf, cliente, cnpj_cpf, observacao, [produtos])], proximo_cursor).
+    """
+    params = list(params)
+    pos = decodificar_cursor(cursor_txt)
+    if pos is not None:
+        where = f"({where}) AND ({_CHAVE_NF}, nf.id) < (%s, %s)"
+        params.extend(pos)
+        offset = 0
+
+    cursor.execute(
+        f"""
+        SELECT pagina.id, pagina.data, pagina.numero_nf, pagina.cliente, pagina.cnpj_cpf,
+               pagina.observacao, COALESCE(itens.produtos, '[]'::json), pagina.chave
+        FROM (
+            SELECT nf.id, nf.data, nf.numero_nf, nf.cliente, nf.cnpj_cpf, nf.observacao,
+                   ({_CHAVE_NF})::text AS chave, {_CHAVE_NF} AS ordem
+            FROM nf
+            WHERE {where}
+            ORDER BY {_CHAVE_NF} DESC, nf.id DESC
+            LIMIT %s OFFSET %s
+        ) pagina
+        LEFT JOIN LATERAL (
+            SELECT json_agg(json_build_object(
+                       'nome', p.produto_nome,
+                       'peso', p.peso::text,
+                       'base', p.base_produto
+                   )) AS produtos
+            FROM produtos_nf p
+            WHERE p.nf_id = pagina.id
+        ) itens ON TRUE
+        ORDER BY pagina.ordem DESC, pagina.id DESC
+        """,
+        params + [limite + 1, max(int(offset or 0), 0)]
+    )
+    resultado = cursor.fetchall()
+
+    proximo = None
+    if len(resultado) > limite:
+        resultado = resultado[:limite]
+        proximo = codificar_cursor(resultado[-1][7], resultado[-1][0])
+
+    linhas = []
+    for id_, data, numero, cliente, cpf, obs, produtos, _ in resultado:
+        # peso vem como texto para não passar por float
+        for prod in produtos:
+            prod['peso'] = Decimal(prod['peso']) if prod.get('peso') is not None else None
+        linhas.append((id_, data, numero, cliente, cpf, obs, produtos))
+    return linhas, proximo
+
 @saida_nf_bp.route('/', methods=['GET'])
 @login_required
 def saida_nf():
     """Listagem paginada e filtrada de NFs e produtos associados"""
-    page = int(request.args.get('page', 1))
+    page = max(int(request.args.get('page', 1) or 1), 1)
     per_page = 10
     offset = (page - 1) * per_page
     search = request.args.get('search', '').strip()
+    cursor_pagina = request.args.get('cursor', '')
+
+    if search:
+        where, params = _condicao_busca_saida(search)
+    else:
+        where, params = "TRUE", []
 
     conexao = conectar()
     cursor = conexao.cursor()
-
-    # Pré-processamento de busca
-    clean_search = re.sub(r'[.\-\/]', '', search)
-    like = f"%{search}%"
-    like_clean = f"%{clean_search}%"
-
     try:
-        data_formatada = datetime.strptime(search, '%d/%m/%Y').strftime('%Y-%m-%d')
-    except ValueError:
-        data_formatada = ''
-
-    if search:
-        cursor.execute(
-            """
-            SELECT DISTINCT nf.id, nf.data, nf.numero_nf, nf.cliente, nf.cnpj_cpf, nf.observacao
-            FROM nf
-            LEFT JOIN produtos_nf ON produtos_nf.nf_id = nf.id
-            WHERE unaccent(nf.numero_nf)            ILIKE unaccent(%s)
-               OR unaccent(nf.cliente)              ILIKE unaccent(%s)
-               OR unaccent(REPLACE(REPLACE(REPLACE(nf.cnpj_cpf, '.', ''), '-', ''), '/', '')) ILIKE unaccent(%s)
-               OR nf.data::text = %s
-               OR unaccent(produtos_nf.produto_nome)  ILIKE unaccent(%s)
-               OR unaccent(produtos_nf.base_produto)  ILIKE unaccent(%s)
-            ORDER BY nf.data DESC, nf.numero_nf DESC
-            """,
-            (like, like, like_clean, data_formatada, like, like)
-        )
-        nfs = cursor.fetchall()
-        total_pages = 1
-        page = 1
-    else:
-        cursor.execute("SELECT COUNT(*) FROM nf")
-        total = cursor.fetchone()[0]
-        total_pages = (total + per_page - 1) // per_page
+        total, total_exato = _total_nfs(cursor, where, params)
+        pagina, proximo_cursor = _pagina_nfs(cursor, where, params, per_page, cursor_pagina, offset)
 
-        cursor.execute(
-            """
-            SELECT id, data, numero_nf, cliente, cnpj_cpf, observacao
-            FROM nf
-            ORDER BY data DESC, numero_nf DESC
-            LIMIT %s OFFSET %s
-            """,
-            (per_page, offset)
-        )
-        nfs = cursor.fetchall()
+        # Dropdown de produtos
+        cursor.execute("SELECT id, nome FROM produtos ORDER BY nome")
+        produtos_select = cursor.fetchall()
+    finally:
+        cursor.close()
+        conexao.close()
+    total_pages = _numero_paginas(total, total_exato, per_page, page)
 
     # Formatação de CNPJ/CPF
     def formatar_documento(doc):
@@ -82,26 +157,11 @@ def saida_nf():
 
     nfs = [
         (id_, data, numero_nf, cliente, formatar_documento(cpf), obs)
-        for (id_, data, numero_nf, cliente, cpf, obs) in nfs
+        for (id_, data, numero_nf, cliente, cpf, obs, _) in pagina
     ]
 
-    # Produtos por NF
-    cursor.execute("SELECT nf_id, produto_nome, peso, base_produto FROM produtos_nf")
-    produtos = cursor.fetchall()
-    map_produtos = {}
-    for nf_id, nome, peso, base in produtos:
-        map_produtos.setdefault(nf_id, []).append({
-            'nome': nome,
-            'peso': peso,
-            'base': base
-        })
-
-    # Dropdown de produtos
-    cursor.execute("SELECT id, nome FROM produtos ORDER BY nome")
-    produtos_select = cursor.fetchall()
-
-    cursor.close()
-    conexao.close()
+    # Produtos por NF (só as NFs da página)
+    map_produtos = {linha[0]: linha[6] for linha in pagina}
 
     return render_template(
         'saida_nf.html',
@@ -110,6 +170,9 @@ def saida_nf():
         produtos=produtos_select,
         page=page,
         total_pages=total_pages,
+        total=total,
+        total_exato=total_exato,
+        proximo_cursor=proximo_cursor,
         search=search,
         modal_aberto=bool(search)
     )
@@ -117,53 +180,36 @@ def saida_nf():
 @saida_nf_bp.route('/atualizar_modal', methods=['GET'])
 @login_required
 def atualizar_modal():
-    page     = int(request.args.get('page', 1))
+    """
+    Página do modal em JSON. Com ?cursor= (o `proximo_cursor` da resposta anterior) traz a
+    página seguinte por keyset, que é como a rolagem infinita do modal carrega mais NFs.
+    """
+    page     = max(int(request.args.get('page', 1) or 1), 1)
     per_page = 10
     offset   = (page - 1) * per_page
+    search   = request.args.get('search', '').strip()
+    cursor_pagina = request.args.get('cursor', '')
+
+    if search:
+        where, params = _condicao_busca_saida(search)
+    else:
+        where, params = "TRUE", []
 
     conexao = conectar()
     cursor  = conexao.cursor()
+    try:
+        # 1) NFs da página já com os produtos
+        pagina, proximo_cursor = _pagina_nfs(cursor, where, params, per_page, cursor_pagina, offset)
+        # 2) total para a paginação (exato com busca, estimado sem)
+        total, total_exato = _total_nfs(cursor, where, params)
+    finally:
+        cursor.close()
+        conexao.close()
+    nfs = [linha[:6] for linha in pagina]
+    map_produtos = {linha[0]: linha[6] for linha in pagina}
+    total_pages = _numero_paginas(total, total_exato, per_page, page)
 
-    # 1) busca só as NFs da página
-    cursor.execute(
-        """
-        SELECT id, data, numero_nf, cliente, cnpj_cpf, observacao
-        FROM nf
-        ORDER BY data DESC, numero_nf DESC
-        LIMIT %s OFFSET %s
-        """,
-        (per_page, offset)
-    )
-    nfs = cursor.fetchall()  # lista de tuplas
-
-    # 2) busca todos produtos dessas NFs numa segunda query
-    nf_ids = [row[0] for row in nfs]
-    map_produtos = {}
-    if nf_ids:
-        cursor.execute(
-            """
-            SELECT nf_id, produto_nome, peso, base_produto
-            FROM produtos_nf
-            WHERE nf_id = ANY(%s)
-            """,
-            (nf_ids,)
-        )
-        for nf_id, nome, peso, base in cursor.fetchall():
-            map_produtos.setdefault(nf_id, []).append({
-                'nome': nome,
-                'peso': peso,
-                'base': base
-            })
-
-    # 3) total_pages para paginação
-    cursor.execute("SELECT COUNT(*) FROM nf")
-    total = cursor.fetchone()[0]
-    total_pages = (total + per_page - 1) // per_page
-
-    cursor.close()
-    conexao.close()
-
-    # 4) formata cada NF e inclui lista de produtos
+    # 3) formata cada NF e inclui lista de produtos
     def fmt_doc(doc):
         if len(doc) == 11:
             return f'{doc[:3]}.{doc[3:6]}.{doc[6:9]}-{doc[9:]}'
@@ -184,8 +230,11 @@ def atualizar_modal():
         })
 
     return jsonify({
-        'rows':        result,
-        'total_pages': total_pages
+        'rows':           result,
+        'total_pages':    total_pages,
+        'total':          total,
+        'total_exato':    total_exato,
+        'proximo_cursor': proximo_cursor
     })
 
 @saida_nf_bp.route('/salvar', methods=['POST'])
@@ -201,45 +250,40 @@ def salvar_nf():
 
     conexao = conectar()
     cursor  = conexao.cursor()
+    try:
+        # 1) menor ID vago (lacuna deixada por exclusão) ou o próximo da sequência — migração 013
+        cursor.execute("SELECT alocar_id_nf()")
+        next_id = cursor.fetchone()[0]
 
-    # 1) encontra o menor ID vago
-    cursor.execute("""
-        SELECT id_series.id
-          FROM generate_series(1, (SELECT COALESCE(MAX(id),1)+1 FROM nf)) AS id_series(id)
-         WHERE NOT EXISTS (SELECT 1 FROM nf WHERE nf.id = id_series.id)
-         ORDER BY id_series.id
-         LIMIT 1
-    """)
-    next_id = cursor.fetchone()[0]
-
-    # 2) insere NF usando esse ID
-    cursor.execute(
-        """
-        INSERT INTO nf (id, data, numero_nf, cliente, cnpj_cpf, observacao)
-             VALUES (%s, %s, %s, %s, %s, %s)
-        """,
-        (next_id, data, numero, cliente, cnpj, observacao)
-    )
-
-    # 3) insere produtos
-    for p in produtos:
-        nome, peso, base = p.split('|')
+        # 2) insere NF usando esse ID
         cursor.execute(
             """
-            INSERT INTO produtos_nf (nf_id, produto_nome, peso, base_produto)
-                 VALUES (%s, %s, %s, %s)
+            INSERT INTO nf (id, data, numero_nf, cliente, cnpj_cpf, observacao)
+                 VALUES (%s, %s, %s, %s, %s, %s)
             """,
-            (next_id, nome, float(peso.replace(',', '.')), base)
+            (next_id, data, numero, cliente, cnpj, observacao)
         )
 
-    # 4) ajusta sequência para o próximo INSERT padrão
-    cursor.execute(
-        "SELECT setval(pg_get_serial_sequence('nf','id'), (SELECT MAX(id) FROM nf))"
-    )
+        # 3) insere produtos
+        for p in produtos:
+            nome, peso, base = p.split('|')
+            cursor.execute(
+                """
+                INSERT INTO produtos_nf (nf_id, produto_nome, peso, base_produto)
+                     VALUES (%s, %s, %s, %s)
+                """,
+                (next_id, nome, float(peso.replace(',', '.')), base)
+            )
 
-    conexao.commit()
-    cursor.close()
-    conexao.close()
+        conexao.commit()
+    except Exception as e:
+        # rollback devolve a lacuna retirada por alocar_id_nf() à tabela nf_ids_livres
+        conexao.rollback()
+        flash(f'Erro ao salvar Nota Fiscal: {e}', 'danger')
+        return redirect(url_for('saida_nf.saida_nf'))
+    finally:
+        cursor.close()
+        conexao.close()
 
     flash('Nota Fiscal salva com sucesso!', 'sucesso')
     return redirect(url_for('saida_nf.saida_nf'))
@@ -257,35 +301,39 @@ def editar_nf(nf_id):
 
     conexao = conectar()
     cursor = conexao.cursor()
+    try:
+        # Atualiza a tabela NF
+        cursor.execute(
+            """
+            UPDATE nf
+            SET data = %s,
+                numero_nf = %s,
+                cliente = %s,
+                cnpj_cpf = %s
+            WHERE id = %s
+            """,
+            (data, numero, cliente, cnpj, nf_id)
+        )
 
-    # Atualiza a tabela NF
-    cursor.execute(
-        """
-        UPDATE nf
-        SET data = %s,
-            numero_nf = %s,
-            cliente = %s,
-            cnpj_cpf = %s
-        WHERE id = %s
-        """,
-        (data, numero, cliente, cnpj, nf_id)
-    )
-
-    # Atualiza os produtos associados
-    cursor.execute(
-        """
-        UPDATE produtos_nf
-        SET produto_nome = %s,
-            peso = %s,
-            base_produto = %s
-        WHERE nf_id = %s
-        """,
-        (produto, float(peso), base, nf_id)
-    )
+        # Atualiza os produtos associados
+        cursor.execute(
+            """
+            UPDATE produtos_nf
+            SET produto_nome = %s,
+                peso = %s,
+                base_produto = %s
+            WHERE nf_id = %s
+            """,
+            (produto, float(peso), base, nf_id)
+        )
 
-    conexao.commit()
-    cursor.close()
-    conexao.close()
+        conexao.commit()
+    except Exception as e:
+        conexao.rollback()
+        return (f'Erro ao atualizar: {str(e)}', 500)
+    finally:
+        cursor.close()
+        conexao.close()
     flash('Nota Fiscal atualizada com sucesso!', 'sucesso')
     return ('', 204)
 
@@ -295,24 +343,33 @@ def excluir_nf(nf_id):
     page = int(request.args.get('page', 1))
     per_page = 10
 
+    xhr = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
     conexao = conectar()
     cursor = conexao.cursor()
-    cursor.execute("DELETE FROM produtos_nf WHERE nf_id = %s", (nf_id,))
-    cursor.execute("DELETE FROM nf WHERE id = %s", (nf_id,))
-    conexao.commit()
+    try:
+        cursor.execute("DELETE FROM produtos_nf WHERE nf_id = %s", (nf_id,))
+        cursor.execute("DELETE FROM nf WHERE id = %s", (nf_id,))
+        conexao.commit()
 
-    # só precisamos do JSON para API
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return ('', 204)
+        # só precisamos do JSON para API
+        if xhr:
+            return ('', 204)
 
-    # para requisições normais, redireciona:
-    cursor.execute("SELECT COUNT(*) FROM nf")
-    total_restante = cursor.fetchone()[0]
+        # para requisições normais, redireciona:
+        cursor.execute("SELECT COUNT(*) FROM nf")
+        total_restante = cursor.fetchone()[0]
+    except Exception as e:
+        conexao.rollback()
+        if xhr:
+            return (f'Erro ao excluir: {str(e)}', 500)
+        flash(f'Erro ao excluir: {e}', 'danger')
+        return redirect(url_for('saida_nf.saida_nf', page=page) + '#modal-nfs')
+    finally:
+        cursor.close()
+        conexao.close()
     total_pages = (total_restante + per_page - 1) // per_page
     if page > total_pages:
         page = total_pages
-    cursor.close()
-    conexao.close()
     flash('Nota Fiscal excluída.', 'info')
     return redirect(url_for('saida_nf.saida_nf', page=page) + '#modal-nfs')
 
@@ -329,31 +386,17 @@ def excluir_massa_nf():
         conexao = conectar()
         cursor  = conexao.cursor()
 
-        # Refaça a mesma query de search do seu GET, mas apenas pegando ids
-        if search:
-            clean = re.sub(r'[.\-\/]', '', search)
-            like = f"%{search}%"
-            like_clean = f"%{clean}%"
-            try:
-                df = datetime.strptime(search, '%d/%m/%Y').strftime('%Y-%m-%d')
-            except ValueError:
-                df = ''
-            cursor.execute("""
-                SELECT DISTINCT nf.id
-                FROM nf
-                LEFT JOIN produtos_nf ON produtos_nf.nf_id = nf.id
-                WHERE unaccent(nf.numero_nf) ILIKE unaccent(%s)
-                   OR unaccent(nf.cliente)    ILIKE unaccent(%s)
-                   OR unaccent(REPLACE(REPLACE(REPLACE(nf.cnpj_cpf, '.', ''), '-', ''), '/', '')) ILIKE unaccent(%s)
-                   OR nf.data::text = %s
-                   OR unaccent(produtos_nf.produto_nome) ILIKE unaccent(%s)
-                   OR unaccent(produtos_nf.base_produto) ILIKE unaccent(%s)
-            """, (like, like, like_clean, df, like, like))
-        else:
-            cursor.execute("SELECT id FROM nf")
-        ids = [row[0] for row in cursor.fetchall()]
-        cursor.close()
-        conexao.close()
+        # Mesmo filtro da listagem (_condicao_busca_saida): exclui exatamente o que a busca mostra
+        try:
+            if search:
+                where, params = _condicao_busca_saida(search)
+                cursor.execute(f"SELECT nf.id FROM nf WHERE {where}", params)
+            else:
+                cursor.execute("SELECT id FROM nf")
+            ids = [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+            conexao.close()
 
         if not ids:
             return ('Nenhum registro para excluir.', 400)
@@ -390,10 +433,15 @@ def editar_obs(nf_id):
     obs  = data.get('observacao','')
     conexao = conectar()
     cur = conexao.cursor()
-    cur.execute("UPDATE nf SET observacao = %s WHERE id = %s", (obs, nf_id))
-    conexao.commit()
-    cur.close()
-    conexao.close()
+    try:
+        cur.execute("UPDATE nf SET observacao = %s WHERE id = %s", (obs, nf_id))
+        conexao.commit()
+    except Exception as e:
+        conexao.rollback()
+        return (f'Erro ao salvar observação: {str(e)}', 500)
+    finally:
+        cur.close()
+        conexao.close()
     return '', 204
 
 @saida_nf_bp.route('/observacao/<int:nf_id>', methods=['DELETE'])
@@ -401,10 +449,15 @@ def editar_obs(nf_id):
 def excluir_observacao(nf_id):
     conexao = conectar()
     cur = conexao.cursor()
-    cur.execute("UPDATE nf SET observacao = '' WHERE id = %s", (nf_id,))
-    conexao.commit()
-    cur.close()
-    conexao.close()
+    try:
+        cur.execute("UPDATE nf SET observacao = '' WHERE id = %s", (nf_id,))
+        conexao.commit()
+    except Exception as e:
+        conexao.rollback()
+        return (f'Erro ao excluir observação: {str(e)}', 500)
+    finally:
+        cur.close()
+        conexao.close()
     return '', 204
 
 @saida_nf_bp.route('/buscar_cliente/<cpf>')
@@ -452,18 +505,19 @@ def buscar_empresa_por_cnpj(cnpj):
         print(f"Erro ao consultar CNPJ: {e}")
         return {'erro': 'Erro interno'}, 500
 
-@saida_nf_bp.route('/exportar_filtrado')
-@login_required
-def exportar_filtrado():
+def _consulta_exportacao_saida(args):
+    """
+    SQL + parâmetros da exportação filtrada de NFs de saída. `args` é o request.args da rota
+    ou os parâmetros guardados num job de relatório (relatorios.py).
+    """
     # --- 1) Lê parâmetros de filtro ---
-    data_de      = request.args.get('data_de')
-    data_ate     = request.args.get('data_ate')
-    numero_nf    = request.args.get('numero_nf')
-    produto_nome = request.args.get('produto_nome')
-    cliente_txt  = request.args.get('cliente')
-    cnpj_cpf     = request.args.get('cnpj_cpf')
-    base_produto = request.args.get('base_produto')
-    tipo         = request.args.get('tipo', 'excel')
+    data_de      = args.get('data_de')
+    data_ate     = args.get('data_ate')
+    numero_nf    = args.get('numero_nf')
+    produto_nome = args.get('produto_nome')
+    cliente_txt  = args.get('cliente')
+    cnpj_cpf     = args.get('cnpj_cpf')
+    base_produto = args.get('base_produto')
 
     # --- 2) Monta consulta SQL dinamicamente ---
     query = """
@@ -494,27 +548,85 @@ def exportar_filtrado():
         query += " AND nf.cnpj_cpf = %s";         params.append(clean)
     if base_produto:
         query += " AND p.base_produto ILIKE %s";  params.append(f'%{base_produto}%')
+    return query, params
 
-    conexao = conectar()
-    df = pd.read_sql_query(query, conexao, params=params)
-    conexao.close()
-
-    # --- 3) Formata colunas:
-    # Data e CNPJ/CPF para exibição
-    df['data'] = pd.to_datetime(df['data']).dt.strftime('%d/%m/%Y')
+def _linhas_exportacao_saida(conexao, args):
+    """
+    Tuplas (data, numero_nf, produto, peso, cliente, cnpj_cpf, base_produto) da exportação,
+    com data e CNPJ/CPF já formatados para exibição.
+    """
+    query, params = _consulta_exportacao_saida(args)
+    cursor = conexao.cursor()
+    try:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
 
     def fmt_doc(d):
-        clean = re.sub(r'\D','', d)
+        clean = re.sub(r'\D','', d or '')
         if len(clean)==11:
             return f'{clean[:3]}.{clean[3:6]}.{clean[6:9]}-{clean[9:]}'
         if len(clean)==14:
             return f'{clean[:2]}.{clean[2:5]}.{clean[5:8]}/{clean[8:12]}-{clean[12:]}'
         return d
-    df['cnpj_cpf'] = df['cnpj_cpf'].apply(fmt_doc)
+
+    return [
+        (data.strftime('%d/%m/%Y') if data else '', numero, produto,
+         float(peso) if peso is not None else None, cliente, fmt_doc(cnpj), base)
+        for data, numero, produto, peso, cliente, cnpj, base in rows
+    ]
+
+def _pdf_saida(linhas, destino, progresso=None):
+    """
+    PDF das NFs de saída (retrato) gravado em `destino` (caminho ou arquivo), pelo
+    renderizador de pdf_tabela. `progresso(pct, msg)` é opcional (jobs).
+    """
+    colunas = [
+        ColunaPdf('Data', 2.2*cm),
+        ColunaPdf('Nota Fiscal', 1.5*cm),
+        ColunaPdf('Produto', 3.9*cm),
+        ColunaPdf('Peso', 2.5*cm, 'direita'),
+        ColunaPdf('Cliente', 3.6*cm),
+        ColunaPdf('CNPJ/CPF', 3.7*cm),
+        ColunaPdf('Base Produto', 2.8*cm),
+    ]
+    now = pd.Timestamp.now().strftime('%d/%m/%Y %H:%M')
+    renderizar_tabela_pdf(
+        destino, colunas,
+        ((data, str(numero), produto, f'{peso or 0:.3f}', cliente, cnpj, base)
+         for data, numero, produto, peso, cliente, cnpj, base in linhas),
+        titulo="Relatório de Notas Fiscais",
+        subtitulo=f"Gerado em: {now}",
+        pagesize=A4, margem=1.5*cm, margem_vertical=2*cm, tamanho_fonte=9,
+        progresso=progresso, total=len(linhas)
+    )
+
+def _relatorio_saida_pdf(conn, parametros, caminho, progresso):
+    """Gerador do job de relatório PDF de saída (ver relatorios.py)."""
+    linhas = _linhas_exportacao_saida(conn, parametros)
+    progresso(10, f"{len(linhas)} produtos encontrados")
+    _pdf_saida(linhas, caminho, progresso)
+    return 'Saida_Nota_Fiscal.pdf'
+
+registrar_gerador('saida_nf', 'pdf', 'application/pdf', _relatorio_saida_pdf)
+
+@saida_nf_bp.route('/exportar_filtrado')
+@login_required
+def exportar_filtrado():
+    tipo = request.args.get('tipo', 'excel')
+
+    conexao = conectar()
+    try:
+        linhas = _linhas_exportacao_saida(conexao, request.args)
+    finally:
+        conexao.close()
 
     # --- 4) Exportar Excel ---
     if tipo == 'excel':
         # Renomeia colunas: substitui "_" por " " e capitaliza
+        df = pd.DataFrame(linhas, columns=['data', 'numero_nf', 'produto', 'peso',
+                                           'cliente', 'cnpj_cpf', 'base_produto'])
         df_excel = df.rename(columns={
             'data':         'Data',
             'numero_nf':    'Nota Fiscal',
@@ -537,72 +649,9 @@ def exportar_filtrado():
             download_name='Saida_Nota_Fiscal.xlsx'
         )
 
-    # --- 5) Exportar PDF via ReportLab Platypus (Retrato) ---
+    # --- 5) PDF síncrono (link direto); a tela usa o job em segundo plano (/relatorios) ---
     buffer = io.BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=A4,
-        leftMargin=1.5*cm, rightMargin=1.5*cm,
-        topMargin=2*cm, bottomMargin=2*cm
-    )
-
-    styles = getSampleStyleSheet()
-    title_style = styles['Heading1']; title_style.alignment = 1
-    normal_style = styles['BodyText']; normal_style.wordWrap = 'CJK'
-
-    elements = []
-    # Título
-    elements.append(Paragraph("Relatório de Notas Fiscais", title_style))
-    elements.append(Spacer(1, 0.3*cm))
-    # Data de geração
-    now = pd.Timestamp.now().strftime('%d/%m/%Y %H:%M')
-    elements.append(Paragraph(f"Gerado em: {now}", styles['Normal']))
-    elements.append(Spacer(1, 0.5*cm))
-
-    # Monta dados da tabela (inclui cabeçalho)
-    header = ['Data','Nota Fiscal','Produto','Peso','Cliente','CNPJ/CPF','Base Produto']
-    data_table = [ header ]
-    for _, row in df.iterrows():
-        data_table.append([
-            row['data'],
-            str(row['numero_nf']),
-            row['produto'],
-            f'{row["peso"]:.3f}',
-            row['cliente'],
-            row['cnpj_cpf'],
-            row['base_produto']
-        ])
-
-    # Converte cada célula em Paragraph (para word wrap)
-    table_data = []
-    for r in data_table:
-        table_data.append([ Paragraph(str(cell), normal_style) for cell in r ])
-
-    # Define larguras de coluna (ajuste se necessário)
-    col_widths = [2.2*cm, 1.5*cm, 3.9*cm, 2.5*cm, 3.6*cm, 3.7*cm, 2.8*cm]
-    tbl = Table(table_data, colWidths=col_widths)
-    tbl.setStyle(TableStyle([
-        ('GRID',         (0,0), (-1,-1), 0.5, colors.grey),
-        ('BACKGROUND',   (0,0), (-1,0),   colors.lightgrey),
-        ('FONTNAME',     (0,0), (-1,0),   'Helvetica-Bold'),
-        ('FONTSIZE',     (0,0), (-1,0),     10),
-        ('FONTSIZE',     (0,1), (-1,-1),    9),
-        ('VALIGN',       (0,0), (-1,-1), 'MIDDLE'),
-        ('BOTTOMPADDING',(0,0), (-1,0),    6),
-        ('TOPPADDING',   (0,0), (-1,0),    6),
-    ]))
-    elements.append(tbl)
-
-    # Adiciona rodapé com número de página
-    def add_page_number(canvas, doc):
-        canvas.saveState()
-        canvas.setFont('Helvetica', 8)
-        canvas.drawString(1.5*cm, 1*cm, f'Página {doc.page}')
-        canvas.restoreState()
-
-    # Gera o PDF
-    doc.build(elements, onFirstPage=add_page_number, onLaterPages=add_page_number)
-
+    _pdf_saida(linhas, buffer)
     buffer.seek(0)
     return send_file(
         buffer,
@@ -611,98 +660,136 @@ def exportar_filtrado():
         download_name='Saida_Nota_Fiscal.pdf'
     )
 
-@saida_nf_bp.route('/importar_excel', methods=['POST'])
-@login_required
-def importar_excel():
-    arquivo = request.files.get('arquivo_excel')
-    if not arquivo:
-        flash('Nenhum arquivo enviado.', 'danger')
-        return redirect(url_for('saida_nf.saida_nf'))
-
-    try:
-        df = pd.read_excel(arquivo.stream)
+# Colunas das tabelas temporárias da importação (COPY, ver carga_em_massa.py)
+_IMPORT_NF_COLUNAS = ('data', 'numero_nf', 'cliente', 'cnpj_cpf', 'observacao')
+_IMPORT_PRODUTOS_COLUNAS = ('ordem', 'numero_nf', 'produto_nome', 'peso', 'base_produto')
 
-        conexao = conectar()
-        cursor = conexao.cursor()
 
-        # ✏️ Normaliza colunas que vamos usar
-        df['numero_nf']    = df['NF'].astype(str)
-        df['peso_float']   = df['Peso'].astype(str).str.replace(',', '.').astype(float)
-        df['observacao']   = df.get('Observação', '').fillna('').astype(str)
-        df['cnpj_cpf']     = df['CNPJ/CPF'].astype(str).apply(lambda x: re.sub(r"\D", '', x))
+def _gravar_bloco_saida(cursor, df):
+    """
+    Grava um bloco da planilha: COPY de cabeçalhos e produtos para tabelas temporárias,
+    criação das NFs que faltam e produtos ligados aos ids por join. NFs criadas em blocos
+    anteriores (já confirmados) são encontradas como existentes. Retorna (produtos, {}).
+    """
+    # ✏️ Normaliza colunas que vamos usar (coluna inteira, sem iterrows)
+    df = df.copy()
+    df['numero_nf']  = df['NF'].astype(str)
+    df['peso_float'] = df['Peso'].astype(str).str.replace(',', '.').astype(float)
+    df['observacao'] = (df['Observação'].fillna('').astype(str)
+                        if 'Observação' in df.columns else '')
+    df['cnpj_cpf']   = df['CNPJ/CPF'].astype(str).str.replace(r'\D', '', regex=True)
+
+    # Cabeçalho de cada NF = primeira ocorrência do número no bloco (agrupa uma vez só)
+    cabecalhos = (df.drop_duplicates('numero_nf', keep='first')
+                    .rename(columns={'Data': 'data', 'Cliente': 'cliente'}))
+    produtos = pd.DataFrame({
+        'ordem': df.index,
+        'numero_nf': df['numero_nf'].values,
+        'produto_nome': df['Produto'].values,
+        'peso': df['peso_float'].values,
+        'base_produto': df['Base Produto'].values,
+    })
 
-        # ✅ Busca todas as NFs únicas no arquivo
-        numeros_nf_unicos = df['numero_nf'].unique().tolist()
+    cursor.execute(f"""
+        CREATE TEMP TABLE tmp_importacao_nf ON COMMIT DROP AS
+        SELECT {', '.join(_IMPORT_NF_COLUNAS)} FROM nf WITH NO DATA
+    """)
+    cursor.execute("""
+        CREATE TEMP TABLE tmp_importacao_nf_ids (numero_nf text PRIMARY KEY, nf_id integer)
+        ON COMMIT DROP
+    """)
+    cursor.execute("""
+        CREATE TEMP TABLE tmp_importacao_produtos_nf ON COMMIT DROP AS
+        SELECT 0 AS ordem, NULL::text AS numero_nf, produto_nome, peso, base_produto
+          FROM produtos_nf WITH NO DATA
+    """)
+    copiar_dataframe(cursor, 'tmp_importacao_nf', _IMPORT_NF_COLUNAS, cabecalhos)
+    copiar_dataframe(cursor, 'tmp_importacao_produtos_nf', _IMPORT_PRODUTOS_COLUNAS, produtos)
 
-        # 🔍 Busca no banco as NFs que já existem
-        cursor.execute(
-            "SELECT id, numero_nf FROM nf WHERE numero_nf = ANY(%s)",
-            (numeros_nf_unicos,)
+    # 🧩 Cria as NFs que faltam e resolve o id de todas (novas + já existentes).
+    # Os dois lados da UNION enxergam o mesmo snapshot: "existentes" não vê as recém-criadas.
+    cursor.execute("""
+        WITH novas AS (
+            INSERT INTO nf (data, numero_nf, cliente, cnpj_cpf, observacao)
+            SELECT t.data, t.numero_nf, t.cliente,
+                   COALESCE(t.cnpj_cpf, ''), COALESCE(t.observacao, '')
+              FROM tmp_importacao_nf t
+             WHERE NOT EXISTS (SELECT 1 FROM nf n WHERE n.numero_nf = t.numero_nf)
+            RETURNING id, numero_nf
+        ),
+        existentes AS (
+            SELECT DISTINCT ON (n.numero_nf) n.id, n.numero_nf
+              FROM nf n
+              JOIN tmp_importacao_nf t ON t.numero_nf = n.numero_nf
+             ORDER BY n.numero_nf, n.id DESC
         )
-        rows_existentes = cursor.fetchall()  # [(id, numero_nf), ...]
+        INSERT INTO tmp_importacao_nf_ids (numero_nf, nf_id)
+        SELECT numero_nf, id FROM novas
+        UNION ALL
+        SELECT numero_nf, id FROM existentes
+    """)
 
-        # Monta dicionário numero_nf -> id
-        nf_map = {numero_nf: nf_id for nf_id, numero_nf in rows_existentes}
+    # ⚡ Produtos ligados aos ids por join, ignorando duplicados
+    cursor.execute("""
+        INSERT INTO produtos_nf (nf_id, produto_nome, peso, base_produto)
+        SELECT i.nf_id, t.produto_nome, t.peso, t.base_produto
+          FROM tmp_importacao_produtos_nf t
+          JOIN tmp_importacao_nf_ids i ON i.numero_nf = t.numero_nf
+         ORDER BY t.ordem
+        ON CONFLICT ON CONSTRAINT unique_nf_produto DO NOTHING
+    """)
+    return (cursor.rowcount if cursor.rowcount is not None else 0), {}
 
-        # 🧩 Descobre quais NFs faltam criar
-        numeros_faltando = [n for n in numeros_nf_unicos if n not in nf_map]
 
-        # Cria as NFs que faltam e atualiza o dicionário nf_map
-        for numero_nf in numeros_faltando:
-            # pega os dados da primeira ocorrência desse numero_nf no DataFrame
-            linha = df[df['numero_nf'] == numero_nf].iloc[0]
-            cursor.execute(
-                """
-                INSERT INTO nf (data, numero_nf, cliente, cnpj_cpf, observacao)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING id
-                """,
-                (
-                    linha['Data'],
-                    numero_nf,
-                    linha['Cliente'],
-                    linha['cnpj_cpf'],
-                    linha['observacao']
-                )
-            )
-            nf_id = cursor.fetchone()[0]
-            nf_map[numero_nf] = nf_id
-
-        # ✅ Monta lista de produtos a inserir
-        lista_produtos = []
-        for _, row in df.iterrows():
-            nf_id = nf_map[row['numero_nf']]
-            lista_produtos.append((
-                nf_id,
-                row['Produto'],
-                row['peso_float'],
-                row['Base Produto']
-            ))
-
-        # ⚡ Insere todos os produtos de uma vez, ignorando duplicados
-        execute_values(
-            cursor,
-            """
-            INSERT INTO produtos_nf (nf_id, produto_nome, peso, base_produto)
-            VALUES %s
-            ON CONFLICT ON CONSTRAINT unique_nf_produto DO NOTHING
-            """,
-            lista_produtos
-        )
+_IMPORT_COLUNAS_PLANILHA = ('Data', 'NF', 'Cliente', 'CNPJ/CPF', 'Produto', 'Peso', 'Base Produto')
+
+
+def _preparar_importacao_saida(primeiro, job_id):
+    """Importador 'saida_nf' (importacoes.py): confere os cabeçalhos pelo primeiro bloco."""
+    faltando = [c for c in _IMPORT_COLUNAS_PLANILHA if c not in primeiro.columns]
+    if faltando:
+        raise ValueError(f'Colunas obrigatórias faltando na planilha: {faltando}. '
+                         f'Cabeçalhos detectados: {list(primeiro.columns)}')
+    return _gravar_bloco_saida
+
+
+importacoes.registrar_importador('saida_nf', _preparar_importacao_saida)
 
-        conexao.commit()
-        cursor.close()
-        conexao.close()
-        flash('Importação concluída com sucesso.', 'success')
 
+@saida_nf_bp.route('/importar_excel', methods=['POST'])
+@login_required
+def importar_excel():
+    arquivo = request.files.get('arquivo_excel')
+    if not arquivo:
+        flash('Nenhum arquivo enviado.', 'danger')
+        return redirect(url_for('saida_nf.saida_nf'))
+
+    nome = arquivo.filename or ''
+    ext = nome.rsplit('.', 1)[1].lower() if '.' in nome else ''
+    if ext not in EXTENSOES:
+        flash('Extensão não permitida. Use .xlsx, .xls ou .csv', 'danger')
+        return redirect(url_for('saida_nf.saida_nf'))
+
+    # Job retomável: reenviar o mesmo arquivo depois de uma falha continua do último bloco gravado
+    try:
+        job_id, retomado = importacoes.receber('saida_nf', arquivo.stream, secure_filename(nome),
+                                               ext, session.get('usuario'))
     except Exception as e:
-        try:
-            conexao.rollback()
-            cursor.close()
-            conexao.close()
-        except:
-            pass
         flash(f'Erro na importação: {e}', 'danger')
+        return redirect(url_for('saida_nf.saida_nf'))
+
+    resumo = importacoes.executar(job_id)
+    if resumo['invalida']:
+        flash(f"Erro na importação: {resumo['falha']}", 'danger')
+    elif resumo['falha']:
+        flash(f"Erro na importação ({resumo['falha']}). Produtos já gravados: {resumo['gravadas']}. "
+              f"Reenvie o arquivo (corrigido, se for o caso) para continuar de onde parou.", 'danger')
+    elif not resumo['lidas'] and not retomado:
+        flash('Planilha sem linhas para importar.', 'warning')
+    elif retomado:
+        flash(f"Importação retomada e concluída. Linhas já importadas antes: {resumo['puladas']}.", 'success')
+    else:
+        flash('Importação concluída com sucesso.', 'success')
 
     return redirect(url_for('saida_nf.saida_nf'))
 
@@ -721,25 +808,22 @@ def agregacao_selecao():
     conexao = conectar()
     cursor = conexao.cursor()
 
-    # Monta filtro simples: procura em numero_nf, cliente e cnpj_cpf
-    filtros = []
-    parametros = []
-
+    # Mesmo filtro da listagem e da exclusão em massa (_condicao_busca_saida): os totais
+    # cobrem exatamente as NFs que a busca mostra
     if pesquisa:
-        like = f"%{pesquisa}%"
-        filtros.append("(nf.numero_nf::text ILIKE %s OR nf.cliente ILIKE %s OR nf.cnpj_cpf ILIKE %s)")
-        parametros.extend([like, like, like])
-
-    clausula_where = "WHERE " + " AND ".join(filtros) if filtros else ""
+        condicao, parametros = _condicao_busca_saida(pesquisa)
+        clausula_where = f"WHERE {condicao}"
+    else:
+        clausula_where, parametros = "", []
 
     # Query: soma por base_produto (agrupa por base) e soma total geral
     sql = f"""
-        SELECT COALESCE(p.base_produto, 'Sem Base') AS base, SUM(p.peso)::numeric AS soma
-        FROM produtos_nf p
-        JOIN nf ON nf.id = p.nf_id
+        SELECT COALESCE(pn.base_produto, 'Sem Base') AS base, SUM(pn.peso)::numeric AS soma
+        FROM produtos_nf pn
+        JOIN nf ON nf.id = pn.nf_id
         {clausula_where}
-        GROUP BY COALESCE(p.base_produto, 'Sem Base')
-        ORDER BY COALESCE(p.base_produto, 'Sem Base')
+        GROUP BY COALESCE(pn.base_produto, 'Sem Base')
+        ORDER BY COALESCE(pn.base_produto, 'Sem Base')
     """
 
     try:
@@ -751,8 +835,8 @@ def agregacao_selecao():
 
         # total geral
         cursor.execute(f"""
-            SELECT COALESCE(SUM(p.peso), 0) FROM produtos_nf p
-            JOIN nf ON nf.id = p.nf_id
+            SELECT COALESCE(SUM(pn.peso), 0) FROM produtos_nf pn
+            JOIN nf ON nf.id = pn.nf_id
             {clausula_where}
         """, parametros)
         linha_total = cursor.fetchone()
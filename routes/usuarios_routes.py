@@ -1,13 +1,11 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from math import ceil
 from routes.auth_routes import login_required
-from conexao_db import conectar
+from conexao_db import conexao_requisicao
 import re
 import bcrypt
 
 usuarios_bp = Blueprint('usuarios', __name__)
-conexao = conectar()
-cursor = conexao.cursor()
 
 # JANELA USUARIO
 @usuarios_bp.route('/usuarios')
@@ -71,6 +69,8 @@ def usuarios():
     """
     # Adicione LIMIT e OFFSET no final dos parâmetros
     params_list = params + [per_page, offset]
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     cursor.execute(sql_list, tuple(params_list))
     rows = cursor.fetchall()
 
@@ -112,6 +112,8 @@ def create_usuario():
         flash('A senha deve conter exatamente 8 dígitos numéricos.', 'erro')
         return redirect(url_for('usuarios.usuarios'))
 
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     # 3) E-mail único
     cursor.execute("SELECT 1 FROM usuarios WHERE email = %s", (email,))
     if cursor.fetchone():
@@ -174,6 +176,8 @@ def edit_usuario(user_id):
         flash('Nome e e-mail são obrigatórios.', 'erro')
         return redirect(url_for('usuarios.usuarios'))
 
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     # 2) Verifica e-mail duplicado
     cursor.execute("SELECT id FROM usuarios WHERE email = %s AND id <> %s", (email, user_id))
     if cursor.fetchone():
@@ -215,6 +219,8 @@ def edit_usuario(user_id):
 @usuarios_bp.route('/usuarios/delete/<int:user_id>', methods=['POST'])
 @login_required
 def delete_usuario(user_id):
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     try:
         cursor.execute("DELETE FROM usuarios WHERE id = %s", (user_id,))
         conexao.commit()
@@ -233,6 +239,8 @@ def delete_selecionados():
         flash('Nenhum usuário selecionado.', 'erro')
         return redirect(url_for('usuarios.usuarios'))
 
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     try:
         # Converte para tupla de inteiros
         ids_int = tuple(map(int, ids))
@@ -250,6 +258,8 @@ def delete_selecionados():
 @usuarios_bp.route('/usuarios/toggle/<int:user_id>', methods=['POST'])
 @login_required
 def toggle_usuario(user_id):
+    conexao = conexao_requisicao()
+    cursor = conexao.cursor()
     try:
         # Alterna ativo entre TRUE e FALSE para esse usuário
         cursor.execute(
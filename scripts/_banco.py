@@ -0,0 +1,90 @@
+"""
+Apoio dos scripts de teste/benchmark que usam o código do app contra um banco de teste.
+
+configurar() traduz DATABASE_URL para as variáveis DB_* lidas por conexao_db e põe a raiz
+do repositório no sys.path; precisa ser chamada ANTES de importar módulos do app.
+app_teste() monta um Flask só com os blueprints pedidos, e cliente_logado() devolve um
+test_client com sessão de usuário (passa pelo login_required).
+resumo_tempos() formata uma lista de durações (s) para os benchmarks e gravar_planilha()
+gera os arquivos dos benchmarks de importação.
+"""
+import os
+import sys
+from urllib.parse import unquote, urlparse
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configurar(pool_max=None):
+    """DATABASE_URL -> DB_HOST/DB_NAME/DB_USER/DB_PASSWORD/DB_PORT. Sai (código 2) se faltar."""
+    url = os.getenv('DATABASE_URL')
+    if not url:
+        print('Defina DATABASE_URL apontando para um banco de teste.')
+        sys.exit(2)
+    u = urlparse(url)
+    os.environ.update(
+        DB_HOST=u.hostname or 'localhost',
+        DB_NAME=u.path.lstrip('/'),
+        DB_USER=unquote(u.username or ''),
+        DB_PASSWORD=unquote(u.password or ''),
+        DB_PORT=str(u.port or 5432),
+    )
+    if pool_max:
+        os.environ['DB_POOL_MAX'] = str(pool_max)
+    if RAIZ not in sys.path:
+        sys.path.insert(0, RAIZ)
+    return url
+
+
+def app_teste(*blueprints):
+    from flask import Flask
+    import conexao_db
+
+    app = Flask(__name__, template_folder=os.path.join(RAIZ, 'templates'),
+                static_folder=os.path.join(RAIZ, 'static'))
+    app.secret_key = 'teste'
+    conexao_db.init_app(app)
+    for bp in blueprints:
+        app.register_blueprint(bp)
+    return app
+
+
+def cliente_logado(app, usuario='teste'):
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['usuario'] = usuario
+    return cliente
+
+
+def resumo_tempos(tempos):
+    """'n=… média=… p50=… p95=… máx=…' em ms, a partir de durações em segundos."""
+    if not tempos:
+        return 'n=0'
+    ordenados = sorted(tempos)
+
+    def p(q):
+        return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))] * 1000
+
+    media = sum(ordenados) / len(ordenados) * 1000
+    return (f'n={len(ordenados)} média={media:.2f}ms p50={p(0.5):.2f}ms '
+            f'p95={p(0.95):.2f}ms máx={ordenados[-1] * 1000:.2f}ms')
+
+
+def gravar_planilha(caminho, cabecalhos, linhas):
+    """Grava `linhas` em .csv (separador ';', como o Excel brasileiro) ou .xlsx, pela extensão."""
+    if caminho.endswith('.xlsx'):
+        from openpyxl import Workbook
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(list(cabecalhos))
+        for linha in linhas:
+            ws.append(list(linha))
+        wb.save(caminho)
+        return
+    import csv
+
+    with open(caminho, 'w', newline='', encoding='utf-8') as arq:
+        escritor = csv.writer(arq, delimiter=';')
+        escritor.writerow(cabecalhos)
+        escritor.writerows(linhas)
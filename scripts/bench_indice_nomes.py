@@ -0,0 +1,109 @@
+"""
+Microbenchmark da resolução aproximada de nomes de produto (indice_nomes.IndiceNomes).
+
+Monta um prod_map de --produtos nomes e --entradas nomes de entrada (parte exata, parte
+prefixo/trecho de um produto, parte contendo um produto, parte sem correspondência) e
+resolve cobre e zinco de cada entrada com percentual_produto:
+  - varredura linear (dict comum, como era): só numa amostra de --amostra entradas, o
+    tempo total é extrapolado (a varredura completa leva minutos);
+  - IndiceNomes: montagem do índice, primeira passada (memória vazia) e segunda (memória
+    cheia), sobre todas as entradas.
+Confere que as duas formas devolvem o mesmo percentual em todas as entradas da amostra.
+Não usa banco.
+
+Uso:
+    python scripts/bench_indice_nomes.py --produtos 5000 --entradas 50000
+Sai com código 1 se os resultados divergirem.
+"""
+import argparse
+import random
+import sys
+import time
+from decimal import Decimal
+
+import _banco
+
+_PALAVRAS = ('LATAO', 'COBRE', 'BRONZE', 'VERGALHAO', 'CHAPA', 'TUBO', 'FIO', 'BARRA',
+             'SUCATA', 'MISTA', 'LIMPA', 'ESTANHADO', 'REDONDO', 'SEXTAVADO', 'PERFIL')
+
+
+def _nomes_produtos(sorteio, quantidade):
+    nomes = set()
+    while len(nomes) < quantidade:
+        partes = sorteio.sample(_PALAVRAS, sorteio.randint(1, 3))
+        nomes.add(' '.join(partes + [str(sorteio.randint(1, 999))]))
+    return list(nomes)
+
+
+def _nome_entrada(sorteio, produtos):
+    base = sorteio.choice(produtos)
+    escolha = sorteio.random()
+    if escolha < 0.4:
+        return base                                  # exato
+    if escolha < 0.6:
+        return base[:sorteio.randint(3, len(base))]  # prefixo
+    if escolha < 0.7:
+        i = sorteio.randint(0, len(base) - 3)
+        return base[i:i + sorteio.randint(3, 8)]     # trecho
+    if escolha < 0.85:
+        return f'{base} POLIDO'                      # contém o produto
+    return f'DESCONHECIDO {sorteio.randint(1, 10 ** 6)}'
+
+
+def _resolver(percentual_produto, prod_map, nomes):
+    return [(percentual_produto(prod_map, n, 0), percentual_produto(prod_map, n, 1)) for n in nomes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmark do IndiceNomes')
+    parser.add_argument('--produtos', type=int, default=5000)
+    parser.add_argument('--entradas', type=int, default=50000)
+    parser.add_argument('--amostra', type=int, default=1000, help='entradas resolvidas pela varredura linear')
+    parser.add_argument('--semente', type=int, default=1)
+    args = parser.parse_args()
+
+    if _banco.RAIZ not in sys.path:
+        sys.path.insert(0, _banco.RAIZ)
+    from indice_nomes import IndiceNomes
+    from routes.calculo_nfs_route import normalize_name, percentual_produto
+
+    sorteio = random.Random(args.semente)
+    produtos = _nomes_produtos(sorteio, args.produtos)
+    mapa = {}
+    for nome in produtos:
+        mapa[normalize_name(nome)] = (Decimal(sorteio.randint(1, 99)) / 100,
+                                      Decimal(sorteio.randint(0, 40)) / 100)
+    entradas = [_nome_entrada(sorteio, produtos) for _ in range(args.entradas)]
+    amostra = entradas[:args.amostra]
+    print(f'{len(mapa)} produtos, {len(entradas)} entradas '
+          f'({len(set(entradas))} nomes distintos), 2 metais por entrada')
+
+    inicio = time.perf_counter()
+    linear = _resolver(percentual_produto, mapa, amostra)
+    t_linear = time.perf_counter() - inicio
+    estimado = t_linear * len(entradas) / max(len(amostra), 1)
+    print(f'varredura linear: {t_linear:.2f}s em {len(amostra)} entradas '
+          f'-> ~{estimado:.1f}s estimados para {len(entradas)}')
+
+    indice = IndiceNomes(mapa)
+    inicio = time.perf_counter()
+    indice.correspondencias('X')  # força a montagem
+    t_montagem = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    frio = _resolver(percentual_produto, indice, entradas)
+    t_frio = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    _resolver(percentual_produto, indice, entradas)
+    t_quente = time.perf_counter() - inicio
+    print(f'IndiceNomes: montagem {t_montagem:.2f}s | 1ª passada {t_frio:.2f}s | '
+          f'2ª passada (memória) {t_quente:.2f}s')
+    print(f'ganho (montagem + 1ª passada): {estimado / (t_montagem + t_frio):.0f}x')
+
+    diferencas = sum(1 for a, b in zip(linear, frio) if a != b)
+    print(f'diferenças na amostra: {diferencas}')
+    return 1 if diferencas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
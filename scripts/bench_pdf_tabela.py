@@ -0,0 +1,131 @@
+"""
+Benchmark do renderizador de PDF tabular (pdf_tabela.py) contra o Table + Paragraph por célula.
+
+Gera linhas no formato do relatório de NFs de saída (7 colunas, retrato, A4) e mede:
+  - antigo: DataFrame + iterrows + um Paragraph por célula + uma Table única no
+    SimpleDocTemplate (como era em saida_nf_routes/entrada_nf_route);
+  - novo: renderizar_tabela_pdf com as mesmas colunas e larguras de _pdf_saida.
+O antigo monta a tabela inteira antes da primeira página e fica inviável nos tamanhos
+grandes: só roda até --antigo-ate linhas; acima disso o tempo dele é estimado pela
+proporção medida no maior tamanho em que rodou. Não usa banco.
+
+Uso:
+    python scripts/bench_pdf_tabela.py --linhas 10000,100000 --alvo 10
+Sai com código 1 se o ganho medido ficar abaixo de --alvo.
+"""
+import argparse
+import io
+import random
+import sys
+import time
+
+import _banco
+
+_CLIENTES = ('METALURGICA SAO JORGE LTDA', 'FUNDICAO BOA VISTA', 'COMERCIO DE METAIS SANTA RITA ME',
+             'RECICLAGEM NOVA ERA', 'INDUSTRIA DE VALVULAS PAULISTA S/A')
+_PRODUTOS = ('LATAO', 'COBRE MISTO', 'BRONZE', 'VERGALHAO DE LATAO 3/8 SEXTAVADO', 'SUCATA DE COBRE LIMPA')
+_BASES = ('LATAO', 'COBRE', 'BRONZE')
+
+
+def _linhas(quantidade, semente=1):
+    sorteio = random.Random(semente)
+    return [
+        (f'{sorteio.randint(1, 28):02d}/{sorteio.randint(1, 12):02d}/2024', str(10000 + i // 3),
+         sorteio.choice(_PRODUTOS), f'{sorteio.uniform(1, 5000):.3f}', sorteio.choice(_CLIENTES),
+         f'{sorteio.randint(10, 99)}.{sorteio.randint(100, 999)}.{sorteio.randint(100, 999)}/0001-'
+         f'{sorteio.randint(10, 99)}', sorteio.choice(_BASES))
+        for i in range(quantidade)
+    ]
+
+
+def _antigo(linhas, destino):
+    import pandas as pd
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import cm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    cabecalho = ['Data', 'Nota Fiscal', 'Produto', 'Peso', 'Cliente', 'CNPJ/CPF', 'Base Produto']
+    df = pd.DataFrame(linhas, columns=cabecalho)
+    doc = SimpleDocTemplate(destino, pagesize=A4, leftMargin=1.5 * cm, rightMargin=1.5 * cm,
+                            topMargin=2 * cm, bottomMargin=2 * cm)
+    styles = getSampleStyleSheet()
+    normal = styles['BodyText']
+    normal.wordWrap = 'CJK'
+    dados = [cabecalho] + [list(row) for _, row in df.iterrows()]
+    tabela = Table([[Paragraph(str(c), normal) for c in r] for r in dados],
+                   colWidths=[2.2 * cm, 1.5 * cm, 3.9 * cm, 2.5 * cm, 3.6 * cm, 3.7 * cm, 2.8 * cm])
+    tabela.setStyle(TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]))
+    doc.build([Paragraph('Relatório de Notas Fiscais', styles['Heading1']), Spacer(1, 0.3 * cm), tabela])
+
+
+def _novo(linhas, destino):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+    from pdf_tabela import ColunaPdf, renderizar_tabela_pdf
+
+    colunas = [
+        ColunaPdf('Data', 2.2 * cm),
+        ColunaPdf('Nota Fiscal', 1.5 * cm),
+        ColunaPdf('Produto', 3.9 * cm),
+        ColunaPdf('Peso', 2.5 * cm, 'direita'),
+        ColunaPdf('Cliente', 3.6 * cm),
+        ColunaPdf('CNPJ/CPF', 3.7 * cm),
+        ColunaPdf('Base Produto', 2.8 * cm),
+    ]
+    renderizar_tabela_pdf(destino, colunas, iter(linhas), titulo='Relatório de Notas Fiscais',
+                          pagesize=A4, margem=1.5 * cm, margem_vertical=2 * cm, tamanho_fonte=9)
+
+
+def _medir(funcao, linhas):
+    destino = io.BytesIO()
+    inicio = time.perf_counter()
+    funcao(linhas, destino)
+    return time.perf_counter() - inicio, len(destino.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do renderizador de PDF tabular')
+    parser.add_argument('--linhas', default='10000,100000')
+    parser.add_argument('--antigo-ate', type=int, default=10000,
+                        help='maior tamanho em que o renderizador antigo roda de verdade')
+    parser.add_argument('--alvo', type=float, default=10.0, help='ganho mínimo esperado')
+    args = parser.parse_args()
+
+    if _banco.RAIZ not in sys.path:
+        sys.path.insert(0, _banco.RAIZ)
+
+    abaixo = False
+    seg_por_linha_antigo = None
+    for n in (int(t) for t in args.linhas.split(',') if t.strip()):
+        linhas = _linhas(n)
+        t_novo, tam_novo = _medir(_novo, linhas)
+        if n <= args.antigo_ate:
+            t_antigo, _ = _medir(_antigo, linhas)
+            seg_por_linha_antigo = t_antigo / n
+            medido = True
+        elif seg_por_linha_antigo is not None:
+            t_antigo, medido = seg_por_linha_antigo * n, False
+        else:
+            t_antigo = None
+        texto = f'{n:>7} linhas | novo {t_novo:7.2f}s ({tam_novo / 2 ** 20:.1f} MiB)'
+        if t_antigo is not None:
+            ganho = t_antigo / t_novo
+            texto += (f' | antigo {t_antigo:7.2f}s{"" if medido else " (estimado)"}'
+                      f' | ganho {ganho:.1f}x')
+            if medido and ganho < args.alvo:
+                abaixo = True
+        print(texto)
+
+    print(f'alvo {args.alvo:.0f}x: {"NÃO ATINGIDO" if abaixo else "ok"}')
+    return 1 if abaixo else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
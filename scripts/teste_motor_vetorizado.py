@@ -0,0 +1,130 @@
+"""
+Teste diferencial do motor vetorizado (calculo_vetorizado.py) contra o cálculo escalar.
+
+Gera registros e cadastros aleatórios (sem banco) cobrindo os ramos do cálculo:
+  - produto com nome exato, parcial (prefixo/substring) ou desconhecido; com e sem % de zinco;
+  - materiais dos grupos cobre/zinco/sucata, por fornecedor e só no fallback;
+  - qtd_* já gravadas (nulas, zero ou preenchidas);
+  - custo_total_manual, valor_integral e as duplicatas como fallback do valor da NF;
+  - valores nulos e casas decimais variadas (inclusive perto de empates de arredondamento).
+Cada registro é calculado por calcular_registro (escalar) e por calcular_registros_lote
+(vetorizado) e todos os campos de saída têm de ser idênticos.
+
+Uso:
+    python scripts/teste_motor_vetorizado.py --registros 20000 --semente 1
+Sai com código 1 se encontrar alguma diferença.
+"""
+import argparse
+import random
+import sys
+from collections import namedtuple
+from decimal import Decimal
+
+import _banco
+
+CAMPOS = ('qtd_cobre', 'qtd_zinco', 'qtd_sucata', 'valor_total_nf', 'mao_de_obra_total',
+          'mao_de_obra', 'materia_prima_total', 'materia_prima', 'custo_total')
+
+Referencias = namedtuple('Referencias', 'produtos fornecedores materiais')
+
+
+def _decimal(sorteio, minimo, maximo, casas, nulo=0.1):
+    if sorteio.random() < nulo:
+        return None
+    if sorteio.random() < 0.05:
+        return Decimal('0')
+    inteiro = sorteio.randint(minimo * 10 ** casas, maximo * 10 ** casas)
+    return Decimal(inteiro).scaleb(-casas)
+
+
+def _cadastros(sorteio):
+    produtos = []
+    for i in range(40):
+        nome = sorteio.choice(['LATAO', 'COBRE', 'BRONZE', 'SUCATA MISTA', 'VERGALHAO']) + f' {i:02d}'
+        produtos.append((i + 1, nome, _decimal(sorteio, 0, 100, 2, nulo=0.1),
+                         _decimal(sorteio, 0, 100, 2, nulo=0.3)))
+    fornecedores = [(i + 1, f'FORNECEDOR {i:02d}') for i in range(10)]
+    materiais = []
+    for i in range(60):
+        grupo = sorteio.choice(['Cobre', 'Zinco', 'Zinc', 'Sucata', 'Outros', None])
+        fornecedor_id = sorteio.choice([None] + [f[0] for f in fornecedores])
+        materiais.append((i + 1, f'MATERIAL {i % 45:02d}', fornecedor_id, grupo,
+                          _decimal(sorteio, 0, 80, sorteio.choice([2, 3, 4]), nulo=0.05)))
+    return Referencias(produtos, fornecedores, materiais)
+
+
+def _registro(sorteio, refs, i):
+    produto = sorteio.choice(refs.produtos)[1]
+    escolha = sorteio.random()
+    if escolha < 0.2:
+        produto = produto.split()[0]                 # parcial: contido em várias chaves
+    elif escolha < 0.3:
+        produto = f'{produto} (lote) ~ 10mm'         # normalização (parênteses, ~, mm)
+    elif escolha < 0.35:
+        produto = 'PRODUTO DESCONHECIDO'
+    materiais = [sorteio.choice(refs.materiais)[1] if sorteio.random() < 0.7 else None
+                 for _ in range(5)]
+    reg = {
+        'entrada_id': i + 1,
+        'produto': produto,
+        'fornecedor': sorteio.choice([f[1] for f in refs.fornecedores] + ['', None, 'OUTRO']),
+        'peso_liquido': _decimal(sorteio, 0, 50000, 3),
+        'peso_integral': _decimal(sorteio, 0, 50000, 3),
+        'valor_integral': _decimal(sorteio, 0, 900000, 2, nulo=0.4),
+        'ipi': _decimal(sorteio, 0, 20, 2, nulo=0.5),
+        'valor_mao_obra_tm_metallica': _decimal(sorteio, 0, 30, 4, nulo=0.3),
+        'valor_unitario_energia': _decimal(sorteio, 0, 10, 4, nulo=0.3),
+        'quantidade_estoque': _decimal(sorteio, 0, 50000, 3, nulo=0),
+        'custo_total_manual': _decimal(sorteio, 0, 100, 2, nulo=0.8),
+        'custo_total': None,
+        'valor_total_nf': None,
+        'mao_de_obra': None,
+        'materia_prima': None,
+    }
+    for k, nome in enumerate(materiais, start=1):
+        reg[f'material_{k}'] = nome
+    for k in range(1, 4):
+        reg[f'valor_unitario_{k}'] = _decimal(sorteio, 0, 80, 4, nulo=0.5)
+    for k in range(1, 7):
+        reg[f'duplicata_{k}'] = _decimal(sorteio, 0, 200000, 2, nulo=0.6)
+    for metal in ('qtd_cobre', 'qtd_zinco', 'qtd_sucata'):
+        reg[metal] = sorteio.choice([None, None, Decimal('0'), _decimal(sorteio, 0, 9000, 3, nulo=0)])
+    return reg
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste diferencial do motor vetorizado')
+    parser.add_argument('--registros', type=int, default=20000)
+    parser.add_argument('--semente', type=int, default=1)
+    args = parser.parse_args()
+
+    # só para achar os módulos do app: nada aqui usa o banco
+    if _banco.RAIZ not in sys.path:
+        sys.path.insert(0, _banco.RAIZ)
+    from routes.calculo_nfs_route import _montar_mapas, calcular_registro, calcular_registros_lote
+
+    sorteio = random.Random(args.semente)
+    refs = _cadastros(sorteio)
+    mapas = _montar_mapas(refs)
+    registros = [_registro(sorteio, refs, i) for i in range(args.registros)]
+
+    escalares = [dict(reg) for reg in registros]
+    for reg in escalares:
+        calcular_registro(None, reg, mapas)
+    vetorizados = [dict(reg) for reg in registros]
+    calcular_registros_lote(None, vetorizados, mapas)
+
+    diferencas = [
+        (esc.get('entrada_id'), campo, esc.get(campo), vet.get(campo))
+        for esc, vet in zip(escalares, vetorizados)
+        for campo in CAMPOS
+        if esc.get(campo) != vet.get(campo)
+    ]
+    print(f'registros: {len(registros)} | diferenças: {len(diferencas)}')
+    for d in diferencas[:20]:
+        print('   entrada %s, %s: escalar=%r vetorizado=%r' % d)
+    return 1 if diferencas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
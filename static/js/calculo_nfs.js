@@ -454,19 +454,8 @@ document.addEventListener('DOMContentLoaded', () => {
     editBtn.textContent = isEditing ? 'OK' : '✏️';
   });
 
-  // Busca
+  // Busca: filtrada no servidor (ver grid paginado no final do arquivo)
   const search = $('#search_nf');
-  if (search) {
-    search.addEventListener('input', () => {
-      const q = search.value.trim().toLowerCase();
-      $$('tbody tr').forEach(tr => {
-        const tdId = tr.querySelector('.td-id')?.textContent || '';
-        const prodTxt = tr.querySelector('.td-produto')?.textContent.trim().toLowerCase() || '';
-        const nfTxt = tr.querySelector('.td-nf')?.textContent.trim().toLowerCase() || '';
-        tr.style.display = tdId.includes(q) || prodTxt.includes(q) || nfTxt.includes(q) ? '' : 'none';
-      });
-    });
-  }
 
   // formatação / paste handlers (mantive os seus)
   function formatInputValueForDisplay(raw, decimals) {
@@ -646,6 +635,9 @@ document.addEventListener('DOMContentLoaded', () => {
     });
   }
 
+  // reaplicado pelo grid paginado a cada página carregada
+  let aplicarColunasFixas = () => {};
+
   // Sticky columns initialization (mantive sua implementação)
   (function initStickyColumns() {
     const tableContainer = document.querySelector('.table-container');
@@ -711,6 +703,7 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     setStickyLefts();
+    aplicarColunasFixas = setStickyLefts;
     let tmr = null;
     window.addEventListener('resize', () => {
       clearTimeout(tmr);
@@ -746,4 +739,169 @@ document.addEventListener('DOMContentLoaded', () => {
   // initial status pass + formatação inicial das células
   formatTableNumericCells();
   updateRowStatus();
+
+  // =====================
+  // GRID PAGINADO (keyset): /calculo_nfs/dados
+  // =====================
+  const gridBody = document.getElementById('grid-calculo-body');
+  const gridStatus = document.getElementById('grid-calculo-status');
+  const gridSentinela = document.getElementById('grid-calculo-sentinela');
+
+  const CAMPOS_GRID = [
+    'peso_liquido', 'quantidade_estoque', 'qtd_cobre', 'qtd_zinco', 'qtd_sucata',
+    'valor_total_nf', 'mao_de_obra', 'materia_prima', 'custo_total_manual', 'custo_total'
+  ];
+
+  const grid = {
+    ordenar: 'data',
+    direcao: 'desc',
+    cursor: null,
+    fim: false,
+    carregando: false,
+    geracao: 0   // descarta respostas de buscas antigas (filtro/ordem mudou no meio)
+  };
+
+  function escapeHtml(v) {
+    return String(v ?? '').replace(/[&<>"']/g, c => ({
+      '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+    }[c]));
+  }
+
+  function linhaGrid(r) {
+    const tr = document.createElement('tr');
+    tr.dataset.id = r.id ?? '';
+    tr.dataset.entradaId = r.entrada_id ?? '';
+
+    const inputs = CAMPOS_GRID.map(campo => {
+      const n = Number(r[campo] ?? 0);
+      const decimals = DECIMALS[campo] ?? 2;
+      let valor = formatBR(isNaN(n) ? 0 : n, decimals);
+      let raw = '';
+      if (campo === 'quantidade_estoque') {
+        raw = String(Math.round(Math.abs(isNaN(n) ? 0 : n) * Math.pow(10, decimals)));
+        valor = formatIntegerAsBR(Number(raw), decimals);
+      }
+      const rawAttr = campo === 'quantidade_estoque' ? ` data-_raw_value="${raw}"` : '';
+      return `<td><input class="input-inline" data-field="${campo}" value="${escapeHtml(valor)}"${rawAttr} disabled></td>`;
+    }).join('');
+
+    tr.innerHTML = `
+      <td>${escapeHtml(r.data)}</td>
+      <td class="td-nf">${escapeHtml(r.nf)}</td>
+      <td class="td-produto">
+        ${escapeHtml(r.produto)}
+        <span class="td-id" style="display:none" aria-hidden="true">${escapeHtml(r.id)}</span>
+      </td>
+      ${inputs}
+      <td class="col-actions">
+        <button type="button" class="icon edit-icon" title="Editar">✏️</button>
+        <button type="button" class="icon save-icon hidden" title="Salvar">💾</button>
+      </td>`;
+    return tr;
+  }
+
+  function paramsGrid() {
+    const params = new URLSearchParams();
+    params.set('ordenar', grid.ordenar);
+    params.set('direcao', grid.direcao);
+    if (grid.cursor) params.set('cursor', grid.cursor);
+    const filtros = {
+      q: search ? search.value.trim() : '',
+      produto: $('#filtro_produto')?.value.trim() || '',
+      fornecedor: $('#filtro_fornecedor')?.value.trim() || '',
+      data_inicio: $('#filtro_data_inicio')?.value || '',
+      data_fim: $('#filtro_data_fim')?.value || ''
+    };
+    Object.entries(filtros).forEach(([k, v]) => { if (v) params.set(k, v); });
+    return params;
+  }
+
+  async function carregarPaginaGrid() {
+    if (!gridBody || grid.carregando || grid.fim) return;
+    grid.carregando = true;
+    const geracao = grid.geracao;
+    if (gridStatus) gridStatus.textContent = 'Carregando...';
+
+    try {
+      const res = await fetch(`${gridBody.dataset.url}?${paramsGrid().toString()}`, {
+        headers: { 'Accept': 'application/json' }
+      });
+      if (geracao !== grid.geracao) return;
+      if (!res.ok) throw new Error(await res.text().catch(() => res.statusText));
+      const data = await res.json();
+      if (geracao !== grid.geracao) return;
+
+      const frag = document.createDocumentFragment();
+      (data.registros || []).forEach(r => frag.appendChild(linhaGrid(r)));
+      gridBody.appendChild(frag);
+
+      grid.cursor = data.proximo_cursor || null;
+      grid.fim = !grid.cursor;
+
+      if (gridStatus) {
+        gridStatus.textContent = gridBody.children.length === 0 ? 'Nenhum registro no estoque.' : '';
+      }
+      updateRowStatus();
+      aplicarColunasFixas();
+    } catch (err) {
+      if (gridStatus && geracao === grid.geracao) gridStatus.textContent = 'Erro ao carregar registros: ' + err.message;
+    } finally {
+      if (geracao === grid.geracao) grid.carregando = false;
+    }
+  }
+
+  function recarregarGrid() {
+    grid.geracao += 1;
+    grid.cursor = null;
+    grid.fim = false;
+    grid.carregando = false;
+    if (gridBody) gridBody.innerHTML = '';
+    $$('th.th-ordenavel').forEach(th => {
+      th.classList.remove('ordem-asc', 'ordem-desc');
+      if (th.dataset.ordenar === grid.ordenar) th.classList.add(grid.direcao === 'asc' ? 'ordem-asc' : 'ordem-desc');
+    });
+    carregarPaginaGrid();
+  }
+
+  // ordenação por coluna (clique alterna asc/desc)
+  $$('th.th-ordenavel').forEach(th => {
+    th.addEventListener('click', () => {
+      const coluna = th.dataset.ordenar;
+      if (grid.ordenar === coluna) {
+        grid.direcao = grid.direcao === 'asc' ? 'desc' : 'asc';
+      } else {
+        grid.ordenar = coluna;
+        grid.direcao = coluna === 'data' ? 'desc' : 'asc';
+      }
+      recarregarGrid();
+    });
+  });
+
+  // filtros (com debounce para não disparar uma busca por tecla)
+  let tmrFiltro = null;
+  [search, $('#filtro_produto'), $('#filtro_fornecedor'), $('#filtro_data_inicio'), $('#filtro_data_fim')]
+    .filter(Boolean)
+    .forEach(el => {
+      el.addEventListener(el.type === 'date' ? 'change' : 'input', () => {
+        clearTimeout(tmrFiltro);
+        tmrFiltro = setTimeout(recarregarGrid, 300);
+      });
+    });
+
+  // carrega a próxima página quando o fim da tabela aparece
+  if (gridSentinela && 'IntersectionObserver' in window) {
+    const obs = new IntersectionObserver(entries => {
+      if (entries.some(e => e.isIntersecting)) carregarPaginaGrid();
+    }, { root: document.querySelector('.table-container'), rootMargin: '200px' });
+    obs.observe(gridSentinela);
+  } else {
+    const tc = document.querySelector('.table-container');
+    if (tc) {
+      tc.addEventListener('scroll', () => {
+        if (tc.scrollTop + tc.clientHeight >= tc.scrollHeight - 200) carregarPaginaGrid();
+      });
+    }
+  }
+
+  recarregarGrid();
 });
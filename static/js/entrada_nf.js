@@ -4,6 +4,20 @@ document.addEventListener('DOMContentLoaded', () => {
   const selectedIds = window.selectedIds;
   window._entradaSelectedAllPages = window._entradaSelectedAllPages || false;
   window.currentEntradaPage = window.currentEntradaPage || 1;
+  // paginação por keyset: cursor de cada página já vista, por termo de busca
+  // ({ busca: {pagina: cursor} }). Sem cursor conhecido, o servidor abre a página por número.
+  window._entradaCursores = window._entradaCursores || {};
+  window.cursorEntradaPagina = function (busca, pagina) {
+    const mapa = window._entradaCursores[busca || ''] || {};
+    return pagina > 1 ? (mapa[pagina] || '') : '';
+  };
+  window.guardarCursorEntrada = function (busca, root) {
+    const pag = root ? root.querySelector('.pagination[data-keyset]') : null;
+    if (!pag) return;
+    const atual = parseInt((pag.querySelector('span.current') || {}).textContent, 10) || 1;
+    const mapa = window._entradaCursores[busca || ''] = window._entradaCursores[busca || ''] || {};
+    if (pag.dataset.proximoCursor) mapa[atual + 1] = pag.dataset.proximoCursor;
+  };
   window.materiaisOptions = window.materiaisOptions || [];
   window.ENTRADAS_PER_PAGE = window.ENTRADAS_PER_PAGE || 10;
   const SELECT_KEY = 'modalSelectedEntradaIds';
@@ -771,7 +785,11 @@ document.addEventListener('DOMContentLoaded', () => {
       // DEBUG: mostra no console exatamente o que será enviado
       try { console.debug('[entrada_nf] loadPage -> page:', page, 'searchRaw:', String(searchRaw||''), 'qparam:', qparam); } catch(e){}
 
-      const resp = await fetch(`/entrada_nf/listar?page=${page}${qparam}`);
+      const buscaChave = String(searchRaw || '').trim();
+      const cursorPagina = window.cursorEntradaPagina(buscaChave, page);
+      const cparam = cursorPagina ? `&cursor=${encodeURIComponent(cursorPagina)}` : '';
+
+      const resp = await fetch(`/entrada_nf/listar?page=${page}${qparam}${cparam}`);
       if (!resp.ok) throw new Error('Falha ao carregar página ' + page);
       const html = await resp.text();
 
@@ -781,6 +799,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
       // injeta HTML recebido
       modalContent.innerHTML = html;
+      window.guardarCursorEntrada(buscaChave, modalContent);
 
       applyStickyColumns(modalContent, ['select','data','nf','produto']);
       window.addEventListener('resize', () => applyStickyColumnsDebounced(modalContent, ['select','data','nf','produto'], 120));
@@ -1712,6 +1731,8 @@ document.addEventListener('DOMContentLoaded', () => {
     if (!root) return;
     const pag = root.querySelector('.pagination');
     if (!pag) return;
+    // paginação por cursor não tem lista de números para condensar
+    if (pag.dataset.keyset) return;
 
     const allPageEls = Array.from(pag.querySelectorAll('a.page-btn, span.current'));
     if (!allPageEls.length) return;
@@ -2431,8 +2452,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
     if(btnPdf) {
       btnPdf.addEventListener('click', function() {
-        const params = new URLSearchParams(new FormData(form)).toString();
-        window.open(`/entrada_nf/exportar_filtrado?tipo=pdf&${params}`, '_blank');
+        // PDF é gerado em segundo plano (relatorios.js): a tela acompanha e baixa quando pronto
+        window.gerarRelatorio('entrada_nf', 'pdf', new URLSearchParams(new FormData(form)));
       });
     }
   };
@@ -2456,6 +2477,8 @@ document.addEventListener('DOMContentLoaded', () => {
       const params = new URLSearchParams();
       if(opts.page) params.append('page', opts.page);
       if(opts.search) params.append('search', opts.search);
+      const cursorPagina = opts.cursor || window.cursorEntradaPagina(opts.search || '', parseInt(opts.page, 10) || 1);
+      if(cursorPagina) params.append('cursor', cursorPagina);
       params.append('_', Date.now());
 
       try {
@@ -2472,6 +2495,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const newContainer = tmp.querySelector('.table-container');
         if(newContainer) container.replaceWith(newContainer);
         else container.innerHTML = html;
+        window.guardarCursorEntrada(opts.search || '', tmp);
 
         attachModalPaginationHandlers();
       } catch(err) {
@@ -2493,7 +2517,7 @@ document.addEventListener('DOMContentLoaded', () => {
           const page = a.dataset.page || 1;
           const searchInput = $id('searchEntradaInput');
           const q = searchInput && searchInput.value ? searchInput.value.trim() : '';
-          loadEntradasIntoModal({ page: page, search: q });
+          loadEntradasIntoModal({ page: page, search: q, cursor: a.dataset.cursor || '' });
         });
       }
 
@@ -2697,8 +2721,8 @@ document.addEventListener('DOMContentLoaded', () => {
       const file = fileInput.files[0];
       const name = file.name || '';
       const ext = name.split('.').pop().toLowerCase();
-      if (!['xls','xlsx'].includes(ext)) {
-        if (importMessage) { importMessage.style.display = 'block'; importMsgText.textContent = 'Formato inválido. Use .xls ou .xlsx'; importMsgText.style.color = 'red'; }
+      if (!['xls','xlsx','csv'].includes(ext)) {
+        if (importMessage) { importMessage.style.display = 'block'; importMsgText.textContent = 'Formato inválido. Use .xls, .xlsx ou .csv'; importMsgText.style.color = 'red'; }
         return;
       }
 
@@ -0,0 +1,75 @@
+// Relatórios em segundo plano (/relatorios): enfileira, acompanha o progresso e baixa o arquivo.
+// Uso: gerarRelatorio('entrada_nf', 'pdf', new URLSearchParams(new FormData(form)))
+(function () {
+  if (window.gerarRelatorio) return;
+
+  const INTERVALO_MS = 1500;
+
+  function painel() {
+    let el = document.getElementById('relatorio-progresso');
+    if (!el) {
+      el = document.createElement('div');
+      el.id = 'relatorio-progresso';
+      el.style.cssText = 'position:fixed;right:16px;bottom:16px;z-index:10000;min-width:240px;' +
+        'background:#fff;border:1px solid #ccc;border-radius:6px;padding:10px 12px;' +
+        'box-shadow:0 2px 8px rgba(0,0,0,.15);font-size:.9rem;';
+      el.innerHTML = '<div class="rel-texto"></div>' +
+        '<div style="background:#eee;height:6px;border-radius:3px;margin-top:6px;overflow:hidden">' +
+        '<div class="rel-barra" style="background:#2e7d32;height:100%;width:0"></div></div>';
+      document.body.appendChild(el);
+    }
+    return el;
+  }
+
+  function mostrar(texto, pct) {
+    const el = painel();
+    el.style.display = 'block';
+    el.querySelector('.rel-texto').textContent = texto;
+    el.querySelector('.rel-barra').style.width = `${Math.max(0, Math.min(pct || 0, 100))}%`;
+  }
+
+  function esconder(depoisMs) {
+    setTimeout(() => {
+      const el = document.getElementById('relatorio-progresso');
+      if (el) el.style.display = 'none';
+    }, depoisMs || 0);
+  }
+
+  const espera = ms => new Promise(r => setTimeout(r, ms));
+
+  window.gerarRelatorio = async function (tipo, formato, filtros) {
+    const corpo = new URLSearchParams(filtros || '');
+    corpo.set('tipo', tipo);
+    corpo.set('formato', formato);
+
+    mostrar('Agendando relatório…', 0);
+    try {
+      const resp = await fetch('/relatorios/', { method: 'POST', body: corpo });
+      const job = await resp.json();
+      if (!resp.ok) throw new Error(job.msg || 'Erro ao agendar o relatório.');
+
+      while (true) {
+        await espera(INTERVALO_MS);
+        const r = await fetch(job.status_url, { cache: 'no-store' });
+        const st = await r.json();
+        if (!r.ok) throw new Error(st.msg || 'Erro ao consultar o relatório.');
+
+        if (st.estado === 'concluido') {
+          mostrar('Relatório pronto. Baixando…', 100);
+          window.location = st.download_url;
+          esconder(3000);
+          return;
+        }
+        if (st.estado === 'erro' || st.estado === 'expirado') {
+          throw new Error(st.mensagem || 'Falha ao gerar o relatório.');
+        }
+        const texto = st.estado === 'pendente' ? 'Na fila…' : (st.mensagem || 'Gerando relatório…');
+        mostrar(`${texto} (${st.progresso}%)`, st.progresso);
+      }
+    } catch (err) {
+      console.error('gerarRelatorio:', err);
+      mostrar(err.message, 0);
+      esconder(5000);
+    }
+  };
+})();
@@ -283,53 +283,96 @@ document.addEventListener('DOMContentLoaded', () => {
   renderList();
 
   // --- PAGINAÇÃO DO MODAL ----
-  let currentPage = Number(new URLSearchParams(window.location.search).get('page')) || 1;
+  // O modal abre na página da URL e rola infinitamente: cada bloco seguinte vem de
+  // /atualizar_modal?cursor=<proximo_cursor> (keyset no servidor, sem OFFSET).
+  const paginaInicial = Number(new URLSearchParams(window.location.search).get('page')) || 1;
+  let currentPage = paginaInicial;
+  // termo de busca atual (o modal pagina dentro do resultado da busca)
+  const termoBusca = new URLSearchParams(window.location.search).get('search') || '';
+  function urlModal(page, cursor) {
+    const params = new URLSearchParams({ page: String(page) });
+    if (termoBusca) params.set('search', termoBusca);
+    if (cursor) params.set('cursor', cursor);
+    return `/saida_nf/atualizar_modal?${params.toString()}`;
+  }
   const perPage    = 10;  // deve bater com o backend
   const modalTbody = document.querySelector('#modal-nfs tbody');
-  let totalPages;         // vamos preencher na abertura do modal
-
-  async function loadNextModalItems(count) {
-    const nextPage = currentPage + 1;
-    if (nextPage > totalPages) {
-      console.log('Não há mais páginas para carregar.');
-      return;
+  let totalPages;         // vamos preencher na abertura do modal (estimado)
+  let proximoCursor = null;
+  let carregandoMais = false;
+
+  // monta a linha do modal (mesmo layout do template)
+  function linhaModal(item) {
+    const tr = document.createElement('tr');
+    tr.dataset.id  = item.id;
+    tr.dataset.obs = item.observacao;
+
+    // define dataset.read com prioridade para valor vindo do servidor
+    if (typeof item.lida !== 'undefined') {
+      tr.dataset.read = item.lida ? '1' : '0';
+    } else {
+      tr.dataset.read = (localStorage.getItem(`nfRead_${item.id}`) === 'true') ? '1' : '0';
     }
 
-    const resp = await fetch(`/saida_nf/atualizar_modal?page=${nextPage}`);
-    if (!resp.ok) throw new Error('Erro ao carregar próximas NFs');
-    const json = await resp.json();
+    const primeiro = item.produtos[0] || { nome: '', peso: 0, base: '' };
+
+    const pesoFmt = Number(primeiro.peso || 0)
+      .toLocaleString('pt-BR', { minimumFractionDigits: 3, maximumFractionDigits: 3 }) + ' Kg';
+
+    tr.innerHTML = `
+      <td><input type="checkbox" class="select-row"></td>
+      <td>${item.data}</td>
+      <td>${item.numero_nf}</td>
+      <td>${primeiro.nome}</td>
+      <td>${pesoFmt}</td>
+      <td>${item.cliente}</td>
+      <td>${item.cnpj_cpf}</td>
+      <td>${primeiro.base}</td>
+      <td class="col-actions"></td>
+    `;
+    return tr;
+  }
 
-    if (json.rows.length > 0) {
-      currentPage = nextPage;
-    }
-    totalPages = json.total_pages;
+  // --- ROLAGEM INFINITA: acrescenta a próxima página ao fim do modal ---
+  async function loadNextModalItems() {
+    if (!modalTbody || !proximoCursor || carregandoMais) return;
+    carregandoMais = true;
+    try {
+      const resp = await fetch(urlModal(currentPage + 1, proximoCursor));
+      if (!resp.ok) throw new Error('Erro ao carregar próximas NFs');
+      const json = await resp.json();
 
-    json.rows.slice(0, count).forEach(item => {
-      const trNew = document.createElement('tr');
-      trNew.dataset.id  = item.id;
-      trNew.dataset.obs = item.observacao;
+      if (json.rows.length > 0) currentPage += 1;
+      totalPages = json.total_pages;
+      proximoCursor = json.proximo_cursor || null;
 
-      // define dataset.read com prioridade para valor vindo do servidor
-      if (typeof item.lida !== 'undefined') {
-        trNew.dataset.read = item.lida ? '1' : '0';
-      } else {
-        trNew.dataset.read = (localStorage.getItem(`nfRead_${item.id}`) === 'true') ? '1' : '0';
-      }
+      json.rows.forEach(item => {
+        const tr = linhaModal(item);
+        modalTbody.appendChild(tr);
+        attachRowSelectionHandler(tr);
+      });
 
-      trNew.innerHTML = `
-        <td><input type="checkbox" class="select-row"></td>
-        <td>${item.data}</td>
-        <td>${item.numero_nf}</td>
-        <td>${item.cliente}</td>
-        <td>${item.cnpj_cpf}</td>
-        <td class="col-actions"></td>
-      `;
-      modalTbody.appendChild(trNew);
-      // anexa handler de seleção
-      attachRowSelectionHandler(trNew);
-    });
+      setupNFList();
+      restoreSelections();
+    } finally {
+      carregandoMais = false;
+    }
+  }
 
-    console.log(`Carregados ${Math.min(count, json.rows.length)} linhas da página ${currentPage}.`);
+  // sentinela no fim da tabela: quando aparece na tela, carrega mais
+  const sentinelaModal = document.createElement('div');
+  sentinelaModal.className = 'modal-sentinela';
+  sentinelaModal.style.height = '1px';
+  if (modalTbody) {
+    const tabelaModal = modalTbody.closest('table');
+    if (tabelaModal) tabelaModal.after(sentinelaModal);
+    if ('IntersectionObserver' in window) {
+      new IntersectionObserver(entradas => {
+        if (entradas.some(e => e.isIntersecting)) {
+          loadNextModalItems().catch(err => console.error(err));
+        }
+      }).observe(sentinelaModal);
+    }
   }
 
   // --- FUNÇÃO DE RECARREGAR PÁGINA DO MODAL ---
@@ -338,44 +381,19 @@ document.addEventListener('DOMContentLoaded', () => {
     if (!modalTbody) return;
     modalTbody.innerHTML = '';
 
-    // 2) busca a página corrente
-    const resp = await fetch(`/saida_nf/atualizar_modal?page=${currentPage}`);
+    // 2) volta para a página de abertura (a rolagem recomeça dali)
+    currentPage = paginaInicial;
+    const resp = await fetch(urlModal(currentPage));
     if (!resp.ok) throw new Error('Erro ao recarregar modal');
     const json = await resp.json();
 
-    // 3) atualiza totalPages
+    // 3) atualiza totalPages / cursor da próxima página
     totalPages = json.total_pages;
+    proximoCursor = json.proximo_cursor || null;
 
     // 4) gera as novas linhas
     json.rows.forEach(item => {
-      const tr = document.createElement('tr');
-      tr.dataset.id  = item.id;
-      tr.dataset.obs = item.observacao;
-
-      // define dataset.read com prioridade para valor vindo do servidor
-      if (typeof item.lida !== 'undefined') {
-        tr.dataset.read = item.lida ? '1' : '0';
-      } else {
-        tr.dataset.read = (localStorage.getItem(`nfRead_${item.id}`) === 'true') ? '1' : '0';
-      }
-
-      const primeiro = item.produtos[0] || { nome: '', peso: 0, base: '' };
-
-      const pesoFmt = Number(primeiro.peso || 0)
-        .toLocaleString('pt-BR', { minimumFractionDigits: 3, maximumFractionDigits: 3 }) + ' Kg';
-
-      tr.innerHTML = `
-        <td><input type="checkbox" class="select-row"></td>
-        <td>${item.data}</td>
-        <td>${item.numero_nf}</td>
-        <td>${primeiro.nome}</td>
-        <td>${pesoFmt}</td>
-        <td>${item.cliente}</td>
-        <td>${item.cnpj_cpf}</td>
-        <td>${primeiro.base}</td>
-        <td class="col-actions"></td>
-      `;
-
+      const tr = linhaModal(item);
       modalTbody.appendChild(tr);
       // garante que cada linha adicionada tenha o handler de seleção
       attachRowSelectionHandler(tr);
@@ -404,12 +422,6 @@ document.addEventListener('DOMContentLoaded', () => {
     document.getElementById('modal-loading').style.display = 'block';
     document.getElementById('modal-content-container').style.display = 'none';
 
-    if (totalPages === undefined) {
-      const resp = await fetch(`/saida_nf/atualizar_modal?page=${currentPage}`);
-      const json = await resp.json();
-      totalPages = json.total_pages;
-    }
-
     await refreshModalPage();
 
     // esconde loading, mostra conteúdo
@@ -1301,6 +1313,11 @@ document.addEventListener('DOMContentLoaded', () => {
     for (const [k, v] of formData.entries()) {
       if (v.trim()) params.append(k, v);
     }
+    if (tipo === 'pdf') {
+      // PDF é gerado em segundo plano (relatorios.js): a tela acompanha e baixa quando pronto
+      window.gerarRelatorio('saida_nf', 'pdf', params);
+      return;
+    }
     params.append('tipo', tipo);
     window.location = `/saida_nf/exportar_filtrado?${params.toString()}`;
   }